@@ -5,7 +5,7 @@ from django.utils.safestring import mark_safe
 from django.utils import timezone
 from .models import (
     UserProfile, Category, Subcategory, Gig, Order, OrderDeliverable, Review, Team, 
-    Conversation, Message, Portfolio, Withdrawal, HelpRequest, GroupJoinRequest,
+    Conversation, Message, Portfolio, Withdrawal, TransferRecipient, HelpRequest, GroupJoinRequest,
     Job, Proposal, Notification, UserVerification, SavedSearch, OnboardingResponse,
     Course, Lesson, Enrollment, SkillAssessment, AssessmentQuestion, 
     AssessmentAttempt, SkillBadge, CourseReview, Dispute, ContentReport, AdminAction, SystemSettings,
@@ -13,7 +13,8 @@ from .models import (
     AnalyticsEvent, ThirdPartyIntegration, IntegrationSync, Project, Task, TaskProposal,
     AssessmentCategory, Assessment, Question, QuestionOption, AssessmentPayment, AssessmentAnswer,
     Transaction, ProfessionalDocument, Like, NewsletterSubscriber, Newsletter, NewsletterSendLog,
-    NewsletterTemplate, NewsletterContent, AIConversation, AIMessage
+    NewsletterTemplate, NewsletterContent, AIConversation, AIMessage, PaystackWebhookEvent, OutboundEmail,
+    NotificationBroadcast, NotificationDigest, ArchivedNotification, LedgerAccount, LedgerEntry, LedgerPosting
 )
 from .report_models import Report, ReportAction, UserReportStats
 from .verification_models import VerificationRequest, VerificationBadge
@@ -286,6 +287,8 @@ class UserProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'user_type', 'rating', 'total_earnings', 'created_at']
     list_filter = ['user_type', 'created_at']
     search_fields = ['user__username', 'user__email']
+    # Balances change only through BalanceService (see UserProfile.save)
+    readonly_fields = UserProfile.LEDGER_FIELDS
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -457,9 +460,17 @@ class PortfolioAdmin(admin.ModelAdmin):
 
 @admin.register(Withdrawal)
 class WithdrawalAdmin(admin.ModelAdmin):
-    list_display = ['user', 'amount', 'status', 'created_at', 'processed_at']
+    list_display = ['user', 'amount', 'status', 'attempts', 'created_at', 'submitted_at', 'processed_at']
     list_filter = ['status', 'created_at']
-    search_fields = ['user__username', 'reference']
+    search_fields = ['user__username', 'reference', 'batch_id']
+    readonly_fields = ['batch_id', 'attempts', 'last_error', 'claimed_at', 'submitted_at']
+
+@admin.register(TransferRecipient)
+class TransferRecipientAdmin(admin.ModelAdmin):
+    list_display = ['user', 'recipient_code', 'recipient_type', 'bank_code', 'account_last4', 'is_active', 'last_used_at']
+    list_filter = ['is_active', 'recipient_type']
+    search_fields = ['user__username', 'recipient_code']
+    readonly_fields = ['account_key', 'last_validated_at', 'last_used_at', 'created_at']
 
 @admin.register(HelpRequest)
 class HelpRequestAdmin(admin.ModelAdmin):
@@ -617,6 +628,69 @@ class TransactionAdmin(admin.ModelAdmin):
     search_fields = ['user__username', 'reference', 'description']
     readonly_fields = ['created_at']
 
+@admin.register(PaystackWebhookEvent)
+class PaystackWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['event_key', 'event', 'reference', 'status', 'attempts', 'deliveries', 'received_at', 'processed_at']
+    list_filter = ['event', 'status', 'received_at']
+    search_fields = ['event_key', 'reference']
+    readonly_fields = ['received_at', 'processed_at', 'locked_at']
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to', 'category', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status', 'category', 'created_at']
+    search_fields = ['subject', 'to']
+    readonly_fields = ['created_at', 'sent_at', 'claimed_at', 'batch_id']
+
+@admin.register(NotificationBroadcast)
+class NotificationBroadcastAdmin(admin.ModelAdmin):
+    list_display = ['title', 'audience', 'status', 'total_created', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['audience', 'status', 'created_at']
+    search_fields = ['title', 'message']
+    readonly_fields = ['created_through', 'total_created', 'claimed_at', 'created_at', 'finished_at']
+
+@admin.register(NotificationDigest)
+class NotificationDigestAdmin(admin.ModelAdmin):
+    list_display = ['user', 'frequency', 'window_start', 'window_end', 'notification_count', 'created_at']
+    list_filter = ['frequency', 'window_start']
+    search_fields = ['user__username', 'user__email']
+    readonly_fields = ['created_at']
+
+@admin.register(ArchivedNotification)
+class ArchivedNotificationAdmin(admin.ModelAdmin):
+    list_display = ['title', 'user', 'notification_type', 'created_at', 'archived_at']
+    list_filter = ['notification_type', 'archived_at']
+    search_fields = ['title', 'user__username']
+    readonly_fields = ['created_at', 'archived_at']
+
+class LedgerPostingInline(admin.TabularInline):
+    model = LedgerPosting
+    fields = ['account', 'amount', 'balance_after']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+@admin.register(LedgerAccount)
+class LedgerAccountAdmin(admin.ModelAdmin):
+    list_display = ['code', 'user', 'kind', 'currency', 'balance', 'posting_count', 'updated_at']
+    list_filter = ['kind', 'currency']
+    search_fields = ['code', 'user__username']
+    readonly_fields = ['balance', 'posting_count', 'created_at', 'updated_at']
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'entry_type', 'reference', 'description', 'created_at']
+    list_filter = ['entry_type', 'created_at']
+    search_fields = ['reference', 'idempotency_key']
+    inlines = [LedgerPostingInline]
+
+    # The ledger is append-only: corrections are new entries
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 @admin.register(ProfessionalDocument)
 class ProfessionalDocumentAdmin(admin.ModelAdmin):
     list_display = ['user', 'name', 'document_type', 'is_public', 'uploaded_at']
@@ -637,10 +711,13 @@ class NewsletterSubscriberAdmin(admin.ModelAdmin):
 
 @admin.register(Newsletter)
 class NewsletterAdmin(admin.ModelAdmin):
-    list_display = ['title', 'newsletter_type', 'status', 'total_recipients', 'open_rate', 'created_at']
+    list_display = ['title', 'newsletter_type', 'status', 'total_recipients', 'total_sent', 'total_failed', 'open_rate', 'created_at']
     list_filter = ['newsletter_type', 'status', 'target_audience', 'created_at']
     search_fields = ['title', 'subject']
-    readonly_fields = ['total_sent', 'total_delivered', 'total_opened', 'total_clicked']
+    readonly_fields = [
+        'total_sent', 'total_failed', 'total_delivered', 'total_opened', 'total_clicked',
+        'recipients_queued', 'send_queued_through', 'send_started_at', 'last_progress_at',
+    ]
 
 @admin.register(NewsletterSendLog)
 class NewsletterSendLogAdmin(admin.ModelAdmin):
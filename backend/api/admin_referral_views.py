@@ -8,6 +8,7 @@ from django.utils import timezone
 from datetime import timedelta
 from .referral_models import ReferralSettings, ReferralCode, Referral, ReferralEarning, ReferralWithdrawal
 from .referral_service import ReferralService
+from . import payouts
 from .permissions import IsAdminUser
 import logging
 
@@ -264,6 +265,12 @@ def admin_process_withdrawal(request, withdrawal_id):
             
         if 'payment_reference' in data:
             withdrawal.payment_reference = data['payment_reference']
+        
+        # Approving an M-Pesa/bank withdrawal without a manual payment reference
+        # hands it to the payout engine; it settles when the transfer does
+        if (withdrawal.status == 'processing' and withdrawal.withdrawal_method != 'balance'
+                and not withdrawal.payment_reference):
+            payouts.queue_referral_payout(withdrawal)
             
         if withdrawal.status in ['completed', 'failed']:
             withdrawal.processed_at = timezone.now()
@@ -0,0 +1,245 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .inline_worker import InlineWorker
+from .models import Gig, Message, Order, UserAnalytics
+
+logger = logging.getLogger(__name__)
+
+VIEW_FIELDS = {
+    'gig_view': 'gig_views',
+    'profile_view': 'profile_views',
+}
+
+
+class ViewCounter:
+    """In-memory coalescing counter for profile and gig views.
+
+    Increments are summed per (user, field) and written as a single ``F()``
+    update per user. A timer armed by the first pending increment flushes
+    them ``ANALYTICS_VIEW_FLUSH_INTERVAL`` seconds later on a background
+    thread, so views of quiet gigs reach the database without waiting for
+    another view.
+    """
+
+    def __init__(self, flush_interval=None):
+        if flush_interval is None:
+            flush_interval = getattr(settings, 'ANALYTICS_VIEW_FLUSH_INTERVAL', 5.0)
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._timer = None
+        self._worker = InlineWorker(self.flush, name='view counters')
+
+    def increment(self, user_id, field, amount=1):
+        """Record ``amount`` views of ``field`` for ``user_id``"""
+        if field not in VIEW_FIELDS.values():
+            raise ValueError(f"Unknown view counter field: {field}")
+
+        with self._lock:
+            self._pending[(user_id, field)] += amount
+            self._arm()
+
+    def _arm(self):
+        # Caller holds self._lock
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self._worker.kick)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def pending(self):
+        """Return a snapshot of the deltas not yet written"""
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        """Write all pending deltas to the database, returning the rows touched"""
+        with self._lock:
+            pending = self._pending
+            self._pending = defaultdict(int)
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if not pending:
+            return 0
+
+        per_user = defaultdict(dict)
+        for (user_id, field), delta in pending.items():
+            per_user[user_id][field] = delta
+
+        flushed = 0
+        for user_id, deltas in per_user.items():
+            try:
+                flushed += self._apply(user_id, deltas)
+            except Exception as e:
+                logger.error(f"Error flushing view counters for user {user_id}: {e}")
+                with self._lock:
+                    for field, delta in deltas.items():
+                        self._pending[(user_id, field)] += delta
+                    self._arm()
+        return flushed
+
+    @staticmethod
+    def _apply(user_id, deltas):
+        updates = {field: F(field) + delta for field, delta in deltas.items()}
+        gig_delta = deltas.get('gig_views')
+        if gig_delta:
+            # Orders per hundred gig views, using the post-increment view count
+            updates['conversion_rate'] = (
+                Cast(F('total_orders'), FloatField()) * 100.0 / (F('gig_views') + gig_delta)
+            )
+
+        rows = UserAnalytics.objects.filter(user_id=user_id).update(**updates)
+        if not rows:
+            UserAnalytics.objects.get_or_create(user_id=user_id)
+            rows = UserAnalytics.objects.filter(user_id=user_id).update(**updates)
+        return rows
+
+
+def _flush_quietly(counter):
+    try:
+        counter.flush()
+    except Exception as e:
+        logger.error(f'Flushing view counters at exit failed: {e}')
+
+
+view_counter = ViewCounter()
+atexit.register(_flush_quietly, view_counter)
+
+
+def _apply_deltas(user_id, **deltas):
+    """Add ``deltas`` to a user's analytics row with a single F() update"""
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if 'total_orders' in deltas:
+        updates['conversion_rate'] = Case(
+            When(gig_views__gt=0, then=Cast(F('total_orders') + deltas['total_orders'], FloatField()) * 100.0 / F('gig_views')),
+            default=Value(0.0),
+        )
+    rows = UserAnalytics.objects.filter(user_id=user_id).update(**updates)
+    if not rows:
+        # No projection yet: build it from the orders, which already include this change
+        AnalyticsService.recompute(user_id)
+
+
+class AnalyticsService:
+    """Service for keeping UserAnalytics counters up to date.
+
+    UserAnalytics is a projection: order totals are adjusted as orders are
+    created and completed, so reading it never needs to aggregate orders.
+    """
+
+    @staticmethod
+    def recompute(user_id):
+        """Rebuild the order totals for ``user_id`` from the Order table"""
+        totals = Order.objects.filter(Q(client_id=user_id) | Q(freelancer_id=user_id)).aggregate(
+            total_orders=Count('id'),
+            total_earnings=Sum('price', filter=Q(freelancer_id=user_id, status='completed')),
+            total_spent=Sum('price', filter=Q(client_id=user_id, status='completed')),
+        )
+        analytics, _ = UserAnalytics.objects.get_or_create(user_id=user_id)
+        analytics.total_orders = totals['total_orders'] or 0
+        analytics.total_earnings = totals['total_earnings'] or 0
+        analytics.total_spent = totals['total_spent'] or 0
+        analytics.conversion_rate = (
+            analytics.total_orders * 100.0 / analytics.gig_views if analytics.gig_views else 0
+        )
+        analytics.save(update_fields=['total_orders', 'total_earnings', 'total_spent', 'conversion_rate', 'last_updated'])
+        return analytics
+
+    @staticmethod
+    def record_order_created(order):
+        """Count a new order for both parties"""
+        try:
+            for user_id in {order.client_id, order.freelancer_id}:
+                _apply_deltas(user_id, total_orders=1)
+        except Exception as e:
+            logger.error(f"Error recording order {order.id} in analytics: {e}")
+
+    @staticmethod
+    def record_order_transition(order, old_status, new_status):
+        """Move the order's price into earnings/spent when it becomes completed"""
+        if old_status == new_status or 'completed' not in (old_status, new_status):
+            return
+        try:
+            amount = Decimal(str(order.price or 0))
+            if new_status != 'completed':
+                amount = -amount
+            _apply_deltas(order.freelancer_id, total_earnings=amount)
+            _apply_deltas(order.client_id, total_spent=amount)
+        except Exception as e:
+            logger.error(f"Error recording order {order.id} transition in analytics: {e}")
+
+    @staticmethod
+    def record_event(event_type, event_data, viewer=None):
+        """Feed a tracked gig_view/profile_view event into the view counters"""
+        field = VIEW_FIELDS.get(event_type)
+        if not field or not isinstance(event_data, dict):
+            return None
+
+        try:
+            if event_type == 'gig_view':
+                gig_id = event_data.get('gig_id') or event_data.get('gig')
+                if not gig_id:
+                    return None
+                owner_id = Gig.objects.filter(id=gig_id).values_list('freelancer_id', flat=True).first()
+            else:
+                owner_id = event_data.get('user_id') or event_data.get('profile_user_id')
+                owner_id = int(owner_id) if owner_id else None
+        except (TypeError, ValueError):
+            return None
+
+        if owner_id:
+            AnalyticsService.record_view(owner_id, field, viewer=viewer)
+        return owner_id
+
+    @staticmethod
+    def record_view(owner_id, field, viewer=None):
+        """Count a view of ``owner_id``'s gig or profile, ignoring self-views"""
+        if viewer is not None and getattr(viewer, 'id', None) == owner_id:
+            return
+        view_counter.increment(owner_id, field)
+
+    @staticmethod
+    def record_message_response(message):
+        """Fold the reply delay of ``message`` into the sender's mean response time.
+
+        The delay is measured from the previous message in the conversation when
+        it came from someone else, so only the first reply in a turn counts.
+        """
+        try:
+            previous = (
+                Message.objects
+                .filter(conversation_id=message.conversation_id, created_at__lte=message.created_at)
+                .exclude(id=message.id)
+                .order_by('-created_at')
+                .values('sender_id', 'created_at')
+                .first()
+            )
+            if not previous or previous['sender_id'] == message.sender_id:
+                return None
+
+            minutes = int((message.created_at - previous['created_at']).total_seconds() // 60)
+            # The mean is derived from the exact running sum, so integer division only
+            # rounds the stored minutes and never accumulates across samples
+            updates = {
+                'response_minutes_total': F('response_minutes_total') + minutes,
+                'response_samples': F('response_samples') + 1,
+                'response_time': (F('response_minutes_total') + minutes) / (F('response_samples') + 1),
+            }
+            rows = UserAnalytics.objects.filter(user_id=message.sender_id).update(**updates)
+            if not rows:
+                UserAnalytics.objects.get_or_create(user_id=message.sender_id)
+                UserAnalytics.objects.filter(user_id=message.sender_id).update(**updates)
+            return minutes
+        except Exception as e:
+            logger.error(f"Error recording response time for message {message.id}: {e}")
+            return None
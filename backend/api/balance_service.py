@@ -0,0 +1,120 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import ledger
+from .ledger import InsufficientFunds, quantize as _quantize
+from .models import UserProfile
+
+BALANCE_FIELDS = tuple(ledger.PROFILE_FIELD_KINDS)
+
+# Where the other side of a user balance change is booked, by entry type
+COUNTERPARTIES = {
+    'payment': ledger.PAYSTACK_CLEARING,
+    'withdrawal': ledger.PAYSTACK_CLEARING,
+    'refund': ledger.PAYSTACK_CLEARING,
+    'bonus': ledger.REFERRAL_BONUSES,
+}
+
+
+def _user_id(user):
+    return user if isinstance(user, int) else user.pk
+
+
+class BalanceService:
+    """Moves user balances through the double-entry ledger.
+
+    Every change is a balanced ``LedgerEntry``: the user's accounts move by the
+    requested deltas and the remainder is booked to a platform account (the
+    Paystack clearing account for payments and withdrawals, the referral pool
+    for bonuses, adjustments otherwise). ``total_earnings`` is a memo balance
+    and is always balanced against the earnings-recognised account.
+
+    Account balances are changed with conditional UPDATEs, so concurrent
+    changes never overwrite each other and an overdraft is rejected by the
+    database. The ``UserProfile`` balance columns are a projection of the
+    ledger, rewritten in the same transaction, so reads stay a single row.
+    Fields listed in ``floor_at_zero`` are clamped at zero instead of rejected
+    (for legacy balances that may already be inconsistent).
+    """
+
+    @staticmethod
+    def apply(user, floor_at_zero=(), entry_type='adjustment', reference='', description='',
+              counterparty=None, idempotency_key=None, **deltas):
+        """Apply ``field=delta`` changes for one user; returns the new balances.
+
+        Raises InsufficientFunds (and changes nothing) if a debit would overdraw.
+        Posting again with a used ``idempotency_key`` changes nothing.
+        """
+        user_id = _user_id(user)
+        deltas = {field: _quantize(delta) for field, delta in deltas.items() if delta}
+        unknown = set(deltas) - set(BALANCE_FIELDS)
+        if unknown:
+            raise ValueError(f'Not a balance field: {", ".join(sorted(unknown))}')
+        if not deltas:
+            return BalanceService.get(user_id)
+
+        with transaction.atomic():
+            # Touch the profile first: concurrent changes for one user queue on its row
+            # before doing any ledger work
+            if not UserProfile.objects.filter(user_id=user_id).update(updated_at=timezone.now()):
+                UserProfile.objects.get_or_create(user_id=user_id)
+            accounts = ledger.user_accounts(user_id, deltas)
+            lines = [(accounts[field], delta) for field, delta in deltas.items()]
+
+            earnings = deltas.get('total_earnings')
+            if earnings:
+                lines.append((ledger.system_account(ledger.EARNINGS_RECOGNISED), -earnings))
+            remainder = sum(delta for field, delta in deltas.items() if field != 'total_earnings')
+            if remainder:
+                name = counterparty or COUNTERPARTIES.get(entry_type, ledger.ADJUSTMENTS)
+                lines.append((ledger.system_account(name), -remainder))
+
+            ledger.post(
+                lines, entry_type, reference=reference, description=description,
+                idempotency_key=idempotency_key,
+                floor_at_zero=[accounts[field] for field in floor_at_zero if field in accounts],
+            )
+
+            balances = ledger.balances(accounts.values())
+            UserProfile.objects.filter(user_id=user_id).update(
+                **{field: balances[account_id] for field, account_id in accounts.items()},
+            )
+            return BalanceService.get(user_id)
+
+    @staticmethod
+    def apply_many(changes, floor_at_zero=(), **entry):
+        """Apply ``[(user, {field: delta}), ...]`` all-or-nothing.
+
+        Deltas are merged per user and applied in user id order, so two
+        transactions touching the same accounts always lock rows in the same
+        order and cannot deadlock each other.
+        """
+        merged = defaultdict(lambda: defaultdict(Decimal))
+        for user, deltas in changes:
+            for field, delta in deltas.items():
+                merged[_user_id(user)][field] += Decimal(str(delta))
+
+        key = entry.pop('idempotency_key', None)
+        with transaction.atomic():
+            return {
+                user_id: BalanceService.apply(
+                    user_id, floor_at_zero=floor_at_zero, idempotency_key=key and f'{key}:{user_id}',
+                    **entry, **merged[user_id],
+                )
+                for user_id in sorted(merged)
+            }
+
+    @staticmethod
+    def credit(user, amount, field='available_balance', **entry):
+        return BalanceService.apply(user, **entry, **{field: amount})
+
+    @staticmethod
+    def debit(user, amount, field='available_balance', **entry):
+        return BalanceService.apply(user, **entry, **{field: -Decimal(str(amount))})
+
+    @staticmethod
+    def get(user):
+        return UserProfile.objects.filter(user_id=_user_id(user)).values(*BALANCE_FIELDS).first()
@@ -0,0 +1,60 @@
+from django.conf import settings
+
+from .cache_utils import StaleWhileRevalidateCache
+from .paystack_client import paystack_client
+
+# Providers Paystack doesn't list for Kenya but the withdrawal form offers
+MOBILE_MONEY_PROVIDERS = [
+    {
+        'id': 'mpesa',
+        'name': 'M-Pesa',
+        'code': 'MPesa',
+        'type': 'mobile_money',
+        'currency': 'KES',
+        'description': 'Safaricom M-Pesa mobile money'
+    },
+    {
+        'id': 'airtel_money',
+        'name': 'Airtel Money',
+        'code': 'AirtelMoney',
+        'type': 'mobile_money',
+        'currency': 'KES',
+        'description': 'Airtel Money mobile money'
+    }
+]
+
+bank_list_cache = StaleWhileRevalidateCache(
+    'paystack_banks',
+    ttl=getattr(settings, 'BANK_LIST_CACHE_TTL', 6 * 60 * 60),
+    stale_ttl=getattr(settings, 'BANK_LIST_STALE_TTL', 7 * 24 * 60 * 60),
+)
+
+
+def fetch_banks(country='kenya'):
+    """Fetch the bank list straight from Paystack; None on failure"""
+    params = {'use_cursor': 'false', 'perPage': 100}
+    if country:
+        params['country'] = country
+    result = paystack_client.request_json('GET', '/bank', params=params)
+    if result and result.get('status'):
+        return result['data']
+    return None
+
+
+def list_banks(country='kenya'):
+    """Cached bank list for ``country`` in Paystack's response shape, or None if never fetched"""
+    banks = bank_list_cache.get(country or 'default', lambda: fetch_banks(country))
+    if banks is None:
+        return None
+    return {'status': True, 'data': banks}
+
+
+def warm(countries=('kenya',)):
+    """Fetch and store the lists now; returns {country: number of banks, or None if the fetch failed}"""
+    results = {}
+    for country in countries:
+        banks = fetch_banks(country)
+        if banks is not None:
+            bank_list_cache.set(country or 'default', banks)
+        results[country] = len(banks) if banks is not None else None
+    return results
@@ -0,0 +1,78 @@
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class StaleWhileRevalidateCache:
+    """TTL cache over Django's cache backend that serves stale values while refreshing.
+
+    Entries are stored as ``{'value': ..., 'fetched_at': ...}``. Within ``ttl``
+    seconds a hit is returned as-is; between ``ttl`` and ``ttl + stale_ttl`` the
+    stale value is returned immediately and one background thread per key
+    reloads it. Only a completely cold key blocks on the loader. A loader that
+    returns None (or raises) never overwrites a good entry.
+    """
+
+    def __init__(self, prefix, ttl, stale_ttl, backend=None):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.backend = backend or cache
+        self._lock = threading.Lock()
+        self._refreshing = {}
+
+    def make_key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def get(self, key, loader):
+        entry = self.backend.get(self.make_key(key))
+        if entry is None:
+            return self.refresh(key, loader)
+        if time.time() - entry['fetched_at'] >= self.ttl:
+            self.refresh_in_background(key, loader)
+        return entry['value']
+
+    def refresh(self, key, loader):
+        """Load ``key`` synchronously and store it; returns the cached value on failure"""
+        try:
+            value = loader()
+        except Exception as e:
+            logger.warning(f'Refreshing {self.make_key(key)} failed: {e}')
+            value = None
+        if value is None:
+            entry = self.backend.get(self.make_key(key))
+            return entry['value'] if entry else None
+        self.set(key, value)
+        return value
+
+    def refresh_in_background(self, key, loader):
+        with self._lock:
+            thread = self._refreshing.get(key)
+            if thread is not None and thread.is_alive():
+                return thread
+            thread = threading.Thread(target=self._background_refresh, args=(key, loader), daemon=True)
+            self._refreshing[key] = thread
+            thread.start()
+        return thread
+
+    def set(self, key, value):
+        self.backend.set(
+            self.make_key(key),
+            {'value': value, 'fetched_at': time.time()},
+            timeout=self.ttl + self.stale_ttl,
+        )
+
+    def delete(self, key):
+        self.backend.delete(self.make_key(key))
+
+    def _background_refresh(self, key, loader):
+        try:
+            self.refresh(key, loader)
+        finally:
+            with self._lock:
+                if self._refreshing.get(key) is threading.current_thread():
+                    del self._refreshing[key]
@@ -5,6 +5,7 @@ from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 from .models import Conversation, Message
+from .notification_fanout import audience_groups
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +49,11 @@ class MessageConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         
+        # Broadcast notifications arrive once per audience group, not per user
+        self.audience_group_names = await self.get_audience_groups()
+        for group_name in self.audience_group_names:
+            await self.channel_layer.group_add(group_name, self.channel_name)
+        
         logger.info(f"WebSocket connected for user {self.user.username}")
         
         # Send connection confirmation
@@ -64,6 +70,9 @@ class MessageConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
             
+            for group_name in getattr(self, 'audience_group_names', []):
+                await self.channel_layer.group_discard(group_name, self.channel_name)
+            
             # Remove from any conversation groups
             if hasattr(self, 'conversation_groups'):
                 for group_name in self.conversation_groups:
@@ -213,6 +222,24 @@ class MessageConsumer(AsyncWebsocketConsumer):
             'status': event['status']
         }))
 
+    # Receive a single notification for this user
+    async def notification(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'notification',
+            'notification': event['notification']
+        }))
+
+    # Receive a notification sent to a whole audience (see api.notification_fanout)
+    async def notification_broadcast(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'notification_broadcast',
+            'notification': event['notification']
+        }))
+
+    @database_sync_to_async
+    def get_audience_groups(self):
+        return audience_groups(self.user)
+
     @database_sync_to_async
     def get_user_from_token(self, token_key):
         try:
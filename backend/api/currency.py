@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+RATE_PLACES = Decimal('0.00000001')
+SNAPSHOT_CACHE_KEY = 'exchange_rates:snapshot'
+
+# Used until the first successful fetch (or shared snapshot) is available
+DEFAULT_RATES = {'USD': '1', 'KES': '130.0'}
+
+
+class CurrencyService:
+    """USD-based rate table held in process memory.
+
+    Reads never do I/O: ``rates()`` returns whatever table is loaded and, if it
+    is older than ``ttl``, starts one background refresh. The refresh first
+    adopts a newer snapshot shared through the cache (so only one worker has
+    to call the rates API), otherwise fetches the API and publishes the
+    result as the new snapshot. Until anything succeeds the fallback table
+    from settings is used.
+    """
+
+    def __init__(self, api_url=None, ttl=None, timeout=None, fallback=None):
+        self.api_url = api_url or getattr(settings, 'EXCHANGE_RATE_API_URL', 'https://api.exchangerate-api.com/v4/latest/USD')
+        self.ttl = ttl if ttl is not None else getattr(settings, 'EXCHANGE_RATE_TTL', 60 * 60)
+        self.timeout = timeout or getattr(settings, 'EXCHANGE_RATE_TIMEOUT', (3.05, 5))
+        self.retry_after = getattr(settings, 'EXCHANGE_RATE_RETRY_AFTER', 5 * 60)
+        fallback = fallback or getattr(settings, 'EXCHANGE_RATE_FALLBACK', DEFAULT_RATES)
+        self._fallback = self._parse(fallback)
+        self._rates = dict(self._fallback)
+        self._fetched_at = 0.0
+        self._refresh_after = 0.0
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    @property
+    def fetched_at(self):
+        return self._fetched_at
+
+    def rates(self):
+        """Current {currency: units per USD}; schedules a refresh when stale"""
+        if time.time() >= self._refresh_after:
+            self.refresh_in_background()
+        return self._rates
+
+    def rate(self, from_currency, to_currency):
+        """Multiplier converting ``from_currency`` amounts to ``to_currency``"""
+        return self._cross_rate(self.rates(), from_currency, to_currency)
+
+    def convert(self, amount, from_currency='USD', to_currency='KES'):
+        return Decimal(str(amount or 0)) * self.rate(from_currency, to_currency)
+
+    def convert_many(self, amounts, from_currency='USD', to_currency='KES'):
+        """Convert a batch of amounts with a single rate lookup"""
+        rate = self.rate(from_currency, to_currency)
+        return [Decimal(str(amount or 0)) * rate for amount in amounts]
+
+    def refresh(self):
+        """Load newer rates now (shared snapshot first, then the API); True if the table changed"""
+        snapshot = cache.get(SNAPSHOT_CACHE_KEY)
+        if snapshot and time.time() - snapshot['fetched_at'] < self.ttl:
+            self._install(self._parse(snapshot['rates']), snapshot['fetched_at'])
+            return True
+
+        rates = self._fetch()
+        if rates is None:
+            # Keep serving what we have, but don't retry on every read
+            with self._lock:
+                self._refresh_after = time.time() + self.retry_after
+            return False
+
+        fetched_at = time.time()
+        self._install(rates, fetched_at)
+        cache.set(SNAPSHOT_CACHE_KEY, {
+            'rates': {code: str(value) for code, value in rates.items()},
+            'fetched_at': fetched_at,
+        }, timeout=None)
+        return True
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return self._refresh_thread
+            self._refresh_thread = threading.Thread(target=self._safe_refresh, daemon=True)
+            self._refresh_thread.start()
+            return self._refresh_thread
+
+    def _safe_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning(f'Exchange rate refresh failed: {e}')
+
+    def _fetch(self):
+        if not self.api_url:
+            return None
+        try:
+            response = requests.get(self.api_url, timeout=self.timeout)
+            response.raise_for_status()
+            rates = self._parse(response.json()['rates'])
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            logger.warning(f'Exchange rate fetch failed: {e}')
+            return None
+        if 'KES' not in rates:
+            logger.warning('Exchange rate response has no KES rate')
+            return None
+        return rates
+
+    def _install(self, rates, fetched_at):
+        merged = dict(self._fallback)
+        merged.update(rates)
+        with self._lock:
+            # Swap the whole dict so readers never see a half-updated table
+            self._rates = merged
+            self._fetched_at = fetched_at
+            self._refresh_after = fetched_at + self.ttl
+
+    @staticmethod
+    def _parse(rates):
+        parsed = {}
+        for code, value in rates.items():
+            try:
+                value = Decimal(str(value))
+            except InvalidOperation:
+                continue
+            if value > 0:
+                parsed[code.upper()] = value
+        return parsed
+
+    @staticmethod
+    def _cross_rate(rates, from_currency, to_currency):
+        from_currency, to_currency = from_currency.upper(), to_currency.upper()
+        if from_currency == to_currency:
+            return Decimal('1')
+        try:
+            return (rates[to_currency] / rates[from_currency]).quantize(RATE_PLACES)
+        except KeyError as e:
+            raise ValueError(f'No exchange rate for {e.args[0]}')
+
+
+currency_service = CurrencyService()
+
+
+def usd_to_kes(amount):
+    return currency_service.convert(amount, 'USD', 'KES')
+
+
+def kes_to_usd(amount):
+    return currency_service.convert(amount, 'KES', 'USD')
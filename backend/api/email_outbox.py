@@ -0,0 +1,131 @@
+import logging
+import random
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.utils import timezone
+
+from .inline_worker import InlineWorker
+from .mail_dispatcher import mail_dispatcher
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(subject, message, recipient_list, html_message=None, from_email=None, category=''):
+    """Queue an email for the outbox worker instead of talking to SMTP in the request.
+
+    Takes the same arguments as ``send_mail``. The row is committed with the
+    caller's transaction, and delivery is kicked off once it commits.
+    """
+    email = OutboundEmail.objects.create(
+        category=category,
+        to=list(recipient_list),
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        subject=subject[:255],
+        body=message,
+        html_body=html_message or '',
+    )
+    schedule_delivery()
+    return email
+
+
+def retry_delay(attempts):
+    """Seconds before retry number ``attempts``: doubling from EMAIL_OUTBOX_RETRY_BASE up to
+    EMAIL_OUTBOX_RETRY_MAX, with the upper half jittered so failed sends don't retry in lockstep"""
+    base = getattr(settings, 'EMAIL_OUTBOX_RETRY_BASE', 30)
+    ceiling = min(base * (2 ** (attempts - 1)), getattr(settings, 'EMAIL_OUTBOX_RETRY_MAX', 60 * 60))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+def build_message(email):
+    msg = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+    )
+    if email.html_body:
+        msg.attach_alternative(email.html_body, 'text/html')
+    return msg
+
+
+def release_stale_claims():
+    """Return emails held by a worker that died mid-batch to the queue"""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_LOCK_TIMEOUT', 300))
+    return OutboundEmail.objects.filter(status='sending', claimed_at__lt=cutoff).update(
+        status='pending', batch_id='', claimed_at=None,
+    )
+
+
+def claim_batch(batch_size):
+    """Atomically take up to ``batch_size`` emails that are due"""
+    now = timezone.now()
+    ids = list(
+        OutboundEmail.objects.filter(status='pending', next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    batch_id = uuid.uuid4().hex
+    OutboundEmail.objects.filter(id__in=ids, status='pending').update(
+        status='sending', batch_id=batch_id, claimed_at=now,
+    )
+    # Rows another worker claimed first simply aren't in our batch
+    return list(OutboundEmail.objects.filter(batch_id=batch_id).order_by('id'))
+
+
+def deliver(emails):
+    """Send one claimed batch; failures are rescheduled with backoff. Returns (sent, failed)."""
+    errors = mail_dispatcher.send_messages([build_message(email) for email in emails])
+    max_attempts = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 8)
+    now = timezone.now()
+    sent = []
+    failed = 0
+    with transaction.atomic():
+        for email, error in zip(emails, errors):
+            if error is None:
+                sent.append(email.id)
+                continue
+            failed += 1
+            attempts = email.attempts + 1
+            updates = {'attempts': attempts, 'last_error': error, 'batch_id': '', 'claimed_at': None}
+            if attempts >= max_attempts:
+                updates['status'] = 'failed'
+                logger.error(f'Giving up on email {email.id} to {", ".join(email.to)} after {attempts} attempts: {error}')
+            else:
+                updates['status'] = 'pending'
+                updates['next_attempt_at'] = now + timedelta(seconds=retry_delay(attempts))
+            OutboundEmail.objects.filter(pk=email.pk).update(**updates)
+        OutboundEmail.objects.filter(id__in=sent).update(status='sent', sent_at=now, batch_id='', claimed_at=None)
+    return len(sent), failed
+
+
+def process_pending(batch_size=None):
+    """Deliver every email that is due; returns {'sent': n, 'failed': n}"""
+    batch_size = batch_size or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50)
+    release_stale_claims()
+    totals = {'sent': 0, 'failed': 0}
+    try:
+        while True:
+            emails = claim_batch(batch_size)
+            if not emails:
+                break
+            sent, failed = deliver(emails)
+            totals['sent'] += sent
+            totals['failed'] += failed
+    finally:
+        mail_dispatcher.close()
+    return totals
+
+
+# Delivers in the web process when no `send_outbox_emails --loop` worker is running (EMAIL_OUTBOX_INLINE)
+outbox_worker = InlineWorker(process_pending, name='email outbox')
+
+
+def schedule_delivery():
+    if getattr(settings, 'EMAIL_OUTBOX_INLINE', True):
+        transaction.on_commit(outbox_worker.kick)
@@ -1,9 +1,10 @@
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
 import logging
 
+from . import email_outbox
+
 logger = logging.getLogger(__name__)
 
 class EmailService:
@@ -21,20 +22,20 @@ class EmailService:
             html_message = render_to_string('emails/welcome_email.html', context)
             plain_message = strip_tags(html_message)
             
-            send_mail(
+            email_outbox.enqueue(
                 subject='Welcome to Neurolancer - Your AI Freelance Journey Starts Here! 🚀',
                 message=plain_message,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[user.email],
                 html_message=html_message,
-                fail_silently=False,
+                category='welcome',
             )
             
-            logger.info(f"Welcome email sent to {user.email}")
+            logger.info(f"Welcome email queued for {user.email}")
             return True
             
         except Exception as e:
-            logger.error(f"Failed to send welcome email to {user.email}: {e}")
+            logger.error(f"Failed to queue welcome email for {user.email}: {e}")
             return False
     
     @staticmethod
@@ -49,20 +50,20 @@ class EmailService:
             html_message = render_to_string('emails/verify_email.html', context)
             plain_message = strip_tags(html_message)
             
-            send_mail(
+            email_outbox.enqueue(
                 subject='Verify your Neurolancer account',
                 message=plain_message,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[user.email],
                 html_message=html_message,
-                fail_silently=False,
+                category='verification',
             )
             
-            logger.info(f"Verification email sent to {user.email}")
+            logger.info(f"Verification email queued for {user.email}")
             return True
             
         except Exception as e:
-            logger.error(f"Failed to send verification email to {user.email}: {e}")
+            logger.error(f"Failed to queue verification email for {user.email}: {e}")
             return False
 
     @staticmethod
@@ -76,18 +77,18 @@ class EmailService:
             }
             html_message = render_to_string('emails/referral_bonus.html', context)
             plain_message = strip_tags(html_message)
-            send_mail(
+            email_outbox.enqueue(
                 subject=f'You earned a referral bonus: ${amount}',
                 message=plain_message,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[referrer.email],
                 html_message=html_message,
-                fail_silently=False,
+                category='referral',
             )
-            logger.info(f"Referral bonus email sent to {referrer.email}")
+            logger.info(f"Referral bonus email queued for {referrer.email}")
             return True
         except Exception as e:
-            logger.error(f"Failed to send referral bonus email to {referrer.email}: {e}")
+            logger.error(f"Failed to queue referral bonus email for {referrer.email}: {e}")
             return False
 
     @staticmethod
@@ -100,18 +101,18 @@ class EmailService:
             }
             html_message = render_to_string('emails/referral_verified.html', context)
             plain_message = strip_tags(html_message)
-            send_mail(
+            email_outbox.enqueue(
                 subject=f'Referral verified: {referred_user.username}',
                 message=plain_message,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[referrer.email],
                 html_message=html_message,
-                fail_silently=False,
+                category='referral',
             )
-            logger.info(f"Referral verified email sent to {referrer.email}")
+            logger.info(f"Referral verified email queued for {referrer.email}")
             return True
         except Exception as e:
-            logger.error(f"Failed to send referral verified email to {referrer.email}: {e}")
+            logger.error(f"Failed to queue referral verified email for {referrer.email}: {e}")
             return False
 
     @staticmethod
@@ -127,18 +128,18 @@ class EmailService:
             }
             html_message = render_to_string('emails/referral_percentage_earning.html', context)
             plain_message = strip_tags(html_message)
-            send_mail(
+            email_outbox.enqueue(
                 subject=f'You earned ${amount} from your referral',
                 message=plain_message,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[referrer.email],
                 html_message=html_message,
-                fail_silently=False,
+                category='referral',
             )
-            logger.info(f"Referral percentage earning email sent to {referrer.email}")
+            logger.info(f"Referral percentage earning email queued for {referrer.email}")
             return True
         except Exception as e:
-            logger.error(f"Failed to send referral percentage email to {referrer.email}: {e}")
+            logger.error(f"Failed to queue referral percentage email for {referrer.email}: {e}")
             return False
 
     @staticmethod
@@ -152,18 +153,18 @@ class EmailService:
             }
             html_message = render_to_string('emails/referral_withdrawal_requested.html', context)
             plain_message = strip_tags(html_message)
-            send_mail(
+            email_outbox.enqueue(
                 subject=f'Referral withdrawal requested: ${amount}',
                 message=plain_message,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[user.email],
                 html_message=html_message,
-                fail_silently=False,
+                category='referral',
             )
-            logger.info(f"Referral withdrawal requested email sent to {user.email}")
+            logger.info(f"Referral withdrawal requested email queued for {user.email}")
             return True
         except Exception as e:
-            logger.error(f"Failed to send referral withdrawal requested email to {user.email}: {e}")
+            logger.error(f"Failed to queue referral withdrawal requested email for {user.email}: {e}")
             return False
 
     @staticmethod
@@ -180,16 +181,16 @@ class EmailService:
             html_message = render_to_string('emails/referral_withdrawal_processed.html', context)
             plain_message = strip_tags(html_message)
             subject_status = 'completed' if status == 'completed' else ('failed' if status == 'failed' else status)
-            send_mail(
+            email_outbox.enqueue(
                 subject=f'Referral withdrawal {subject_status}: ${amount}',
                 message=plain_message,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[user.email],
                 html_message=html_message,
-                fail_silently=False,
+                category='referral',
             )
-            logger.info(f"Referral withdrawal processed email sent to {user.email}")
+            logger.info(f"Referral withdrawal processed email queued for {user.email}")
             return True
         except Exception as e:
-            logger.error(f"Failed to send referral withdrawal processed email to {user.email}: {e}")
+            logger.error(f"Failed to queue referral withdrawal processed email for {user.email}: {e}")
             return False
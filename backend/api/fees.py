@@ -0,0 +1,197 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP, localcontext
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from .currency import currency_service
+
+CENTS = Decimal('0.01')
+
+FREELANCER_FEE_RATE = Decimal('0.05')   # taken from the freelancer's earnings
+CLIENT_FEE_RATE = Decimal('0.025')      # added to what the client pays
+PROCESSING_FEE_KES = Decimal('50.00')   # flat, once per Paystack charge
+
+MAX_QUOTE_ITEMS = 100
+QUOTE_SALT = 'api.fees.quote'
+
+# Per-line amounts in a quote, in column order
+LINE_FIELDS = ('base_amount', 'client_fee', 'processing_fee', 'total_amount', 'freelancer_fee', 'freelancer_earnings')
+
+
+class FeeError(ValueError):
+    """A line item or quote that can't be priced"""
+
+
+def to_decimal(value, field='amount'):
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise FeeError(f'{field} must be a number')
+    if not amount.is_finite():
+        raise FeeError(f'{field} must be a number')
+    return amount
+
+
+def base_amount(item):
+    """Base price of one line item: ``amount``, or ``hours_worked`` x ``hourly_rate``"""
+    if item.get('hours_worked') not in (None, '') and item.get('hourly_rate') not in (None, ''):
+        amount = to_decimal(item['hours_worked'], 'hours_worked') * to_decimal(item['hourly_rate'], 'hourly_rate')
+    elif item.get('amount') not in (None, ''):
+        amount = to_decimal(item['amount'])
+    else:
+        raise FeeError('Either amount or hours_worked and hourly_rate are required')
+    if amount <= 0:
+        raise FeeError('Amount must be greater than zero')
+    return amount.quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def processing_fee(currency='KES'):
+    if currency == 'KES':
+        return PROCESSING_FEE_KES
+    if currency not in currency_service.rates():
+        raise FeeError(f'Unsupported currency: {currency}')
+    return currency_service.convert(PROCESSING_FEE_KES, 'KES', currency).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def _percent(column, rate):
+    return [(amount * rate).quantize(CENTS, rounding=ROUND_HALF_UP) for amount in column]
+
+
+def allocate(total, weights):
+    """Split ``total`` across ``weights`` in cents so the parts add up to it exactly.
+
+    Largest-remainder method: everyone gets the floor of their share, then the
+    leftover cents go to the largest remainders (earliest line on ties).
+    """
+    if not weights:
+        raise FeeError('Nothing to allocate to')
+    if not any(weights):
+        weights = [1] * len(weights)
+    cents = int(total / CENTS)
+    weight_sum = sum(weights)
+    shares = [cents * weight / weight_sum for weight in weights]
+    parts = [int(share) for share in shares]
+    leftover = cents - sum(parts)
+    by_remainder = sorted(range(len(shares)), key=lambda i: (parts[i] - shares[i], i))
+    for i in by_remainder[:leftover]:
+        parts[i] += 1
+    return [part * CENTS for part in parts]
+
+
+def calculate(bases, currency='KES'):
+    """Fee columns for a batch of base amounts paid in one charge.
+
+    Every column is computed over the whole batch with the same rounding
+    (half-up to the cent, per line), and the flat processing fee is shared
+    across the lines in proportion to their base, so each column's lines add
+    up exactly to its total. Returns ``{'lines': [...], 'totals': {...}}``
+    with Decimal values.
+    """
+    bases = [to_decimal(base).quantize(CENTS, rounding=ROUND_HALF_UP) for base in bases]
+    if not bases:
+        raise FeeError('At least one line item is required')
+    if len(bases) > MAX_QUOTE_ITEMS:
+        raise FeeError(f'At most {MAX_QUOTE_ITEMS} line items per quote')
+
+    with localcontext() as context:
+        context.prec = 28
+        columns = {
+            'base_amount': bases,
+            'client_fee': _percent(bases, CLIENT_FEE_RATE),
+            'processing_fee': allocate(processing_fee(currency), bases),
+            'freelancer_fee': _percent(bases, FREELANCER_FEE_RATE),
+        }
+        columns['total_amount'] = [
+            sum(parts) for parts in zip(bases, columns['client_fee'], columns['processing_fee'])
+        ]
+        columns['freelancer_earnings'] = [base - fee for base, fee in zip(bases, columns['freelancer_fee'])]
+
+    lines = [dict(zip(LINE_FIELDS, values)) for values in zip(*(columns[field] for field in LINE_FIELDS))]
+    totals = {field: sum(columns[field], Decimal('0.00')) for field in LINE_FIELDS}
+    return {'currency': currency, 'lines': lines, 'totals': totals}
+
+
+def freelancer_split(base):
+    """(freelancer_fee, freelancer_earnings) for one base amount"""
+    base = to_decimal(base).quantize(CENTS, rounding=ROUND_HALF_UP)
+    fee = _percent([base], FREELANCER_FEE_RATE)[0]
+    return fee, base - fee
+
+
+def platform_income(metadata):
+    """Fees the platform keeps from a verified charge, from the breakdown stored in its metadata"""
+    base = to_decimal(metadata.get('base_amount') or '0', 'base_amount')
+    client_fee = metadata.get('client_fee', metadata.get('platform_fee')) or '0'
+    freelancer_fee = metadata.get('freelancer_fee')
+    if freelancer_fee is None:
+        freelancer_fee = freelancer_split(base)[0]
+    return sum(
+        (to_decimal(value) for value in (client_fee, freelancer_fee, metadata.get('processing_fee') or '0')),
+        Decimal('0.00'),
+    )
+
+
+# Signed quotes
+
+def _serialize(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, dict):
+        return {key: _serialize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_serialize(item) for item in value]
+    return value
+
+
+def quote(user, items, currency='KES'):
+    """Price ``items`` for ``user``; returns the breakdown plus a signed ``quote`` token.
+
+    Each item carries ``amount`` or ``hours_worked``/``hourly_rate`` (and may
+    name what it pays for, e.g. ``order_id``, which is kept in the quote).
+    The token can be handed to ``initialize_payment`` within
+    ``FEE_QUOTE_TTL`` seconds instead of the fees being worked out again.
+    """
+    if not isinstance(items, list):
+        raise FeeError('items must be a list')
+    bases = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise FeeError(f'Item {index} must be an object')
+        try:
+            bases.append(base_amount(item))
+        except FeeError as e:
+            raise FeeError(f'Item {index}: {e}')
+    result = calculate(bases, currency)
+
+    for item, line in zip(items, result['lines']):
+        for key in ('order_id', 'job_id', 'course_id'):
+            if item.get(key) not in (None, ''):
+                line[key] = str(item[key])
+    payload = _serialize({
+        'user': user.pk,
+        'currency': currency,
+        'lines': result['lines'],
+        'totals': result['totals'],
+        'issued_at': timezone.now().isoformat(),
+    })
+    return {**payload, 'quote': signing.dumps(payload, salt=QUOTE_SALT, compress=True)}
+
+
+def load_quote(token, user):
+    """Check a quote token's signature, age and owner; returns it with Decimal amounts"""
+    try:
+        payload = signing.loads(token, salt=QUOTE_SALT, max_age=getattr(settings, 'FEE_QUOTE_TTL', 15 * 60))
+    except signing.SignatureExpired:
+        raise FeeError('Quote has expired, request a new one')
+    except signing.BadSignature:
+        raise FeeError('Invalid quote')
+    if payload.get('user') != user.pk:
+        raise FeeError('Invalid quote')
+
+    payload['lines'] = [
+        {key: Decimal(value) if key in LINE_FIELDS else value for key, value in line.items()}
+        for line in payload['lines']
+    ]
+    payload['totals'] = {key: Decimal(value) for key, value in payload['totals'].items()}
+    return payload
@@ -52,12 +52,13 @@ class FirebaseService:
             cls._initialized = True
     
     @classmethod
-    def send_verification_code(cls, phone_number: str) -> dict:
+    def send_verification_code(cls, phone_number: str, ip_address: str = None) -> dict:
         """
         Send SMS verification code using Firebase or fallback
         
         Args:
             phone_number (str): Phone number in E.164 format (e.g., +1234567890)
+            ip_address (str): Requesting client's IP, for the SMS dispatcher's rate limits
             
         Returns:
             dict: Response with success status and session info
@@ -97,12 +98,12 @@ class FirebaseService:
                     logger.error(f"Firebase phone verification failed: {e}")
                     # Fall back to SMS service
                     from .sms_service import SMSService
-                    return SMSService.send_verification_code(phone_number)
+                    return SMSService.send_verification_code(phone_number, ip_address)
             else:
                 # Fallback to SMS service (Twilio/Mock)
                 logger.info(f"Firebase not available, using SMS service for phone verification: {phone_number}")
                 from .sms_service import SMSService
-                return SMSService.send_verification_code(phone_number)
+                return SMSService.send_verification_code(phone_number, ip_address)
             
         except Exception as e:
             logger.error(f"Failed to send verification code: {e}")
@@ -0,0 +1,43 @@
+import logging
+import threading
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class InlineWorker:
+    """Runs a queue-draining function on a background thread inside the web process.
+
+    Used when no dedicated worker command is running. At most one thread runs
+    per worker; a kick that arrives while it is busy makes it do one more pass.
+    """
+
+    def __init__(self, target, name='queue'):
+        self.target = target
+        self.name = name
+        self._lock = threading.Lock()
+        self._wanted = threading.Event()
+        self._thread = None
+
+    def kick(self):
+        self._wanted.set()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                self._wanted.clear()
+                try:
+                    self.target()
+                except Exception as e:
+                    logger.error(f'Inline {self.name} processing failed: {e}')
+                with self._lock:
+                    if not self._wanted.is_set():
+                        self._thread = None
+                        return
+        finally:
+            connection.close()
@@ -0,0 +1,176 @@
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .ledger_models import LedgerAccount, LedgerEntry, LedgerPosting
+
+CENTS = Decimal('0.01')
+
+# UserProfile balance columns and the ledger account kind behind each
+PROFILE_FIELD_KINDS = {
+    'available_balance': 'available',
+    'escrow_balance': 'escrow',
+    'total_earnings': 'earnings',
+}
+KIND_FIELDS = {kind: field for field, kind in PROFILE_FIELD_KINDS.items()}
+
+# Platform-side accounts every user movement is balanced against
+PAYSTACK_CLEARING = 'paystack_clearing'     # money entering/leaving through Paystack
+PLATFORM_FEES = 'fees'                      # fee income
+REFERRAL_BONUSES = 'referral_bonuses'       # referral payouts funded by the platform
+WALLET_PAYMENTS = 'wallet_payments'         # wallet balance spent on platform purchases
+EARNINGS_RECOGNISED = 'earnings_recognised' # contra for the lifetime-earnings memo accounts
+OPENING_BALANCES = 'opening_balances'       # balances carried over from before the ledger
+ADJUSTMENTS = 'adjustments'                 # manual fixes and legacy write-offs
+
+
+class InsufficientFunds(Exception):
+    """A debit would take a balance below zero"""
+
+    def __init__(self, user_id, field, required):
+        self.user_id = user_id
+        self.field = field
+        self.required = required
+        super().__init__(f'Insufficient {field.replace("_", " ")} for user {user_id}: {required} required')
+
+
+class UnbalancedEntry(ValueError):
+    pass
+
+
+def quantize(amount):
+    return Decimal(str(amount)).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def system_account(name, currency='USD'):
+    """Id of a platform account such as ``system_account(PLATFORM_FEES, 'KES')``"""
+    account, _ = LedgerAccount.objects.get_or_create(
+        code=f'platform:{name}:{currency}',
+        defaults={'kind': 'system', 'currency': currency, 'allow_negative': True},
+    )
+    return account.id
+
+
+def user_accounts(user_id, fields):
+    """{field: account_id} for the ledger accounts behind ``UserProfile.<field>``.
+
+    Looked up with one query; a missing account is opened with an 'opening'
+    entry carrying the profile's current value, so balances from before the
+    ledger existed are carried over.
+    """
+    codes = {f'user:{user_id}:{PROFILE_FIELD_KINDS[field]}': field for field in fields}
+    found = {
+        codes[code]: account_id
+        for code, account_id in LedgerAccount.objects.filter(code__in=codes).values_list('code', 'id')
+    }
+    for code, field in codes.items():
+        if field not in found:
+            found[field] = _open_user_account(user_id, field, code)
+    return found
+
+
+def _open_user_account(user_id, field, code):
+    from .models import UserProfile
+
+    try:
+        with transaction.atomic():
+            account = LedgerAccount.objects.create(code=code, user_id=user_id, kind=PROFILE_FIELD_KINDS[field])
+    except IntegrityError:
+        return LedgerAccount.objects.values_list('id', flat=True).get(code=code)
+    opening = UserProfile.objects.filter(user_id=user_id).values_list(field, flat=True).first()
+    if opening:
+        post(
+            [(account.id, opening), (system_account(OPENING_BALANCES), -opening)],
+            'opening', reference=code, description=f'Opening {account.kind} balance',
+            idempotency_key=f'opening:{code}', floor_at_zero=(account.id,),
+        )
+    return account.id
+
+
+def post(lines, entry_type, reference='', description='', idempotency_key=None, floor_at_zero=()):
+    """Append a balanced entry and move the materialized balances; returns the entry.
+
+    ``lines`` is ``[(account_id, amount), ...]`` and must sum to zero. Each
+    account is changed with one conditional UPDATE, in account id order, so
+    concurrent entries never lose updates or deadlock, and a debit that would
+    take a non-negative account below zero raises InsufficientFunds. Accounts
+    in ``floor_at_zero`` are clamped at zero instead; the shortfall is booked
+    to the adjustments account. With an ``idempotency_key`` that was already
+    used, nothing is posted and the earlier entry is returned.
+    """
+    amounts = defaultdict(Decimal)
+    for account_id, amount in lines:
+        amounts[account_id] += quantize(amount)
+    amounts = {account_id: amount for account_id, amount in amounts.items() if amount}
+    if sum(amounts.values()) != 0:
+        raise UnbalancedEntry(f'Ledger entry does not balance: {amounts}')
+
+    with transaction.atomic():
+        if idempotency_key:
+            existing = LedgerEntry.objects.filter(idempotency_key=idempotency_key).first()
+            if existing is not None:
+                return existing
+        try:
+            with transaction.atomic():
+                entry = LedgerEntry.objects.create(
+                    entry_type=entry_type, reference=reference[:150], description=description[:255],
+                    idempotency_key=idempotency_key,
+                )
+        except IntegrityError:
+            if not idempotency_key:
+                raise
+            # A concurrent post with the same key committed between the check and the insert
+            return LedgerEntry.objects.get(idempotency_key=idempotency_key)
+
+        floored = [account_id for account_id in floor_at_zero if amounts.get(account_id, 0) < 0]
+        if floored:
+            # Lock every account in id order, then clamp the floored debits against the
+            # locked balances; what they can't cover is booked to adjustments
+            adjustments = system_account(ADJUSTMENTS)
+            current = dict(
+                LedgerAccount.objects.select_for_update().filter(id__in=set(amounts) | {adjustments})
+                .order_by('id').values_list('id', 'balance')
+            )
+            for account_id in floored:
+                clamped = max(amounts[account_id], -max(current[account_id], Decimal('0')))
+                amounts[adjustments] = amounts.get(adjustments, Decimal('0')) + amounts[account_id] - clamped
+                amounts[account_id] = clamped
+
+        postings = []
+        for account_id in sorted(amounts):
+            amount = amounts[account_id]
+            if not amount:
+                continue
+            accounts = LedgerAccount.objects.filter(id=account_id)
+            if amount < 0:
+                accounts = accounts.filter(allow_negative=True) | accounts.filter(balance__gte=-amount)
+            if not accounts.update(
+                balance=F('balance') + amount, posting_count=F('posting_count') + 1, updated_at=timezone.now(),
+            ):
+                account = LedgerAccount.objects.get(id=account_id)
+                raise InsufficientFunds(account.user_id, KIND_FIELDS.get(account.kind, account.kind), -amount)
+            balance_after = LedgerAccount.objects.values_list('balance', flat=True).get(id=account_id)
+            postings.append(LedgerPosting(entry=entry, account_id=account_id, amount=amount, balance_after=balance_after))
+
+        LedgerPosting.objects.bulk_create(postings)
+    return entry
+
+
+def balances(account_ids):
+    """{account_id: balance} straight from the materialized column"""
+    return dict(LedgerAccount.objects.filter(id__in=account_ids).values_list('id', 'balance'))
+
+
+def record_fee(reference, amount, currency='KES', description=''):
+    """Book platform fee income collected through Paystack (once per reference)"""
+    amount = quantize(amount)
+    if amount <= 0:
+        return None
+    return post(
+        [(system_account(PAYSTACK_CLEARING, currency), amount), (system_account(PLATFORM_FEES, currency), -amount)],
+        'fee', reference=reference, description=description or f'Platform fees for {reference}',
+        idempotency_key=f'fee:{reference}',
+    )
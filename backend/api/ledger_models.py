@@ -0,0 +1,102 @@
+from django.db import models
+from django.contrib.auth.models import User
+
+
+class AppendOnlyQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise TypeError(f"{self.model.__name__} rows are append-only")
+
+    def delete(self):
+        raise TypeError(f"{self.model.__name__} rows are append-only")
+
+
+class AppendOnlyModel(models.Model):
+    objects = AppendOnlyQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError(f"{type(self).__name__} rows are append-only")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__} rows are append-only")
+
+
+class LedgerAccount(models.Model):
+    """One balance in the double-entry ledger, with its running total materialized"""
+
+    ACCOUNT_KINDS = (
+        ('available', 'Available Balance'),
+        ('escrow', 'Escrow'),
+        ('earnings', 'Lifetime Earnings'),
+        ('system', 'Platform'),
+    )
+
+    # e.g. "user:42:available" or "platform:fees:KES"
+    code = models.CharField(max_length=100, unique=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='ledger_accounts', null=True, blank=True)
+    kind = models.CharField(max_length=15, choices=ACCOUNT_KINDS)
+    currency = models.CharField(max_length=3, default='USD')
+    # Platform-side accounts (clearing, contra) naturally run negative; user accounts may not
+    allow_negative = models.BooleanField(default=False)
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    posting_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.code} ({self.balance} {self.currency})"
+
+
+class LedgerEntry(AppendOnlyModel):
+    """A balanced journal entry: its postings always sum to zero"""
+
+    ENTRY_TYPES = (
+        ('opening', 'Opening Balance'),
+        ('payment', 'Payment'),
+        ('escrow_release', 'Escrow Release'),
+        ('withdrawal', 'Withdrawal'),
+        ('refund', 'Refund'),
+        ('fee', 'Platform Fee'),
+        ('bonus', 'Bonus'),
+        ('adjustment', 'Adjustment'),
+    )
+
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPES)
+    reference = models.CharField(max_length=150, blank=True, db_index=True)
+    # Set when posting the same business event twice must be a no-op (e.g. webhook replays)
+    idempotency_key = models.CharField(max_length=150, unique=True, null=True, blank=True)
+    description = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name_plural = 'Ledger entries'
+
+    def __str__(self):
+        return f"#{self.id} {self.entry_type} {self.reference}"
+
+
+class LedgerPosting(AppendOnlyModel):
+    """One leg of an entry; ``balance_after`` is the account's running balance after it"""
+
+    entry = models.ForeignKey(LedgerEntry, on_delete=models.PROTECT, related_name='postings')
+    account = models.ForeignKey(LedgerAccount, on_delete=models.PROTECT, related_name='postings')
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    balance_after = models.DecimalField(max_digits=14, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['account', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.account.code} {self.amount:+} -> {self.balance_after}"
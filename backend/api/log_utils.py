@@ -0,0 +1,44 @@
+import logging
+import random
+
+from django.conf import settings
+
+
+class StructuredMessage:
+    """Log message rendered as ``event key=value ...`` only when a handler emits it.
+
+    Field values may be zero-argument callables; they are evaluated lazily, so
+    expensive values cost nothing when the record is filtered out.
+    """
+
+    def __init__(self, event, fields):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+        parts = [self.event]
+        for key, value in self.fields.items():
+            if callable(value):
+                value = value()
+            parts.append(f"{key}={value}")
+        return ' '.join(parts)
+
+
+def log_event(logger, level, event, sample_rate=None, **fields):
+    """Log a structured event if ``level`` is enabled and the event is sampled in.
+
+    ``sample_rate`` defaults to settings.LOG_SAMPLE_RATE for DEBUG events and
+    1.0 (always) for anything more severe.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sample_rate is None:
+        sample_rate = getattr(settings, 'LOG_SAMPLE_RATE', 1.0) if level <= logging.DEBUG else 1.0
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    logger.log(level, StructuredMessage(event, fields), extra={'event': event})
+
+
+def debug_event(logger, event, **fields):
+    """Sampled DEBUG-level structured event"""
+    log_event(logger, logging.DEBUG, event, **fields)
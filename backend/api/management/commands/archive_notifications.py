@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import notification_retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Move read notifications older than the retention period out of the live table into "
+        "ArchivedNotification, in chunked copy-and-delete transactions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=None,
+            help=f"Retention period in days (default: NOTIFICATION_RETENTION_DAYS, {settings.NOTIFICATION_RETENTION_DAYS})",
+        )
+        parser.add_argument("--batch-size", type=int, default=None, help="Notifications moved per transaction")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the notifications that would be archived")
+
+    def handle(self, *args, **options):
+        if options["days"] is not None and options["days"] < 1:
+            raise CommandError("--days must be at least 1")
+        if options["dry_run"]:
+            count = notification_retention.expired(options["days"]).count()
+            self.stdout.write(f"Notifications to archive: {count}")
+            return
+        archived = notification_retention.archive_read_notifications(options["days"], options["batch_size"])
+        self.stdout.write(f"Notifications archived: {archived}")
@@ -0,0 +1,106 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.test import APIClient
+
+from api.models import (
+    Category, Conversation, Course, Enrollment, Gig, Lesson, Message, Order, UserProfile,
+)
+from api.profiling import QueryRecorder
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Measure latency and query counts of the hot list endpoints against throwaway data (rolled back afterwards)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50, help="Requests per endpoint")
+        parser.add_argument("--orders", type=int, default=200, help="Orders for the freelancer")
+        parser.add_argument("--messages", type=int, default=200, help="Messages in the conversation")
+        parser.add_argument("--courses", type=int, default=10, help="Courses the student is enrolled in")
+
+    def handle(self, *args, **options):
+        results = []
+        try:
+            with transaction.atomic():
+                endpoints = self._build_fixtures(options)
+                for name, method, url, payload, user in endpoints:
+                    results.append((name, *self._measure(method, url, payload, user, options["iterations"])))
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        self.stdout.write(f"{'endpoint':<40} {'mean ms':>9} {'p95 ms':>9} {'queries':>8}")
+        for name, mean_ms, p95_ms, queries in results:
+            self.stdout.write(f"{name:<40} {mean_ms:>9.2f} {p95_ms:>9.2f} {queries:>8}")
+
+    def _measure(self, method, url, payload, user, iterations):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        timings = []
+        queries = 0
+        for _ in range(iterations):
+            recorder = QueryRecorder()
+            with connection.execute_wrapper(recorder):
+                start = time.perf_counter()
+                response = getattr(client, method)(url, payload, format="json")
+                timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{url} returned {response.status_code}: {response.content[:200]}")
+            queries = recorder.count
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        return statistics.mean(timings), p95, queries
+
+    def _build_fixtures(self, options):
+        freelancer = User.objects.create_user(username="bench_freelancer", password="x")
+        client = User.objects.create_user(username="bench_client", password="x")
+        UserProfile.objects.create(user=freelancer, user_type="freelancer")
+        UserProfile.objects.create(user=client, user_type="client")
+
+        category = Category.objects.create(name="Benchmark Category")
+        gig = Gig.objects.create(
+            freelancer=freelancer, category=category, title="Benchmark gig", description="d",
+            basic_title="Basic", basic_description="d", basic_price=100, basic_delivery_time=3,
+        )
+        Order.objects.bulk_create([
+            Order(client=client, freelancer=freelancer, gig=gig, package_type="basic",
+                  title=f"Order {i}", price=100, status="completed" if i % 2 else "in_progress")
+            for i in range(options["orders"])
+        ])
+
+        conversation = Conversation.objects.create()
+        conversation.participants.add(freelancer, client)
+        Message.objects.bulk_create([
+            Message(conversation=conversation, sender=client if i % 2 else freelancer, content=f"Message {i}")
+            for i in range(options["messages"])
+        ])
+
+        first_course = None
+        for i in range(options["courses"]):
+            course = Course.objects.create(
+                title=f"Course {i}", description="d", category=category, instructor=freelancer,
+                duration_hours=1, learning_outcomes="o", status="published",
+            )
+            lessons = Lesson.objects.bulk_create([
+                Lesson(course=course, title=f"Lesson {j}", order=j) for j in range(10)
+            ])
+            enrollment = Enrollment.objects.create(student=client, course=course)
+            enrollment.completed_lessons.add(*lessons[:5])
+            first_course = first_course or course
+
+        return [
+            ("GET conversations/<id>/messages/", "get", f"/api/conversations/{conversation.id}/messages/", None, client),
+            ("POST messages/create/", "post", "/api/messages/create/",
+             {"conversation": conversation.id, "content": "benchmark"}, client),
+            ("GET orders/freelancer/", "get", "/api/orders/freelancer/", None, freelancer),
+            ("GET courses/my/", "get", "/api/courses/my/", None, client),
+            ("GET courses/<id>/lessons/", "get", f"/api/courses/{first_course.id}/lessons/", None, client),
+            ("GET dashboard/stats/", "get", "/api/dashboard/stats/", None, freelancer),
+        ]
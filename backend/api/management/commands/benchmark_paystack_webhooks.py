@@ -0,0 +1,114 @@
+import hashlib
+import hmac
+import json
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+
+from api import webhook_inbox
+from api.models import Category, Gig, Order, PaystackWebhookEvent, UserProfile
+from api.payments import PAYSTACK_SECRET_KEY
+from api.profiling import QueryRecorder
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Measure webhook enqueue latency and worker throughput against throwaway data (rolled back afterwards)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=500, help="charge.success events to send")
+        parser.add_argument("--batch-size", type=int, default=100, help="Worker batch size")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(), override_settings(PAYSTACK_WEBHOOK_INLINE=False):
+                payloads = self._build_fixtures(options["events"])
+                enqueue = self._post_all(payloads)
+                redelivery = self._post_all(payloads)
+                worker = self._drain(options["batch_size"])
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        self.stdout.write(f"{'stage':<22} {'events':>7} {'events/s':>10} {'mean ms':>9} {'p95 ms':>9} {'queries':>8}")
+        for name, (count, seconds, timings, queries) in (
+            ("enqueue (new)", enqueue), ("enqueue (redelivery)", redelivery), ("worker", worker),
+        ):
+            if timings:
+                mean_ms = f"{statistics.mean(timings):.2f}"
+                p95_ms = f"{timings[min(len(timings) - 1, int(len(timings) * 0.95))]:.2f}"
+            else:
+                mean_ms = p95_ms = "-"
+            self.stdout.write(
+                f"{name:<22} {count:>7} {count / seconds:>10.1f} {mean_ms:>9} {p95_ms:>9} {queries / max(count, 1):>8.1f}"
+            )
+
+    def _post_all(self, payloads):
+        client = Client()
+        timings = []
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            for body, signature in payloads:
+                start = time.perf_counter()
+                response = client.post(
+                    "/api/payments/webhook/", body, content_type="application/json",
+                    HTTP_X_PAYSTACK_SIGNATURE=signature,
+                )
+                timings.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    raise RuntimeError(f"Webhook returned {response.status_code}: {response.content[:200]}")
+        timings.sort()
+        return len(payloads), time.perf_counter() - started, timings, recorder.count
+
+    def _drain(self, batch_size):
+        pending = PaystackWebhookEvent.objects.filter(status="pending").count()
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            processed, failed = webhook_inbox.process_pending(batch_size=batch_size)
+        elapsed = time.perf_counter() - started
+        if processed != pending or failed:
+            raise RuntimeError(f"Worker processed {processed}/{pending} events, {failed} failed")
+        return processed, elapsed, [], recorder.count
+
+    def _build_fixtures(self, count):
+        freelancer = User.objects.create_user(username="bench_webhook_freelancer", password="x")
+        client = User.objects.create_user(username="bench_webhook_client", password="x")
+        UserProfile.objects.create(user=freelancer, user_type="freelancer")
+        UserProfile.objects.create(user=client, user_type="client")
+        category = Category.objects.create(name="Webhook Benchmark Category")
+        gig = Gig.objects.create(
+            freelancer=freelancer, category=category, title="Benchmark gig", description="d",
+            basic_title="Basic", basic_description="d", basic_price=100, basic_delivery_time=3,
+        )
+        orders = Order.objects.bulk_create([
+            Order(client=client, freelancer=freelancer, gig=gig, package_type="basic", title=f"Order {i}",
+                  price=100, payment_reference=f"bench_webhook_{i}")
+            for i in range(count)
+        ])
+
+        payloads = []
+        for i, order in enumerate(orders):
+            body = json.dumps({
+                "event": "charge.success",
+                "data": {
+                    "id": 9_000_000 + i,
+                    "reference": order.payment_reference,
+                    "amount": 10_500,
+                    "metadata": {
+                        "payment_type": "gig", "order_id": order.id,
+                        "base_amount": "100", "platform_fee": "2.5", "processing_fee": "2.5",
+                    },
+                },
+            }).encode()
+            signature = hmac.new(PAYSTACK_SECRET_KEY.encode(), body, hashlib.sha512).hexdigest()
+            payloads.append((body, signature))
+        return payloads
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import payouts
+
+
+class Command(BaseCommand):
+    help = (
+        "Submit queued withdrawals to Paystack in bulk transfers and reconcile submitted ones "
+        "(run once, or keep polling with --loop)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="Transfers per bulk request (max 100)")
+        parser.add_argument("--loop", action="store_true", help="Keep polling instead of exiting when the queue is empty")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to sleep between polls with --loop")
+        parser.add_argument("--no-reconcile", action="store_true", help="Skip checking transfers with no webhook yet")
+        parser.add_argument(
+            "--reconcile-after", type=int, default=None,
+            help="Verify transfers still processing this many seconds after submission (default: setting)",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            totals = payouts.process_queue(batch_size=options["batch_size"])
+            settled = 0
+            if not options["no_reconcile"]:
+                settled = payouts.reconcile(older_than=options["reconcile_after"])
+            busy = any(totals.values()) or settled
+            if busy or not options["loop"]:
+                summary = ", ".join(f"{outcome}={count}" for outcome, count in totals.items())
+                self.stdout.write(f"Payouts: {summary}, reconciled={settled}")
+            if not options["loop"]:
+                return
+            if not busy:
+                time.sleep(options["interval"])
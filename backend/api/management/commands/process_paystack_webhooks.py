@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import webhook_inbox
+
+
+class Command(BaseCommand):
+    help = "Apply queued Paystack webhook events in arrival order (run once, or keep polling with --loop)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="Events fetched per query")
+        parser.add_argument("--loop", action="store_true", help="Keep polling instead of exiting when the queue is empty")
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds to sleep between polls with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            processed, failed = webhook_inbox.process_pending(batch_size=options["batch_size"])
+            if processed or failed or not options["loop"]:
+                self.stdout.write(f"Webhook events: processed={processed}, failed={failed}")
+            if not options["loop"]:
+                return
+            if not (processed or failed):
+                time.sleep(options["interval"])
@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import webhook_inbox
+from api.models import PaystackWebhookEvent
+
+
+class Command(BaseCommand):
+    help = "Re-queue stored Paystack webhook events (failed ones by default) and optionally process them now."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--id", type=int, action="append", dest="ids", help="Event id to replay (repeatable)")
+        parser.add_argument("--reference", help="Replay every event for this payment/transfer reference")
+        parser.add_argument("--event", help="Only events of this type, e.g. charge.success")
+        parser.add_argument(
+            "--status",
+            default="failed",
+            choices=[choice for choice, _ in PaystackWebhookEvent.EVENT_STATUS],
+            help="Only events in this status (default: failed; ignored with --id)",
+        )
+        parser.add_argument("--hours", type=int, help="Only events received in the last N hours")
+        parser.add_argument("--process", action="store_true", help="Run the worker after re-queuing")
+        parser.add_argument("--dry-run", action="store_true", help="List what would be replayed")
+
+    def handle(self, *args, **options):
+        events = PaystackWebhookEvent.objects.all()
+        if options["ids"]:
+            events = events.filter(id__in=options["ids"])
+        else:
+            events = events.filter(status=options["status"])
+        if options["reference"]:
+            events = events.filter(reference=options["reference"])
+        if options["event"]:
+            events = events.filter(event=options["event"])
+        if options["hours"]:
+            events = events.filter(received_at__gte=timezone.now() - timedelta(hours=options["hours"]))
+
+        for event in events.only("id", "event_key", "status", "attempts").iterator():
+            self.stdout.write(f"{event.id} {event.event_key} status={event.status} attempts={event.attempts}")
+
+        if options["dry_run"]:
+            self.stdout.write(self.style.NOTICE(f"Dry run: {events.count()} event(s) would be replayed"))
+            return
+
+        # Handlers are idempotent, so re-running already processed events is safe
+        count = events.update(status="pending", attempts=0, last_error="", locked_at=None)
+        self.stdout.write(self.style.SUCCESS(f"Re-queued {count} event(s)"))
+
+        if options["process"]:
+            processed, failed = webhook_inbox.process_pending()
+            self.stdout.write(f"Webhook events: processed={processed}, failed={failed}")
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import newsletter_sender
+
+
+class Command(BaseCommand):
+    help = (
+        "Send newsletters that are in 'sending' to their queued recipients in chunks, resuming "
+        "where an interrupted send stopped (run once, or keep polling with --loop)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=None, help="Recipients claimed and sent per chunk")
+        parser.add_argument("--loop", action="store_true", help="Keep polling instead of exiting when nothing is sending")
+        parser.add_argument("--interval", type=float, default=10.0, help="Seconds to sleep between polls with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            totals = newsletter_sender.process_pending(chunk_size=options["chunk_size"])
+            busy = any(totals.values())
+            if busy or not options["loop"]:
+                self.stdout.write(f"Newsletters: sent={totals['sent']}, failed={totals['failed']}")
+            if not options["loop"]:
+                return
+            if not busy:
+                time.sleep(options["interval"])
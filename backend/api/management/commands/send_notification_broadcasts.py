@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import notification_fanout
+
+
+class Command(BaseCommand):
+    help = (
+        "Fan out queued audience notifications in bulk batches, resuming broadcasts an "
+        "interrupted worker left part-way (run once, or keep polling with --loop)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="Notifications written per bulk insert")
+        parser.add_argument("--loop", action="store_true", help="Keep polling instead of exiting when nothing is queued")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to sleep between polls with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            totals = notification_fanout.process_pending(batch_size=options["batch_size"])
+            busy = any(totals.values())
+            if busy or not options["loop"]:
+                self.stdout.write(
+                    f"Notification broadcasts: {totals['broadcasts']}, notifications created={totals['notifications']}"
+                )
+            if not options["loop"]:
+                return
+            if not busy:
+                time.sleep(options["interval"])
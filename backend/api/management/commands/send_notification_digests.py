@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import notification_digest
+
+
+class Command(BaseCommand):
+    help = (
+        "Email each user one digest of the unread notifications they asked to receive daily or "
+        "weekly, grouped by category (run once, or keep polling with --loop; each window is sent once)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--frequency", choices=notification_digest.DIGEST_FREQUENCIES, action="append",
+            help="Digest frequency to send (repeatable; default: all)",
+        )
+        parser.add_argument("--batch-size", type=int, default=None, help="Users whose preferences are loaded per query")
+        parser.add_argument("--loop", action="store_true", help="Keep running instead of exiting after one pass")
+        parser.add_argument("--interval", type=float, default=900.0, help="Seconds to sleep between passes with --loop")
+
+    def handle(self, *args, **options):
+        frequencies = options["frequency"] or notification_digest.DIGEST_FREQUENCIES
+        while True:
+            for frequency in frequencies:
+                sent = notification_digest.send_digests(frequency, batch_size=options["batch_size"])
+                if sent or not options["loop"]:
+                    self.stdout.write(f"Notification digests ({frequency}): sent={sent}")
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
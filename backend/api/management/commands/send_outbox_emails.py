@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import email_outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver queued transactional emails from the outbox, rescheduling failures with "
+        "exponential backoff (run once, or keep polling with --loop)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="Emails claimed and sent per batch")
+        parser.add_argument("--loop", action="store_true", help="Keep polling instead of exiting when the outbox is empty")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to sleep between polls with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            totals = email_outbox.process_pending(batch_size=options["batch_size"])
+            busy = any(totals.values())
+            if busy or not options["loop"]:
+                self.stdout.write(f"Outbox emails: sent={totals['sent']}, failed={totals['failed']}")
+            if not options["loop"]:
+                return
+            if not busy:
+                time.sleep(options["interval"])
@@ -78,8 +78,8 @@ class Command(BaseCommand):
                 )
             )
             
-            # Send newsletter
-            result = NewsletterService.send_newsletter(newsletter)
+            # Send newsletter (this command is already a worker, so run the send job here)
+            result = NewsletterService.send_newsletter(newsletter, background=False)
             
             self.stdout.write(
                 self.style.SUCCESS(
@@ -0,0 +1,149 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+
+from api import ledger
+from api.models import LedgerAccount, LedgerPosting, UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute ledger balances from the postings in chunks and report drift against the "
+        "materialized account balances and the UserProfile balance columns."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=getattr(settings, "LEDGER_VERIFY_CHUNK_SIZE", 500),
+            help="Accounts (and entries) checked per batch",
+        )
+        parser.add_argument(
+            "--repair", action="store_true",
+            help="Reset drifted account balances from their postings and re-project them onto UserProfile",
+        )
+        parser.add_argument(
+            "--open-missing", action="store_true",
+            help="First open ledger accounts for profiles with balances but no account yet",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        if options["open_missing"]:
+            self.stdout.write(f"Opened {self.open_missing(chunk_size)} accounts")
+
+        drift = self.check_accounts(chunk_size, options["repair"])
+        unbalanced = self.check_entries(chunk_size)
+
+        if unbalanced:
+            raise CommandError(f"{unbalanced} unbalanced entries; the ledger cannot be repaired automatically")
+        if drift and not options["repair"]:
+            raise CommandError(f"{drift} balances drifted (run with --repair to fix them)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Ledger verified{f', repaired {drift} balances' if drift else ''}"
+        ))
+
+    def open_missing(self, chunk_size):
+        opened = 0
+        last_id = 0
+        has_balance = Q(available_balance__gt=0) | Q(escrow_balance__gt=0) | Q(total_earnings__gt=0)
+        while True:
+            user_ids = list(
+                UserProfile.objects.filter(has_balance, user_id__gt=last_id)
+                .order_by("user_id").values_list("user_id", flat=True)[:chunk_size]
+            )
+            for user_id in user_ids:
+                existing = LedgerAccount.objects.filter(user_id=user_id).count()
+                with transaction.atomic():
+                    ledger.user_accounts(user_id, ledger.PROFILE_FIELD_KINDS)
+                opened += len(ledger.PROFILE_FIELD_KINDS) - existing
+            if len(user_ids) < chunk_size:
+                return opened
+            last_id = user_ids[-1]
+
+    def check_accounts(self, chunk_size, repair):
+        """Walk accounts in id order; each chunk costs three queries plus one streamed posting scan"""
+        drift = 0
+        last_id = 0
+        while True:
+            accounts = list(LedgerAccount.objects.filter(id__gt=last_id).order_by("id")[:chunk_size])
+            if not accounts:
+                return drift
+            last_id = accounts[-1].id
+            ids = [account.id for account in accounts]
+
+            totals = {
+                row["account"]: (row["total"], row["count"])
+                for row in LedgerPosting.objects.filter(account_id__in=ids)
+                .values("account").annotate(total=Sum("amount"), count=Count("id")).order_by()
+            }
+            broken_chains = self.check_chains(ids)
+            profiles = {
+                row["user_id"]: row
+                for row in UserProfile.objects.filter(user_id__in={a.user_id for a in accounts if a.user_id})
+                .values("user_id", *ledger.PROFILE_FIELD_KINDS)
+            }
+
+            for account in accounts:
+                total, count = totals.get(account.id, (Decimal("0"), 0))
+                problems = []
+                if total != account.balance or count != account.posting_count:
+                    problems.append(
+                        f"materialized {account.balance} ({account.posting_count} postings), "
+                        f"recomputed {total} ({count} postings)"
+                    )
+                if account.id in broken_chains:
+                    # History can't be rewritten; only a wrong current balance counts as drift
+                    self.stdout.write(f"{account.code}: running balance breaks at posting {broken_chains[account.id]}")
+                field = ledger.KIND_FIELDS.get(account.kind)
+                profile = profiles.get(account.user_id)
+                if field and profile and profile[field] != total:
+                    problems.append(f"UserProfile.{field} is {profile[field]}")
+                if not problems:
+                    continue
+
+                drift += 1
+                self.stdout.write(self.style.WARNING(f"{account.code}: {'; '.join(problems)}"))
+                if repair:
+                    with transaction.atomic():
+                        LedgerAccount.objects.filter(id=account.id).update(balance=total, posting_count=count)
+                        if field and profile:
+                            UserProfile.objects.filter(user_id=account.user_id).update(**{field: total})
+
+    def check_chains(self, account_ids):
+        """{account_id: first posting id whose balance_after doesn't follow from the one before}"""
+        broken = {}
+        current_account = None
+        running = Decimal("0")
+        postings = (
+            LedgerPosting.objects.filter(account_id__in=account_ids)
+            .order_by("account_id", "id").values_list("account_id", "id", "amount", "balance_after")
+        )
+        for account_id, posting_id, amount, balance_after in postings.iterator(chunk_size=2000):
+            if account_id != current_account:
+                current_account, running = account_id, Decimal("0")
+            running += amount
+            if running != balance_after and account_id not in broken:
+                broken[account_id] = posting_id
+            # Carry on from the recorded value so one bad posting is reported once
+            running = balance_after
+        return broken
+
+    def check_entries(self, chunk_size):
+        """Every entry's postings must sum to zero; scanned in entry id ranges"""
+        unbalanced = 0
+        bounds = LedgerPosting.objects.aggregate(low=Min("entry_id"), high=Max("entry_id"))
+        if bounds["low"] is None:
+            return 0
+        step = chunk_size * 10
+        for start in range(bounds["low"], bounds["high"] + 1, step):
+            rows = (
+                LedgerPosting.objects.filter(entry_id__gte=start, entry_id__lt=start + step)
+                .values("entry").annotate(total=Sum("amount")).exclude(total=0).order_by()
+            )
+            for row in rows:
+                unbalanced += 1
+                self.stdout.write(self.style.ERROR(f"Entry #{row['entry']} is off by {row['total']}"))
+        return unbalanced
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import bank_directory
+
+
+class Command(BaseCommand):
+    help = "Fetch the Paystack bank lists and store them in the shared cache so withdrawal forms never wait on Paystack."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--country",
+            action="append",
+            dest="countries",
+            help="Country to warm (repeatable, defaults to kenya)",
+        )
+
+    def handle(self, *args, **options):
+        countries = options.get("countries") or ["kenya"]
+        failed = False
+        for country, count in bank_directory.warm(countries).items():
+            if count is None:
+                failed = True
+                self.stdout.write(self.style.ERROR(f"{country}: fetch failed, keeping any cached list"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{country}: cached {count} banks"))
+        if failed:
+            raise CommandError("Some bank lists could not be fetched")
@@ -20,4 +20,56 @@ class SecurityHeadersMiddleware:
             response['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With'
             response['Access-Control-Allow-Credentials'] = 'true'
         
-        return response
\ No newline at end of file
+        return response
+
+class ProfilingMiddleware:
+    """
+    Opt-in per-endpoint latency, query-count and response-size instrumentation.
+    Enabled with PROFILING_ENABLED; stats are served by the admin profiling endpoint.
+    """
+    def __init__(self, get_response):
+        from django.conf import settings
+        from django.core.exceptions import MiddlewareNotUsed
+
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'PROFILING_SLOW_REQUEST_MS', 500)
+        self.capture_sql = getattr(settings, 'PROFILING_CAPTURE_SQL', 20)
+
+    def __call__(self, request):
+        import time
+        from contextlib import ExitStack
+        from django.db import connections
+        from .profiling import QueryRecorder, registry
+
+        start = time.perf_counter()
+        # Timings are kept for every request; SQL text only once it has become slow
+        recorder = QueryRecorder(capture_sql=self.capture_sql, capture_after_ms=self.slow_ms, started=start)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        endpoint = f"{request.method} /{match.route}" if match else f"{request.method} <unmatched>"
+        if response.streaming:
+            response_bytes = int(response.get('Content-Length') or 0)
+        else:
+            response_bytes = len(response.content)
+
+        registry.record(endpoint, duration_ms, response.status_code, recorder, response_bytes)
+        if duration_ms >= self.slow_ms:
+            registry.record_slow({
+                'endpoint': endpoint,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'duration_ms': round(duration_ms, 2),
+                'queries': recorder.count,
+                'db_ms': round(recorder.duration, 2),
+                'sql': recorder.statements,
+                'slowest_query': recorder.slowest_statement(),
+                'at': time.time(),
+            })
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0039_alter_notification_notification_type_add_referral'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useranalytics',
+            name='response_samples',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0040_useranalytics_response_samples'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaystackWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_key', models.CharField(max_length=200, unique=True)),
+                ('event', models.CharField(max_length=50)),
+                ('reference', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('processed', 'Processed'), ('failed', 'Failed')], default='pending', max_length=15)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('deliveries', models.PositiveIntegerField(default=1)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'id'], name='api_paystac_status_3f4374_idx')],
+            },
+        ),
+    ]
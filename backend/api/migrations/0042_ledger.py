@@ -0,0 +1,64 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0041_paystackwebhookevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('opening', 'Opening Balance'), ('payment', 'Payment'), ('escrow_release', 'Escrow Release'), ('withdrawal', 'Withdrawal'), ('refund', 'Refund'), ('fee', 'Platform Fee'), ('bonus', 'Bonus'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('reference', models.CharField(blank=True, db_index=True, max_length=150)),
+                ('idempotency_key', models.CharField(blank=True, max_length=150, null=True, unique=True)),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Ledger entries',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=100, unique=True)),
+                ('kind', models.CharField(choices=[('available', 'Available Balance'), ('escrow', 'Escrow'), ('earnings', 'Lifetime Earnings'), ('system', 'Platform')], max_length=15)),
+                ('currency', models.CharField(default='USD', max_length=3)),
+                ('allow_negative', models.BooleanField(default=False)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('posting_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_accounts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('balance_after', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='api.ledgeraccount')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='api.ledgerentry')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['account', 'id'], name='api_ledgerp_account_140cb4_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0042_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='api_transac_user_id_5bb13d_idx'),
+        ),
+    ]
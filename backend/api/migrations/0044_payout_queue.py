@@ -0,0 +1,74 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0043_transaction_history_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='withdrawal',
+            name='account_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='withdrawal',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='withdrawal',
+            name='balance_debit',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='withdrawal',
+            name='bank_code',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='withdrawal',
+            name='batch_id',
+            field=models.CharField(blank=True, db_index=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='withdrawal',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='withdrawal',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='withdrawal',
+            name='recipient_type',
+            field=models.CharField(default='nuban', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='withdrawal',
+            name='submitted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='withdrawal',
+            name='reference',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='withdrawal',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('queued', 'Queued for Payout'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=15),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawal',
+            index=models.Index(fields=['status', 'id'], name='api_withdra_status_86ef77_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0044_payout_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_key', models.CharField(max_length=64, unique=True)),
+                ('recipient_type', models.CharField(max_length=20)),
+                ('bank_code', models.CharField(max_length=50)),
+                ('account_last4', models.CharField(blank=True, max_length=4)),
+                ('account_name', models.CharField(blank=True, max_length=100)),
+                ('recipient_code', models.CharField(max_length=100)),
+                ('is_active', models.BooleanField(default=True)),
+                ('last_validated_at', models.DateTimeField()),
+                ('last_used_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfer_recipients', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
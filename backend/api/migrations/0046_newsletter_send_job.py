@@ -0,0 +1,57 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0045_transfer_recipient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletter',
+            name='last_progress_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='newsletter',
+            name='recipients_queued',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='newsletter',
+            name='send_queued_through',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='newsletter',
+            name='send_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='newsletter',
+            name='total_failed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='newslettersendlog',
+            name='batch_id',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='newslettersendlog',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='newslettersendlog',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('delivered', 'Delivered'), ('opened', 'Opened'), ('clicked', 'Clicked'), ('bounced', 'Bounced'), ('complained', 'Complained'), ('unsubscribed', 'Unsubscribed'), ('failed', 'Failed')], default='pending', max_length=15),
+        ),
+        migrations.AddIndex(
+            model_name='newslettersendlog',
+            index=models.Index(fields=['newsletter', 'status', 'id'], name='api_newslet_newslet_b27dfd_idx'),
+        ),
+    ]
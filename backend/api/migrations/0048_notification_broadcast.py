@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0047_email_outbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationBroadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('audience', models.CharField(choices=[('all', 'All Active Users'), ('client', 'Clients'), ('freelancer', 'Freelancers'), ('staff', 'Staff')], max_length=20)),
+                ('title', models.CharField(max_length=200)),
+                ('message', models.TextField()),
+                ('notification_type', models.CharField(choices=[('order', 'Order Update'), ('message', 'New Message'), ('job', 'Job Alert'), ('proposal', 'Proposal Update'), ('payment', 'Payment Update'), ('system', 'System Notification'), ('review', 'Review Notification'), ('help', 'Help Request'), ('group_invite', 'Group Invitation'), ('verification', 'Verification Update'), ('referral', 'Referral'), ('support', 'Support Ticket')], default='system', max_length=15)),
+                ('action_url', models.URLField(blank=True)),
+                ('related_object_id', models.IntegerField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done')], default='pending', max_length=10)),
+                ('created_through', models.IntegerField(default=0)),
+                ('total_created', models.PositiveIntegerField(default=0)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notification_broadcasts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
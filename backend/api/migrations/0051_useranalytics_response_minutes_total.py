@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:55
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_response_minutes_total(apps, schema_editor):
+    UserAnalytics = apps.get_model('api', 'UserAnalytics')
+    UserAnalytics.objects.update(response_minutes_total=F('response_time') * F('response_samples'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0050_notification_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useranalytics',
+            name='response_minutes_total',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_response_minutes_total, migrations.RunPython.noop),
+    ]
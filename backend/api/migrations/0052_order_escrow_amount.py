@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:12
+
+from django.db import migrations, models
+
+
+def backfill_escrow_amount(apps, schema_editor):
+    # Orders paid through the ledger already record what escrow was credited
+    Order = apps.get_model('api', 'Order')
+    LedgerPosting = apps.get_model('api', 'LedgerPosting')
+    credited = LedgerPosting.objects.filter(
+        entry__idempotency_key__startswith='escrow:', account__kind='escrow', amount__gt=0,
+    ).values_list('entry__idempotency_key', 'amount')
+    for key, amount in credited.iterator():
+        reference = key.split(':', 1)[1]
+        if reference:
+            Order.objects.filter(
+                payment_reference=reference, escrow_released=False, escrow_amount__isnull=True,
+            ).update(escrow_amount=amount)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0051_useranalytics_response_minutes_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='escrow_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(backfill_escrow_amount, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0052_order_escrow_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletter',
+            name='render_content',
+            field=models.BooleanField(default=False, help_text='Render the content as a template ({{ unsubscribe_url }}, {{ preferences_url }}, {{ frontend_url }})'),
+        ),
+    ]
@@ -119,6 +119,19 @@ class UserProfile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Projections of the ledger, written only by BalanceService
+    LEDGER_FIELDS = ('available_balance', 'escrow_balance', 'total_earnings')
+
+    def save(self, *args, **kwargs):
+        # Saving an existing profile never writes the balance columns, so a stale
+        # copy can't overwrite balance changes made since it was loaded
+        if not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+            kwargs['update_fields'] = [field for field in update_fields if field not in self.LEDGER_FIELDS]
+        super().save(*args, **kwargs)
+
     def get_avatar_url(self):
         if self.avatar_type == 'google' and self.google_photo_url:
             return self.google_photo_url
@@ -130,6 +143,22 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.user_type}"
 
+class PhoneVerification(models.Model):
+    """A code sent by send_phone_verification, waiting for verify_phone_number.
+
+    Kept in the database rather than the cache so every web worker sees it;
+    the session info may carry the code, so it never leaves the server.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='phone_verification')
+    phone_number = models.CharField(max_length=20)
+    session_info = models.CharField(max_length=200)
+    attempts = models.IntegerField(default=0)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Phone verification for {self.user.username} ({self.phone_number})"
+
 class ProfessionalDocument(models.Model):
     DOCUMENT_TYPES = (
         ('cv', 'CV/Resume'),
@@ -348,6 +377,8 @@ class Order(models.Model):
     ])
     is_paid = models.BooleanField(default=False)
     escrow_released = models.BooleanField(default=False)
+    # USD credited to the freelancer's escrow at payment; released as-is so rate moves don't leave a remainder
+    escrow_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
@@ -515,6 +546,10 @@ class Transaction(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a user's history on (created_at, id)
+            models.Index(fields=['user', 'created_at', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.transaction_type} - ${self.amount} for {self.user.username}"
@@ -522,6 +557,7 @@ class Transaction(models.Model):
 class Withdrawal(models.Model):
     WITHDRAWAL_STATUS = (
         ('pending', 'Pending'),
+        ('queued', 'Queued for Payout'),
         ('processing', 'Processing'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
@@ -531,16 +567,115 @@ class Withdrawal(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     bank_name = models.CharField(max_length=100)
     account_number = models.CharField(max_length=20)
+    # Payout details, so the batch worker can create the transfer recipient itself
+    account_name = models.CharField(max_length=100, blank=True)
+    bank_code = models.CharField(max_length=50, blank=True)
+    recipient_type = models.CharField(max_length=20, default='nuban')
+    # USD reserved from available_balance, returned if the payout fails (0 for payouts not funded by it)
+    balance_debit = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     paystack_recipient_code = models.CharField(max_length=100, blank=True)
     paystack_transfer_code = models.CharField(max_length=100, blank=True)
-    reference = models.CharField(max_length=100, blank=True)
+    reference = models.CharField(max_length=100, blank=True, db_index=True)
     status = models.CharField(max_length=15, choices=WITHDRAWAL_STATUS, default='pending')
+    # Payout engine bookkeeping
+    batch_id = models.CharField(max_length=50, blank=True, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    submitted_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     processed_at = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
     def __str__(self):
         return f"Withdrawal #{self.id} - ${self.amount} for {self.user.username}"
 
+class TransferRecipient(models.Model):
+    """Paystack transfer recipient created for one of a user's payout accounts, reused across withdrawals"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transfer_recipients')
+    # HMAC of (user, recipient type, account number, bank code); the account number itself isn't stored
+    account_key = models.CharField(max_length=64, unique=True)
+    recipient_type = models.CharField(max_length=20)
+    bank_code = models.CharField(max_length=50)
+    account_last4 = models.CharField(max_length=4, blank=True)
+    account_name = models.CharField(max_length=100, blank=True)
+    recipient_code = models.CharField(max_length=100)
+    is_active = models.BooleanField(default=True)
+    last_validated_at = models.DateTimeField()
+    last_used_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.recipient_code} ({self.recipient_type} ****{self.account_last4}) for {self.user.username}"
+
+class PaystackWebhookEvent(models.Model):
+    """Inbox of verified Paystack webhook deliveries, processed in arrival order by a worker"""
+    EVENT_STATUS = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    )
+
+    # "<event>:<paystack data id or reference>", so redeliveries of the same event collapse
+    event_key = models.CharField(max_length=200, unique=True)
+    event = models.CharField(max_length=50)
+    reference = models.CharField(max_length=100, blank=True, db_index=True)
+    payload = models.JSONField()
+    status = models.CharField(max_length=15, choices=EVENT_STATUS, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    deliveries = models.PositiveIntegerField(default=1)
+    received_at = models.DateTimeField(auto_now_add=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_key} ({self.status})"
+
+class OutboundEmail(models.Model):
+    """Outbox of transactional emails; requests only insert a row and a worker delivers it"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+
+    category = models.CharField(max_length=30, blank=True, db_index=True)
+    to = models.JSONField()
+    from_email = models.CharField(max_length=254)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    batch_id = models.CharField(max_length=50, blank=True, db_index=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
+
 class HelpRequest(models.Model):
     HELP_STATUS = (
         ('open', 'Open'),
@@ -664,6 +799,15 @@ class Proposal(models.Model):
 
 
 # Notification System Models
+class NotificationQuerySet(models.QuerySet):
+    def create(self, **kwargs):
+        notification = super().create(**kwargs)
+        # Every notification is pushed to the user's open WebSocket connections once committed
+        from .notification_fanout import publish_on_commit
+        publish_on_commit(notification)
+        return notification
+
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = (
         ('order', 'Order Update'),
@@ -689,12 +833,72 @@ class Notification(models.Model):
     related_object_id = models.IntegerField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = NotificationQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'is_read', 'created_at']),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.user.username}"
 
+class NotificationBroadcast(models.Model):
+    """A notification fanned out to a whole audience in batches, resumable from ``created_through``"""
+    AUDIENCE_CHOICES = (
+        ('all', 'All Active Users'),
+        ('client', 'Clients'),
+        ('freelancer', 'Freelancers'),
+        ('staff', 'Staff'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+    )
+
+    audience = models.CharField(max_length=20, choices=AUDIENCE_CHOICES)
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    notification_type = models.CharField(max_length=15, choices=Notification.NOTIFICATION_TYPES, default='system')
+    action_url = models.URLField(blank=True)
+    related_object_id = models.IntegerField(blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    # Highest user id notified so far; users are walked in id order
+    created_through = models.IntegerField(default=0)
+    total_created = models.PositiveIntegerField(default=0)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='notification_broadcasts')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.title} -> {self.audience} ({self.status})"
+
+class ArchivedNotification(models.Model):
+    """A read notification moved out of the live table by ``archive_notifications``"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_notifications')
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    notification_type = models.CharField(max_length=15, choices=Notification.NOTIFICATION_TYPES)
+    action_url = models.URLField(blank=True)
+    related_object_id = models.IntegerField(blank=True, null=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.title} - {self.user_id} (archived)"
+
 # Enhanced User Models
 class UserVerification(models.Model):
     VERIFICATION_TYPES = (
@@ -1103,6 +1307,22 @@ class NotificationPreference(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.category} - {self.delivery_method}"
 
+class NotificationDigest(models.Model):
+    """One digest email sent to a user for one daily/weekly window; the unique key keeps it to one"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notification_digests')
+    frequency = models.CharField(max_length=10, choices=NotificationPreference.FREQUENCY_SETTINGS)
+    window_start = models.DateTimeField()
+    window_end = models.DateTimeField()
+    notification_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-window_start']
+        unique_together = ['user', 'frequency', 'window_start']
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.frequency} digest from {self.window_start:%Y-%m-%d}"
+
 class NotificationTemplate(models.Model):
     TEMPLATE_TYPES = (
         ('order_created', 'Order Created'),
@@ -1169,6 +1389,8 @@ class UserAnalytics(models.Model):
     conversion_rate = models.FloatField(default=0)
     avg_rating = models.FloatField(default=0)
     response_time = models.IntegerField(default=0)  # in minutes
+    response_samples = models.IntegerField(default=0)  # replies folded into response_time
+    response_minutes_total = models.BigIntegerField(default=0)  # exact sum behind the response_time mean
     last_updated = models.DateTimeField(auto_now=True)
     
     def __str__(self):
@@ -1380,6 +1602,10 @@ class Newsletter(models.Model):
     subject = models.CharField(max_length=200)
     newsletter_type = models.CharField(max_length=20, choices=NEWSLETTER_TYPES, default='weekly_digest')
     content = models.TextField(help_text="HTML content of the newsletter")
+    render_content = models.BooleanField(
+        default=False,
+        help_text="Render the content as a template ({{ unsubscribe_url }}, {{ preferences_url }}, {{ frontend_url }})",
+    )
     plain_text_content = models.TextField(blank=True, help_text="Plain text version")
     preview_text = models.CharField(max_length=150, blank=True, help_text="Email preview text")
     header_image = models.ImageField(upload_to='newsletter_images/', blank=True, null=True)
@@ -1404,12 +1630,25 @@ class Newsletter(models.Model):
     total_clicked = models.IntegerField(default=0)
     total_bounced = models.IntegerField(default=0)
     total_unsubscribed = models.IntegerField(default=0)
+    total_failed = models.IntegerField(default=0)
+    # Background send progress: recipients are queued as NewsletterSendLog rows
+    # in subscriber id order up to send_queued_through, then sent in chunks
+    recipients_queued = models.BooleanField(default=False)
+    send_queued_through = models.IntegerField(default=0)
+    send_started_at = models.DateTimeField(null=True, blank=True)
+    last_progress_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"{self.title} ({self.status})"
     
+    @property
+    def send_progress(self):
+        if self.total_recipients > 0:
+            return min(100.0, (self.total_sent + self.total_failed) / self.total_recipients * 100)
+        return 100.0 if self.status == 'sent' else 0.0
+    
     @property
     def open_rate(self):
         if self.total_delivered > 0:
@@ -1427,6 +1666,7 @@ class Newsletter(models.Model):
 class NewsletterSendLog(models.Model):
     SEND_STATUS = (
         ('pending', 'Pending'),
+        ('sending', 'Sending'),
         ('sent', 'Sent'),
         ('delivered', 'Delivered'),
         ('opened', 'Opened'),
@@ -1447,6 +1687,9 @@ class NewsletterSendLog(models.Model):
     bounced_at = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(blank=True)
     tracking_id = models.CharField(max_length=100, unique=True, blank=True)
+    # Set while a send worker holds the row
+    batch_id = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
     
     def save(self, *args, **kwargs):
         if not self.tracking_id:
@@ -1460,6 +1703,9 @@ class NewsletterSendLog(models.Model):
     class Meta:
         unique_together = ['newsletter', 'subscriber']
         ordering = ['-sent_at']
+        indexes = [
+            models.Index(fields=['newsletter', 'status', 'id']),
+        ]
 
 class NewsletterTemplate(models.Model):
     TEMPLATE_TYPES = (
@@ -1794,4 +2040,7 @@ from .report_models import Report, ReportAction, UserReportStats
 from .ticket_models import SupportTicket, TicketReply
 
 # Import referral models
-from .referral_models import ReferralSettings, ReferralCode, Referral, ReferralEarning, ReferralWithdrawal
\ No newline at end of file
+from .referral_models import ReferralSettings, ReferralCode, Referral, ReferralEarning, ReferralWithdrawal
+
+# Import ledger models
+from .ledger_models import LedgerAccount, LedgerEntry, LedgerPosting
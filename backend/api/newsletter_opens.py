@@ -0,0 +1,109 @@
+import atexit
+import logging
+import threading
+import uuid
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .inline_worker import InlineWorker
+from .models import Newsletter, NewsletterSendLog, NewsletterSubscriber
+
+logger = logging.getLogger(__name__)
+
+# 1x1 transparent GIF served by the tracking pixel
+PIXEL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00\x21\xF9\x04\x01\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02\x04\x01\x00\x3B'
+)
+
+
+class OpenTracker:
+    """Buffers newsletter open events in memory and writes them in aggregate.
+
+    The pixel view only appends the tracking id here. Buffered ids are flushed
+    on a background thread every ``NEWSLETTER_OPEN_FLUSH_INTERVAL`` seconds,
+    or as soon as ``NEWSLETTER_OPEN_FLUSH_SIZE`` distinct ids are waiting, as
+    one conditional UPDATE of the send logs plus ``F()`` increments per
+    newsletter and per subscriber. Opens still buffered when a process is
+    killed are lost, which only undercounts the open statistics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._timer = None
+        self._worker = InlineWorker(self.flush, name='newsletter opens')
+
+    def record(self, tracking_id):
+        if not tracking_id or len(tracking_id) > 100:
+            return
+        with self._lock:
+            self._pending.add(tracking_id)
+            size = len(self._pending)
+            if self._timer is None:
+                interval = getattr(settings, 'NEWSLETTER_OPEN_FLUSH_INTERVAL', 5)
+                self._timer = threading.Timer(interval, self._worker.kick)
+                self._timer.daemon = True
+                self._timer.start()
+        if size >= getattr(settings, 'NEWSLETTER_OPEN_FLUSH_SIZE', 500):
+            self._worker.kick()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Write every buffered open; returns the number of first opens recorded"""
+        with self._lock:
+            tracking_ids, self._pending = self._pending, set()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not tracking_ids:
+            return 0
+        try:
+            return self._write(tracking_ids)
+        except Exception:
+            # Put them back for the next flush rather than dropping them
+            with self._lock:
+                self._pending |= tracking_ids
+            raise
+
+    def _write(self, tracking_ids):
+        flush_id = uuid.uuid4().hex
+        with transaction.atomic():
+            # Only logs still 'sent' count as a first open; the flush id tells us which rows
+            # this flush changed when several processes flush the same ids at once
+            NewsletterSendLog.objects.filter(tracking_id__in=tracking_ids, status='sent').update(
+                status='opened', opened_at=timezone.now(), batch_id=flush_id,
+            )
+            opened = list(NewsletterSendLog.objects.filter(batch_id=flush_id).values_list('newsletter_id', 'subscriber_id'))
+            if not opened:
+                return 0
+            NewsletterSendLog.objects.filter(batch_id=flush_id).update(batch_id='')
+
+            for newsletter_id, count in Counter(newsletter_id for newsletter_id, _ in opened).items():
+                Newsletter.objects.filter(pk=newsletter_id).update(total_opened=F('total_opened') + count)
+            subscribers_by_count = defaultdict(list)
+            for subscriber_id, count in Counter(subscriber_id for _, subscriber_id in opened).items():
+                subscribers_by_count[count].append(subscriber_id)
+            for count, subscriber_ids in subscribers_by_count.items():
+                NewsletterSubscriber.objects.filter(id__in=subscriber_ids).update(
+                    email_open_count=F('email_open_count') + count,
+                )
+        return len(opened)
+
+
+open_tracker = OpenTracker()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        open_tracker.flush()
+    except Exception as e:
+        logger.error(f'Flushing newsletter opens at exit failed: {e}')
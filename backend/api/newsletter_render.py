@@ -0,0 +1,86 @@
+import re
+import threading
+import uuid
+
+from django.conf import settings
+from django.template import Context, Template, TemplateSyntaxError
+from django.template.loader import render_to_string
+
+# Per-recipient values left open in a compiled newsletter
+SLOTS = ('tracking_id', 'unsubscribe_token')
+
+_cache = {}
+_cache_lock = threading.Lock()
+_CACHE_SIZE = 16
+
+
+class CompiledNewsletter:
+    """A newsletter's HTML with everything shared by all recipients already rendered.
+
+    ``parts`` alternates literal HTML with slot names (``'tracking_id'``,
+    ``'unsubscribe_token'``), so rendering one recipient is a single join.
+    """
+
+    def __init__(self, parts, text):
+        self.parts = parts
+        self.text = text
+        # Literal chunks at even indexes, slot names at odd ones
+        self._literals = parts[0::2]
+        self._slots = parts[1::2]
+
+    @property
+    def html(self):
+        return ''.join(self.parts)
+
+    def render(self, tracking_id, unsubscribe_token):
+        values = {'tracking_id': tracking_id, 'unsubscribe_token': unsubscribe_token}
+        out = [self._literals[0]]
+        for slot, literal in zip(self._slots, self._literals[1:]):
+            out.append(values[slot])
+            out.append(literal)
+        return ''.join(out)
+
+
+def compile_newsletter(newsletter):
+    """Render the shared parts of ``newsletter`` once, leaving the per-recipient slots open.
+
+    Content is sent as written unless the newsletter opts in with
+    ``render_content``; then it may use template placeholders
+    (``{{ unsubscribe_url }}``, ``{{ preferences_url }}``, ``{{ frontend_url }}``),
+    and content that isn't a valid template is still sent as written.
+    """
+    # Random markers stand in for the slots while rendering, then the HTML is split on them
+    markers = {slot: f'nlslot{uuid.uuid4().hex}' for slot in SLOTS}
+    context = {
+        'newsletter': newsletter,
+        'frontend_url': settings.FRONTEND_URL,
+        'preferences_url': f"{settings.FRONTEND_URL}/newsletter/preferences",
+        'unsubscribe_url': f"{settings.FRONTEND_URL}/newsletter/unsubscribe/{markers['unsubscribe_token']}/",
+        'tracking_pixel_url': f"{settings.FRONTEND_URL}/api/newsletter/track/open/{markers['tracking_id']}/",
+    }
+    body = newsletter.content
+    if newsletter.render_content:
+        try:
+            body = Template(newsletter.content).render(Context(context))
+        except TemplateSyntaxError:
+            pass
+    html = body + render_to_string('emails/newsletter_footer.html', context)
+
+    parts = re.split('(' + '|'.join(markers.values()) + ')', html)
+    slot_of = {marker: slot for slot, marker in markers.items()}
+    parts = [slot_of[part] if i % 2 else part for i, part in enumerate(parts)]
+    return CompiledNewsletter(parts, newsletter.plain_text_content or "Please view this email in HTML format.")
+
+
+def compiled(newsletter):
+    """``compile_newsletter``, cached per newsletter version so each send compiles it once"""
+    key = (newsletter.pk, newsletter.updated_at)
+    with _cache_lock:
+        result = _cache.get(key)
+    if result is None:
+        result = compile_newsletter(newsletter)
+        with _cache_lock:
+            if len(_cache) >= _CACHE_SIZE:
+                _cache.pop(next(iter(_cache)))
+            _cache[key] = result
+    return result
@@ -0,0 +1,201 @@
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import newsletter_render
+from .inline_worker import InlineWorker
+from .mail_dispatcher import mail_dispatcher
+from .models import Newsletter, NewsletterSendLog, NewsletterSubscriber
+
+logger = logging.getLogger(__name__)
+
+
+def audience(newsletter):
+    """Subscribers a newsletter goes to, per its target audience"""
+    subscribers = NewsletterSubscriber.objects.filter(status='active')
+    if (newsletter.custom_filter or {}).get('email_verified'):
+        subscribers = subscribers.filter(email_verified=True)
+
+    if newsletter.target_audience == 'clients':
+        subscribers = subscribers.filter(user_type_preference__in=['client', 'all'])
+    elif newsletter.target_audience == 'freelancers':
+        subscribers = subscribers.filter(user_type_preference__in=['freelancer', 'all'])
+    elif newsletter.target_audience == 'new_users':
+        subscribers = subscribers.filter(subscribed_at__gte=timezone.now() - timedelta(days=30))
+    return subscribers
+
+
+def build_message(newsletter, subscriber, tracking_id):
+    """The newsletter email for one subscriber, with its tracking pixel and unsubscribe link"""
+    template = newsletter_render.compiled(newsletter)
+    msg = EmailMultiAlternatives(
+        subject=newsletter.subject,
+        body=template.text,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[subscriber.email],
+    )
+    msg.attach_alternative(template.render(tracking_id, subscriber.unsubscribe_token), "text/html")
+    return msg
+
+
+def start(newsletter, verified_only=False, background=True):
+    """Move a draft newsletter to 'sending' for the send worker; returns the expected recipient count.
+
+    Raises ValueError if the newsletter isn't a draft (or another request
+    started it first).
+    """
+    custom_filter = dict(newsletter.custom_filter or {})
+    if verified_only:
+        custom_filter['email_verified'] = True
+    newsletter.custom_filter = custom_filter
+    total = audience(newsletter).count()
+    now = timezone.now()
+
+    started = Newsletter.objects.filter(pk=newsletter.pk, status='draft').update(
+        status='sending', custom_filter=custom_filter, total_recipients=total, total_sent=0, total_failed=0,
+        recipients_queued=False, send_queued_through=0, send_started_at=now, last_progress_at=now, updated_at=now,
+    )
+    if not started:
+        raise ValueError("Only draft newsletters can be sent")
+    newsletter.refresh_from_db()
+    if background:
+        schedule_sending()
+    return total
+
+
+def queue_recipients(newsletter, chunk_size):
+    """Snapshot the audience as pending send logs, a chunk at a time from the saved cursor"""
+    while not newsletter.recipients_queued:
+        ids = list(
+            audience(newsletter).filter(id__gt=newsletter.send_queued_through)
+            .order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        with transaction.atomic():
+            # Rows left by an earlier, interrupted pass are kept as they are
+            NewsletterSendLog.objects.bulk_create([
+                NewsletterSendLog(newsletter=newsletter, subscriber_id=subscriber_id, tracking_id=str(uuid.uuid4()))
+                for subscriber_id in ids
+            ], ignore_conflicts=True)
+            updates = {'last_progress_at': timezone.now()}
+            if ids:
+                updates['send_queued_through'] = ids[-1]
+            if len(ids) < chunk_size:
+                updates['recipients_queued'] = True
+                updates['total_recipients'] = NewsletterSendLog.objects.filter(newsletter=newsletter).count()
+            Newsletter.objects.filter(pk=newsletter.pk).update(**updates)
+        for field, value in updates.items():
+            setattr(newsletter, field, value)
+
+
+def release_stale_claims():
+    """Return send logs held by a worker that died mid-chunk to the queue"""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'NEWSLETTER_SEND_LOCK_TIMEOUT', 600))
+    return NewsletterSendLog.objects.filter(status='sending', claimed_at__lt=cutoff).update(
+        status='pending', batch_id='', claimed_at=None,
+    )
+
+
+def claim_chunk(newsletter, chunk_size):
+    """Atomically take up to ``chunk_size`` pending send logs of a newsletter"""
+    ids = list(
+        NewsletterSendLog.objects.filter(newsletter=newsletter, status='pending')
+        .order_by('id').values_list('id', flat=True)[:chunk_size]
+    )
+    if not ids:
+        return []
+    batch_id = uuid.uuid4().hex
+    NewsletterSendLog.objects.filter(id__in=ids, status='pending').update(
+        status='sending', batch_id=batch_id, claimed_at=timezone.now(),
+    )
+    # Rows another worker claimed first simply aren't in our chunk
+    return list(NewsletterSendLog.objects.filter(batch_id=batch_id).select_related('subscriber').order_by('id'))
+
+
+def send_chunk(newsletter, logs):
+    """Send one claimed chunk through the mail dispatcher; returns (sent, failed)"""
+    skipped = [log.id for log in logs if log.subscriber.status != 'active']
+    logs = [log for log in logs if log.subscriber.status == 'active']
+    errors = mail_dispatcher.send_messages([
+        build_message(newsletter, log.subscriber, log.tracking_id) for log in logs
+    ])
+    sent, failed = [], {}
+    for log, error in zip(logs, errors):
+        if error is None:
+            sent.append(log)
+        else:
+            failed.setdefault(error, []).append(log.id)
+
+    now = timezone.now()
+    failed_count = sum(len(ids) for ids in failed.values())
+    with transaction.atomic():
+        NewsletterSendLog.objects.filter(id__in=[log.id for log in sent]).update(
+            status='sent', sent_at=now, error_message='', batch_id='',
+        )
+        for error, ids in failed.items():
+            NewsletterSendLog.objects.filter(id__in=ids).update(status='failed', error_message=error, batch_id='')
+        if skipped:
+            NewsletterSendLog.objects.filter(id__in=skipped).update(status='unsubscribed', batch_id='')
+        NewsletterSubscriber.objects.filter(id__in=[log.subscriber_id for log in sent]).update(last_email_sent=now)
+        Newsletter.objects.filter(pk=newsletter.pk).update(
+            total_sent=F('total_sent') + len(sent),
+            total_failed=F('total_failed') + failed_count,
+            total_recipients=F('total_recipients') - len(skipped),
+            last_progress_at=now,
+        )
+    return len(sent), failed_count
+
+
+def finish_if_done(newsletter):
+    """Mark the newsletter sent once every queued recipient has been handled"""
+    if not newsletter.recipients_queued:
+        return False
+    if NewsletterSendLog.objects.filter(newsletter=newsletter, status__in=['pending', 'sending']).exists():
+        return False
+    now = timezone.now()
+    return bool(Newsletter.objects.filter(pk=newsletter.pk, status='sending').update(
+        status='sent', sent_at=now, last_progress_at=now, updated_at=now,
+    ))
+
+
+def process_newsletter(newsletter, chunk_size=None):
+    """Queue and send whatever is left of one newsletter; returns {'sent': n, 'failed': n}"""
+    chunk_size = chunk_size or getattr(settings, 'NEWSLETTER_SEND_CHUNK_SIZE', 200)
+    totals = {'sent': 0, 'failed': 0}
+    queue_recipients(newsletter, chunk_size)
+    while True:
+        logs = claim_chunk(newsletter, chunk_size)
+        if not logs:
+            break
+        sent, failed = send_chunk(newsletter, logs)
+        totals['sent'] += sent
+        totals['failed'] += failed
+    finish_if_done(newsletter)
+    return totals
+
+
+def process_pending(chunk_size=None):
+    """One pass over every newsletter in 'sending'; returns totals across them"""
+    release_stale_claims()
+    totals = {'sent': 0, 'failed': 0}
+    try:
+        for newsletter in Newsletter.objects.filter(status='sending').order_by('id'):
+            for outcome, count in process_newsletter(newsletter, chunk_size).items():
+                totals[outcome] += count
+    finally:
+        mail_dispatcher.close()
+    return totals
+
+
+# Sends in the web process when no `send_newsletters --loop` worker is running (NEWSLETTER_SEND_INLINE)
+newsletter_worker = InlineWorker(process_pending, name='newsletter')
+
+
+def schedule_sending():
+    if getattr(settings, 'NEWSLETTER_SEND_INLINE', True):
+        transaction.on_commit(newsletter_worker.kick)
@@ -21,17 +21,19 @@ class NewsletterSerializer(serializers.ModelSerializer):
     class Meta:
         model = Newsletter
         fields = [
-            'id', 'title', 'subject', 'newsletter_type', 'content', 'plain_text_content',
+            'id', 'title', 'subject', 'newsletter_type', 'content', 'render_content', 'plain_text_content',
             'preview_text', 'header_image', 'header_image_url', 'target_audience',
             'custom_filter', 'status', 'created_by', 'created_by_name', 'scheduled_at',
             'sent_at', 'total_recipients', 'total_sent', 'total_delivered',
             'total_opened', 'total_clicked', 'total_bounced', 'total_unsubscribed',
+            'total_failed', 'send_progress', 'send_started_at', 'last_progress_at',
             'open_rate', 'click_rate', 'created_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'created_by', 'created_by_name', 'sent_at', 'total_recipients',
             'total_sent', 'total_delivered', 'total_opened', 'total_clicked',
-            'total_bounced', 'total_unsubscribed', 'open_rate', 'click_rate',
+            'total_bounced', 'total_unsubscribed', 'total_failed', 'send_progress',
+            'send_started_at', 'last_progress_at', 'open_rate', 'click_rate',
             'created_at', 'updated_at'
         ]
 
@@ -42,8 +44,8 @@ class NewsletterListSerializer(serializers.ModelSerializer):
         model = Newsletter
         fields = [
             'id', 'title', 'subject', 'newsletter_type', 'status', 'created_by_name',
-            'scheduled_at', 'sent_at', 'total_recipients', 'total_opened',
-            'total_clicked', 'open_rate', 'click_rate', 'created_at'
+            'scheduled_at', 'sent_at', 'total_recipients', 'total_sent', 'send_progress',
+            'total_opened', 'total_clicked', 'open_rate', 'click_rate', 'created_at'
         ]
 
 class NewsletterSendLogSerializer(serializers.ModelSerializer):
@@ -13,6 +13,7 @@ urlpatterns = [
     path('admin/newsletter/', newsletter_views.NewsletterListCreateView.as_view(), name='admin-newsletter-list'),
     path('admin/newsletter/<int:pk>/', newsletter_views.NewsletterDetailView.as_view(), name='admin-newsletter-detail'),
     path('admin/newsletter/<int:newsletter_id>/send/', newsletter_views.send_newsletter, name='admin-newsletter-send'),
+    path('admin/newsletter/<int:newsletter_id>/progress/', newsletter_views.newsletter_send_progress, name='admin-newsletter-progress'),
     path('admin/newsletter/templates/', newsletter_views.NewsletterTemplateListCreateView.as_view(), name='admin-newsletter-templates'),
     path('admin/newsletter/content/', newsletter_views.NewsletterContentListCreateView.as_view(), name='admin-newsletter-content'),
     path('admin/newsletter/analytics/', newsletter_views.newsletter_analytics, name='admin-newsletter-analytics'),
@@ -2,8 +2,8 @@ from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from django.contrib.auth.models import User
-from django.core.mail import send_mail
 from django.conf import settings
+from django.http import HttpResponse
 from django.utils import timezone
 from django.template.loader import render_to_string
 from django.db.models import Q
@@ -14,70 +14,15 @@ from .models import (
     NewsletterSubscriber, Newsletter, NewsletterSendLog, 
     NewsletterTemplate, NewsletterContent
 )
+from . import newsletter_sender
+from .mail_dispatcher import mail_dispatcher
+from .newsletter_opens import PIXEL_GIF, open_tracker
 from .newsletter_serializers import (
     NewsletterSubscriberSerializer, NewsletterSerializer, NewsletterListSerializer,
     NewsletterSendLogSerializer, NewsletterTemplateSerializer, NewsletterContentSerializer,
     NewsletterSubscriptionSerializer
 )
 
-def send_newsletter_email(subscriber, newsletter):
-    """Send newsletter email to subscriber"""
-    try:
-        # Create tracking log
-        send_log = NewsletterSendLog.objects.create(
-            newsletter=newsletter,
-            subscriber=subscriber,
-            status='pending'
-        )
-        
-        # Prepare email content
-        subject = newsletter.subject
-        html_content = newsletter.content
-        plain_content = newsletter.plain_text_content or "Please view this email in HTML format."
-        
-        # Add tracking pixels and unsubscribe link
-        tracking_pixel = f'<img src="{settings.FRONTEND_URL}/api/newsletter/track/open/{send_log.tracking_id}/" width="1" height="1" style="display:none;">'
-        unsubscribe_link = f'{settings.FRONTEND_URL}/newsletter/unsubscribe/{subscriber.unsubscribe_token}/'
-        
-        html_content += f"""
-        <div style="margin-top: 40px; padding: 20px; background-color: #f8f9fa; text-align: center; font-size: 12px; color: #6c757d;">
-            <p>You received this email because you subscribed to Neurolancer updates.</p>
-            <p><a href="{unsubscribe_link}" style="color: #6c757d;">Unsubscribe</a> | 
-               <a href="{settings.FRONTEND_URL}" style="color: #6c757d;">Visit Neurolancer</a></p>
-        </div>
-        {tracking_pixel}
-        """
-        
-        # Send email
-        send_mail(
-            subject=subject,
-            message=plain_content,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[subscriber.email],
-            html_message=html_content,
-            fail_silently=False,
-        )
-        
-        # Update send log
-        send_log.status = 'sent'
-        send_log.sent_at = timezone.now()
-        send_log.save()
-        
-        # Update subscriber
-        subscriber.last_email_sent = timezone.now()
-        subscriber.save()
-        
-        return True, None
-        
-    except Exception as e:
-        # Update send log with error
-        if 'send_log' in locals():
-            send_log.status = 'failed'
-            send_log.error_message = str(e)
-            send_log.save()
-        
-        return False, str(e)
-
 def send_newsletter_verification_email(subscriber):
     """Send email verification to newsletter subscriber"""
     verification_url = f"{settings.FRONTEND_URL}/newsletter/verify/{subscriber.verification_token}/"
@@ -112,7 +57,7 @@ The Neurolancer Team
     '''
     
     try:
-        send_mail(
+        mail_dispatcher.send_mail(
             subject=subject,
             message=message,
             from_email=settings.DEFAULT_FROM_EMAIL,
@@ -239,37 +184,12 @@ def unsubscribe_newsletter(request, token):
             'error': 'Invalid unsubscribe token'
         }, status=status.HTTP_400_BAD_REQUEST)
 
-@api_view(['GET'])
-@permission_classes([permissions.AllowAny])
 def track_newsletter_open(request, tracking_id):
-    """Track newsletter open"""
-    try:
-        send_log = NewsletterSendLog.objects.get(tracking_id=tracking_id)
-        
-        if send_log.status == 'sent':
-            send_log.status = 'opened'
-            send_log.opened_at = timezone.now()
-            send_log.save()
-            
-            # Update newsletter stats
-            newsletter = send_log.newsletter
-            newsletter.total_opened += 1
-            newsletter.save()
-            
-            # Update subscriber stats
-            subscriber = send_log.subscriber
-            subscriber.email_open_count += 1
-            subscriber.save()
-        
-        # Return 1x1 transparent pixel
-        from django.http import HttpResponse
-        pixel = b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00\x21\xF9\x04\x01\x00\x00\x00\x00\x2C\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02\x04\x01\x00\x3B'
-        return HttpResponse(pixel, content_type='image/gif')
-        
-    except NewsletterSendLog.DoesNotExist:
-        from django.http import HttpResponse
-        pixel = b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00\x21\xF9\x04\x01\x00\x00\x00\x00\x2C\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02\x04\x01\x00\x3B'
-        return HttpResponse(pixel, content_type='image/gif')
+    """Tracking pixel: buffers the open and answers from a prebuilt GIF without touching the database"""
+    open_tracker.record(tracking_id)
+    response = HttpResponse(PIXEL_GIF, content_type='image/gif')
+    response['Cache-Control'] = 'no-store, private'
+    return response
 
 # Admin Newsletter Management Views
 class IsAdminPermission(permissions.BasePermission):
@@ -309,7 +229,7 @@ class NewsletterDetailView(generics.RetrieveUpdateDestroyAPIView):
 @api_view(['POST'])
 @permission_classes([IsAdminPermission])
 def send_newsletter(request, newsletter_id):
-    """Send newsletter to subscribers"""
+    """Start sending a newsletter; the send runs in the background (poll progress/ for status)"""
     try:
         newsletter = Newsletter.objects.get(id=newsletter_id)
         
@@ -318,59 +238,48 @@ def send_newsletter(request, newsletter_id):
                 'error': 'Only draft newsletters can be sent'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Get target subscribers
-        subscribers = NewsletterSubscriber.objects.filter(
-            status='active'
-        )
-        # Note: Removed email_verified=True filter to include all active subscribers
-        
-        # Apply audience filters
-        if newsletter.target_audience == 'clients':
-            subscribers = subscribers.filter(
-                Q(user_type_preference='client') | Q(user_type_preference='all')
-            )
-        elif newsletter.target_audience == 'freelancers':
-            subscribers = subscribers.filter(
-                Q(user_type_preference='freelancer') | Q(user_type_preference='all')
-            )
-        elif newsletter.target_audience == 'new_users':
-            thirty_days_ago = timezone.now() - timedelta(days=30)
-            subscribers = subscribers.filter(subscribed_at__gte=thirty_days_ago)
-        
-        # Update newsletter status
-        newsletter.status = 'sending'
-        newsletter.total_recipients = subscribers.count()
-        newsletter.save()
-        
-        # Send emails
-        sent_count = 0
-        failed_count = 0
-        
-        for subscriber in subscribers:
-            success, error = send_newsletter_email(subscriber, newsletter)
-            if success:
-                sent_count += 1
-            else:
-                failed_count += 1
-        
-        # Update newsletter final status
-        newsletter.status = 'sent'
-        newsletter.sent_at = timezone.now()
-        newsletter.total_sent = sent_count
-        newsletter.save()
+        # All active subscribers (email_verified isn't required here), sent by the newsletter worker
+        try:
+            total_recipients = newsletter_sender.start(newsletter)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         return Response({
-            'message': f'Newsletter sent successfully to {sent_count} subscribers',
-            'sent_count': sent_count,
-            'failed_count': failed_count,
-            'total_recipients': newsletter.total_recipients
-        })
+            'message': f'Newsletter is being sent to {total_recipients} subscribers',
+            'status': newsletter.status,
+            'total_recipients': total_recipients,
+            'progress_url': f'/api/admin/newsletter/{newsletter.id}/progress/',
+        }, status=status.HTTP_202_ACCEPTED)
         
     except Newsletter.DoesNotExist:
         return Response({
             'error': 'Newsletter not found'
         }, status=status.HTTP_404_NOT_FOUND)
 
+@api_view(['GET'])
+@permission_classes([IsAdminPermission])
+def newsletter_send_progress(request, newsletter_id):
+    """Live progress of a newsletter send"""
+    try:
+        newsletter = Newsletter.objects.get(id=newsletter_id)
+    except Newsletter.DoesNotExist:
+        return Response({
+            'error': 'Newsletter not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    return Response({
+        'id': newsletter.id,
+        'status': newsletter.status,
+        'total_recipients': newsletter.total_recipients,
+        'total_sent': newsletter.total_sent,
+        'total_failed': newsletter.total_failed,
+        'progress': round(newsletter.send_progress, 1),
+        'recipients_queued': newsletter.recipients_queued,
+        'send_started_at': newsletter.send_started_at,
+        'last_progress_at': newsletter.last_progress_at,
+        'sent_at': newsletter.sent_at,
+    })
+
 class NewsletterTemplateListCreateView(generics.ListCreateAPIView):
     queryset = NewsletterTemplate.objects.filter(is_active=True)
     serializer_class = NewsletterTemplateSerializer
@@ -0,0 +1,159 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, time as dt_time, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from . import email_outbox
+from .models import Notification, NotificationDigest, NotificationPreference
+
+logger = logging.getLogger(__name__)
+
+# NotificationPreference category governing each Notification.notification_type
+PREFERENCE_CATEGORIES = {
+    'order': 'order_updates',
+    'message': 'messages',
+    'job': 'job_alerts',
+    'proposal': 'proposals',
+    'payment': 'payments',
+    'referral': 'payments',
+    'review': 'reviews',
+    'verification': 'verification',
+    'system': 'system_notifications',
+    'help': 'system_notifications',
+    'group_invite': 'system_notifications',
+    'support': 'system_notifications',
+}
+
+DIGEST_FREQUENCIES = ('daily', 'weekly')
+
+
+def preference_category(notification_type):
+    return PREFERENCE_CATEGORIES.get(notification_type, notification_type)
+
+
+def load_preferences(user_ids, delivery_methods=('email',)):
+    """{user_id: {(category, delivery_method): preference}} for many users in one query"""
+    preferences = defaultdict(dict)
+    for preference in NotificationPreference.objects.filter(
+        user_id__in=user_ids, delivery_method__in=delivery_methods,
+    ).only('user_id', 'category', 'delivery_method', 'frequency', 'is_enabled'):
+        preferences[preference.user_id][(preference.category, preference.delivery_method)] = preference
+    return preferences
+
+
+def find_preference(preferences, notification_type, delivery_method):
+    """The preference (from one user's ``load_preferences`` entry) governing a notification type, if any"""
+    preference = preferences.get((preference_category(notification_type), delivery_method))
+    if preference is None:
+        # Preferences saved under the raw notification type are honoured too
+        preference = preferences.get((notification_type, delivery_method))
+    return preference
+
+
+def is_enabled(preferences, notification_type, delivery_method):
+    """Whether a user's preferences allow this delivery; off when unset"""
+    preference = find_preference(preferences, notification_type, delivery_method)
+    return bool(preference and preference.is_enabled and preference.frequency != 'disabled')
+
+
+def window(frequency, now=None):
+    """(start, end) of the last complete digest window: yesterday, or last Monday-to-Monday week"""
+    today = timezone.localtime(now or timezone.now()).date()
+    if frequency == 'weekly':
+        today -= timedelta(days=today.weekday())
+        length = timedelta(days=7)
+    else:
+        length = timedelta(days=1)
+    end = timezone.make_aware(datetime.combine(today, dt_time.min))
+    return end - length, end
+
+
+def _subscribed_user_ids(frequency, batch_size):
+    """Ids of users with an enabled email digest at ``frequency``, in keyset batches"""
+    last_id = 0
+    while True:
+        user_ids = list(
+            NotificationPreference.objects.filter(
+                delivery_method='email', frequency=frequency, is_enabled=True, user_id__gt=last_id,
+            ).order_by('user_id').values_list('user_id', flat=True).distinct()[:batch_size]
+        )
+        if not user_ids:
+            return
+        yield user_ids
+        last_id = user_ids[-1]
+
+
+def build_digest(user, frequency, groups, start, end):
+    """(subject, text, html) of one user's digest; ``groups`` is [(category label, notifications)]"""
+    count = sum(len(notifications) for _, notifications in groups)
+    html = render_to_string('emails/notification_digest.html', {
+        'user_name': user.first_name or user.username,
+        'frequency': frequency,
+        'groups': groups,
+        'count': count,
+        'start': start,
+        'end': end,
+        'frontend_url': settings.FRONTEND_URL,
+    })
+    period = 'yesterday' if frequency == 'daily' else 'last week'
+    subject = f"Your Neurolancer {frequency} digest: {count} update{'s' if count != 1 else ''} {period}"
+    return subject, strip_tags(html), html
+
+
+def send_batch(user_ids, frequency, start, end):
+    """Send the digests for one batch of users; returns how many were sent"""
+    preferences = load_preferences(user_ids)
+    already_sent = set(NotificationDigest.objects.filter(
+        user_id__in=user_ids, frequency=frequency, window_start=start,
+    ).values_list('user_id', flat=True))
+
+    pending = defaultdict(list)
+    for notification in (
+        Notification.objects.filter(
+            user_id__in=[user_id for user_id in user_ids if user_id not in already_sent],
+            is_read=False, created_at__gte=start, created_at__lt=end,
+        ).select_related('user').order_by('user_id', 'created_at')
+    ):
+        preference = find_preference(preferences[notification.user_id], notification.notification_type, 'email')
+        if preference is not None and preference.frequency == frequency and preference.is_enabled:
+            pending[notification.user_id].append(notification)
+
+    labels = dict(NotificationPreference.NOTIFICATION_CATEGORIES)
+    sent = 0
+    for user_id, notifications in pending.items():
+        user = notifications[0].user
+        if not user.email:
+            continue
+        by_category = defaultdict(list)
+        for notification in notifications:
+            by_category[preference_category(notification.notification_type)].append(notification)
+        groups = [(labels.get(category, category), items) for category, items in sorted(by_category.items())]
+        subject, text, html = build_digest(user, frequency, groups, start, end)
+        try:
+            with transaction.atomic():
+                NotificationDigest.objects.create(
+                    user_id=user_id, frequency=frequency, window_start=start, window_end=end,
+                    notification_count=len(notifications),
+                )
+                email_outbox.enqueue(subject, text, [user.email], html_message=html, category='digest')
+        except IntegrityError:
+            # Another run already sent this user's digest for the window
+            continue
+        sent += 1
+    return sent
+
+
+def send_digests(frequency, now=None, batch_size=None):
+    """Send the last complete window's digest to every user who asked for one at ``frequency``"""
+    batch_size = batch_size or getattr(settings, 'NOTIFICATION_DIGEST_BATCH_SIZE', 500)
+    start, end = window(frequency, now)
+    sent = 0
+    for user_ids in _subscribed_user_ids(frequency, batch_size):
+        sent += send_batch(user_ids, frequency, start, end)
+    logger.info(f'Sent {sent} {frequency} notification digests for {start:%Y-%m-%d}')
+    return sent
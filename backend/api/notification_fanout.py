@@ -0,0 +1,184 @@
+import itertools
+import logging
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .inline_worker import InlineWorker
+from .models import Notification, NotificationBroadcast
+
+logger = logging.getLogger(__name__)
+
+
+def audience_users(audience):
+    if audience == 'client':
+        return User.objects.filter(userprofile__user_type__in=['client', 'both'])
+    if audience == 'freelancer':
+        return User.objects.filter(userprofile__user_type__in=['freelancer', 'both'])
+    if audience == 'staff':
+        return User.objects.filter(is_staff=True, is_active=True)
+    return User.objects.filter(is_active=True)
+
+
+def audience_group(audience):
+    """Channel group every connected member of ``audience`` joins"""
+    return f'audience_{audience}'
+
+
+def audience_groups(user):
+    """Groups a user's WebSocket connection joins, so a broadcast reaches them with one group_send"""
+    groups = [audience_group('all')] if user.is_active else []
+    user_type = getattr(getattr(user, 'userprofile', None), 'user_type', None)
+    if user_type in ('client', 'both'):
+        groups.append(audience_group('client'))
+    if user_type in ('freelancer', 'both'):
+        groups.append(audience_group('freelancer'))
+    if user.is_staff and user.is_active:
+        groups.append(audience_group('staff'))
+    return groups
+
+
+def publish(broadcast):
+    """One WebSocket event for the whole audience; clients refetch their notifications on it"""
+    try:
+        channel_layer = get_channel_layer()
+        if channel_layer:
+            async_to_sync(channel_layer.group_send)(audience_group(broadcast.audience), {
+                'type': 'notification_broadcast',
+                'notification': {
+                    'broadcast_id': broadcast.id,
+                    'title': broadcast.title,
+                    'notification_type': broadcast.notification_type,
+                    'action_url': broadcast.action_url,
+                },
+            })
+    except Exception:
+        logger.exception('WebSocket publish failed for notification broadcast %s', broadcast.id)
+
+
+def frame(notification):
+    """Compact WebSocket payload for one notification"""
+    return {
+        'id': notification.id,
+        'title': notification.title,
+        'message': notification.message,
+        'notification_type': notification.notification_type,
+        'action_url': notification.action_url,
+        'related_object_id': notification.related_object_id,
+        'created_at': notification.created_at.isoformat(),
+    }
+
+
+def publish_to_user(notification):
+    try:
+        channel_layer = get_channel_layer()
+        if channel_layer:
+            async_to_sync(channel_layer.group_send)(f'user_{notification.user_id}', {
+                'type': 'notification',
+                'notification': frame(notification),
+            })
+    except Exception:
+        logger.exception('WebSocket publish failed for notification %s', notification.id)
+
+
+def publish_on_commit(notification):
+    """Push ``notification`` to its user once the surrounding transaction commits (never if it rolls back)"""
+    transaction.on_commit(lambda: publish_to_user(notification))
+
+
+def notify_audience(audience, title, message, notification_type='system', action_url='',
+                    related_object_id=None, created_by=None, background=None):
+    """Notify every user in ``audience``; returns (broadcast, expected recipient count).
+
+    Audiences larger than ``NOTIFICATION_FANOUT_INLINE_MAX`` (or any audience
+    with ``background=True``) are left to the fan-out worker, otherwise the
+    notifications are written before this returns.
+    """
+    total = audience_users(audience).count()
+    broadcast = NotificationBroadcast.objects.create(
+        audience=audience, title=title, message=message, notification_type=notification_type,
+        action_url=action_url, related_object_id=related_object_id, created_by=created_by,
+    )
+    if background is None:
+        background = total > getattr(settings, 'NOTIFICATION_FANOUT_INLINE_MAX', 1000)
+    if background:
+        schedule_processing()
+    elif claim(broadcast):
+        process_broadcast(broadcast)
+    return broadcast, total
+
+
+def claim(broadcast):
+    claimed = NotificationBroadcast.objects.filter(pk=broadcast.pk, status='pending').update(
+        status='running', claimed_at=timezone.now(),
+    )
+    if claimed:
+        broadcast.refresh_from_db()
+    return bool(claimed)
+
+
+def process_broadcast(broadcast, batch_size=None):
+    """Write a claimed broadcast's notifications from its cursor onwards, then publish it"""
+    batch_size = batch_size or getattr(settings, 'NOTIFICATION_FANOUT_BATCH_SIZE', 1000)
+    fields = {
+        'title': broadcast.title,
+        'message': broadcast.message,
+        'notification_type': broadcast.notification_type,
+        'action_url': broadcast.action_url,
+        'related_object_id': broadcast.related_object_id,
+    }
+    user_ids = (
+        audience_users(broadcast.audience).filter(id__gt=broadcast.created_through)
+        .order_by('id').values_list('id', flat=True).iterator(chunk_size=batch_size)
+    )
+    while True:
+        chunk = list(itertools.islice(user_ids, batch_size))
+        if not chunk:
+            break
+        with transaction.atomic():
+            Notification.objects.bulk_create([Notification(user_id=user_id, **fields) for user_id in chunk])
+            # The cursor moves with the batch, so a restarted worker never notifies anyone twice
+            NotificationBroadcast.objects.filter(pk=broadcast.pk).update(
+                created_through=chunk[-1], total_created=F('total_created') + len(chunk), claimed_at=timezone.now(),
+            )
+    NotificationBroadcast.objects.filter(pk=broadcast.pk).update(status='done', finished_at=timezone.now())
+    broadcast.refresh_from_db()
+    publish(broadcast)
+    return broadcast.total_created
+
+
+def release_stale_claims():
+    """Return broadcasts whose worker died mid-way to the queue; they resume from their cursor"""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'NOTIFICATION_FANOUT_LOCK_TIMEOUT', 300))
+    return NotificationBroadcast.objects.filter(status='running', claimed_at__lt=cutoff).update(
+        status='pending', claimed_at=None,
+    )
+
+
+def process_pending(batch_size=None):
+    """One pass over queued broadcasts; returns {'broadcasts': n, 'notifications': n}"""
+    release_stale_claims()
+    totals = {'broadcasts': 0, 'notifications': 0}
+    for broadcast in NotificationBroadcast.objects.filter(status='pending').order_by('id'):
+        if not claim(broadcast):
+            continue
+        created_before = broadcast.total_created
+        totals['notifications'] += process_broadcast(broadcast, batch_size) - created_before
+        totals['broadcasts'] += 1
+    return totals
+
+
+# Fans out in the web process when no `send_notification_broadcasts --loop` worker is running
+# (NOTIFICATION_FANOUT_INLINE)
+fanout_worker = InlineWorker(process_pending, name='notification fan-out')
+
+
+def schedule_processing():
+    if getattr(settings, 'NOTIFICATION_FANOUT_INLINE', True):
+        transaction.on_commit(fanout_worker.kick)
@@ -0,0 +1,50 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedNotification, Notification
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_FIELDS = ('id', 'user_id', 'title', 'message', 'notification_type', 'action_url', 'related_object_id', 'created_at')
+
+
+def expired(days=None, now=None):
+    """Read notifications older than the retention period"""
+    days = days if days is not None else getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 90)
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return Notification.objects.filter(is_read=True, created_at__lt=cutoff)
+
+
+def archive_batch(queryset, last_id, batch_size):
+    """Move the next ``batch_size`` rows of ``queryset`` after ``last_id``; returns their ids"""
+    with transaction.atomic():
+        rows = list(queryset.filter(id__gt=last_id).order_by('id').values(*ARCHIVED_FIELDS)[:batch_size])
+        ids = [row.pop('id') for row in rows]
+        if ids:
+            ArchivedNotification.objects.bulk_create([ArchivedNotification(**row) for row in rows])
+            Notification.objects.filter(id__in=ids).delete()
+    return ids
+
+
+def archive_read_notifications(days=None, batch_size=None, now=None):
+    """Move expired read notifications to ArchivedNotification in chunks; returns how many were moved.
+
+    Each chunk is copied and deleted in its own short transaction, so the live
+    table is never locked for the whole run and an interrupted run loses nothing.
+    """
+    batch_size = batch_size or getattr(settings, 'NOTIFICATION_ARCHIVE_BATCH_SIZE', 1000)
+    queryset = expired(days, now)
+    archived = 0
+    last_id = 0
+    while True:
+        ids = archive_batch(queryset, last_id, batch_size)
+        if not ids:
+            break
+        archived += len(ids)
+        last_id = ids[-1]
+    logger.info(f'Archived {archived} read notifications')
+    return archived
@@ -1,6 +1,11 @@
+import logging
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from .models import Notification
 
+logger = logging.getLogger(__name__)
+
 class NotificationService:
     """Service for creating and managing notifications"""
     
@@ -81,4 +86,60 @@ class NotificationService:
             )
             
         except Exception as e:
-            print(f"Error sending verification notification: {e}")
\ No newline at end of file
+            print(f"Error sending verification notification: {e}")
+    
+    @staticmethod
+    def send_ticket_notification(ticket, action, admin_user=None, message=''):
+        """Notify about a support ticket event; replies to the ticket owner are also emailed"""
+        try:
+            recipient = ticket.user
+            email = False
+            if action == 'created':
+                title = f"Ticket Received: {ticket.ticket_id}"
+                msg = f"We've received your ticket \"{ticket.subject}\" and our support team will get back to you soon."
+            elif action == 'status_updated':
+                title = f"Ticket Updated: {ticket.ticket_id}"
+                msg = f"Your ticket \"{ticket.subject}\" is now {ticket.get_status_display()}."
+            elif action == 'reply_added' and admin_user is not None:
+                title = f"Support Response: {ticket.ticket_id}"
+                msg = message if len(message) <= 200 else f"{message[:200]}..."
+                email = True
+            elif action == 'reply_added':
+                # The owner replied: let the assigned agent know
+                recipient = ticket.assigned_to
+                title = f"New Reply on {ticket.ticket_id}"
+                msg = f"{ticket.user.username} replied to \"{ticket.subject}\"."
+            elif action == 'assigned':
+                recipient = ticket.assigned_to
+                title = f"Ticket Assigned: {ticket.ticket_id}"
+                msg = f"You've been assigned \"{ticket.subject}\"."
+            elif action == 'custom_reply':
+                title = f"Support Update: {ticket.ticket_id}"
+                msg = message
+                email = True
+            else:
+                return
+            if recipient is None:
+                return
+            
+            NotificationService.create_notification(
+                user=recipient,
+                title=title,
+                message=msg,
+                notification_type='support',
+                action_url='/help',
+                related_object_id=ticket.id
+            )
+            
+            if email and recipient.email:
+                from . import email_outbox
+                email_outbox.enqueue(
+                    f"{title} - {ticket.subject}",
+                    f"Hi {recipient.first_name or recipient.username},\n\n{message}\n\n"
+                    f"View your ticket: {settings.FRONTEND_URL}/help\n\nThe Neurolancer Support Team",
+                    [recipient.email],
+                    category='ticket',
+                )
+            
+        except Exception:
+            logger.exception(f"Error sending ticket notification for {ticket.ticket_id}")
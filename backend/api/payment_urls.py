@@ -13,4 +13,5 @@ urlpatterns = [
     path('wallet-payment/', views_payments.wallet_payment, name='wallet_payment'),
     path('record-transaction/', transaction_views.record_transaction, name='record_transaction'),
     path('transactions/', transaction_views.get_transactions, name='get_transactions'),
+    path('transactions/statement/', transaction_views.export_transaction_statement, name='export_transaction_statement'),
 ]
\ No newline at end of file
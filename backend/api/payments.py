@@ -1,7 +1,4 @@
-import requests
 import json
-import hashlib
-import hmac
 from django.conf import settings
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
@@ -12,46 +9,53 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from .models import Order, UserProfile, Transaction, Job, Withdrawal
+from .paystack_client import paystack_client
+from . import bank_directory
+from .currency import kes_to_usd, usd_to_kes
+from . import webhook_inbox
+from . import fees, ledger, payouts
+from .balance_service import BalanceService, InsufficientFunds
 from decimal import Decimal
 import logging
 from datetime import datetime, timedelta
+from django.db import transaction
+from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
 # Paystack configuration
 PAYSTACK_SECRET_KEY = getattr(settings, 'PAYSTACK_SECRET_KEY', 'sk_test_your_secret_key_here')
 PAYSTACK_PUBLIC_KEY = getattr(settings, 'PAYSTACK_PUBLIC_KEY', 'pk_test_your_public_key_here')
-PAYSTACK_BASE_URL = 'https://api.paystack.co'
 
 # Platform configuration
-FREELANCER_FEE_PERCENTAGE = Decimal('0.05')  # 5% fee from freelancer earnings
-CLIENT_FEE_PERCENTAGE = Decimal('0.025')  # 2.5% fee from client payment
-PROCESSING_FEE_KES = Decimal('50.00')  # 50 KES processing fee
+# Fee rates live in the fee engine (api/fees.py)
+FREELANCER_FEE_PERCENTAGE = fees.FREELANCER_FEE_RATE
+CLIENT_FEE_PERCENTAGE = fees.CLIENT_FEE_RATE
+PROCESSING_FEE_KES = fees.PROCESSING_FEE_KES
 PLATFORM_ACCOUNT_NUMBER = '1234567890'  # Platform's M-Pesa account
-KES_TO_USD_RATE = Decimal('0.0077')  # Approximate conversion rate (1 KES = 0.0077 USD)
-USD_TO_KES_RATE = Decimal('130.0')   # Approximate conversion rate (1 USD = 130 KES)
 
 def convert_kes_to_usd(kes_amount):
     """Convert KES amount to USD for dashboard display"""
-    return kes_amount * KES_TO_USD_RATE
+    return kes_to_usd(kes_amount)
 
 def convert_usd_to_kes(usd_amount):
     """Convert USD amount to KES for Paystack processing"""
-    return usd_amount * USD_TO_KES_RATE
+    return usd_to_kes(usd_amount)
+
+def escrow_release_amounts(order):
+    """(KES, USD) released from an order's escrow: the freelancer's earnings, and the USD credited at payment"""
+    earnings_kes = fees.freelancer_split(order.price)[1]
+    if order.escrow_amount is not None:
+        return earnings_kes, order.escrow_amount
+    # Paid before escrow amounts were recorded
+    return earnings_kes, convert_kes_to_usd(earnings_kes)
 
 class PaystackAPI:
     def __init__(self):
-        self.secret_key = PAYSTACK_SECRET_KEY
-        self.base_url = PAYSTACK_BASE_URL
-        self.headers = {
-            'Authorization': f'Bearer {self.secret_key}',
-            'Content-Type': 'application/json',
-        }
+        self.client = paystack_client
 
     def initialize_transaction(self, email, amount, reference, callback_url=None, metadata=None, channels=None):
         """Initialize a payment transaction with M-Pesa support"""
-        url = f'{self.base_url}/transaction/initialize'
-        
         # Convert amount to cents (KES cents)
         amount_cents = int(float(amount) * 100)
         
@@ -69,30 +73,15 @@ class PaystackAPI:
         if metadata:
             data['metadata'] = metadata
             
-        try:
-            response = requests.post(url, headers=self.headers, json=data)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f'Paystack API error: {e}')
-            return None
+        # Safe to retry: Paystack rejects a second initialize with the same reference
+        return self.client.request_json('POST', '/transaction/initialize', json=data, idempotent=True)
 
     def verify_transaction(self, reference):
         """Verify a payment transaction"""
-        url = f'{self.base_url}/transaction/verify/{reference}'
-        
-        try:
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f'Paystack verification error: {e}')
-            return None
+        return self.client.request_json('GET', f'/transaction/verify/{reference}')
 
     def create_transfer_recipient(self, name, account_number, bank_code, recipient_type='mobile_money'):
         """Create a transfer recipient for withdrawals (M-Pesa support)"""
-        url = f'{self.base_url}/transferrecipient'
-        
         data = {
             'type': recipient_type,  # 'mobile_money' for M-Pesa, 'nuban' for bank
             'name': name,
@@ -101,18 +90,11 @@ class PaystackAPI:
             'currency': 'KES'
         }
         
-        try:
-            response = requests.post(url, headers=self.headers, json=data)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f'Paystack recipient creation error: {e}')
-            return None
+        # Paystack returns the existing recipient for a repeated account, so retries are safe
+        return self.client.request_json('POST', '/transferrecipient', json=data, idempotent=True)
 
     def initiate_transfer(self, amount, recipient_code, reason):
         """Initiate a transfer for withdrawals"""
-        url = f'{self.base_url}/transfer'
-        
         data = {
             'source': 'balance',
             'amount': int(float(amount) * 100),  # Convert to cents
@@ -121,26 +103,12 @@ class PaystackAPI:
             'currency': 'KES'
         }
         
-        try:
-            response = requests.post(url, headers=self.headers, json=data)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f'Paystack transfer error: {e}')
-            return None
+        # Not retried: a repeat could move money twice
+        return self.client.request_json('POST', '/transfer', json=data)
 
     def list_banks(self, country='kenya'):
-        """Get list of supported banks and mobile money providers"""
-        url = f'{self.base_url}/bank'
-        params = {'country': country, 'use_cursor': 'false', 'perPage': 100}
-        
-        try:
-            response = requests.get(url, headers=self.headers, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f'Paystack banks list error: {e}')
-            return None
+        """Get list of supported banks and mobile money providers (cached)"""
+        return bank_directory.list_banks(country)
 
 # Initialize Paystack API instance
 paystack = PaystackAPI()
@@ -212,10 +180,27 @@ def initialize_payment(request):
             except Course.DoesNotExist:
                 return Response({'error': 'Course not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        # Calculate fees
-        client_fee = base_amount * CLIENT_FEE_PERCENTAGE  # 2.5% from client
-        processing_fee = PROCESSING_FEE_KES
-        total_amount = base_amount + client_fee + processing_fee
+        # Fees come from the client's signed quote when one is given, else from the fee engine
+        try:
+            if request.data.get('quote'):
+                fee_quote = fees.load_quote(request.data['quote'], request.user)
+                if len(fee_quote['lines']) != 1 or fee_quote['currency'] != 'KES':
+                    raise fees.FeeError('Quote must be for a single KES payment')
+                line = fee_quote['lines'][0]
+                # The quote may only pay for what it was priced for
+                paying = {'order_id': order_id, 'job_id': job_id, 'course_id': course_id}
+                target = next(key for key, value in paying.items() if value)
+                if line['base_amount'] != fees.to_decimal(base_amount).quantize(fees.CENTS) or any(
+                    key in line and (key != target or line[key] != str(paying[key])) for key in paying
+                ):
+                    raise fees.FeeError('Quote does not match this payment, request a new one')
+            else:
+                line = fees.calculate([base_amount])['lines'][0]
+        except fees.FeeError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        client_fee = line['client_fee']
+        processing_fee = line['processing_fee']
+        total_amount = line['total_amount']
         
         # Generate unique reference
         reference = f'{reference_prefix}_{datetime.now().strftime("%Y%m%d%H%M%S")}'
@@ -228,6 +213,7 @@ def initialize_payment(request):
             'base_amount': str(base_amount),
             'client_fee': str(client_fee),
             'processing_fee': str(processing_fee),
+            'freelancer_fee': str(line['freelancer_fee']),
             'total_amount': str(total_amount),
             'platform_account': PLATFORM_ACCOUNT_NUMBER,
             'custom_fields': [
@@ -295,51 +281,6 @@ def initialize_payment(request):
 
 
 
-
-
-
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
-def release_escrow(request):
-    """Release escrow funds when order is completed"""
-    try:
-        order_id = request.data.get('order_id')
-        
-        if not order_id:
-            return Response({'error': 'Order ID is required'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        try:
-            order = Order.objects.get(id=order_id, client=request.user)
-        except Order.DoesNotExist:
-            return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
-        
-        if order.status != 'delivered':
-            return Response({'error': 'Order must be delivered before releasing escrow'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        if order.payment_status != 'paid':
-            return Response({'error': 'Order payment not confirmed'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Release escrow funds
-        order.status = 'completed'
-        order.escrow_released = True
-        order.save()
-        
-        # Update freelancer's available balance
-        freelancer_profile, created = UserProfile.objects.get_or_create(user=order.freelancer)
-        freelancer_profile.escrow_balance -= order.total_amount
-        freelancer_profile.available_balance += order.total_amount
-        freelancer_profile.save()
-        
-        return Response({
-            'status': 'success',
-            'message': 'Escrow funds released successfully'
-        })
-        
-    except Exception as e:
-        logger.error(f'Escrow release error: {e}')
-        return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-
 @api_view(['POST'])
 def verify_payment(request):
     """Verify payment callback from Paystack with platform fee handling"""
@@ -363,9 +304,9 @@ def verify_payment(request):
             processing_fee = Decimal(metadata.get('processing_fee', '0'))
             total_paid = Decimal(str(payment_data['amount'])) / 100  # Convert from cents
             
-            # Calculate freelancer fee (5% from their earnings)
-            freelancer_fee = base_amount * FREELANCER_FEE_PERCENTAGE
-            freelancer_earnings = base_amount - freelancer_fee
+            # Freelancer fee (5% of their earnings); the webhook splits the same way, so
+            # whichever path sees the charge first credits the same escrow amount
+            freelancer_fee, freelancer_earnings = fees.freelancer_split(base_amount)
             
             freelancer_id = metadata.get('freelancer_id')
             client_id = metadata.get('client_id')
@@ -374,17 +315,22 @@ def verify_payment(request):
             if payment_type == 'gig' and metadata.get('order_id'):
                 try:
                     order = Order.objects.get(payment_reference=reference)
-                    order.payment_status = 'paid'
-                    order.status = 'in_progress'
-                    order.is_paid = True
-                    order.save()
-                    
                     # Update freelancer's escrow balance (convert KES to USD for dashboard)
                     # Deduct freelancer fee (5%) from their earnings
-                    freelancer_profile, created = UserProfile.objects.get_or_create(user=order.freelancer)
                     usd_amount = convert_kes_to_usd(freelancer_earnings)
-                    freelancer_profile.escrow_balance += usd_amount
-                    freelancer_profile.save()
+                    # Flip to paid exactly once so a repeated verify (or the webhook) can't credit escrow twice
+                    newly_paid = Order.objects.filter(pk=order.pk).exclude(payment_status='paid').update(
+                        payment_status='paid', status='in_progress', is_paid=True, escrow_amount=usd_amount,
+                        updated_at=timezone.now(),
+                    )
+                    order.payment_status, order.status, order.is_paid = 'paid', 'in_progress', True
+                    
+                    if newly_paid:
+                        order.escrow_amount = usd_amount
+                        BalanceService.credit(
+                            order.freelancer, usd_amount, field='escrow_balance',
+                            entry_type='payment', reference=reference, idempotency_key=f'escrow:{reference}',
+                        )
                     
                     # Create transaction records
                     Transaction.objects.create(
@@ -448,10 +394,11 @@ def verify_payment(request):
                     client = User.objects.get(id=client_id)
                     
                     # Update freelancer's escrow balance (convert KES to USD for dashboard)
-                    freelancer_profile, created = UserProfile.objects.get_or_create(user=freelancer)
                     usd_amount = convert_kes_to_usd(base_amount)
-                    freelancer_profile.escrow_balance += usd_amount
-                    freelancer_profile.save()
+                    BalanceService.credit(
+                        freelancer, usd_amount, field='escrow_balance',
+                        entry_type='payment', reference=reference, idempotency_key=f'escrow:{reference}',
+                    )
                     
                     # Create transaction records
                     Transaction.objects.create(
@@ -517,10 +464,11 @@ def verify_payment(request):
                         course.save()
                         
                         # Update instructor's escrow balance (convert KES to USD for dashboard)
-                        instructor_profile, created = UserProfile.objects.get_or_create(user=course.instructor)
                         usd_amount = convert_kes_to_usd(base_amount)
-                        instructor_profile.escrow_balance += usd_amount
-                        instructor_profile.save()
+                        BalanceService.credit(
+                            course.instructor, usd_amount, field='escrow_balance',
+                            entry_type='payment', reference=reference, idempotency_key=f'escrow:{reference}',
+                        )
                         
                         # Create transaction records
                         Transaction.objects.create(
@@ -567,16 +515,12 @@ def verify_payment(request):
                     return Response({'error': 'Course or user not found'}, status=status.HTTP_404_NOT_FOUND)
             
             # Record platform fees
-            total_platform_fees = client_fee + freelancer_fee + processing_fee
+            total_platform_fees = fees.platform_income(metadata)
             if total_platform_fees > 0:
-                # Create platform fee transaction (could be to admin user or system account)
-                Transaction.objects.create(
-                    user_id=1,  # Assuming admin user ID is 1
-                    transaction_type='fee',
-                    amount=total_platform_fees,
+                # Booked to the platform fee account in the ledger (once per reference)
+                ledger.record_fee(
+                    reference, total_platform_fees,
                     description=f'Platform fees (Client: {client_fee}, Freelancer: {freelancer_fee}) and processing fees for {reference}',
-                    reference=f'{reference}_fees',
-                    status='completed'
                 )
             
             return Response({
@@ -613,13 +557,9 @@ def initiate_withdrawal(request):
         if not all([amount, account_number, account_name]):
             return Response({'error': 'Amount, account number, and account name are required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check user's available balance (amount is in KES, but balance is stored in USD)
-        user_profile, created = UserProfile.objects.get_or_create(user=request.user)
+        # Amount is in KES, but balance is stored in USD
         usd_amount = convert_kes_to_usd(Decimal(str(amount)))
         
-        if user_profile.available_balance < usd_amount:
-            return Response({'error': f'Insufficient balance. Available: ${user_profile.available_balance}, Required: ${usd_amount}'}, status=status.HTTP_400_BAD_REQUEST)
-        
         # Determine recipient type and bank code
         if withdrawal_method == 'mpesa':
             recipient_type = 'mobile_money'
@@ -629,62 +569,29 @@ def initiate_withdrawal(request):
             if not bank_code:
                 return Response({'error': 'Bank code is required for bank transfers'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create transfer recipient
-        recipient_result = paystack.create_transfer_recipient(
-            name=account_name,
-            account_number=account_number,
-            bank_code=bank_code,
-            recipient_type=recipient_type
-        )
-        
-        if not recipient_result or not recipient_result.get('status'):
-            return Response({'error': 'Failed to create transfer recipient'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        recipient_code = recipient_result['data']['recipient_code']
-        
-        # Initiate transfer
-        transfer_result = paystack.initiate_transfer(
-            amount=amount,
-            recipient_code=recipient_code,
-            reason=f'Withdrawal for {request.user.get_full_name() or request.user.username}'
-        )
-        
-        if transfer_result and transfer_result.get('status'):
-            # Deduct from available balance (convert KES withdrawal to USD)
-            user_profile.available_balance -= usd_amount
-            user_profile.save()
-            
-            # Create withdrawal record
-            withdrawal = Withdrawal.objects.create(
-                user=request.user,
-                amount=amount,
+        # Reserve the funds and queue the payout; the batch worker creates the
+        # recipient and sends it through Paystack's bulk transfer API
+        try:
+            withdrawal = payouts.request_withdrawal(
+                request.user, Decimal(str(amount)), account_number, bank_code,
+                balance_debit=usd_amount,
+                account_name=account_name,
+                recipient_type=recipient_type,
                 bank_name=f'{withdrawal_method.upper()}: {bank_code}',
-                account_number=account_number,
-                status='processing',
-                reference=transfer_result['data']['reference'],
-                paystack_recipient_code=recipient_code,
-                paystack_transfer_code=transfer_result['data'].get('transfer_code', '')
-            )
-            
-            # Create transaction record
-            Transaction.objects.create(
-                user=request.user,
-                transaction_type='withdrawal',
-                amount=-Decimal(str(amount)),
                 description=f'Withdrawal to {withdrawal_method.upper()}: {account_number}',
-                reference=transfer_result['data']['reference'],
-                status='pending'
             )
-            
-            return Response({
-                'status': 'success',
-                'message': f'Withdrawal to {withdrawal_method.upper()} initiated successfully',
-                'withdrawal_id': withdrawal.id,
-                'reference': transfer_result['data']['reference'],
-                'method': withdrawal_method
-            })
-        else:
-            return Response({'error': 'Failed to initiate transfer'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except InsufficientFunds:
+            available = (BalanceService.get(request.user) or {}).get('available_balance', Decimal('0'))
+            return Response({'error': f'Insufficient balance. Available: ${available}, Required: ${usd_amount}'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'status': 'success',
+            'message': f'Withdrawal to {withdrawal_method.upper()} queued for payout',
+            'withdrawal_id': withdrawal.id,
+            'reference': withdrawal.reference,
+            'method': withdrawal_method,
+            'withdrawal_status': withdrawal.status
+        })
             
     except Exception as e:
         logger.error(f'Withdrawal error: {e}')
@@ -702,15 +609,7 @@ def get_banks(request):
             banks = result['data']
             
             # Add M-Pesa as a mobile money option
-            mobile_money_providers = [
-                {
-                    'id': 'mpesa',
-                    'name': 'M-Pesa',
-                    'code': 'MPesa',
-                    'type': 'mobile_money',
-                    'currency': 'KES'
-                }
-            ]
+            mobile_money_providers = bank_directory.MOBILE_MONEY_PROVIDERS[:1]
             
             # Separate banks and mobile money
             bank_list = [bank for bank in banks if bank.get('type') != 'mobile_money']
@@ -735,69 +634,61 @@ def get_banks(request):
 def get_mobile_money_providers(request):
     """Get list of mobile money providers for Kenya"""
     try:
-        providers = [
-            {
-                'id': 'mpesa',
-                'name': 'M-Pesa',
-                'code': 'MPesa',
-                'type': 'mobile_money',
-                'currency': 'KES',
-                'description': 'Safaricom M-Pesa mobile money'
-            },
-            {
-                'id': 'airtel_money',
-                'name': 'Airtel Money',
-                'code': 'AirtelMoney',
-                'type': 'mobile_money',
-                'currency': 'KES',
-                'description': 'Airtel Money mobile money'
-            }
-        ]
-        
         return Response({
             'status': 'success',
-            'data': providers
+            'data': bank_directory.MOBILE_MONEY_PROVIDERS
         })
         
     except Exception as e:
         logger.error(f'Mobile money providers error: {e}')
         return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def fee_quote_response(request):
+    """Fee breakdown and signed quote for the request's ``items`` (or its single amount).
+
+    ``breakdown`` keeps the keys of the old single-amount response, but with
+    the fee engine's amounts: ``platform_fee`` is the client fee (2.5% of the
+    base) and ``processing_fee`` the flat 50 KES, in the quote's currency.
+    """
+    items = request.data.get('items')
+    if items is None:
+        items = [{
+            key: request.data.get(key)
+            for key in ('amount', 'hours_worked', 'hourly_rate', 'order_id', 'job_id', 'course_id')
+        }]
+    try:
+        result = fees.quote(request.user, items, currency=request.data.get('currency') or 'KES')
+    except fees.FeeError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    totals = result['totals']
+    return Response({
+        'status': 'success',
+        'currency': result['currency'],
+        'items': result['lines'],
+        'totals': totals,
+        'quote': result['quote'],
+        'expires_in': getattr(settings, 'FEE_QUOTE_TTL', 15 * 60),
+        # Single-amount summary kept for existing clients
+        'breakdown': {
+            'base_amount': float(totals['base_amount']),
+            'platform_fee': float(totals['client_fee']),
+            'platform_fee_percentage': float(fees.CLIENT_FEE_RATE * 100),
+            'client_fee': float(totals['client_fee']),
+            'client_fee_percentage': float(fees.CLIENT_FEE_RATE * 100),
+            'processing_fee': float(totals['processing_fee']),
+            'freelancer_fee': float(totals['freelancer_fee']),
+            'total_amount': float(totals['total_amount']),
+            'currency': result['currency'],
+        },
+    })
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def calculate_payment_fees(request):
-    """Calculate payment fees for a given amount"""
+    """Calculate payment fees for one amount or a batch of ``items`` in a single request"""
     try:
-        amount = request.data.get('amount')
-        hours_worked = request.data.get('hours_worked')
-        hourly_rate = request.data.get('hourly_rate')
-        
-        if not amount and not (hours_worked and hourly_rate):
-            return Response({'error': 'Amount or hourly details required'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Calculate base amount
-        if hours_worked and hourly_rate:
-            base_amount = Decimal(str(hours_worked)) * Decimal(str(hourly_rate))
-        else:
-            base_amount = Decimal(str(amount))
-        
-        # Calculate fees
-        platform_fee = base_amount * Decimal('0.05')  # 5% platform fee
-        processing_fee = base_amount * Decimal('0.025')  # 2.5% processing fee
-        total_amount = base_amount + platform_fee + processing_fee
-        
-        return Response({
-            'status': 'success',
-            'breakdown': {
-                'base_amount': float(base_amount),
-                'platform_fee': float(platform_fee),
-                'platform_fee_percentage': 5,
-                'processing_fee': float(processing_fee),
-                'total_amount': float(total_amount),
-                'currency': 'USD'
-            }
-        })
-        
+        return fee_quote_response(request)
     except Exception as e:
         logger.error(f'Fee calculation error: {e}')
         return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -805,121 +696,31 @@ def calculate_payment_fees(request):
 @csrf_exempt
 @require_http_methods(["POST"])
 def paystack_webhook(request):
-    """Handle Paystack webhooks with enhanced processing"""
+    """Verify and queue Paystack webhooks; events are applied by the webhook worker"""
+    signature = request.META.get('HTTP_X_PAYSTACK_SIGNATURE')
+    if not signature:
+        return JsonResponse({'error': 'No signature provided'}, status=400)
+    
+    if not webhook_inbox.verify_signature(request.body, signature, PAYSTACK_SECRET_KEY):
+        return JsonResponse({'error': 'Invalid signature'}, status=400)
+    
     try:
-        # Verify webhook signature
-        signature = request.META.get('HTTP_X_PAYSTACK_SIGNATURE')
-        if not signature:
-            return JsonResponse({'error': 'No signature provided'}, status=400)
-        
-        # Compute expected signature
-        expected_signature = hmac.new(
-            PAYSTACK_SECRET_KEY.encode('utf-8'),
-            request.body,
-            hashlib.sha512
-        ).hexdigest()
-        
-        if not hmac.compare_digest(signature, expected_signature):
-            return JsonResponse({'error': 'Invalid signature'}, status=400)
-        
-        # Parse webhook data
         data = json.loads(request.body)
-        event = data.get('event')
-        
-        if event == 'charge.success':
-            # Handle successful payment
-            reference = data['data']['reference']
-            amount = Decimal(str(data['data']['amount'])) / 100  # Convert from cents
-            metadata = data['data'].get('metadata', {})
-            
-            # Handle platform fee distribution
-            platform_fee = Decimal(metadata.get('platform_fee', '0'))
-            processing_fee = Decimal(metadata.get('processing_fee', '0'))
-            base_amount = Decimal(metadata.get('base_amount', '0'))
-            
-            # Update order or job payment status
-            payment_type = metadata.get('payment_type', 'gig')
-            
-            if payment_type == 'gig' and metadata.get('order_id'):
-                try:
-                    order = Order.objects.get(payment_reference=reference)
-                    if order.payment_status == 'pending':
-                        order.payment_status = 'paid'
-                        order.status = 'in_progress'
-                        order.is_paid = True
-                        order.save()
-                        
-                        # Update freelancer's escrow balance (convert KES to USD for dashboard)
-                        freelancer_profile, created = UserProfile.objects.get_or_create(user=order.freelancer)
-                        usd_amount = convert_kes_to_usd(base_amount)
-                        freelancer_profile.escrow_balance += usd_amount
-                        freelancer_profile.save()
-                        
-                        logger.info(f'Order {order.id} payment processed: {base_amount} KES to escrow')
-                        
-                except Order.DoesNotExist:
-                    logger.error(f'Order not found for reference: {reference}')
-            
-            # Record platform fees
-            if platform_fee > 0 or processing_fee > 0:
-                total_fees = platform_fee + processing_fee
-                Transaction.objects.create(
-                    user_id=1,  # Platform account
-                    transaction_type='fee',
-                    amount=total_fees,
-                    description=f'Platform fees for {reference}',
-                    reference=f'{reference}_platform_fees',
-                    status='completed'
-                )
-                logger.info(f'Platform fees recorded: {total_fees} KES for {reference}')
-        
-        elif event == 'transfer.success':
-            # Handle successful withdrawal
-            reference = data['data']['reference']
-            
-            try:
-                from .models import Withdrawal
-                withdrawal = Withdrawal.objects.get(reference=reference)
-                withdrawal.status = 'completed'
-                withdrawal.processed_at = datetime.now()
-                withdrawal.save()
-                
-                # Update transaction status
-                Transaction.objects.filter(reference=reference).update(status='completed')
-                
-                logger.info(f'Withdrawal {withdrawal.id} completed successfully')
-                
-            except Withdrawal.DoesNotExist:
-                logger.error(f'Withdrawal not found for reference: {reference}')
-            
-        elif event == 'transfer.failed':
-            # Handle failed withdrawal
-            reference = data['data']['reference']
-            
-            try:
-                from .models import Withdrawal
-                withdrawal = Withdrawal.objects.get(reference=reference)
-                withdrawal.status = 'failed'
-                withdrawal.save()
-                
-                # Refund user's balance
-                user_profile, created = UserProfile.objects.get_or_create(user=withdrawal.user)
-                user_profile.available_balance += withdrawal.amount
-                user_profile.save()
-                
-                # Update transaction status
-                Transaction.objects.filter(reference=reference).update(status='failed')
-                
-                logger.info(f'Withdrawal {withdrawal.id} failed, balance refunded')
-                
-            except Withdrawal.DoesNotExist:
-                logger.error(f'Withdrawal not found for reference: {reference}')
-            
-        return JsonResponse({'status': 'success'})
-        
+    except ValueError:
+        return JsonResponse({'error': 'Invalid payload'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Invalid payload'}, status=400)
+    
+    try:
+        event, created = webhook_inbox.enqueue(data)
     except Exception as e:
-        logger.error(f'Webhook error: {e}')
+        # Nothing was stored, so let Paystack redeliver
+        logger.error(f'Webhook enqueue error: {e}')
         return JsonResponse({'error': 'Internal server error'}, status=500)
+    
+    if created:
+        webhook_inbox.schedule_processing()
+    return JsonResponse({'status': 'success', 'duplicate': not created})
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -946,26 +747,35 @@ def release_escrow(request):
         if order.escrow_released:
             return Response({'error': 'Escrow already released'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Calculate freelancer earnings (after 5% platform fee) in KES
-        freelancer_fee = Decimal(str(order.price)) * FREELANCER_FEE_PERCENTAGE
-        earnings_kes = Decimal(str(order.price)) - freelancer_fee
-        
-        # Mark order completed
-        order.status = 'completed'
-        order.escrow_released = True
-        order.completed_at = datetime.now()
-        order.save()
-        
-        # Update freelancer's balances (convert KES earnings to USD for dashboard)
-        freelancer_profile, _ = UserProfile.objects.get_or_create(user=order.freelancer)
-        earnings_usd = convert_kes_to_usd(earnings_kes)
-        
-        # Prevent negative escrow due to legacy inconsistencies
-        new_escrow = freelancer_profile.escrow_balance - earnings_usd
-        freelancer_profile.escrow_balance = new_escrow if new_escrow > 0 else Decimal('0')
-        freelancer_profile.available_balance += earnings_usd
-        freelancer_profile.total_earnings += earnings_usd
-        freelancer_profile.save()
+        # Freelancer earnings (after 5% platform fee) in KES, and exactly the USD that went into escrow
+        earnings_kes, earnings_usd = escrow_release_amounts(order)
+        
+        with transaction.atomic():
+            # Mark order completed; the conditional update makes a concurrent second release a no-op
+            order.completed_at = datetime.now()
+            released = Order.objects.filter(pk=order.pk, escrow_released=False).update(
+                status='completed', escrow_released=True, completed_at=order.completed_at, updated_at=timezone.now()
+            )
+            if not released:
+                return Response({'error': 'Escrow already released'}, status=status.HTTP_400_BAD_REQUEST)
+            order.status = 'completed'
+            order.escrow_released = True
+            
+            # Update freelancer's balances (convert KES earnings to USD for dashboard);
+            # escrow is floored at zero because of legacy inconsistencies
+            BalanceService.apply(
+                order.freelancer,
+                floor_at_zero=('escrow_balance',),
+                entry_type='escrow_release',
+                reference=f'order:{order.id}',
+                idempotency_key=f'escrow_release:{order.id}',
+                escrow_balance=-earnings_usd,
+                available_balance=earnings_usd,
+                total_earnings=earnings_usd,
+            )
+        
+        from .analytics_service import AnalyticsService
+        AnalyticsService.record_order_transition(order, 'delivered', 'completed')
         
         # Create transaction record for escrow release (recorded in KES)
         Transaction.objects.create(
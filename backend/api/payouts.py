@@ -0,0 +1,426 @@
+import logging
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import recipient_registry
+from .balance_service import BalanceService
+from .inline_worker import InlineWorker
+from .models import LedgerEntry, Transaction, Withdrawal
+from .paystack_client import paystack_client
+
+logger = logging.getLogger(__name__)
+
+# Paystack accepts at most 100 transfers per bulk request
+MAX_BULK_TRANSFERS = 100
+# Terminal transfer statuses that mean the money never arrived
+FAILED_TRANSFER_STATUSES = ('failed', 'reversed', 'abandoned', 'rejected')
+# Withdrawals made by simple_withdrawal, which never reach Paystack
+MOCK_REFERENCE_PREFIX = 'mock_withdrawal_'
+
+
+def new_reference():
+    return f'payout_{uuid.uuid4().hex}'
+
+
+def _call(method, path, **kwargs):
+    """(body, definitive): body is None on failure; definitive means Paystack rejected
+    the request itself (a 4xx), as opposed to a timeout or server error worth retrying"""
+    try:
+        response = paystack_client.request(method, path, **kwargs)
+    except requests.RequestException:
+        return None, False
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    if response.status_code >= 400:
+        definitive = response.status_code < 500 and response.status_code != 429
+        return (body if definitive else None), definitive
+    return body, True
+
+
+# Recipient codes
+
+def get_recipient_code(withdrawal):
+    """(recipient_code, error, definitive) for a withdrawal's payout account, from the recipient registry"""
+    if withdrawal.paystack_recipient_code:
+        return withdrawal.paystack_recipient_code, None, True
+    return recipient_registry.get_recipient_code(
+        withdrawal.user, withdrawal.recipient_type, withdrawal.account_number, withdrawal.bank_code,
+        name=withdrawal.account_name,
+    )
+
+
+# Queueing
+
+def queue_withdrawal(user, amount, account_number, bank_code, account_name='', recipient_type='nuban',
+                     balance_debit=None, bank_name='', recipient_code=''):
+    """Create a queued Withdrawal (``amount`` in KES) for the batch worker.
+
+    The caller reserves the funds in the same transaction; ``balance_debit`` is
+    what to return to ``available_balance`` if the payout fails.
+    """
+    withdrawal = Withdrawal.objects.create(
+        user=user,
+        amount=amount,
+        bank_name=bank_name or f'{recipient_type}: {bank_code}',
+        account_number=account_number,
+        account_name=account_name,
+        bank_code=bank_code,
+        recipient_type=recipient_type,
+        balance_debit=balance_debit,
+        paystack_recipient_code=recipient_code,
+        reference=new_reference(),
+        status='queued',
+    )
+    schedule_processing()
+    return withdrawal
+
+
+def request_withdrawal(user, amount, account_number, bank_code, balance_debit, account_name='',
+                       recipient_type='nuban', bank_name='', recipient_code='', description=''):
+    """Reserve ``balance_debit`` (USD) from the user's available balance and queue a KES payout.
+
+    Raises InsufficientFunds, with nothing queued, if the balance can't cover it.
+    """
+    with transaction.atomic():
+        withdrawal = queue_withdrawal(
+            user, amount, account_number, bank_code, account_name=account_name, recipient_type=recipient_type,
+            balance_debit=balance_debit, bank_name=bank_name, recipient_code=recipient_code,
+        )
+        BalanceService.debit(
+            user, balance_debit, entry_type='withdrawal', reference=withdrawal.reference,
+            description=description or 'Withdrawal reserved',
+        )
+        Transaction.objects.create(
+            user=user,
+            transaction_type='withdrawal',
+            amount=-Decimal(str(amount)),
+            description=description or f'Withdrawal to {withdrawal.bank_name}: {account_number}',
+            reference=withdrawal.reference,
+            status='pending',
+        )
+    return withdrawal
+
+
+# Referral withdrawals are paid from referral earnings, so nothing is reserved from the balance
+REFERRAL_RECIPIENT_TYPES = {'mpesa': 'mobile_money', 'bank': 'nuban'}
+
+
+def queue_referral_payout(referral_withdrawal):
+    """Queue the Paystack payout for an approved referral withdrawal.
+
+    Returns the Withdrawal, or None when the method or account details can't
+    be paid automatically (e.g. PayPal), which leaves it for manual processing.
+    The referral withdrawal settles when the transfer does.
+    """
+    from .currency import usd_to_kes
+
+    recipient_type = REFERRAL_RECIPIENT_TYPES.get(referral_withdrawal.withdrawal_method)
+    details = referral_withdrawal.account_details or {}
+    account_number = details.get('account_number') or details.get('phone_number')
+    bank_code = details.get('bank_code') or ('MPesa' if recipient_type == 'mobile_money' else '')
+    if not recipient_type or not account_number or not bank_code:
+        return None
+
+    with transaction.atomic():
+        withdrawal = queue_withdrawal(
+            referral_withdrawal.user, usd_to_kes(referral_withdrawal.amount), account_number, bank_code,
+            account_name=details.get('account_name', ''), recipient_type=recipient_type,
+            balance_debit=Decimal('0'), bank_name=f'Referral payout ({referral_withdrawal.withdrawal_method})',
+        )
+        referral_withdrawal.status = 'processing'
+        referral_withdrawal.payment_reference = withdrawal.reference
+        referral_withdrawal.save(update_fields=['status', 'payment_reference'])
+    return withdrawal
+
+
+# Settlement (also used by the transfer webhooks)
+
+def _refund_amount(withdrawal):
+    # Rows from before balance_debit existed refund the withdrawal amount, as they always did
+    return withdrawal.amount if withdrawal.balance_debit is None else withdrawal.balance_debit
+
+
+def complete(withdrawal):
+    """Mark a payout as paid; safe to call more than once.
+
+    A payout that was failed and refunded but turns out to have been sent
+    takes the refund back out of the balance.
+    """
+    if withdrawal.status != 'completed':
+        withdrawal.status = 'completed'
+        withdrawal.processed_at = timezone.now()
+        withdrawal.save(update_fields=['status', 'processed_at'])
+        logger.info(f'Withdrawal {withdrawal.id} completed successfully')
+        if LedgerEntry.objects.filter(idempotency_key=f'withdrawal_refund:{withdrawal.reference}').exists():
+            # Whatever the user has already spent of the refund is booked to adjustments
+            BalanceService.debit(
+                withdrawal.user_id, _refund_amount(withdrawal), floor_at_zero=('available_balance',),
+                entry_type='withdrawal', reference=withdrawal.reference, description='Withdrawal refund reversed',
+                idempotency_key=f'withdrawal_refund_reversal:{withdrawal.reference}',
+            )
+            logger.error(f'Withdrawal {withdrawal.id} was refunded but has been paid; refund reversed')
+    Transaction.objects.filter(reference=withdrawal.reference).update(status='completed')
+    _settle_referral_withdrawal(withdrawal, succeeded=True)
+
+
+def fail(withdrawal, reason=''):
+    """Mark a payout as failed and return the reserved funds; only the first call refunds"""
+    if withdrawal.status != 'failed':
+        withdrawal.status = 'failed'
+        withdrawal.last_error = reason or withdrawal.last_error
+        withdrawal.processed_at = timezone.now()
+        withdrawal.save(update_fields=['status', 'last_error', 'processed_at'])
+
+        refund = _refund_amount(withdrawal)
+        if refund:
+            BalanceService.credit(
+                withdrawal.user_id, refund, entry_type='refund', reference=withdrawal.reference,
+                idempotency_key=f'withdrawal_refund:{withdrawal.reference}',
+            )
+        logger.info(f'Withdrawal {withdrawal.id} failed, balance refunded: {reason}')
+        if withdrawal.paystack_recipient_code:
+            # Check the recipient is still good before the next payout reuses it
+            recipient_registry.invalidate(withdrawal.paystack_recipient_code)
+    Transaction.objects.filter(reference=withdrawal.reference).update(status='failed')
+    _settle_referral_withdrawal(withdrawal, succeeded=False)
+
+
+def _settle_referral_withdrawal(withdrawal, succeeded):
+    from .referral_models import ReferralCode, ReferralWithdrawal
+
+    referral = ReferralWithdrawal.objects.select_for_update().filter(
+        payment_reference=withdrawal.reference, status='processing',
+    ).first()
+    if referral is None:
+        return
+    referral.status = 'completed' if succeeded else 'failed'
+    referral.processed_at = timezone.now()
+    referral.save(update_fields=['status', 'processed_at'])
+    if succeeded:
+        ReferralCode.objects.filter(user_id=referral.user_id).update(withdrawn_earnings=F('withdrawn_earnings') + referral.amount)
+    else:
+        # The earnings were set aside when the withdrawal was requested; give them back
+        ReferralCode.objects.filter(user_id=referral.user_id).update(pending_earnings=F('pending_earnings') + referral.amount)
+
+
+# Batch worker
+
+def release_stale_claims():
+    """Requeue withdrawals claimed by a worker that died before submitting them"""
+    timeout = getattr(settings, 'PAYSTACK_PAYOUT_LOCK_TIMEOUT', 300)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return Withdrawal.objects.filter(
+        status='processing', submitted_at__isnull=True, claimed_at__lt=cutoff,
+    ).update(status='queued', attempts=F('attempts') + 1, last_error='Claim expired')
+
+
+def claim_batch(batch_size, after_id=0, up_to=None):
+    """Atomically take up to ``batch_size`` queued withdrawals with ids in (after_id, up_to]"""
+    queued = Withdrawal.objects.filter(status='queued', id__gt=after_id)
+    if up_to is not None:
+        queued = queued.filter(id__lte=up_to)
+    ids = list(queued.order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return [], None
+    batch_id = uuid.uuid4().hex
+    Withdrawal.objects.filter(id__in=ids, status='queued').update(
+        status='processing', batch_id=batch_id, claimed_at=timezone.now(),
+    )
+    # Rows another worker claimed first simply aren't in our batch
+    return list(Withdrawal.objects.filter(batch_id=batch_id).select_related('user').order_by('id')), ids[-1]
+
+
+def _out_of_attempts(withdrawal):
+    return withdrawal.attempts >= getattr(settings, 'PAYSTACK_PAYOUT_MAX_ATTEMPTS', 5)
+
+
+def _requeue(withdrawal, error, maybe_sent=False):
+    """Put a withdrawal back for the next pass until it has used up its attempts.
+
+    Then it fails, unless it may have reached Paystack (``maybe_sent``): that
+    one stays submitted for reconcile to settle from Paystack's own record,
+    since refunding a transfer that went out would pay the user twice.
+    """
+    withdrawal.attempts += 1
+    withdrawal.last_error = error
+    if _out_of_attempts(withdrawal):
+        if maybe_sent:
+            withdrawal.submitted_at = timezone.now()
+            withdrawal.save(update_fields=['attempts', 'last_error', 'submitted_at'])
+            return 'submitted'
+        withdrawal.save(update_fields=['attempts', 'last_error'])
+        with transaction.atomic():
+            fail(withdrawal, error)
+        return 'failed'
+    withdrawal.status = 'queued'
+    withdrawal.save(update_fields=['status', 'attempts', 'last_error'])
+    return 'requeued'
+
+
+def verify_transfer(reference):
+    """Paystack's record of a transfer: its data dict, {} if Paystack has none, None if unknown"""
+    body, definitive = _call('GET', f'/transfer/verify/{reference}')
+    if body and body.get('status'):
+        return body.get('data') or {}
+    return {} if definitive else None
+
+
+def apply_transfer_status(withdrawal, data):
+    """Move a withdrawal on from a Paystack transfer record (bulk item or verify result)"""
+    transfer_status = data.get('status')
+    with transaction.atomic():
+        withdrawal = Withdrawal.objects.select_for_update().get(pk=withdrawal.pk)
+        if data.get('transfer_code') and not withdrawal.paystack_transfer_code:
+            withdrawal.paystack_transfer_code = data['transfer_code']
+            withdrawal.save(update_fields=['paystack_transfer_code'])
+        if transfer_status == 'success':
+            complete(withdrawal)
+        elif transfer_status in FAILED_TRANSFER_STATUSES:
+            fail(withdrawal, data.get('reason') or f'Transfer {transfer_status}')
+    return transfer_status
+
+
+def _outcome(transfer_status):
+    if transfer_status == 'success':
+        return 'completed'
+    return 'failed' if transfer_status in FAILED_TRANSFER_STATUSES else 'submitted'
+
+
+def submit_batch(withdrawals):
+    """Send claimed withdrawals to Paystack in one bulk transfer; returns a status count"""
+    counts = {'submitted': 0, 'completed': 0, 'failed': 0, 'requeued': 0}
+    ready = []
+    for withdrawal in withdrawals:
+        # A retry may already have reached Paystack before the previous attempt timed out
+        if withdrawal.attempts:
+            existing = verify_transfer(withdrawal.reference)
+            if existing is None:
+                counts[_requeue(withdrawal, 'Could not verify previous attempt', maybe_sent=True)] += 1
+                continue
+            if existing:
+                Withdrawal.objects.filter(pk=withdrawal.pk).update(submitted_at=timezone.now())
+                counts[_outcome(apply_transfer_status(withdrawal, existing))] += 1
+                continue
+
+        code, error, definitive = get_recipient_code(withdrawal)
+        if code is None:
+            if definitive:
+                with transaction.atomic():
+                    fail(withdrawal, error)
+                counts['failed'] += 1
+            else:
+                counts[_requeue(withdrawal, error)] += 1
+            continue
+        if code != withdrawal.paystack_recipient_code:
+            withdrawal.paystack_recipient_code = code
+            withdrawal.save(update_fields=['paystack_recipient_code'])
+        ready.append(withdrawal)
+
+    if not ready:
+        return counts
+
+    body, definitive = _call('POST', '/transfer/bulk', json={
+        'currency': 'KES',
+        'source': 'balance',
+        'transfers': [{
+            'amount': int(Decimal(str(withdrawal.amount)) * 100),
+            'recipient': withdrawal.paystack_recipient_code,
+            'reference': withdrawal.reference,
+            'reason': f'Withdrawal for {withdrawal.user.get_full_name() or withdrawal.user.username}',
+        } for withdrawal in ready],
+    })
+    if not body or not body.get('status'):
+        # Paystack refused the whole batch (e.g. low float), or the request timed out and
+        # may or may not have gone through: try again later
+        error = (body or {}).get('message', 'Bulk transfer request failed')
+        for withdrawal in ready:
+            counts[_requeue(withdrawal, error, maybe_sent=not definitive)] += 1
+        return counts
+
+    results = {item.get('reference'): item for item in body.get('data') or []}
+    now = timezone.now()
+    for withdrawal in ready:
+        item = results.get(withdrawal.reference)
+        if item is None:
+            counts[_requeue(withdrawal, 'Missing from bulk transfer response', maybe_sent=True)] += 1
+            continue
+        Withdrawal.objects.filter(pk=withdrawal.pk).update(submitted_at=now, last_error='')
+        counts[_outcome(apply_transfer_status(withdrawal, item))] += 1
+    return counts
+
+
+def process_queue(batch_size=None, limit=None):
+    """Submit queued withdrawals in bulk batches; returns totals by outcome.
+
+    One pass walks the queue in id order up to the newest row queued when it
+    started, so a withdrawal that gets requeued is retried on the next pass
+    rather than in a tight loop.
+    """
+    batch_size = min(batch_size or getattr(settings, 'PAYSTACK_PAYOUT_BATCH_SIZE', MAX_BULK_TRANSFERS), MAX_BULK_TRANSFERS)
+    release_stale_claims()
+    totals = {'submitted': 0, 'completed': 0, 'failed': 0, 'requeued': 0}
+    up_to = Withdrawal.objects.filter(status='queued').order_by('-id').values_list('id', flat=True).first()
+    last_id = 0
+    handled = 0
+    while up_to is not None and (limit is None or handled < limit):
+        size = batch_size if limit is None else min(batch_size, limit - handled)
+        batch, last_claimed = claim_batch(size, after_id=last_id, up_to=up_to)
+        if last_claimed is None:
+            break
+        last_id = last_claimed
+        for outcome, count in submit_batch(batch).items():
+            totals[outcome] += count
+        handled += len(batch)
+    return totals
+
+
+def reconcile(older_than=None, batch_size=200):
+    """Check submitted payouts Paystack hasn't reported back on; returns how many were settled.
+
+    Transfers normally settle through the transfer.success / transfer.failed
+    webhooks. This catches the ones whose webhook never arrived.
+    """
+    older_than = older_than if older_than is not None else getattr(settings, 'PAYSTACK_PAYOUT_RECONCILE_AFTER', 15 * 60)
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    settled = 0
+    last_id = 0
+    while True:
+        batch = list(
+            Withdrawal.objects.filter(
+                # Submitted by the batch worker, or sent synchronously before it existed
+                Q(submitted_at__lte=cutoff) | Q(submitted_at__isnull=True, claimed_at__isnull=True, created_at__lte=cutoff),
+                status='processing', id__gt=last_id,
+            ).exclude(reference__startswith=MOCK_REFERENCE_PREFIX).order_by('id')[:batch_size]
+        )
+        for withdrawal in batch:
+            last_id = withdrawal.id
+            data = verify_transfer(withdrawal.reference)
+            if data == {} and _out_of_attempts(withdrawal):
+                # Given up on without knowing whether it was sent, and Paystack has no such transfer
+                with transaction.atomic():
+                    withdrawal = Withdrawal.objects.select_for_update().filter(pk=withdrawal.pk, status='processing').first()
+                    if withdrawal is not None:
+                        fail(withdrawal, withdrawal.last_error)
+                        settled += 1
+            elif data and _outcome(apply_transfer_status(withdrawal, data)) != 'submitted':
+                settled += 1
+        if len(batch) < batch_size:
+            return settled
+
+
+# Drains the queue when no dedicated `process_payouts` worker is running (PAYSTACK_PAYOUT_INLINE)
+payout_worker = InlineWorker(process_queue, name='payout')
+
+
+def schedule_processing():
+    if getattr(settings, 'PAYSTACK_PAYOUT_INLINE', True):
+        transaction.on_commit(payout_worker.kick)
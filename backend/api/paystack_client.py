@@ -0,0 +1,145 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .profiling import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class PaystackClient:
+    """Shared HTTP client for the Paystack API.
+
+    One ``requests.Session`` keeps TLS connections alive across calls, every
+    request has explicit connect/read timeouts, and idempotent requests are
+    retried a bounded number of times with jittered exponential backoff.
+    Per-endpoint latency and error counts are kept for the admin metrics view.
+    """
+
+    def __init__(self, base_url=None, secret_key=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff=None, pool_size=None):
+        self.base_url = (base_url or getattr(settings, 'PAYSTACK_BASE_URL', 'https://api.paystack.co')).rstrip('/')
+        self.secret_key = secret_key or getattr(settings, 'PAYSTACK_SECRET_KEY', '')
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else getattr(settings, 'PAYSTACK_CONNECT_TIMEOUT', 3.05),
+            read_timeout if read_timeout is not None else getattr(settings, 'PAYSTACK_READ_TIMEOUT', 15),
+        )
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, 'PAYSTACK_MAX_RETRIES', 2)
+        self.backoff = backoff if backoff is not None else getattr(settings, 'PAYSTACK_RETRY_BACKOFF', 0.25)
+        pool_size = pool_size or getattr(settings, 'PAYSTACK_POOL_SIZE', 10)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+        self._metrics_lock = threading.Lock()
+        self._metrics = {}
+
+    def get(self, path, params=None, **kwargs):
+        return self.request('GET', path, params=params, **kwargs)
+
+    def post(self, path, json=None, **kwargs):
+        return self.request('POST', path, json=json, **kwargs)
+
+    def request(self, method, path, params=None, json=None, idempotent=None, secret_key=None):
+        """Send a request and return the ``requests.Response``.
+
+        GETs are retried by default; pass ``idempotent=True`` for POSTs that
+        are safe to repeat (e.g. they carry a unique reference). Raises
+        ``requests.RequestException`` once retries are exhausted.
+        """
+        if idempotent is None:
+            idempotent = method.upper() == 'GET'
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        headers = {'Authorization': f'Bearer {secret_key or self.secret_key}'}
+        url = f'{self.base_url}/{path.lstrip("/")}'
+        endpoint = self._endpoint_name(method, path)
+
+        for attempt in range(1, attempts + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.request(
+                    method, url, params=params, json=json, headers=headers, timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(endpoint, start, error=True, retried=attempt < attempts)
+                if attempt >= attempts:
+                    logger.error(f'Paystack {endpoint} failed after {attempt} attempt(s): {e}')
+                    raise
+                self._sleep(attempt)
+                continue
+
+            retry = response.status_code in RETRY_STATUS_CODES and attempt < attempts
+            self._record(endpoint, start, error=response.status_code >= 500, retried=retry)
+            if retry:
+                logger.warning(f'Paystack {endpoint} returned {response.status_code}, retrying')
+                self._sleep(attempt)
+                continue
+            return response
+
+    def request_json(self, method, path, **kwargs):
+        """Like ``request`` but returns the decoded body, or None on any failure"""
+        try:
+            response = self.request(method, path, **kwargs)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f'Paystack {method} {path} error: {e}')
+            return None
+
+    def metrics(self):
+        with self._metrics_lock:
+            return {
+                endpoint: {
+                    'requests': data['requests'],
+                    'errors': data['errors'],
+                    'retries': data['retries'],
+                    'latency_ms': {
+                        'mean': round(data['latency'].mean, 2),
+                        'p50': round(data['latency'].percentile(0.50), 2),
+                        'p95': round(data['latency'].percentile(0.95), 2),
+                        'p99': round(data['latency'].percentile(0.99), 2),
+                        'max': round(data['latency'].max, 2),
+                    },
+                }
+                for endpoint, data in self._metrics.items()
+            }
+
+    def reset_metrics(self):
+        with self._metrics_lock:
+            self._metrics.clear()
+
+    def _sleep(self, attempt):
+        # Full jitter: anywhere between 0 and the exponential ceiling
+        time.sleep(random.uniform(0, self.backoff * (2 ** (attempt - 1))))
+
+    @staticmethod
+    def _endpoint_name(method, path):
+        # Keep the first two path segments so references/ids don't explode the key space
+        segments = [segment for segment in path.strip('/').split('/') if segment][:2]
+        return f"{method.upper()} /{'/'.join(segments)}"
+
+    def _record(self, endpoint, start, error=False, retried=False):
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._metrics_lock:
+            data = self._metrics.get(endpoint)
+            if data is None:
+                data = self._metrics[endpoint] = {
+                    'requests': 0, 'errors': 0, 'retries': 0, 'latency': LatencyHistogram(),
+                }
+            data['requests'] += 1
+            data['errors'] += int(error)
+            data['retries'] += int(retried)
+            data['latency'].record(elapsed)
+
+
+paystack_client = PaystackClient()
@@ -1,21 +1,21 @@
 import requests
-import json
-from django.conf import settings
 from decimal import Decimal
+from .paystack_client import paystack_client
+from . import bank_directory, fees, recipient_registry
 
 class PaystackAPI:
-    BASE_URL = "https://api.paystack.co"
-    
     def __init__(self):
-        self.secret_key = settings.PAYSTACK_SECRET_KEY
-        self.headers = {
-            'Authorization': f'Bearer {self.secret_key}',
-            'Content-Type': 'application/json'
-        }
+        self.client = paystack_client
+    
+    def _request(self, method, path, **kwargs):
+        """Return Paystack's JSON body, or a failed-status body if the call itself failed"""
+        try:
+            return self.client.request(method, path, **kwargs).json()
+        except (requests.RequestException, ValueError) as e:
+            return {'status': False, 'message': f'Paystack request failed: {e}'}
     
     def create_subaccount(self, business_name, settlement_bank, account_number, percentage_charge=5):
         """Create a subaccount for freelancer/vendor"""
-        url = f"{self.BASE_URL}/subaccount"
         data = {
             "business_name": business_name,
             "settlement_bank": settlement_bank,
@@ -24,13 +24,10 @@ class PaystackAPI:
             "description": f"Subaccount for {business_name}"
         }
         
-        response = requests.post(url, headers=self.headers, json=data)
-        return response.json()
+        return self._request('POST', '/subaccount', json=data)
     
     def initialize_split_payment(self, email, amount, subaccount_code, reference, metadata=None):
         """Initialize payment with split to subaccount"""
-        url = f"{self.BASE_URL}/transaction/initialize"
-        
         # Convert USD to KES if needed
         if isinstance(amount, Decimal):
             amount = float(amount)
@@ -44,36 +41,28 @@ class PaystackAPI:
             "currency": "KES",
             "reference": reference,
             "subaccount": subaccount_code,
-            "transaction_charge": int(amount * 0.05 * 100),  # 5% platform fee
+            "transaction_charge": int(fees.freelancer_split(amount)[0] * 100),  # 5% platform fee
             "bearer": "subaccount"
         }
         
         if metadata:
             data["metadata"] = metadata
         
-        response = requests.post(url, headers=self.headers, json=data)
-        return response.json()
+        return self._request('POST', '/transaction/initialize', json=data, idempotent=True)
     
     def verify_payment(self, reference):
         """Verify payment status"""
-        url = f"{self.BASE_URL}/transaction/verify/{reference}"
-        response = requests.get(url, headers=self.headers)
-        return response.json()
+        return self._request('GET', f'/transaction/verify/{reference}')
     
     def list_banks(self):
-        """Get list of supported banks"""
-        url = f"{self.BASE_URL}/bank"
-        response = requests.get(url, headers=self.headers)
-        return response.json()
+        """Get list of supported banks (cached)"""
+        return bank_directory.list_banks(None) or {'status': False, 'message': 'Failed to fetch banks'}
     
     def resolve_account(self, account_number, bank_code):
-        """Resolve bank account details"""
-        url = f"{self.BASE_URL}/bank/resolve"
-        params = {
-            "account_number": account_number,
-            "bank_code": bank_code
-        }
-        response = requests.get(url, headers=self.headers, params=params)
-        return response.json()
+        """Resolve bank account details (cached)"""
+        return (
+            recipient_registry.resolve_account(account_number, bank_code)
+            or {'status': False, 'message': 'Could not resolve account'}
+        )
 
 paystack = PaystackAPI()
\ No newline at end of file
@@ -1,12 +1,11 @@
-import requests
-import json
-import time
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from django.conf import settings
-from .models import UserProfile, Withdrawal
+from .balance_service import BalanceService, InsufficientFunds
+from .paystack_client import paystack_client
+from . import bank_directory, payouts, recipient_registry
 from decimal import Decimal
 import logging
 
@@ -15,49 +14,22 @@ logger = logging.getLogger(__name__)
 # Paystack Test Credentials
 PAYSTACK_SECRET_KEY = 'sk_test_fd47bd1c9a97e30551cc3bb2def6d664d1671246'
 PAYSTACK_PUBLIC_KEY = 'pk_test_ce9730c10c85c796d2382e48d8635c0dcb59dd1a'
-PAYSTACK_BASE_URL = 'https://api.paystack.co'
 
 class PaystackWithdrawal:
     def __init__(self):
         self.secret_key = PAYSTACK_SECRET_KEY
-        self.headers = {
-            'Authorization': f'Bearer {self.secret_key}',
-            'Content-Type': 'application/json',
-        }
+        self.client = paystack_client
 
     def list_banks(self, country='kenya'):
-        """Get list of supported banks"""
-        url = f'{PAYSTACK_BASE_URL}/bank'
-        params = {'country': country, 'use_cursor': 'false', 'perPage': 100}
-        
-        try:
-            response = requests.get(url, headers=self.headers, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f'Paystack banks list error: {e}')
-            return None
+        """Get list of supported banks (cached)"""
+        return bank_directory.list_banks(country)
 
     def resolve_account(self, account_number, bank_code):
-        """Resolve account number to get account name"""
-        url = f'{PAYSTACK_BASE_URL}/bank/resolve'
-        params = {
-            'account_number': account_number,
-            'bank_code': bank_code
-        }
-        
-        try:
-            response = requests.get(url, headers=self.headers, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f'Account resolution error: {e}')
-            return None
+        """Resolve account number to get account name (cached)"""
+        return recipient_registry.resolve_account(account_number, bank_code, secret_key=self.secret_key)
 
     def create_transfer_recipient(self, name, account_number, bank_code):
         """Create a transfer recipient"""
-        url = f'{PAYSTACK_BASE_URL}/transferrecipient'
-        
         data = {
             'type': 'nuban',
             'name': name,
@@ -66,18 +38,12 @@ class PaystackWithdrawal:
             'currency': 'KES'
         }
         
-        try:
-            response = requests.post(url, headers=self.headers, json=data)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f'Transfer recipient creation error: {e}')
-            return None
+        return self.client.request_json(
+            'POST', '/transferrecipient', json=data, idempotent=True, secret_key=self.secret_key
+        )
 
     def initiate_transfer(self, amount, recipient_code, reason):
         """Initiate a transfer"""
-        url = f'{PAYSTACK_BASE_URL}/transfer'
-        
         data = {
             'source': 'balance',
             'amount': int(float(amount) * 100),  # Convert to cents
@@ -86,13 +52,7 @@ class PaystackWithdrawal:
             'currency': 'KES'
         }
         
-        try:
-            response = requests.post(url, headers=self.headers, json=data)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f'Transfer initiation error: {e}')
-            return None
+        return self.client.request_json('POST', '/transfer', json=data, secret_key=self.secret_key)
 
 # Initialize Paystack instance
 paystack_withdrawal = PaystackWithdrawal()
@@ -112,14 +72,6 @@ def paystack_withdraw(request):
                 'error': 'Amount, bank code, account number, and account name are required'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check user's available balance
-        user_profile, created = UserProfile.objects.get_or_create(user=request.user)
-        
-        if user_profile.available_balance < amount:
-            return Response({
-                'error': f'Insufficient balance. Available: ${user_profile.available_balance}, Required: ${amount}'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
         # Step 1: Resolve account to verify it exists
         account_resolution = paystack_withdrawal.resolve_account(account_number, bank_code)
         
@@ -130,64 +82,31 @@ def paystack_withdraw(request):
         
         resolved_name = account_resolution['data']['account_name']
         
-        # Step 2: Create transfer recipient
-        recipient_result = paystack_withdrawal.create_transfer_recipient(
-            name=account_name,
-            account_number=account_number,
-            bank_code=bank_code
-        )
-        
-        if not recipient_result or not recipient_result.get('status'):
-            return Response({
-                'error': 'Failed to create transfer recipient. Please try again.'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        recipient_code = recipient_result['data']['recipient_code']
-        
-        # Step 3: Initiate transfer
-        transfer_result = paystack_withdrawal.initiate_transfer(
-            amount=amount,
-            recipient_code=recipient_code,
-            reason=f'Withdrawal for {request.user.get_full_name() or request.user.username}'
-        )
-        
-        if transfer_result and transfer_result.get('status'):
-            # Deduct from available balance
-            user_profile.available_balance -= Decimal(str(amount))
-            user_profile.save()
-            
-            # Create withdrawal record
-            withdrawal = Withdrawal.objects.create(
-                user=request.user,
-                amount=amount,
+        # Step 2: Reserve the balance and queue the payout for the batch worker
+        try:
+            withdrawal = payouts.request_withdrawal(
+                request.user, Decimal(str(amount)), account_number, bank_code,
+                balance_debit=Decimal(str(amount)),
+                account_name=account_name,
                 bank_name=f'Bank Code: {bank_code}',
-                account_number=account_number,
-                status='processing',
-                reference=transfer_result['data']['reference'],
-                paystack_recipient_code=recipient_code,
-                paystack_transfer_code=transfer_result['data'].get('transfer_code', '')
             )
-            
-            return Response({
-                'status': 'success',
-                'message': 'Withdrawal initiated successfully via Paystack',
-                'data': {
-                    'withdrawal_id': withdrawal.id,
-                    'reference': transfer_result['data']['reference'],
-                    'resolved_account_name': resolved_name,
-                    'amount': amount,
-                    'transfer_code': transfer_result['data'].get('transfer_code', ''),
-                    'status': transfer_result['data'].get('status', 'processing')
-                }
-            })
-        else:
-            error_msg = 'Transfer initiation failed'
-            if transfer_result and 'message' in transfer_result:
-                error_msg = transfer_result['message']
-            
+        except InsufficientFunds:
+            available = (BalanceService.get(request.user) or {}).get('available_balance', Decimal('0'))
             return Response({
-                'error': error_msg
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                'error': f'Insufficient balance. Available: ${available}, Required: ${amount}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'status': 'success',
+            'message': 'Withdrawal queued for payout via Paystack',
+            'data': {
+                'withdrawal_id': withdrawal.id,
+                'reference': withdrawal.reference,
+                'resolved_account_name': resolved_name,
+                'amount': amount,
+                'status': withdrawal.status
+            }
+        })
             
     except Exception as e:
         logger.error(f'Paystack withdrawal error: {e}')
@@ -219,18 +138,16 @@ def create_recipient(request):
                 'error': 'Invalid bank account details. Please verify your account number and bank.'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create recipient
-        recipient_result = paystack_withdrawal.create_transfer_recipient(
-            name=name,
-            account_number=account_number,
-            bank_code=bank_code
+        # Reuse the user's registered recipient for this account, or create one
+        recipient_code, error, _ = recipient_registry.get_recipient_code(
+            request.user, 'nuban', account_number, bank_code, name=name,
         )
         
-        if recipient_result and recipient_result.get('status'):
+        if recipient_code:
             return Response({
                 'status': 'success',
                 'data': {
-                    'recipient_code': recipient_result['data']['recipient_code'],
+                    'recipient_code': recipient_code,
                     'resolved_name': account_resolution['data']['account_name']
                 }
             })
@@ -253,63 +170,37 @@ def process_withdrawal(request):
         amount = float(request.data.get('amount', 0))
         recipient = request.data.get('recipient')
         reason = request.data.get('reason', 'Neurolancer withdrawal')
-        reference = request.data.get('reference', f'neurolancer_{int(time.time())}')
         
         if not all([amount, recipient]):
             return Response({
                 'error': 'Amount and recipient are required'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check user's available balance
-        user_profile, created = UserProfile.objects.get_or_create(user=request.user)
-        
-        if user_profile.available_balance < amount:
-            return Response({
-                'error': f'Insufficient balance. Available: ${user_profile.available_balance}'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Initiate transfer
-        transfer_result = paystack_withdrawal.initiate_transfer(
-            amount=amount,
-            recipient_code=recipient,
-            reason=reason
-        )
-        
-        if transfer_result and transfer_result.get('status'):
-            # Deduct from available balance
-            user_profile.available_balance -= Decimal(str(amount))
-            user_profile.save()
-            
-            # Create withdrawal record
-            withdrawal = Withdrawal.objects.create(
-                user=request.user,
-                amount=amount,
+        # Reserve the balance and queue the payout to the existing recipient
+        try:
+            withdrawal = payouts.request_withdrawal(
+                request.user, Decimal(str(amount)), '****', '',
+                balance_debit=Decimal(str(amount)),
                 bank_name='Paystack Transfer',
-                account_number='****',
-                status='processing',
-                reference=transfer_result['data']['reference'],
-                paystack_recipient_code=recipient,
-                paystack_transfer_code=transfer_result['data'].get('transfer_code', '')
+                recipient_code=recipient,
+                description=reason,
             )
-            
-            return Response({
-                'status': 'success',
-                'message': 'Withdrawal processed successfully',
-                'data': {
-                    'withdrawal_id': withdrawal.id,
-                    'reference': transfer_result['data']['reference'],
-                    'amount': amount,
-                    'status': transfer_result['data'].get('status', 'processing')
-                }
-            })
-        else:
-            error_msg = 'Transfer failed'
-            if transfer_result and 'message' in transfer_result:
-                error_msg = transfer_result['message']
-            
+        except InsufficientFunds:
+            available = (BalanceService.get(request.user) or {}).get('available_balance', Decimal('0'))
             return Response({
-                'error': error_msg
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                'error': f'Insufficient balance. Available: ${available}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'status': 'success',
+            'message': 'Withdrawal queued for payout',
+            'data': {
+                'withdrawal_id': withdrawal.id,
+                'reference': withdrawal.reference,
+                'amount': amount,
+                'status': withdrawal.status
+            }
+        })
             
     except Exception as e:
         logger.error(f'Process withdrawal error: {e}')
@@ -0,0 +1,179 @@
+import math
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+
+class LatencyHistogram:
+    """Fixed-size log-bucketed histogram.
+
+    Bucket bounds grow geometrically, so percentiles are accurate to within
+    one bucket width (~20%) while memory stays constant regardless of how
+    many samples are recorded.
+    """
+
+    MIN_VALUE = 0.5
+    GROWTH = 1.2
+    BUCKETS = 64
+
+    def __init__(self):
+        self.counts = [0] * (self.BUCKETS + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def bucket_for(cls, value):
+        if value <= cls.MIN_VALUE:
+            return 0
+        index = int(math.ceil(math.log(value / cls.MIN_VALUE, cls.GROWTH)))
+        return min(index, cls.BUCKETS)
+
+    @classmethod
+    def upper_bound(cls, index):
+        return cls.MIN_VALUE * (cls.GROWTH ** index)
+
+    def record(self, value):
+        self.counts[self.bucket_for(value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        if not self.total:
+            return 0.0
+        target = fraction * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.upper_bound(index), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.total if self.total else 0.0
+
+
+class EndpointStats:
+    """Aggregated counters for one URL pattern"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.errors = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.response_bytes = 0
+
+    def record(self, duration_ms, status_code, query_count, db_ms, response_bytes):
+        self.requests += 1
+        if status_code >= 500:
+            self.errors += 1
+        self.latency.record(duration_ms)
+        self.queries += query_count
+        self.db_time += db_ms
+        self.response_bytes += response_bytes
+
+    def as_dict(self):
+        requests = self.requests or 1
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'latency_ms': {
+                'mean': round(self.latency.mean, 2),
+                'p50': round(self.latency.percentile(0.50), 2),
+                'p95': round(self.latency.percentile(0.95), 2),
+                'p99': round(self.latency.percentile(0.99), 2),
+                'max': round(self.latency.max, 2),
+            },
+            'queries_per_request': round(self.queries / requests, 2),
+            'db_ms_per_request': round(self.db_time / requests, 2),
+            'bytes_per_request': int(self.response_bytes / requests),
+        }
+
+
+class QueryRecorder:
+    """Database execute wrapper that counts and times queries for one request.
+
+    Every query is counted and timed, but SQL text is only kept once the
+    request has run for ``capture_after_ms`` (the slow-request threshold), up
+    to ``capture_sql`` statements. The slowest statement is always remembered
+    so a slow request's log entry still names the query that made it slow
+    when that query ran before the threshold was crossed.
+    """
+
+    def __init__(self, capture_sql=0, capture_after_ms=0.0, started=None):
+        self.count = 0
+        self.duration = 0.0
+        self.capture_sql = capture_sql
+        self.capture_after_ms = capture_after_ms
+        self.started = started if started is not None else time.perf_counter()
+        self.statements = []
+        self.slowest = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            end = time.perf_counter()
+            elapsed = (end - start) * 1000
+            self.count += 1
+            self.duration += elapsed
+            if self.slowest is None or elapsed > self.slowest[1]:
+                self.slowest = (sql, elapsed)
+            if (len(self.statements) < self.capture_sql
+                    and (end - self.started) * 1000 >= self.capture_after_ms):
+                self.statements.append({'sql': sql, 'ms': round(elapsed, 2)})
+
+    def slowest_statement(self):
+        if self.slowest is None or not self.capture_sql:
+            return None
+        sql, elapsed = self.slowest
+        return {'sql': sql, 'ms': round(elapsed, 2)}
+
+
+class ProfilingRegistry:
+    """Process-wide store of per-endpoint stats and recent slow requests"""
+
+    def __init__(self, slow_log_size=None):
+        if slow_log_size is None:
+            slow_log_size = getattr(settings, 'PROFILING_SLOW_LOG_SIZE', 50)
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._slow = deque(maxlen=slow_log_size)
+        self.started_at = time.time()
+
+    def record(self, endpoint, duration_ms, status_code, recorder, response_bytes):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            stats.record(duration_ms, status_code, recorder.count, recorder.duration, response_bytes)
+
+    def record_slow(self, entry):
+        with self._lock:
+            self._slow.append(entry)
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {name: stats.as_dict() for name, stats in self._endpoints.items()}
+            slow = list(self._slow)
+        return {
+            'since': self.started_at,
+            'endpoints': dict(sorted(endpoints.items(), key=lambda item: -item[1]['requests'])),
+            'slow_requests': slow[::-1],
+        }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._slow.clear()
+            self.started_at = time.time()
+
+
+registry = ProfilingRegistry()
@@ -0,0 +1,126 @@
+import hashlib
+import hmac
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import TransferRecipient
+
+
+def account_key(user_id, recipient_type, account_number, bank_code):
+    """Registry key for a payout account; keyed with SECRET_KEY so short account numbers can't be brute-forced back"""
+    message = f'{user_id}:{recipient_type}:{account_number}:{bank_code}'.encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+
+def _call(method, path, **kwargs):
+    # Shares payouts' error classification; imported lazily since payouts imports this module
+    from .payouts import _call
+    return _call(method, path, **kwargs)
+
+
+def _revalidate_after():
+    return timedelta(seconds=getattr(settings, 'PAYSTACK_RECIPIENT_REVALIDATE_AFTER', 7 * 24 * 60 * 60))
+
+
+def _still_valid(recipient):
+    """False only when Paystack says the recipient is gone or inactive; errors give it the benefit of the doubt"""
+    body, definitive = _call('GET', f'/transferrecipient/{recipient.recipient_code}')
+    if body and body.get('status'):
+        return (body.get('data') or {}).get('active', True) is not False
+    return not definitive
+
+
+def get_recipient_code(user, recipient_type, account_number, bank_code, name='', currency='KES'):
+    """(recipient_code, error, definitive) for one of ``user``'s payout accounts.
+
+    A recipient is created on Paystack once per account and reused for every
+    later withdrawal. Codes are only re-checked with Paystack once they haven't
+    been validated for ``PAYSTACK_RECIPIENT_REVALIDATE_AFTER`` seconds (or after
+    a transfer to them failed, see ``invalidate``); a recipient Paystack no
+    longer accepts is replaced.
+    """
+    key = account_key(user.pk, recipient_type, account_number, bank_code)
+    now = timezone.now()
+    recipient = TransferRecipient.objects.filter(account_key=key, is_active=True).first()
+    if recipient is not None:
+        fresh = recipient.last_validated_at > now - _revalidate_after()
+        if fresh or _still_valid(recipient):
+            updates = {'last_used_at': now} if fresh else {'last_used_at': now, 'last_validated_at': now}
+            TransferRecipient.objects.filter(pk=recipient.pk).update(**updates)
+            return recipient.recipient_code, None, True
+        recipient.is_active = False
+        recipient.save(update_fields=['is_active'])
+
+    name = name or user.get_full_name() or user.username
+    body, definitive = _call('POST', '/transferrecipient', json={
+        'type': recipient_type,
+        'name': name,
+        'account_number': account_number,
+        'bank_code': bank_code,
+        'currency': currency,
+    }, idempotent=True)
+    if not body or not body.get('status'):
+        return None, (body or {}).get('message', 'Could not create transfer recipient'), definitive
+
+    code = body['data']['recipient_code']
+    fields = {
+        'user': user,
+        'recipient_type': recipient_type,
+        'bank_code': bank_code,
+        'account_last4': str(account_number)[-4:],
+        'account_name': name[:100],
+        'recipient_code': code,
+        'is_active': True,
+        'last_validated_at': now,
+        'last_used_at': now,
+    }
+    try:
+        with transaction.atomic():
+            TransferRecipient.objects.update_or_create(account_key=key, defaults=fields)
+    except IntegrityError:
+        # Another worker registered the same account at the same moment; Paystack
+        # hands back the same recipient for identical details, so either row will do
+        pass
+    return code, None, True
+
+
+def invalidate(recipient_code):
+    """Force the next use of ``recipient_code`` to re-check it with Paystack"""
+    return TransferRecipient.objects.filter(recipient_code=recipient_code, is_active=True).update(
+        last_validated_at=timezone.now() - _revalidate_after() - timedelta(seconds=1),
+    )
+
+
+# Account resolution
+
+def resolve_cache_key(account_number, bank_code):
+    digest = hashlib.sha256(f'{account_number}:{bank_code}'.encode()).hexdigest()
+    return f'paystack_resolve:{digest}'
+
+
+def resolve_account(account_number, bank_code, secret_key=None):
+    """Paystack's ``/bank/resolve`` body for an account, cached; None if the lookup failed.
+
+    Successful lookups are cached for ``PAYSTACK_RESOLVE_CACHE_TTL`` seconds and
+    definitive rejections (an unknown account) for
+    ``PAYSTACK_RESOLVE_NEGATIVE_TTL``; timeouts and server errors are not cached.
+    """
+    key = resolve_cache_key(account_number, bank_code)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    body, definitive = _call('GET', '/bank/resolve', params={
+        'account_number': account_number,
+        'bank_code': bank_code,
+    }, secret_key=secret_key)
+    if body and body.get('status'):
+        cache.set(key, body, timeout=getattr(settings, 'PAYSTACK_RESOLVE_CACHE_TTL', 24 * 60 * 60))
+        return body
+    if body is not None and definitive:
+        cache.set(key, body, timeout=getattr(settings, 'PAYSTACK_RESOLVE_NEGATIVE_TTL', 5 * 60))
+    return body
@@ -3,7 +3,8 @@ from django.utils import timezone
 from django.db import models
 from decimal import Decimal
 from .referral_models import ReferralSettings, ReferralCode, Referral, ReferralEarning
-from .models import Transaction, UserProfile
+from .models import Transaction
+from .balance_service import BalanceService
 import logging
 
 logger = logging.getLogger(__name__)
@@ -261,11 +262,8 @@ class ReferralService:
     def add_to_referral_balance(user, amount):
         """Add amount to user's referral balance"""
         try:
-            user_profile, created = UserProfile.objects.get_or_create(user=user)
-            
             # Add to available balance (referral earnings go directly to available balance)
-            user_profile.available_balance += amount
-            user_profile.save()
+            BalanceService.credit(user, amount, entry_type='bonus', description='Referral earnings')
             
             # Create transaction record
             Transaction.objects.create(
@@ -7,6 +7,8 @@ from django.db.models import Sum, Count, Q
 from django.utils import timezone
 from .referral_models import ReferralSettings, ReferralCode, Referral, ReferralEarning, ReferralWithdrawal
 from .referral_service import ReferralService
+from .balance_service import BalanceService
+from . import payouts
 from .models import UserProfile, Transaction
 import logging
 
@@ -316,9 +318,11 @@ def admin_process_withdrawal(request, withdrawal_id):
         if action == 'approve':
             if withdrawal.withdrawal_method == 'balance':
                 # Add to user's account balance
-                user_profile, created = UserProfile.objects.get_or_create(user=withdrawal.user)
-                user_profile.available_balance += withdrawal.amount
-                user_profile.save()
+                BalanceService.credit(
+                    withdrawal.user, withdrawal.amount, entry_type='bonus',
+                    description=f'Referral withdrawal #{withdrawal.id}',
+                    idempotency_key=f'referral_withdrawal:{withdrawal.id}',
+                )
                 
                 # Update referral code
                 referral_code = ReferralCode.objects.get(user=withdrawal.user)
@@ -326,7 +330,7 @@ def admin_process_withdrawal(request, withdrawal_id):
                 referral_code.save()
                 
                 withdrawal.status = 'completed'
-            else:
+            elif payouts.queue_referral_payout(withdrawal) is None:
                 withdrawal.status = 'processing'  # Manual processing required
             
             withdrawal.processed_by = request.user
@@ -11,6 +11,7 @@ import logging
 from .models import Gig, Job, Order, UserProfile, Notification
 from .report_models import Report, ReportAction, UserReportStats
 from .notification_service import NotificationService
+from . import notification_fanout
 
 logger = logging.getLogger(__name__)
 
@@ -80,16 +81,15 @@ def create_report(request):
             )
         
         # Notify admins
-        admin_users = User.objects.filter(is_staff=True, is_active=True)
-        for admin in admin_users:
-            NotificationService.create_notification(
-                user=admin,
-                title=f"New Report: {report.title}",
-                message=f"A new {report.report_type} report has been filed by {reporter.username}",
-                notification_type='system',
-                action_url=f'/admin/reports',
-                related_object_id=report.id
-            )
+        notification_fanout.notify_audience(
+            'staff',
+            title=f"New Report: {report.title}",
+            message=f"A new {report.report_type} report has been filed by {reporter.username}",
+            notification_type='system',
+            action_url='/admin/reports',
+            related_object_id=report.id,
+            created_by=reporter,
+        )
         
         return Response({
             'message': 'Report submitted successfully',
@@ -1,3 +1,4 @@
+from decimal import Decimal
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
@@ -10,6 +11,8 @@ from .models import (
     UserAnalytics, PlatformAnalytics, AnalyticsEvent, ThirdPartyIntegration, IntegrationSync,
     AIConversation, AIMessage, AssessmentCategory, Assessment, Question, QuestionOption, AssessmentPayment, AssessmentAnswer
 )
+from .currency import currency_service
+from . import notification_digest
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -158,19 +161,21 @@ class UserProfileSerializer(serializers.ModelSerializer):
     def get_avatar_url(self, obj):
         return obj.get_avatar_url()
     
+    def _usd_to_kes_rate(self):
+        # Looked up once per response; list serializers share the context with every child
+        if 'usd_to_kes_rate' not in self.context:
+            self.context['usd_to_kes_rate'] = currency_service.rate('USD', 'KES')
+        return self.context['usd_to_kes_rate']
+    
     def get_available_balance_kes(self, obj):
         """Convert USD balance to KES for withdrawal display"""
-        from decimal import Decimal
-        USD_TO_KES_RATE = Decimal('130.0')
         balance = obj.available_balance or Decimal('0')
-        return float(Decimal(str(balance)) * USD_TO_KES_RATE)
+        return float(Decimal(str(balance)) * self._usd_to_kes_rate())
     
     def get_total_earnings_kes(self, obj):
         """Convert USD earnings to KES for display"""
-        from decimal import Decimal
-        USD_TO_KES_RATE = Decimal('130.0')
         earnings = obj.total_earnings or Decimal('0')
-        return float(Decimal(str(earnings)) * USD_TO_KES_RATE)
+        return float(Decimal(str(earnings)) * self._usd_to_kes_rate())
     
     def update(self, instance, validated_data):
         category_ids = validated_data.pop('category_ids', [])
@@ -833,7 +838,7 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = '__all__'
-        read_only_fields = ['payment_id', 'is_paid', 'escrow_released', 'total_amount', 'freelancer', 'gig', 'project', 'task']
+        read_only_fields = ['payment_id', 'is_paid', 'escrow_released', 'escrow_amount', 'total_amount', 'freelancer', 'gig', 'project', 'task']
         extra_kwargs = {
             'title': {'required': False},
             'description': {'required': False}, 
@@ -976,7 +981,7 @@ class ReviewSerializer(serializers.ModelSerializer):
         freelancer_profile = order.freelancer.userprofile
         freelancer_profile.rating = freelancer_avg
         freelancer_profile.total_reviews = freelancer_reviews.count()
-        freelancer_profile.save()
+        freelancer_profile.save(update_fields=['rating', 'total_reviews', 'updated_at'])
         
         return review
 
@@ -1958,27 +1963,23 @@ class NotificationWithPreferencesSerializer(serializers.ModelSerializer):
         model = Notification
         fields = '__all__'
     
+    def _preferences(self, obj):
+        """The notification owner's email/push preferences, loaded once for the whole list"""
+        cache = self.context.setdefault('_notification_preferences', {})
+        if obj.user_id not in cache:
+            instances = getattr(self.parent, 'instance', None) if isinstance(self.parent, serializers.ListSerializer) else None
+            user_ids = {n.user_id for n in instances} if instances is not None else set()
+            user_ids.add(obj.user_id)
+            loaded = notification_digest.load_preferences(user_ids, ('email', 'push'))
+            for user_id in user_ids:
+                cache.setdefault(user_id, loaded.get(user_id, {}))
+        return cache[obj.user_id]
+
     def get_can_email(self, obj):
-        try:
-            pref = NotificationPreference.objects.get(
-                user=obj.user,
-                category=obj.notification_type,
-                delivery_method='email'
-            )
-            return pref.is_enabled
-        except NotificationPreference.DoesNotExist:
-            return False
-    
+        return notification_digest.is_enabled(self._preferences(obj), obj.notification_type, 'email')
+
     def get_can_push(self, obj):
-        try:
-            pref = NotificationPreference.objects.get(
-                user=obj.user,
-                category=obj.notification_type,
-                delivery_method='push'
-            )
-            return pref.is_enabled
-        except NotificationPreference.DoesNotExist:
-            return False
+        return notification_digest.is_enabled(self._preferences(obj), obj.notification_type, 'push')
 
 # Error Handling Serializers
 class ErrorLogSerializer(serializers.ModelSerializer):
@@ -2,8 +2,12 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from .models import UserProfile, Withdrawal
+from django.db import transaction
+from .balance_service import BalanceService, InsufficientFunds
+from .payouts import MOCK_REFERENCE_PREFIX
+from .models import Withdrawal
 from decimal import Decimal
+import time
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -19,27 +23,30 @@ def simple_withdrawal(request):
         if not all([amount, account_number, account_name]):
             return Response({'error': 'Amount, account number, and account name are required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check user's available balance
-        user_profile, created = UserProfile.objects.get_or_create(user=request.user)
-        
-        if user_profile.available_balance < amount:
-            return Response({
-                'error': f'Insufficient balance. Available: ${user_profile.available_balance}, Required: ${amount}'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Deduct from available balance
-        user_profile.available_balance -= Decimal(str(amount))
-        user_profile.save()
-        
-        # Create withdrawal record (mock - no actual Paystack call)
-        withdrawal = Withdrawal.objects.create(
-            user=request.user,
-            amount=amount,
-            bank_name=f'{withdrawal_method.upper()}: {bank_code}',
-            account_number=account_number,
-            status='processing',
-            reference=f'mock_withdrawal_{request.user.id}_{int(__import__("time").time())}'
-        )
+        reference = f'{MOCK_REFERENCE_PREFIX}{request.user.id}_{int(time.time())}'
+        with transaction.atomic():
+            # Deduct from available balance; the database rejects an overdraft
+            try:
+                BalanceService.debit(request.user, amount, entry_type='withdrawal', reference=reference)
+            except InsufficientFunds:
+                available = (BalanceService.get(request.user) or {}).get('available_balance', Decimal('0'))
+                return Response({
+                    'error': f'Insufficient balance. Available: ${available}, Required: ${amount}'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Create withdrawal record (mock - no actual Paystack call, so it never enters the payout queue
+            # and reconcile skips it by its reference)
+            withdrawal = Withdrawal.objects.create(
+                user=request.user,
+                amount=amount,
+                bank_name=f'{withdrawal_method.upper()}: {bank_code}',
+                account_number=account_number,
+                account_name=account_name,
+                bank_code=bank_code or '',
+                balance_debit=Decimal(str(amount)),
+                status='processing',
+                reference=reference
+            )
         
         return Response({
             'status': 'success',
@@ -0,0 +1,327 @@
+import hmac
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .mail_dispatcher import TokenBucket
+from .profiling import LatencyHistogram
+from .sms_service import SMSService
+
+logger = logging.getLogger(__name__)
+
+# Placeholder credentials from the example .env count as unconfigured
+PLACEHOLDERS = {'', 'your_account_sid', 'your_auth_token'}
+
+
+class SMSProviderError(Exception):
+    """The provider is unavailable (network error, timeout, 5xx, throttling); the next one is tried"""
+
+
+class SMSRejected(Exception):
+    """The provider refused this message (e.g. an invalid number); other providers would too"""
+
+
+def generate_code():
+    return f'{secrets.randbelow(10 ** 6):06d}'
+
+
+class CircuitBreaker:
+    """Skips a provider for ``reset_timeout`` seconds after ``threshold`` consecutive failures.
+
+    Once the timeout has passed one trial call is let through (half-open); its
+    success closes the breaker again and its failure reopens it.
+    """
+
+    def __init__(self, threshold, reset_timeout, clock=time.monotonic):
+        self.threshold = max(threshold, 1)
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half_open' if self.clock() - self.opened_at >= self.reset_timeout else 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.clock() - self.opened_at < self.reset_timeout or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+            self._trial = False
+
+
+class KeyedRateLimiter:
+    """A non-blocking ``TokenBucket`` per key (phone number, client IP).
+
+    Buckets live in this process and the least recently used ones are dropped
+    past ``max_keys``, so each web worker enforces the limit on its own.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        if not key or not self.rate:
+            return True
+        with self._lock:
+            bucket = self._buckets.pop(key, None) or TokenBucket(self.rate, self.burst)
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return bucket.try_acquire()
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class TwilioVerifyProvider:
+    """Twilio Verify over the REST API; Twilio generates and checks the code"""
+    name = 'twilio'
+    base_url = 'https://verify.twilio.com/v2/Services'
+
+    def configured(self):
+        sid = getattr(settings, 'TWILIO_ACCOUNT_SID', None) or ''
+        token = getattr(settings, 'TWILIO_AUTH_TOKEN', None) or ''
+        return sid not in PLACEHOLDERS and token not in PLACEHOLDERS and bool(
+            getattr(settings, 'TWILIO_VERIFY_SERVICE_SID', None)
+        )
+
+    def _post(self, session, timeout, path, data):
+        url = f'{self.base_url}/{settings.TWILIO_VERIFY_SERVICE_SID}/{path}'
+        auth = (settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+        try:
+            response = session.post(url, data=data, auth=auth, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise SMSProviderError(str(e)) from e
+        if response.status_code == 429 or response.status_code >= 500:
+            raise SMSProviderError(f'HTTP {response.status_code}')
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if response.status_code >= 400:
+            raise SMSRejected(body.get('message') or f'HTTP {response.status_code}')
+        return body
+
+    def send(self, session, timeout, phone_number):
+        body = self._post(session, timeout, 'Verifications', {'To': phone_number, 'Channel': 'sms'})
+        return {
+            'success': True,
+            'message': 'SMS sent successfully via Twilio',
+            'session_info': f"twilio_verify_{phone_number}_{body.get('sid', '')}",
+            'provider': 'twilio_verify',
+            'verification_sid': body.get('sid'),
+        }
+
+    def check(self, session, timeout, phone_number, code):
+        body = self._post(session, timeout, 'VerificationCheck', {'To': phone_number, 'Code': code})
+        return body.get('status') == 'approved'
+
+
+class VonageProvider:
+    """Vonage SMS API; the code is generated here and carried in the session info"""
+    name = 'vonage'
+    url = 'https://rest.nexmo.com/sms/json'
+    # Message statuses that mean Vonage itself is struggling (throttled, internal error)
+    RETRYABLE_STATUSES = {'1', '5'}
+
+    def configured(self):
+        return bool(getattr(settings, 'VONAGE_API_KEY', None) and getattr(settings, 'VONAGE_API_SECRET', None))
+
+    def send(self, session, timeout, phone_number):
+        code = generate_code()
+        try:
+            response = session.post(self.url, data={
+                'api_key': settings.VONAGE_API_KEY,
+                'api_secret': settings.VONAGE_API_SECRET,
+                'from': getattr(settings, 'VONAGE_SENDER', 'Neurolancer'),
+                'to': phone_number.lstrip('+'),
+                'text': f'Your Neurolancer verification code is: {code}',
+            }, timeout=timeout)
+            response.raise_for_status()
+            message = response.json()['messages'][0]
+        except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+            raise SMSProviderError(str(e)) from e
+        if message.get('status') != '0':
+            error = message.get('error-text', 'Unknown error')
+            if message.get('status') in self.RETRYABLE_STATUSES:
+                raise SMSProviderError(error)
+            raise SMSRejected(error)
+        return {
+            'success': True,
+            'message': 'SMS sent successfully via Vonage',
+            'session_info': f'vonage_session_{phone_number}_{code}',
+            'provider': 'vonage',
+            'message_id': message.get('message-id'),
+        }
+
+
+PROVIDERS = {provider.name: provider for provider in (TwilioVerifyProvider(), VonageProvider())}
+
+
+class SMSDispatcher:
+    """Sends verification SMS through the configured providers in ``SMS_PROVIDERS`` order.
+
+    All providers share one pooled ``requests.Session`` with short connect/read
+    timeouts, so a slow provider costs one timeout rather than stalling signup.
+    A provider that keeps failing is skipped by its circuit breaker until it
+    recovers, and the next provider is tried instead. Sends are limited per
+    phone number and per client IP (``SMS_PHONE_RATE_PER_HOUR`` /
+    ``SMS_IP_RATE_PER_HOUR`` with their bursts). With no provider configured
+    the code goes through ``SMSService._send_mock_sms`` (development and tests).
+    """
+
+    def __init__(self, providers=None):
+        self.providers = providers or [
+            PROVIDERS[name.strip()]
+            for name in getattr(settings, 'SMS_PROVIDERS', 'twilio,vonage').split(',')
+            if name.strip() in PROVIDERS
+        ]
+        self.timeout = (getattr(settings, 'SMS_CONNECT_TIMEOUT', 3.05), getattr(settings, 'SMS_READ_TIMEOUT', 5))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(PROVIDERS), pool_maxsize=getattr(settings, 'SMS_POOL_SIZE', 10))
+        self.session.mount('https://', adapter)
+        self.breakers = {
+            provider.name: CircuitBreaker(
+                getattr(settings, 'SMS_BREAKER_THRESHOLD', 3), getattr(settings, 'SMS_BREAKER_RESET_TIMEOUT', 60),
+            )
+            for provider in self.providers
+        }
+        self.phone_limiter = KeyedRateLimiter(
+            getattr(settings, 'SMS_PHONE_RATE_PER_HOUR', 5) / 3600, getattr(settings, 'SMS_PHONE_BURST', 3),
+        )
+        self.ip_limiter = KeyedRateLimiter(
+            getattr(settings, 'SMS_IP_RATE_PER_HOUR', 30) / 3600, getattr(settings, 'SMS_IP_BURST', 10),
+        )
+        self._metrics_lock = threading.Lock()
+        self.reset_metrics()
+
+    def send_verification_code(self, phone_number, ip_address=None):
+        """Send a code to ``phone_number``; returns the SMSService-style result dict.
+
+        A throttled request gets ``{'success': False, 'rate_limited': True}``
+        without reaching any provider.
+        """
+        if not self.phone_limiter.allow(phone_number) or not self.ip_limiter.allow(ip_address):
+            self._count('rate_limited')
+            logger.warning(f'SMS verification to {phone_number} from {ip_address} rate limited')
+            return {
+                'success': False,
+                'rate_limited': True,
+                'message': 'Too many verification codes requested. Please try again later.',
+            }
+
+        configured = [provider for provider in self.providers if provider.configured()]
+        if not configured:
+            logger.warning('No SMS provider configured, using mock SMS')
+            return SMSService._send_mock_sms(phone_number, generate_code())
+
+        for provider in configured:
+            breaker = self.breakers[provider.name]
+            if not breaker.allow():
+                self._count('skipped', provider.name)
+                continue
+            start = time.perf_counter()
+            try:
+                result = provider.send(self.session, self.timeout, phone_number)
+            except SMSRejected as e:
+                # The provider is healthy; the number or message is the problem
+                breaker.record_success()
+                self._count('rejected', provider.name, start)
+                logger.warning(f'SMS to {phone_number} rejected by {provider.name}: {e}')
+                return {'success': False, 'error': str(e), 'message': 'Failed to send SMS verification code'}
+            except SMSProviderError as e:
+                breaker.record_failure()
+                self._count('failed', provider.name, start)
+                logger.error(f'SMS provider {provider.name} failed for {phone_number}: {e}')
+                continue
+            breaker.record_success()
+            self._count('sent', provider.name, start)
+            return result
+
+        return {
+            'success': False,
+            'error': 'All SMS providers are unavailable',
+            'message': 'Failed to send SMS verification code',
+        }
+
+    def verify_code(self, session_info, code):
+        """Check ``code`` against a session from ``send_verification_code``; returns a result dict"""
+        if not session_info or not code:
+            return {'success': False, 'verified': False, 'message': 'Session info and verification code required'}
+        parts = session_info.split('_')
+        verified = False
+        if session_info.startswith('twilio_verify_') and len(parts) > 2:
+            try:
+                verified = PROVIDERS['twilio'].check(self.session, self.timeout, parts[2], code)
+            except (SMSProviderError, SMSRejected) as e:
+                logger.error(f'Twilio Verify check failed: {e}')
+                return {'success': False, 'verified': False, 'error': str(e), 'message': 'Verification failed'}
+        elif session_info.startswith(('mock_session_', 'vonage_session_', 'firebase_session_')) and len(parts) >= 4:
+            verified = hmac.compare_digest(parts[-1], str(code))
+        if verified:
+            return {'success': True, 'verified': True, 'message': 'Phone number verified successfully'}
+        return {'success': False, 'verified': False, 'message': 'Invalid verification code'}
+
+    # Metrics
+
+    def _count(self, outcome, provider='all', start=None):
+        with self._metrics_lock:
+            data = self._metrics.setdefault(provider, {'latency': LatencyHistogram()})
+            data[outcome] = data.get(outcome, 0) + 1
+            if start is not None:
+                data['latency'].record((time.perf_counter() - start) * 1000)
+
+    def metrics(self):
+        with self._metrics_lock:
+            return {
+                provider: {
+                    **{key: value for key, value in data.items() if key != 'latency'},
+                    'breaker': self.breakers[provider].state if provider in self.breakers else None,
+                    'latency_ms': {
+                        'p50': round(data['latency'].percentile(0.50), 2),
+                        'p95': round(data['latency'].percentile(0.95), 2),
+                        'max': round(data['latency'].max, 2),
+                    },
+                }
+                for provider, data in self._metrics.items()
+            }
+
+    def reset_metrics(self):
+        with self._metrics_lock:
+            self._metrics = {}
+
+
+sms_dispatcher = SMSDispatcher()
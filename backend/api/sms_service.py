@@ -1,41 +1,27 @@
-import os
-import random
-import string
-from django.conf import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
 class SMSService:
-    """Real SMS service using Twilio"""
+    """Phone verification codes over SMS; provider choice and throttling live in sms_dispatcher"""
     
     @classmethod
-    def send_verification_code(cls, phone_number: str) -> dict:
+    def send_verification_code(cls, phone_number: str, ip_address: str = None) -> dict:
         """
-        Send SMS verification code using Twilio
+        Send SMS verification code through the SMS dispatcher (provider failover,
+        circuit breakers and per-number/per-IP rate limits)
         
         Args:
             phone_number (str): Phone number in E.164 format
+            ip_address (str): Requesting client's IP, for rate limiting
             
         Returns:
-            dict: Response with success status and verification code
+            dict: Response with success status and session info
         """
+        from .sms_dispatcher import sms_dispatcher
+        
         try:
-            # Get Twilio credentials from settings
-            twilio_sid = getattr(settings, 'TWILIO_ACCOUNT_SID', None)
-            twilio_token = getattr(settings, 'TWILIO_AUTH_TOKEN', None)
-            
-            logger.info(f"Twilio SID configured: {bool(twilio_sid)}")
-            logger.info(f"Twilio Token configured: {bool(twilio_token)}")
-            
-            if twilio_sid and twilio_token and twilio_sid != 'your_account_sid' and twilio_token != 'your_auth_token':
-                return cls._send_twilio_sms(phone_number, twilio_sid, twilio_token)
-            else:
-                # Fallback to mock for development
-                logger.warning("Twilio credentials not properly configured, using mock SMS")
-                verification_code = ''.join(random.choices(string.digits, k=6))
-                return cls._send_mock_sms(phone_number, verification_code)
-                
+            return sms_dispatcher.send_verification_code(phone_number, ip_address)
         except Exception as e:
             logger.error(f"SMS service error: {e}")
             return {
@@ -44,48 +30,6 @@ class SMSService:
                 'message': 'Failed to send SMS verification code'
             }
     
-    @classmethod
-    def _send_twilio_sms(cls, phone_number: str, sid: str, token: str) -> dict:
-        """Send SMS using Twilio Verify API"""
-        try:
-            from twilio.rest import Client
-            from twilio.base.exceptions import TwilioRestException
-            
-            client = Client(sid, token)
-            
-            # Use Twilio Verify service
-            verify_service_sid = getattr(settings, 'TWILIO_VERIFY_SERVICE_SID', 'VAff7eb489cf64e2df684b828bc8a1a2e3')
-            
-            logger.info(f"Attempting to send SMS to {phone_number} using Verify Service {verify_service_sid}")
-            
-            verification = client.verify.v2.services(verify_service_sid).verifications.create(
-                to=phone_number,
-                channel='sms'
-            )
-            
-            logger.info(f"Twilio Verify SMS sent to {phone_number}, Status: {verification.status}, SID: {verification.sid}")
-            
-            return {
-                'success': True,
-                'message': 'SMS sent successfully via Twilio',
-                'session_info': f'twilio_verify_{phone_number}_{verification.sid}',
-                'provider': 'twilio_verify',
-                'verification_sid': verification.sid
-            }
-            
-        except ImportError:
-            logger.error("Twilio library not installed. Install with: pip install twilio")
-            verification_code = ''.join(random.choices(string.digits, k=6))
-            return cls._send_mock_sms(phone_number, verification_code)
-        except TwilioRestException as e:
-            logger.error(f"Twilio API error: {e.msg} (Code: {e.code})")
-            verification_code = ''.join(random.choices(string.digits, k=6))
-            return cls._send_mock_sms(phone_number, verification_code)
-        except Exception as e:
-            logger.error(f"Twilio Verify failed: {e}")
-            verification_code = ''.join(random.choices(string.digits, k=6))
-            return cls._send_mock_sms(phone_number, verification_code)
-    
     @classmethod
     def _send_mock_sms(cls, phone_number: str, code: str) -> dict:
         """Mock SMS for development/testing"""
@@ -112,29 +56,10 @@ class SMSService:
         Returns:
             dict: Verification result
         """
+        from .sms_dispatcher import sms_dispatcher
+        
         try:
-            # Handle Twilio Verify
-            if session_info.startswith('twilio_verify_'):
-                return cls._verify_twilio_code(session_info, provided_code)
-            
-            # Handle mock sessions
-            elif session_info.startswith('mock_session_'):
-                parts = session_info.split('_')
-                if len(parts) >= 4:
-                    original_code = parts[-1]
-                    if original_code == provided_code:
-                        return {
-                            'success': True,
-                            'message': 'Phone number verified successfully',
-                            'verified': True
-                        }
-            
-            return {
-                'success': False,
-                'message': 'Invalid verification code',
-                'verified': False
-            }
-            
+            return sms_dispatcher.verify_code(session_info, provided_code)
         except Exception as e:
             logger.error(f"Code verification error: {e}")
             return {
@@ -142,62 +67,3 @@ class SMSService:
                 'error': str(e),
                 'message': 'Verification failed'
             }
-    
-    @classmethod
-    def _verify_twilio_code(cls, session_info: str, code: str) -> dict:
-        """Verify code using Twilio Verify API"""
-        try:
-            from twilio.rest import Client
-            
-            # Extract phone number from session info
-            parts = session_info.split('_')
-            phone_number = parts[2] if len(parts) > 2 else None
-            
-            if not phone_number:
-                return {
-                    'success': False,
-                    'message': 'Invalid session info',
-                    'verified': False
-                }
-            
-            # Get Twilio credentials
-            sid = getattr(settings, 'TWILIO_ACCOUNT_SID', None)
-            token = getattr(settings, 'TWILIO_AUTH_TOKEN', None)
-            verify_service_sid = getattr(settings, 'TWILIO_VERIFY_SERVICE_SID', 'VAff7eb489cf64e2df684b828bc8a1a2e3')
-            
-            if not sid or not token:
-                return {
-                    'success': False,
-                    'message': 'Twilio credentials not configured',
-                    'verified': False
-                }
-            
-            client = Client(sid, token)
-            
-            verification_check = client.verify.v2.services(verify_service_sid).verification_checks.create(
-                to=phone_number,
-                code=code
-            )
-            
-            if verification_check.status == 'approved':
-                logger.info(f"Twilio Verify successful for {phone_number}")
-                return {
-                    'success': True,
-                    'message': 'Phone number verified successfully',
-                    'verified': True
-                }
-            else:
-                logger.warning(f"Twilio Verify failed for {phone_number}: {verification_check.status}")
-                return {
-                    'success': False,
-                    'message': 'Invalid verification code',
-                    'verified': False
-                }
-                
-        except Exception as e:
-            logger.error(f"Twilio Verify error: {e}")
-            return {
-                'success': False,
-                'error': str(e),
-                'message': 'Verification failed'
-            }
\ No newline at end of file
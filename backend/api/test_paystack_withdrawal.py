@@ -2,6 +2,7 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from .balance_service import BalanceService
 from .models import UserProfile, Withdrawal
 from decimal import Decimal
 import logging
@@ -36,8 +37,7 @@ def test_paystack_withdraw(request):
         mock_transfer_code = f'TRF_{mock_reference}'
         
         # Deduct from available balance
-        user_profile.available_balance -= Decimal(str(amount))
-        user_profile.save()
+        BalanceService.debit(request.user, Decimal(str(amount)), entry_type='withdrawal', reference=mock_reference)
         
         # Create withdrawal record
         withdrawal = Withdrawal.objects.create(
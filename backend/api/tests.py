@@ -1,3 +1,2374 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from io import StringIO
+from unittest import mock
+
+import requests
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from . import (
+    bank_directory, email_outbox, fees, ledger, newsletter_sender, notification_digest, notification_fanout,
+    notification_retention, payouts, recipient_registry, webhook_inbox,
+)
+from .balance_service import BalanceService, InsufficientFunds
+from .cache_utils import StaleWhileRevalidateCache
+from .currency import CurrencyService, currency_service
+from .mail_dispatcher import MailDispatcher, TokenBucket
+from .models import LedgerAccount, LedgerEntry, LedgerPosting, PaystackWebhookEvent, UserProfile
+from .paystack_client import PaystackClient
+from .sms_dispatcher import CircuitBreaker, SMSDispatcher, SMSProviderError, sms_dispatcher
+from .sms_service import SMSService
+
+
+class ViewCounterTests(SimpleTestCase):
+    """Coalesced view counts are flushed by a timer even when no further views arrive"""
+
+    def test_timer_flushes_without_a_later_increment(self):
+        from .analytics_service import ViewCounter
+
+        written = []
+        flushed = threading.Event()
+
+        def apply(user_id, deltas):
+            written.append((user_id, deltas))
+            flushed.set()
+            return 1
+
+        counter = ViewCounter(flush_interval=0.05)
+        with mock.patch.object(ViewCounter, '_apply', side_effect=apply):
+            counter.increment(7, 'gig_views')
+            counter.increment(7, 'gig_views')
+            counter.increment(7, 'profile_views')
+            self.assertTrue(flushed.wait(5))
+        self.assertEqual(written, [(7, {'gig_views': 2, 'profile_views': 1})])
+        self.assertEqual(counter.pending(), {})
+
+    def test_failed_flush_keeps_deltas_and_rearms(self):
+        from .analytics_service import ViewCounter
+
+        counter = ViewCounter(flush_interval=60)
+        with mock.patch.object(ViewCounter, '_apply', side_effect=OperationalError('locked')):
+            counter.increment(3, 'profile_views')
+            self.assertEqual(counter.flush(), 0)
+        self.assertEqual(counter.pending(), {(3, 'profile_views'): 1})
+        self.assertIsNotNone(counter._timer)
+        counter._timer.cancel()
+
+    def test_flush_failure_at_exit_is_logged(self):
+        from .analytics_service import _flush_quietly
+
+        counter = mock.Mock(flush=mock.Mock(side_effect=OperationalError('locked')))
+        with self.assertLogs('api.analytics_service', 'ERROR') as logs:
+            _flush_quietly(counter)
+        self.assertIn('locked', logs.output[0])
+
+
+class ResponseTimeTests(TestCase):
+    """Reply delays fold into an exact running sum, so the mean doesn't drift with truncation"""
+
+    def test_mean_response_time_is_exact(self):
+        from datetime import timedelta
+        from django.contrib.auth.models import User
+        from django.utils import timezone
+        from .analytics_service import AnalyticsService
+        from .models import Conversation, Message, UserAnalytics
+
+        client = User.objects.create_user(username='rt_client', password='x')
+        freelancer = User.objects.create_user(username='rt_freelancer', password='x')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(client, freelancer)
+        start = timezone.now() - timedelta(hours=1)
+
+        # Replies after 1, 2 and 3 minutes: a truncating running mean would give 1, the true mean is 2
+        offset = 0
+        for delay in (1, 2, 3):
+            for sender, minutes in ((client, offset), (freelancer, offset + delay)):
+                message = Message.objects.create(conversation=conversation, sender=sender, content='hi')
+                Message.objects.filter(pk=message.pk).update(created_at=start + timedelta(minutes=minutes))
+                message.refresh_from_db()
+                AnalyticsService.record_message_response(message)
+            offset += delay + 1
+
+        analytics = UserAnalytics.objects.get(user=freelancer)
+        self.assertEqual(
+            (analytics.response_samples, analytics.response_minutes_total, analytics.response_time), (3, 6, 2),
+        )
+
+
+class AnalyticsProjectionTests(TestCase):
+    """UserAnalytics order totals move with order events, and ?refresh=1 rebuilds them"""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import Category, Gig
+
+        self.client_user = User.objects.create_user(username='proj_client', password='x')
+        self.freelancer = User.objects.create_user(username='proj_freelancer', password='x')
+        self.category = Category.objects.create(name='Projection Category')
+        self.gig = Gig.objects.create(
+            freelancer=self.freelancer, category=self.category, title='Gig', description='d',
+            basic_title='Basic', basic_description='d', basic_price=100, basic_delivery_time=3,
+        )
+
+    def _order(self, price, title='Order', status='pending'):
+        from .analytics_service import AnalyticsService
+        from .models import Order
+
+        order = Order.objects.create(
+            client=self.client_user, freelancer=self.freelancer, gig=self.gig, package_type='basic',
+            title=title, price=price, status=status,
+        )
+        AnalyticsService.record_order_created(order)
+        return order
+
+    def _totals(self, user):
+        from .models import UserAnalytics
+
+        analytics = UserAnalytics.objects.get(user=user)
+        return analytics.total_orders, analytics.total_earnings, analytics.total_spent
+
+    def test_deltas_follow_order_events(self):
+        from .analytics_service import AnalyticsService
+
+        first = self._order(Decimal('100.00'))
+        self._order(Decimal('40.00'))
+        self.assertEqual(self._totals(self.freelancer), (2, Decimal('0'), Decimal('0')))
+
+        AnalyticsService.record_order_transition(first, 'delivered', 'completed')
+        self.assertEqual(self._totals(self.freelancer), (2, Decimal('100.00'), Decimal('0')))
+        self.assertEqual(self._totals(self.client_user), (2, Decimal('0'), Decimal('100.00')))
+
+        # Leaving 'completed' reverses the amount; unrelated transitions change nothing
+        AnalyticsService.record_order_transition(first, 'completed', 'disputed')
+        AnalyticsService.record_order_transition(first, 'pending', 'accepted')
+        self.assertEqual(self._totals(self.freelancer), (2, Decimal('0'), Decimal('0')))
+
+    def test_refresh_rebuilds_from_orders(self):
+        from rest_framework.test import force_authenticate
+        from .models import Order, UserAnalytics
+        from .views import user_analytics
+
+        order = self._order(Decimal('75.00'))
+        # A write that bypassed the projection
+        Order.objects.filter(pk=order.pk).update(status='completed')
+        factory = APIRequestFactory()
+
+        request = factory.get('/api/analytics/user/')
+        force_authenticate(request, user=self.freelancer)
+        self.assertEqual(Decimal(str(user_analytics(request).data['total_earnings'])), Decimal('0'))
+
+        request = factory.get('/api/analytics/user/', {'refresh': '1'})
+        force_authenticate(request, user=self.freelancer)
+        self.assertEqual(Decimal(str(user_analytics(request).data['total_earnings'])), Decimal('75.00'))
+        self.assertEqual(UserAnalytics.objects.get(user=self.freelancer).total_earnings, Decimal('75.00'))
+
+    def test_bulk_job_completion_updates_projection(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from rest_framework.test import force_authenticate
+        from .models import Job, Order
+        from .views import update_job_status
+
+        job = Job.objects.create(
+            client=self.client_user, title='Logo design', description='d', category=self.category,
+            budget_min=10, budget_max=100, deadline=timezone.now() + timedelta(days=7), skills_required='design',
+        )
+        self._order(Decimal('60.00'), title='Logo design', status='in_progress')
+        self._order(Decimal('30.00'), title='Logo design revisions', status='delivered')
+
+        request = APIRequestFactory().post(f'/api/jobs/{job.id}/update-status/', {'status': 'completed'}, format='json')
+        force_authenticate(request, user=self.client_user)
+        self.assertEqual(update_job_status(request, job.id).status_code, 200)
+
+        self.assertEqual(Order.objects.filter(status='completed').count(), 2)
+        self.assertEqual(self._totals(self.freelancer), (2, Decimal('90.00'), Decimal('0')))
+        self.assertEqual(self._totals(self.client_user), (2, Decimal('0'), Decimal('90.00')))
+
+
+class StreamingExportTests(TestCase):
+    """Admin exports honour the list view's filters and stream CSV or JSONL"""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.admin = User.objects.create_user(username='exporting_staff', password='x', is_staff=True)
+        for name, active in (('export_alice', True), ('export_bob', True), ('export_carol', False)):
+            user = User.objects.create_user(username=name, email=f'{name}@example.com', password='x', is_active=active)
+            UserProfile.objects.create(user=user, user_type='freelancer')
+        self.factory = APIRequestFactory()
+
+    def _export(self, **params):
+        from rest_framework.test import force_authenticate
+        from .views import AdminUserExportView
+
+        request = self.factory.get('/api/admin/users/export/', params)
+        force_authenticate(request, user=self.admin)
+        return AdminUserExportView.as_view()(request)
+
+    def test_csv_applies_filters_and_search(self):
+        import csv
+
+        response = self._export(is_active='true', search='export_', ordering='date_joined')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertRegex(response['Content-Disposition'], r'attachment; filename="users_\d{14}\.csv"')
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['username'] for row in rows], ['export_alice', 'export_bob'])
+        self.assertEqual(rows[0]['userprofile__user_type'], 'freelancer')
+        self.assertEqual(rows[0]['email'], 'export_alice@example.com')
+
+    @override_settings(EXPORT_CHUNK_SIZE=1)
+    def test_jsonl_streams_one_document_per_row(self):
+        response = self._export(export_format='jsonl', search='export_carol')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 1)
+        row = json.loads(chunks[0])
+        self.assertEqual((row['username'], row['is_active']), ('export_carol', False))
+        # Dates are serialised as ISO strings
+        self.assertIn('T', row['date_joined'])
+
+    def test_rows_are_read_lazily_with_an_iterator(self):
+        from .views import AdminUserExportView
+
+        view = AdminUserExportView()
+        view.request = mock.Mock(query_params={})
+        with mock.patch.object(AdminUserExportView, 'filter_queryset', side_effect=lambda qs: qs):
+            rows = view.get_export_queryset()
+        self.assertFalse(isinstance(rows, (list, tuple)))
+        self.assertTrue(hasattr(rows, '__next__'))
+
+    def test_unsupported_format_is_rejected(self):
+        response = self._export(export_format='xlsx')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('xlsx', response.data['error'])
+
+
+class ProfilingTests(TestCase):
+    """Latency percentiles, the slow-request log and the admin profiling endpoint"""
+
+    def test_histogram_percentiles_within_one_bucket(self):
+        from .profiling import LatencyHistogram
+
+        histogram = LatencyHistogram()
+        for value in range(1, 101):
+            histogram.record(float(value))
+        self.assertEqual(histogram.total, 100)
+        self.assertAlmostEqual(histogram.mean, 50.5)
+        self.assertEqual(histogram.max, 100.0)
+        for fraction, exact in ((0.5, 50), (0.95, 95), (0.99, 99)):
+            self.assertGreaterEqual(histogram.percentile(fraction), exact)
+            self.assertLessEqual(histogram.percentile(fraction), exact * LatencyHistogram.GROWTH)
+        self.assertEqual(histogram.percentile(1.0), 100.0)
+        self.assertEqual(LatencyHistogram().percentile(0.5), 0.0)
+
+    def _run(self, slow_ms, sleep_ms=0):
+        from django.contrib.auth.models import Group, User
+        from django.http import HttpResponse
+        from .middleware import ProfilingMiddleware
+        from .profiling import registry
+
+        def view(request):
+            User.objects.exists()
+            time.sleep(sleep_ms / 1000)
+            Group.objects.exists()
+            return HttpResponse(b'hello')
+
+        registry.reset()
+        with self.settings(PROFILING_ENABLED=True, PROFILING_SLOW_REQUEST_MS=slow_ms, PROFILING_CAPTURE_SQL=20):
+            middleware = ProfilingMiddleware(view)
+        middleware(APIRequestFactory().get('/api/things/'))
+        return registry.snapshot()
+
+    def test_fast_requests_record_timings_without_sql(self):
+        snapshot = self._run(slow_ms=10000)
+        stats = snapshot['endpoints']['GET <unmatched>']
+        self.assertEqual((stats['requests'], stats['queries_per_request'], stats['bytes_per_request']), (1, 2.0, 5))
+        self.assertEqual(snapshot['slow_requests'], [])
+
+    def test_slow_requests_keep_sql_captured_after_the_threshold(self):
+        snapshot = self._run(slow_ms=20, sleep_ms=40)
+        [entry] = snapshot['slow_requests']
+        self.assertEqual(entry['queries'], 2)
+        # Only the query that ran once the request was already slow is captured...
+        self.assertEqual(len(entry['sql']), 1)
+        self.assertIn('auth_group', entry['sql'][0]['sql'])
+        # ...while the slowest query is always named
+        self.assertIsNotNone(entry['slowest_query'])
+
+    def test_recorder_skips_sql_text_before_threshold(self):
+        from .profiling import QueryRecorder
+
+        recorder = QueryRecorder(capture_sql=5, capture_after_ms=10000)
+        for sql in ('SELECT 1', 'SELECT 2'):
+            recorder(lambda *args: None, sql, None, False, {})
+        self.assertEqual((recorder.count, recorder.statements), (2, []))
+        self.assertIn(recorder.slowest_statement()['sql'], ('SELECT 1', 'SELECT 2'))
+
+    def test_admin_endpoint_serves_and_resets_stats(self):
+        from django.contrib.auth.models import User
+        from rest_framework.test import force_authenticate
+        from .profiling import registry
+        from .views import profiling_stats
+
+        admin = User.objects.create_user(username='profiling_admin', password='x', is_staff=True)
+        registry.reset()
+        registry.record('GET /api/x', 12.0, 200, mock.Mock(count=3, duration=4.0), 100)
+        factory = APIRequestFactory()
+
+        with self.settings(PROFILING_ENABLED=True):
+            request = factory.get('/api/admin/profiling/')
+            force_authenticate(request, user=admin)
+            data = profiling_stats(request).data
+            self.assertEqual(data['endpoints']['GET /api/x']['requests'], 1)
+            self.assertIn('mail', data)
+
+            request = factory.delete('/api/admin/profiling/')
+            force_authenticate(request, user=admin)
+            profiling_stats(request)
+        self.assertEqual(registry.snapshot()['endpoints'], {})
+
+        request = factory.get('/api/admin/profiling/')
+        force_authenticate(request, user=User.objects.create_user(username='not_admin', password='x'))
+        self.assertEqual(profiling_stats(request).status_code, 403)
+
+
+class LogUtilsTests(SimpleTestCase):
+    """Structured debug events are sampled and only formatted when emitted"""
+
+    def setUp(self):
+        import logging
+
+        self.logger = logging.getLogger('api.tests.log_utils')
+        self.logger.propagate = False
+        self.addCleanup(setattr, self.logger, 'propagate', True)
+
+    def test_disabled_level_skips_formatting(self):
+        import logging
+        from .log_utils import debug_event
+
+        expensive = mock.Mock(return_value=3)
+        self.logger.setLevel(logging.INFO)
+        with mock.patch.object(self.logger, 'log') as log:
+            debug_event(self.logger, 'orders.list', count=expensive)
+        log.assert_not_called()
+        expensive.assert_not_called()
+
+    @override_settings(LOG_SAMPLE_RATE=0.25)
+    def test_debug_events_are_sampled(self):
+        import logging
+        from .log_utils import debug_event, log_event
+
+        self.logger.setLevel(logging.DEBUG)
+        with mock.patch.object(self.logger, 'log') as log, \
+                mock.patch('api.log_utils.random.random', side_effect=[0.1, 0.9, 0.2, 0.3]):
+            for _ in range(4):
+                debug_event(self.logger, 'orders.list')
+            self.assertEqual(log.call_count, 2)
+            # Events above DEBUG are never sampled out
+            log_event(self.logger, logging.WARNING, 'orders.failed')
+            self.assertEqual(log.call_count, 3)
+
+    def test_fields_render_lazily_as_key_value_pairs(self):
+        import logging
+        from .log_utils import StructuredMessage, debug_event
+
+        calls = []
+        self.logger.setLevel(logging.DEBUG)
+        with self.assertLogs(self.logger, level='DEBUG') as logs:
+            debug_event(self.logger, 'messages.list', user_id=5, count=lambda: calls.append(1) or 12, sample_rate=1.0)
+        self.assertEqual(logs.output, ['DEBUG:api.tests.log_utils:messages.list user_id=5 count=12'])
+        self.assertEqual(logs.records[0].event, 'messages.list')
+
+        message = StructuredMessage('x', {'value': lambda: calls.append(1) or 1})
+        calls.clear()
+        self.assertEqual(calls, [])
+        self.assertEqual(str(message), 'x value=1')
+        self.assertEqual(calls, [1])
+
+
+class _StubPaystackHandler(BaseHTTPRequestHandler):
+    """Minimal Paystack stand-in; behaviour is driven by ``server.routes``"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        path = self.path.split('?')[0]
+        self.server.calls.append((self.command, path, body, self.client_address[1], self.headers.get('Authorization')))
+
+        route = self.server.routes.get((self.command, path), (200, {'status': True, 'data': {}}))
+        if callable(route):
+            route = route(self.server)
+        status_code, payload = route[:2]
+        delay = route[2] if len(route) > 2 else 0
+        if delay:
+            time.sleep(delay)
+
+        content = json.dumps(payload).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = _dispatch
+    do_POST = _dispatch
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Timeout tests hang up on purpose; the resulting broken pipes are expected
+        pass
+
+
+class StubPaystackServer:
+    def __init__(self):
+        self.httpd = _QuietHTTPServer(('127.0.0.1', 0), _StubPaystackHandler)
+        self.httpd.routes = {}
+        self.httpd.calls = []
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+    @property
+    def routes(self):
+        return self.httpd.routes
+
+    @property
+    def calls(self):
+        return self.httpd.calls
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class PaystackClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = StubPaystackServer().start()
+        self.addCleanup(self.server.stop)
+        self.client = PaystackClient(
+            base_url=self.server.url, secret_key='sk_stub', connect_timeout=1, read_timeout=0.5,
+            max_retries=2, backoff=0,
+        )
+        self.addCleanup(self.client.session.close)
+
+    def test_reuses_keep_alive_connection(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get('/bank').status_code, 200)
+        client_ports = {call[3] for call in self.server.calls}
+        self.assertEqual(len(self.server.calls), 5)
+        self.assertEqual(len(client_ports), 1)
+
+    def test_sends_bearer_key(self):
+        self.client.get('/bank')
+        self.client.get('/bank', secret_key='sk_override')
+        self.assertEqual([call[4] for call in self.server.calls], ['Bearer sk_stub', 'Bearer sk_override'])
+
+    def test_retries_idempotent_get_on_server_error(self):
+        def flaky(server):
+            attempts = sum(1 for call in server.calls if call[1] == '/transaction/verify/ref1')
+            return (503, {'status': False}) if attempts < 3 else (200, {'status': True, 'data': {'status': 'success'}})
+
+        self.server.routes[('GET', '/transaction/verify/ref1')] = flaky
+        data = self.client.request_json('GET', '/transaction/verify/ref1')
+        self.assertEqual(data['data']['status'], 'success')
+        self.assertEqual(len(self.server.calls), 3)
+
+    def test_gives_up_after_max_retries(self):
+        self.server.routes[('GET', '/bank')] = (503, {'status': False})
+        response = self.client.get('/bank')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.server.calls), 3)
+        self.assertIsNone(self.client.request_json('GET', '/bank'))
+
+    def test_does_not_retry_transfer(self):
+        self.server.routes[('POST', '/transfer')] = (502, {'status': False})
+        response = self.client.post('/transfer', json={'amount': 100})
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(len(self.server.calls), 1)
+
+    def test_retries_post_marked_idempotent(self):
+        self.server.routes[('POST', '/transaction/initialize')] = lambda server: (
+            (500, {}) if len(server.calls) == 1 else (200, {'status': True})
+        )
+        response = self.client.post('/transaction/initialize', json={'reference': 'r'}, idempotent=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.calls), 2)
+
+    def test_read_timeout_raises(self):
+        self.server.routes[('POST', '/transfer')] = (200, {'status': True}, 1.5)
+        started = time.perf_counter()
+        with self.assertRaises(requests.Timeout):
+            self.client.post('/transfer', json={})
+        self.assertLess(time.perf_counter() - started, 1.5)
+        self.assertIsNone(self.client.request_json('POST', '/transfer', json={}))
+
+    def test_records_endpoint_metrics(self):
+        self.server.routes[('GET', '/transaction/verify/a')] = (503, {})
+        self.client.get('/transaction/verify/a')
+        self.client.get('/transaction/verify/b')
+        metrics = self.client.metrics()
+        verify = metrics['GET /transaction/verify']
+        self.assertEqual(verify['requests'], 4)
+        self.assertEqual(verify['errors'], 3)
+        self.assertEqual(verify['retries'], 2)
+        self.assertGreater(verify['latency_ms']['max'], 0)
+
+        self.client.reset_metrics()
+        self.assertEqual(self.client.metrics(), {})
+
+
+class PaystackIntegrationStubTests(TestCase):
+    """The payment modules talk to the stub through the shared client"""
+
+    def setUp(self):
+        self.server = StubPaystackServer().start()
+        self.addCleanup(self.server.stop)
+        self.client = PaystackClient(base_url=self.server.url, secret_key='sk_stub', read_timeout=0.5, backoff=0)
+        self.addCleanup(self.client.session.close)
+
+    def test_payments_api_initialize_and_verify(self):
+        from .payments import PaystackAPI
+
+        self.server.routes[('POST', '/transaction/initialize')] = (
+            200, {'status': True, 'data': {'authorization_url': 'https://pay', 'reference': 'ref'}},
+        )
+        self.server.routes[('GET', '/transaction/verify/ref')] = (
+            200, {'status': True, 'data': {'status': 'success', 'amount': 1000}},
+        )
+        api = PaystackAPI()
+        api.client = self.client
+
+        init = api.initialize_transaction('a@b.com', 10, 'ref')
+        self.assertEqual(init['data']['authorization_url'], 'https://pay')
+        self.assertEqual(api.verify_transaction('ref')['data']['status'], 'success')
+
+    def test_utils_returns_failed_status_when_unreachable(self):
+        from .paystack_utils import PaystackAPI
+
+        self.server.routes[('GET', '/bank/resolve')] = (200, {'status': True}, 1.5)
+        api = PaystackAPI()
+        api.client = self.client
+        result = api.resolve_account('0123', '01')
+        self.assertFalse(result['status'])
+
+
+class StaleWhileRevalidateCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.swr = StaleWhileRevalidateCache('test_swr', ttl=60, stale_ttl=600)
+        self.loads = []
+
+    def loader(self, value):
+        def load():
+            self.loads.append(value)
+            return value
+        return load
+
+    def test_cold_key_loads_once_then_hits(self):
+        self.assertEqual(self.swr.get('k', self.loader('a')), 'a')
+        self.assertEqual(self.swr.get('k', self.loader('b')), 'a')
+        self.assertEqual(self.loads, ['a'])
+
+    def test_stale_value_served_while_refreshing(self):
+        self.swr.get('k', self.loader('old'))
+        with mock.patch('api.cache_utils.time.time', return_value=time.time() + 120):
+            self.assertEqual(self.swr.get('k', self.loader('new')), 'old')
+            self.swr._refreshing.get('k') and self.swr._refreshing['k'].join(2)
+        self.assertEqual(self.swr.get('k', self.loader('unused')), 'new')
+        self.assertEqual(self.loads, ['old', 'new'])
+
+    def test_failed_refresh_keeps_cached_value(self):
+        self.swr.get('k', self.loader('good'))
+
+        def broken():
+            raise requests.ConnectionError('down')
+
+        self.assertEqual(self.swr.refresh('k', broken), 'good')
+        self.assertEqual(self.swr.refresh('k', lambda: None), 'good')
+        self.assertIsNone(self.swr.get('cold', lambda: None))
+
+
+class BankDirectoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.server = StubPaystackServer().start()
+        self.addCleanup(self.server.stop)
+        self.server.routes[('GET', '/bank')] = (200, {'status': True, 'data': [{'name': 'Stub Bank', 'code': '01'}]})
+        client = PaystackClient(base_url=self.server.url, secret_key='sk_stub', read_timeout=0.5, backoff=0)
+        self.addCleanup(client.session.close)
+        patcher = mock.patch.object(bank_directory, 'paystack_client', client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_banks_endpoints_hit_paystack_once(self):
+        from . import paystack_withdrawal
+
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/payments/banks/').status_code, 200)
+        request = APIRequestFactory().get('/banks/')
+        self.assertEqual(paystack_withdrawal.get_paystack_banks(request).data['data'][0]['code'], '01')
+        self.assertEqual(len(self.server.calls), 1)
+
+        response = self.client.get('/api/payments/mobile-money/')
+        self.assertEqual(response.json()['data'], bank_directory.MOBILE_MONEY_PROVIDERS)
+
+    def test_warm_command_populates_cache(self):
+        out = StringIO()
+        call_command('warm_bank_lists', stdout=out)
+        self.assertIn('kenya: cached 1 banks', out.getvalue())
+
+        from .paystack_withdrawal import PaystackWithdrawal
+        self.assertEqual(PaystackWithdrawal().list_banks()['data'][0]['code'], '01')
+        self.assertEqual(len(self.server.calls), 1)
+
+
+class CurrencyServiceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.server = StubPaystackServer().start()
+        self.addCleanup(self.server.stop)
+        self.server.routes[('GET', '/latest/USD')] = (200, {'base': 'USD', 'rates': {'USD': 1, 'KES': 129.5, 'EUR': 0.92}})
+
+    def make_service(self, **kwargs):
+        return CurrencyService(api_url=f'{self.server.url}/latest/USD', ttl=3600, timeout=(1, 1), **kwargs)
+
+    def test_fallback_served_without_io(self):
+        service = self.make_service()
+        with mock.patch.object(service, 'refresh_in_background') as refresh:
+            self.assertEqual(service.rate('USD', 'KES'), Decimal('130'))
+            refresh.assert_called_once()
+        self.assertEqual(self.server.calls, [])
+
+    def test_refresh_updates_table_and_shared_snapshot(self):
+        service = self.make_service()
+        self.assertTrue(service.refresh())
+        self.assertEqual(service.rate('USD', 'KES'), Decimal('129.5'))
+        self.assertEqual(service.convert(Decimal('2'), 'USD', 'KES'), Decimal('259.0'))
+        self.assertEqual(service.convert_many([1, 2, None]), [Decimal('129.5'), Decimal('259.0'), Decimal('0')])
+        self.assertEqual(service.rate('KES', 'USD'), Decimal('0.00772201'))
+
+        other = self.make_service()
+        self.assertTrue(other.refresh())
+        self.assertEqual(other.rate('EUR', 'KES'), Decimal('140.76086957'))
+        self.assertEqual(len(self.server.calls), 1)
+
+    def test_failed_fetch_keeps_current_rates(self):
+        self.server.routes[('GET', '/latest/USD')] = (500, {})
+        service = self.make_service()
+        self.assertFalse(service.refresh())
+        self.assertEqual(service.rate('USD', 'KES'), Decimal('130'))
+        self.assertGreater(service._refresh_after, time.time())
+
+    def test_unknown_currency(self):
+        with self.assertRaises(ValueError):
+            self.make_service().rate('USD', 'XYZ')
+
+    def test_profile_list_serializer_looks_up_rate_once(self):
+        from django.contrib.auth.models import User
+        from .models import UserProfile
+        from .serializers import UserProfileSerializer
+
+        profiles = [
+            UserProfile.objects.create(
+                user=User.objects.create_user(username=f'fx{i}', password='x'),
+                available_balance=Decimal('10.00'), total_earnings=Decimal('20.00'),
+            )
+            for i in range(3)
+        ]
+        with mock.patch.object(currency_service, 'rate', return_value=Decimal('100')) as rate:
+            data = UserProfileSerializer(profiles, many=True, context={}).data
+        self.assertEqual(rate.call_count, 1)
+        self.assertEqual([row['available_balance_kes'] for row in data], [1000.0] * 3)
+        self.assertEqual(data[0]['total_earnings_kes'], 2000.0)
+
+
+@override_settings(PAYSTACK_WEBHOOK_INLINE=False)
+class PaystackWebhookInboxTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import Category, Gig, Order, UserProfile
+
+        self.freelancer = User.objects.create_user(username='wh_freelancer', password='x')
+        self.client_user = User.objects.create_user(username='wh_client', password='x')
+        self.profile = UserProfile.objects.create(user=self.freelancer, user_type='freelancer')
+        UserProfile.objects.create(user=self.client_user, user_type='client')
+        category = Category.objects.create(name='Webhook Category')
+        gig = Gig.objects.create(
+            freelancer=self.freelancer, category=category, title='Gig', description='d',
+            basic_title='Basic', basic_description='d', basic_price=100, basic_delivery_time=3,
+        )
+        self.order = Order.objects.create(
+            client=self.client_user, freelancer=self.freelancer, gig=gig, package_type='basic',
+            title='Order', price=100, payment_reference='ref_order',
+        )
+        patcher = mock.patch.object(currency_service, 'rate', return_value=Decimal('0.01'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, payload, signature=None):
+        from .payments import PAYSTACK_SECRET_KEY
+
+        body = json.dumps(payload).encode()
+        if signature is None:
+            signature = hmac.new(PAYSTACK_SECRET_KEY.encode(), body, hashlib.sha512).hexdigest()
+        return self.client.post(
+            '/api/payments/webhook/', body, content_type='application/json', HTTP_X_PAYSTACK_SIGNATURE=signature,
+        )
+
+    def charge(self, event_id=1):
+        return {
+            'event': 'charge.success',
+            'data': {
+                'id': event_id, 'reference': 'ref_order', 'amount': 10000,
+                'metadata': {'payment_type': 'gig', 'order_id': self.order.id, 'base_amount': '100'},
+            },
+        }
+
+    def test_rejects_bad_signature(self):
+        self.assertEqual(self.post(self.charge(), signature='nope').status_code, 400)
+        self.assertFalse(PaystackWebhookEvent.objects.exists())
+
+    def test_enqueue_is_fast_and_deduplicated(self):
+        first = self.post(self.charge())
+        second = self.post(self.charge())
+        self.assertEqual((first.status_code, second.status_code), (200, 200))
+        self.assertTrue(second.json()['duplicate'])
+
+        event = PaystackWebhookEvent.objects.get()
+        self.assertEqual((event.status, event.deliveries, event.reference), ('pending', 2, 'ref_order'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'pending')
+
+    def test_worker_applies_charge_once(self):
+        self.post(self.charge(event_id=1))
+        self.post(self.charge(event_id=2))  # a distinct event for the same payment
+        self.assertEqual(webhook_inbox.process_pending(), (2, 0))
+
+        self.order.refresh_from_db()
+        self.profile.refresh_from_db()
+        self.assertEqual((self.order.payment_status, self.order.status, self.order.is_paid), ('paid', 'in_progress', True))
+        self.assertEqual(self.profile.escrow_balance, Decimal('0.95'))
+
+        out = StringIO()
+        call_command('replay_paystack_webhooks', '--status', 'processed', '--process', stdout=out)
+        self.assertIn('processed=2, failed=0', out.getvalue())
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.escrow_balance, Decimal('0.95'))
+
+    def test_release_returns_the_escrow_credited_at_payment(self):
+        from rest_framework.test import force_authenticate
+        from .payments import release_escrow
+
+        self.post(self.charge())
+        webhook_inbox.process_pending()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.escrow_amount, Decimal('0.95'))
+
+        type(self.order).objects.filter(pk=self.order.pk).update(status='delivered')
+        request = APIRequestFactory().post('/api/payments/release-escrow/', {'order_id': self.order.id}, format='json')
+        force_authenticate(request, user=self.client_user)
+        # The rate moved between payment and release
+        with mock.patch.object(currency_service, 'rate', return_value=Decimal('0.02')):
+            self.assertEqual(release_escrow(request).status_code, 200)
+        self.profile.refresh_from_db()
+        self.assertEqual((self.profile.escrow_balance, self.profile.available_balance), (Decimal('0.00'), Decimal('0.95')))
+
+    def test_dispute_release_moves_escrow_once(self):
+        from django.contrib.auth.models import User
+        from rest_framework.test import force_authenticate
+        from .models import Dispute
+        from .views import resolve_dispute
+
+        self.post(self.charge())
+        webhook_inbox.process_pending()
+        dispute = Dispute.objects.create(
+            order=self.order, complainant=self.client_user, respondent=self.freelancer,
+            category='delivery', title='Late', description='d',
+        )
+        admin = User.objects.create_user(username='wh_admin', password='x', is_staff=True)
+        for _ in range(2):
+            request = APIRequestFactory().post(f'/api/disputes/{dispute.id}/resolve/', {'action': 'release'}, format='json')
+            force_authenticate(request, user=admin)
+            self.assertEqual(resolve_dispute(request, dispute.id).status_code, 200)
+        self.profile.refresh_from_db()
+        self.assertEqual(
+            (self.profile.escrow_balance, self.profile.available_balance, self.profile.total_earnings),
+            (Decimal('0.00'), Decimal('0.95'), Decimal('0.95')),
+        )
+
+    def test_transfer_failure_refunds_once(self):
+        from .models import Withdrawal
+
+        Withdrawal.objects.create(
+            user=self.freelancer, amount=Decimal('25.00'), bank_name='Bank', account_number='1', reference='wd_1',
+            status='processing',
+        )
+        for event_id in (10, 11):
+            self.post({'event': 'transfer.failed', 'data': {'id': event_id, 'reference': 'wd_1'}})
+        self.assertEqual(webhook_inbox.process_pending(), (2, 0))
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.available_balance, Decimal('25.00'))
+
+    def test_failure_blocks_later_events_for_reference(self):
+        self.post(self.charge(event_id=1))
+        self.post(self.charge(event_id=2))
+        with mock.patch.dict(webhook_inbox.HANDLERS, {'charge.success': mock.Mock(side_effect=RuntimeError('boom'))}):
+            self.assertEqual(webhook_inbox.process_pending(), (0, 1))
+        first, second = PaystackWebhookEvent.objects.order_by('id')
+        self.assertEqual((first.status, first.attempts, second.attempts), ('pending', 1, 0))
+        self.assertIn('boom', first.last_error)
+
+        self.assertEqual(webhook_inbox.process_pending(), (2, 0))
+
+    def test_gives_up_after_max_attempts(self):
+        self.post(self.charge())
+        with override_settings(PAYSTACK_WEBHOOK_MAX_ATTEMPTS=2), \
+                mock.patch.dict(webhook_inbox.HANDLERS, {'charge.success': mock.Mock(side_effect=RuntimeError('boom'))}):
+            webhook_inbox.process_pending()
+            webhook_inbox.process_pending()
+        self.assertEqual(PaystackWebhookEvent.objects.get().status, 'failed')
+        self.assertEqual(webhook_inbox.process_pending(), (0, 0))
+
+
+class BalanceServiceTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import UserProfile
+
+        self.user = User.objects.create_user(username='balance_user', password='x')
+        UserProfile.objects.create(user=self.user, available_balance=Decimal('50.00'), escrow_balance=Decimal('10.00'))
+
+    def test_apply_returns_new_balances_and_rounds_to_cents(self):
+        balances = BalanceService.apply(self.user, available_balance=Decimal('0.005'), total_earnings=Decimal('1.234'))
+        self.assertEqual(balances['available_balance'], Decimal('50.01'))
+        self.assertEqual(balances['total_earnings'], Decimal('1.23'))
+
+    def test_overdraft_is_rejected_without_partial_update(self):
+        with self.assertRaises(InsufficientFunds) as ctx:
+            BalanceService.apply(self.user, available_balance=Decimal('-50.01'), escrow_balance=Decimal('5'))
+        self.assertEqual(ctx.exception.field, 'available_balance')
+        self.assertEqual(BalanceService.get(self.user)['escrow_balance'], Decimal('10.00'))
+
+    def test_floor_at_zero(self):
+        balances = BalanceService.apply(self.user, floor_at_zero=('escrow_balance',), escrow_balance=Decimal('-25'))
+        self.assertEqual(balances['escrow_balance'], Decimal('0.00'))
+
+    def test_profile_saves_never_write_balances(self):
+        stale = UserProfile.objects.get(user=self.user)
+        BalanceService.credit(self.user, 5)
+        stale.bio = 'Updated'
+        stale.available_balance = Decimal('999.00')
+        stale.save()
+        stale.save(update_fields=['available_balance', 'escrow_balance'])
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.bio, profile.available_balance, profile.escrow_balance), ('Updated', Decimal('55.00'), Decimal('10.00')))
+
+    def test_creates_missing_profile(self):
+        from django.contrib.auth.models import User
+
+        other = User.objects.create_user(username='balance_other', password='x')
+        self.assertEqual(BalanceService.credit(other, 3)['available_balance'], Decimal('3.00'))
+        with self.assertRaises(InsufficientFunds):
+            BalanceService.debit(other, 4)
+
+    def test_apply_many_is_all_or_nothing(self):
+        from django.contrib.auth.models import User
+
+        other = User.objects.create_user(username='balance_poor', password='x')
+        with self.assertRaises(InsufficientFunds):
+            BalanceService.apply_many([
+                (self.user, {'available_balance': 5}),
+                (other, {'available_balance': -1}),
+            ])
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], Decimal('50.00'))
+
+
+class BalanceServiceConcurrencyTests(TransactionTestCase):
+    """Many threads hammering one account through separate DB connections"""
+
+    THREADS = 12
+    OPERATIONS = 20
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import UserProfile
+
+        self.user = User.objects.create_user(username='stress_user', password='x')
+        UserProfile.objects.create(user=self.user, available_balance=Decimal('100.00'))
+
+    def run_threads(self, operation):
+        errors = []
+        results = []
+        start = threading.Barrier(self.THREADS)
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(self.OPERATIONS):
+                    results.append(self.retry_locked(operation))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    @staticmethod
+    def retry_locked(operation):
+        # SQLite serialises writers and reports contention as an error instead of waiting;
+        # back off with jitter so the retrying threads don't keep colliding
+        for attempt in itertools.count():
+            try:
+                return operation()
+            except OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                time.sleep(random.uniform(0, min(0.02, 0.001 * 2 ** attempt)))
+
+    def test_concurrent_credits_are_not_lost(self):
+        self.run_threads(lambda: BalanceService.credit(self.user.id, Decimal('1.00')))
+        expected = Decimal('100.00') + self.THREADS * self.OPERATIONS
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], expected)
+
+    def test_concurrent_debits_never_overdraw(self):
+        def debit():
+            try:
+                BalanceService.debit(self.user.id, Decimal('1.00'))
+                return True
+            except InsufficientFunds:
+                return False
+
+        results = self.run_threads(debit)
+        self.assertEqual(results.count(True), 100)
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], Decimal('0.00'))
+
+    def test_concurrent_mixed_changes_balance_out(self):
+        def move():
+            # Retry each step on its own so a locked second step doesn't repeat the first
+            self.retry_locked(lambda: BalanceService.apply(
+                self.user.id, available_balance=Decimal('-2.50'), escrow_balance=Decimal('2.50')))
+            self.retry_locked(lambda: BalanceService.apply(
+                self.user.id, available_balance=Decimal('2.50'), escrow_balance=Decimal('-2.50')))
+
+        self.run_threads(move)
+        balances = BalanceService.get(self.user)
+        self.assertEqual((balances['available_balance'], balances['escrow_balance']), (Decimal('100.00'), Decimal('0.00')))
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.user = User.objects.create_user(username='ledger_user', password='x')
+        UserProfile.objects.create(user=self.user, available_balance=Decimal('40.00'))
+
+    def account(self, kind):
+        return LedgerAccount.objects.get(code=f'user:{self.user.id}:{kind}')
+
+    def assert_entries_balance(self):
+        for entry in LedgerEntry.objects.all():
+            self.assertEqual(sum(p.amount for p in entry.postings.all()), 0, entry)
+
+    def test_opening_balance_is_carried_over(self):
+        BalanceService.credit(self.user, Decimal('10.00'), entry_type='payment', reference='ref_1')
+        account = self.account('available')
+        self.assertEqual(account.balance, Decimal('50.00'))
+        self.assertEqual(
+            list(account.postings.values_list('amount', 'balance_after')),
+            [(Decimal('40.00'), Decimal('40.00')), (Decimal('10.00'), Decimal('50.00'))],
+        )
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], Decimal('50.00'))
+        self.assert_entries_balance()
+
+    def test_counterparties_by_entry_type(self):
+        BalanceService.credit(self.user, 5, entry_type='bonus')
+        BalanceService.apply(
+            self.user, entry_type='escrow_release', floor_at_zero=('escrow_balance',),
+            escrow_balance=-3, available_balance=3, total_earnings=3,
+        )
+        balances = dict(LedgerAccount.objects.filter(kind='system').values_list('code', 'balance'))
+        self.assertEqual(balances['platform:referral_bonuses:USD'], Decimal('-5.00'))
+        self.assertEqual(balances['platform:earnings_recognised:USD'], Decimal('-3.00'))
+        # Escrow was empty, so the floored debit's shortfall lands in adjustments
+        self.assertEqual(balances['platform:adjustments:USD'], Decimal('-3.00'))
+        self.assertEqual(self.account('escrow').balance, Decimal('0.00'))
+        self.assert_entries_balance()
+
+    def test_idempotency_key_posts_once(self):
+        for _ in range(2):
+            BalanceService.credit(self.user, 7, field='escrow_balance', entry_type='payment', idempotency_key='escrow:ref_2')
+        self.assertEqual(BalanceService.get(self.user)['escrow_balance'], Decimal('7.00'))
+        self.assertEqual(LedgerEntry.objects.filter(idempotency_key='escrow:ref_2').count(), 1)
+
+    def test_idempotency_key_race_returns_existing_entry(self):
+        fees, clearing = ledger.system_account(ledger.PLATFORM_FEES), ledger.system_account(ledger.PAYSTACK_CLEARING)
+        first = ledger.post([(clearing, 3), (fees, -3)], 'fee', idempotency_key='fee:race')
+        # The other writer's entry isn't visible to the pre-check, only to the insert
+        with mock.patch.object(LedgerEntry.objects, 'filter', return_value=LedgerEntry.objects.none()):
+            second = ledger.post([(clearing, 3), (fees, -3)], 'fee', idempotency_key='fee:race')
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(LedgerAccount.objects.get(id=fees).balance, Decimal('-3.00'))
+
+    def test_overdraft_leaves_ledger_untouched(self):
+        with self.assertRaises(InsufficientFunds):
+            BalanceService.debit(self.user, Decimal('40.01'))
+        self.assertFalse(LedgerEntry.objects.exists())
+
+    def test_unbalanced_entry_is_rejected(self):
+        with self.assertRaises(ledger.UnbalancedEntry):
+            ledger.post([(ledger.system_account(ledger.ADJUSTMENTS), 1)], 'adjustment')
+
+    def test_entries_are_append_only(self):
+        ledger.record_fee('ref_3', Decimal('12.50'))
+        entry = LedgerEntry.objects.get()
+        with self.assertRaises(TypeError):
+            LedgerEntry.objects.update(description='edited')
+        with self.assertRaises(TypeError):
+            LedgerPosting.objects.all().delete()
+        with self.assertRaises(TypeError):
+            entry.save()
+
+    def test_fees_are_booked_once_per_reference(self):
+        ledger.record_fee('ref_4', Decimal('12.50'))
+        ledger.record_fee('ref_4', Decimal('12.50'))
+        fees = LedgerAccount.objects.get(code='platform:fees:KES')
+        self.assertEqual(fees.balance, Decimal('-12.50'))
+        self.assertEqual(fees.posting_count, 1)
+
+    def test_verify_ledger_detects_and_repairs_drift(self):
+        BalanceService.credit(self.user, 10)
+        call_command('verify_ledger', stdout=StringIO())
+
+        UserProfile.objects.filter(user=self.user).update(available_balance=Decimal('999.00'))
+        LedgerAccount.objects.filter(code='platform:adjustments:USD').update(balance=Decimal('1.00'))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('verify_ledger', '--chunk-size', '1', stdout=out)
+        self.assertIn('UserProfile.available_balance is 999.00', out.getvalue())
+        self.assertIn('platform:adjustments:USD', out.getvalue())
+
+        call_command('verify_ledger', '--repair', stdout=StringIO())
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], Decimal('50.00'))
+        call_command('verify_ledger', stdout=StringIO())
+
+    def test_verify_ledger_opens_missing_accounts(self):
+        call_command('verify_ledger', '--open-missing', stdout=StringIO())
+        self.assertEqual(self.account('available').balance, Decimal('40.00'))
+
+
+    def test_wallet_payment_debits_through_ledger(self):
+        from rest_framework.test import force_authenticate
+        from .views_payments import wallet_payment
+
+        def pay(amount):
+            request = APIRequestFactory().post(
+                '/api/payments/wallet-payment/', {'amount': amount, 'payment_type': 'course'}, format='json',
+            )
+            force_authenticate(request, user=self.user)
+            return wallet_payment(request)
+
+        response = pay('15.00')
+        self.assertEqual((response.status_code, response.data['new_balance']), (200, 25.0))
+        with mock.patch('api.views_payments.time.time', return_value=time.time() + 1):
+            self.assertEqual(pay('25.01').status_code, 400)
+        self.assertEqual(self.account('available').balance, Decimal('25.00'))
+        wallet = LedgerAccount.objects.get(code='platform:wallet_payments:USD')
+        self.assertEqual(wallet.balance, Decimal('15.00'))
+        self.assert_entries_balance()
+
+    def test_record_transaction_credits_through_ledger(self):
+        from rest_framework.test import force_authenticate
+        from .transaction_views import record_transaction
+
+        self.user.first_name = 'Ledgerina'
+        self.user.save()
+        request = APIRequestFactory().post(
+            '/api/transactions/record/', {'reference': 'rt_1', 'amount': '12.5', 'freelancer': 'Ledgerina'}, format='json',
+        )
+        force_authenticate(request, user=self.user)
+        self.assertEqual(record_transaction(request).status_code, 200)
+        balances = BalanceService.get(self.user)
+        self.assertEqual((balances['available_balance'], balances['total_earnings']), (Decimal('52.50'), Decimal('12.50')))
+        self.assertTrue(LedgerEntry.objects.filter(idempotency_key='transaction:rt_1').exists())
+
+    def test_dashboard_reports_ledger_earnings(self):
+        from rest_framework.test import force_authenticate
+        from .views import dashboard_stats
+
+        UserProfile.objects.filter(user=self.user).update(user_type='freelancer')
+        BalanceService.apply(self.user, entry_type='escrow_release', available_balance=5, total_earnings=5)
+        request = APIRequestFactory().get('/api/dashboard/stats/')
+        force_authenticate(request, user=type(self.user).objects.get(pk=self.user.pk))
+        # No completed orders, which used to reset total_earnings to zero
+        self.assertEqual(dashboard_stats(request).data['total_earnings'], 5.0)
+        self.assertEqual(BalanceService.get(self.user)['total_earnings'], Decimal('5.00'))
+        call_command('verify_ledger', stdout=StringIO())
+
+class TransactionHistoryTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import Transaction
+
+        self.user = User.objects.create_user(username='history_user', password='x')
+        other = User.objects.create_user(username='history_other', password='x')
+        kinds = ['payment', 'payment', 'withdrawal', 'fee', 'payment', 'refund', 'withdrawal']
+        for i, kind in enumerate(kinds):
+            Transaction.objects.create(
+                user=self.user, transaction_type=kind, amount=Decimal(i + 1), description=f'tx {i}',
+                reference=f'hist_{i}', status='failed' if i == 2 else 'completed',
+            )
+        Transaction.objects.create(user=other, transaction_type='payment', amount=100, description='x', reference='hist_other')
+        # Several rows share a timestamp so the id tie-breaker matters
+        tied = Transaction.objects.filter(reference__in=['hist_1', 'hist_2', 'hist_3']).values_list('created_at', flat=True)[0]
+        Transaction.objects.filter(reference__in=['hist_1', 'hist_2', 'hist_3']).update(created_at=tied)
+
+    def get(self, view, **params):
+        from rest_framework.test import force_authenticate
+
+        request = APIRequestFactory().get('/', params)
+        force_authenticate(request, user=self.user)
+        return view(request)
+
+    def test_cursor_pages_cover_every_row_once(self):
+        from .transaction_views import get_transactions
+
+        seen = []
+        response = self.get(get_transactions, limit=3)
+        self.assertEqual(response.data['summary']['count'], 7)
+        while True:
+            seen += [row['reference'] for row in response.data['transactions']]
+            if not response.data['has_more']:
+                break
+            response = self.get(get_transactions, limit=3, cursor=response.data['next_cursor'])
+            self.assertNotIn('summary', response.data)
+
+        expected = list(
+            self.user.transactions.order_by('-created_at', '-id').values_list('reference', flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+    def test_filters_and_summary(self):
+        from .transaction_views import get_transactions
+
+        response = self.get(get_transactions, type='payment,withdrawal', status='completed')
+        self.assertEqual(len(response.data['transactions']), 4)
+        self.assertEqual(response.data['summary']['totals'], {
+            'payment': {'amount': 8.0, 'count': 3},
+            'withdrawal': {'amount': 7.0, 'count': 1},
+        })
+
+    def test_bad_parameters_are_rejected(self):
+        from .transaction_views import get_transactions
+
+        self.assertEqual(self.get(get_transactions, cursor='not-a-cursor').status_code, 400)
+        self.assertEqual(self.get(get_transactions, start_date='yesterday').status_code, 400)
+
+    def test_statement_streams_csv_oldest_first(self):
+        from .transaction_views import export_transaction_statement
+
+        response = self.get(export_transaction_statement, type='payment')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'created_at,reference,transaction_type,status,description,amount')
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['hist_0', 'hist_1', 'hist_4'])
+
+
+class FeeEngineTests(SimpleTestCase):
+    """Property checks over randomly generated carts (seeded, so failures reproduce)"""
+
+    EXAMPLES = 300
+
+    def carts(self):
+        rng = random.Random(40)
+        for _ in range(self.EXAMPLES):
+            size = rng.choice([1, 1, 2, 3, rng.randint(4, fees.MAX_QUOTE_ITEMS)])
+            yield [Decimal(rng.randint(1, 10 ** rng.randint(1, 9))) / 100 for _ in range(size)]
+
+    def test_columns_add_up_exactly(self):
+        for bases in self.carts():
+            result = fees.calculate(bases)
+            for field in fees.LINE_FIELDS:
+                self.assertEqual(sum(line[field] for line in result['lines']), result['totals'][field], (field, bases))
+            self.assertEqual(result['totals']['processing_fee'], fees.PROCESSING_FEE_KES)
+            for line in result['lines']:
+                self.assertEqual(line['total_amount'], line['base_amount'] + line['client_fee'] + line['processing_fee'])
+                self.assertEqual(line['freelancer_fee'] + line['freelancer_earnings'], line['base_amount'])
+                self.assertGreaterEqual(line['processing_fee'], 0)
+                for field in fees.LINE_FIELDS:
+                    self.assertEqual(line[field], line[field].quantize(fees.CENTS))
+
+    def test_per_line_fees_match_single_item_quotes(self):
+        for bases in itertools.islice(self.carts(), 50):
+            lines = fees.calculate(bases)['lines']
+            for base, line in zip(bases, lines):
+                single = fees.calculate([base])['lines'][0]
+                self.assertEqual(line['client_fee'], single['client_fee'])
+                self.assertEqual((line['freelancer_fee'], line['freelancer_earnings']), fees.freelancer_split(base))
+
+    def test_allocation_is_exact_and_proportional(self):
+        rng = random.Random(41)
+        for _ in range(self.EXAMPLES):
+            total = Decimal(rng.randint(0, 100000)) / 100
+            weights = [Decimal(rng.randint(0, 5000)) for _ in range(rng.randint(1, 20))]
+            parts = fees.allocate(total, weights)
+            self.assertEqual(sum(parts), total)
+            weight_sum = sum(weights) or len(weights)
+            for part, weight in zip(parts, weights if any(weights) else [1] * len(weights)):
+                self.assertLess(abs(part - total * weight / weight_sum), fees.CENTS)
+
+    def test_rejects_bad_items(self):
+        for item in ({}, {'amount': '0'}, {'amount': '-5'}, {'amount': 'abc'}, {'amount': 'NaN'},
+                     {'hours_worked': '2'}, {'amount': 'Infinity'}):
+            with self.assertRaises(fees.FeeError, msg=item):
+                fees.base_amount(item)
+        self.assertEqual(fees.base_amount({'hours_worked': '2.5', 'hourly_rate': '10.005'}), Decimal('25.01'))
+        with self.assertRaises(fees.FeeError):
+            fees.calculate([Decimal('1')] * (fees.MAX_QUOTE_ITEMS + 1))
+
+
+class FeeQuoteTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.user = User.objects.create_user(username='quote_client', password='x', email='q@example.com')
+        self.freelancer = User.objects.create_user(username='quote_freelancer', password='x')
+
+    def post(self, view, data, user=None):
+        from rest_framework.test import force_authenticate
+
+        request = APIRequestFactory().post('/', data, format='json')
+        force_authenticate(request, user=user or self.user)
+        return view(request)
+
+    def test_batch_quote_in_one_request(self):
+        from .payments import calculate_payment_fees
+
+        response = self.post(calculate_payment_fees, {'items': [
+            {'amount': '1000', 'job_id': 7}, {'hours_worked': 3, 'hourly_rate': '500'}, {'amount': '2500.50'},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertEqual(response.data['items'][0]['job_id'], '7')
+        self.assertEqual(response.data['totals']['base_amount'], '5000.50')
+        self.assertEqual(response.data['totals']['processing_fee'], '50.00')
+        # The legacy summary's platform_fee is the client fee
+        self.assertEqual(response.data['breakdown']['platform_fee'], response.data['breakdown']['client_fee'])
+
+        quote = fees.load_quote(response.data['quote'], self.user)
+        self.assertEqual(quote['totals']['total_amount'], Decimal(response.data['totals']['total_amount']))
+
+        bad = self.post(calculate_payment_fees, {'items': [{'amount': '10'}, {'amount': '-1'}]})
+        self.assertEqual(bad.status_code, 400)
+        self.assertIn('Item 1', bad.data['error'])
+
+    def test_quotes_are_bound_to_their_owner_and_unforgeable(self):
+        token = fees.quote(self.user, [{'amount': '100'}])['quote']
+        with self.assertRaises(fees.FeeError):
+            fees.load_quote(token, self.freelancer)
+        with self.assertRaises(fees.FeeError):
+            fees.load_quote(token[:-2] + ('AA' if not token.endswith('AA') else 'BB'), self.user)
+        with override_settings(FEE_QUOTE_TTL=-1), self.assertRaisesMessage(fees.FeeError, 'expired'):
+            fees.load_quote(token, self.user)
+
+    def test_initialize_payment_accepts_quote(self):
+        from . import payments
+        from .models import Category, Course
+
+        course = Course.objects.create(
+            title='Quoted course', description='d', category=Category.objects.create(name='Quotes'),
+            instructor=self.freelancer, duration_hours=1, price=Decimal('1000.00'), learning_outcomes='x',
+        )
+        token = fees.quote(self.user, [{'amount': '1000'}])['quote']
+        result = {'status': True, 'data': {'authorization_url': 'https://pay', 'access_code': 'ac'}}
+        with mock.patch.object(payments.paystack, 'initialize_transaction', return_value=result) as init, \
+                mock.patch.object(payments.fees, 'calculate', side_effect=AssertionError('recomputed')):
+            response = self.post(payments.initialize_payment, {
+                'course_id': course.id, 'amount': '1000', 'payment_type': 'course', 'quote': token,
+            })
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['data']['amount_breakdown']['total_amount'], 1075.0)
+        self.assertEqual(init.call_args.kwargs['metadata']['freelancer_fee'], '50.00')
+
+        # A quote for a different amount, or priced for something else, is refused
+        for item in ({'amount': '999'}, {'amount': '1000', 'course_id': course.id + 1},
+                     {'amount': '1000', 'job_id': 7}):
+            stale = fees.quote(self.user, [item])['quote']
+            with mock.patch.object(payments.paystack, 'initialize_transaction', return_value=result):
+                response = self.post(payments.initialize_payment, {
+                    'course_id': course.id, 'amount': '1000', 'payment_type': 'course', 'quote': stale,
+                })
+            self.assertEqual(response.status_code, 400, item)
+
+        # One priced for this course is accepted
+        token = fees.quote(self.user, [{'amount': '1000', 'course_id': course.id}])['quote']
+        with mock.patch.object(payments.paystack, 'initialize_transaction', return_value=result):
+            response = self.post(payments.initialize_payment, {
+                'course_id': course.id, 'amount': '1000', 'payment_type': 'course', 'quote': token,
+            })
+        self.assertEqual(response.status_code, 200, response.data)
+
+
+@override_settings(PAYSTACK_PAYOUT_INLINE=False)
+class PayoutEngineTests(TestCase):
+    """Withdrawals are queued, then sent to the stub in bulk by the payout worker"""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        cache.clear()
+        self.server = StubPaystackServer().start()
+        self.addCleanup(self.server.stop)
+        client = PaystackClient(base_url=self.server.url, secret_key='sk_stub', read_timeout=0.5, backoff=0)
+        self.addCleanup(client.session.close)
+        patcher = mock.patch.object(payouts, 'paystack_client', client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.recipients = 0
+        self.server.routes[('POST', '/transferrecipient')] = self.create_recipient
+        self.server.routes[('POST', '/transfer/bulk')] = self.bulk_transfer
+        self.transfer_status = 'pending'
+
+        self.user = User.objects.create_user(username='payout_user', password='x')
+        UserProfile.objects.create(user=self.user, available_balance=Decimal('100.00'))
+
+    def create_recipient(self, server):
+        self.recipients += 1
+        return 200, {'status': True, 'data': {'recipient_code': f'RCP_{self.recipients}'}}
+
+    def bulk_transfer(self, server):
+        transfers = json.loads(server.calls[-1][2])['transfers']
+        return 200, {'status': True, 'data': [
+            {'reference': t['reference'], 'recipient': t['recipient'], 'amount': t['amount'],
+             'transfer_code': f"TRF_{t['reference'][-6:]}", 'status': self.transfer_status}
+            for t in transfers
+        ]}
+
+    def paths(self):
+        return [call[1] for call in self.server.calls]
+
+    def queue(self, account_number='0700000001', amount='10.00'):
+        return payouts.request_withdrawal(
+            self.user, Decimal('1300'), account_number, 'MPesa', balance_debit=Decimal(amount),
+            account_name='Payout User', recipient_type='mobile_money',
+        )
+
+    def test_initiate_withdrawal_only_queues(self):
+        from rest_framework.test import force_authenticate
+        from .models import Withdrawal
+        from .payments import initiate_withdrawal
+
+        request = APIRequestFactory().post('/', {
+            'amount': 1300, 'method': 'mpesa', 'account_number': '0700000001', 'account_name': 'Payout User',
+        }, format='json')
+        force_authenticate(request, user=self.user)
+        response = initiate_withdrawal(request)
+
+        self.assertEqual(response.data['withdrawal_status'], 'queued')
+        withdrawal = Withdrawal.objects.get()
+        self.assertEqual((withdrawal.recipient_type, withdrawal.bank_code), ('mobile_money', 'MPesa'))
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], Decimal('100.00') - withdrawal.balance_debit)
+        self.assertEqual(self.server.calls, [])
+
+    def test_insufficient_balance_queues_nothing(self):
+        from .models import Withdrawal
+
+        with self.assertRaises(InsufficientFunds):
+            self.queue(amount='100.01')
+        self.assertFalse(Withdrawal.objects.exists())
+
+    def test_batches_share_one_bulk_request_and_cached_recipients(self):
+        first, second, third = self.queue(), self.queue(), self.queue(account_number='0700000002')
+        totals = payouts.process_queue()
+
+        self.assertEqual(totals, {'submitted': 3, 'completed': 0, 'failed': 0, 'requeued': 0})
+        self.assertEqual(self.paths().count('/transferrecipient'), 2)
+        self.assertEqual(self.paths().count('/transfer/bulk'), 1)
+        for withdrawal in (first, second, third):
+            withdrawal.refresh_from_db()
+            self.assertEqual(withdrawal.status, 'processing')
+            self.assertTrue(withdrawal.paystack_transfer_code)
+            self.assertIsNotNone(withdrawal.submitted_at)
+        self.assertEqual(first.paystack_recipient_code, second.paystack_recipient_code)
+
+        # A later withdrawal to a known account skips the recipient call
+        self.queue()
+        payouts.process_queue()
+        self.assertEqual(self.paths().count('/transferrecipient'), 2)
+
+    def test_outage_requeues_and_verifies_before_resubmitting(self):
+        withdrawal = self.queue()
+        self.server.routes[('POST', '/transfer/bulk')] = (503, {'status': False})
+        self.assertEqual(payouts.process_queue()['requeued'], 1)
+        withdrawal.refresh_from_db()
+        self.assertEqual((withdrawal.status, withdrawal.attempts), ('queued', 1))
+
+        # The request did reach Paystack after all: the retry picks it up instead of paying twice
+        self.server.routes[('GET', f'/transfer/verify/{withdrawal.reference}')] = (
+            200, {'status': True, 'data': {'status': 'success', 'transfer_code': 'TRF_late'}},
+        )
+        self.assertEqual(payouts.process_queue()['completed'], 1)
+        self.assertEqual(self.paths().count('/transfer/bulk'), 1)
+        withdrawal.refresh_from_db()
+        self.assertEqual((withdrawal.status, withdrawal.paystack_transfer_code), ('completed', 'TRF_late'))
+
+    def transfer_webhook(self, event, withdrawal, event_id=1):
+        from .payments import PAYSTACK_SECRET_KEY
+
+        body = json.dumps({'event': event, 'data': {'id': event_id, 'reference': withdrawal.reference}}).encode()
+        signature = hmac.new(PAYSTACK_SECRET_KEY.encode(), body, hashlib.sha512).hexdigest()
+        self.client.post('/api/payments/webhook/', body, content_type='application/json', HTTP_X_PAYSTACK_SIGNATURE=signature)
+        webhook_inbox.process_pending()
+
+    @override_settings(PAYSTACK_PAYOUT_MAX_ATTEMPTS=1)
+    def test_timeout_on_last_attempt_is_left_for_reconcile_not_refunded(self):
+        withdrawal = self.queue(amount='10.00')
+        self.server.routes[('POST', '/transfer/bulk')] = (200, {'status': True, 'data': []}, 1)
+        self.assertEqual(payouts.process_queue()['submitted'], 1)
+        withdrawal.refresh_from_db()
+        self.assertEqual(withdrawal.status, 'processing')
+        self.assertIsNotNone(withdrawal.submitted_at)
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], Decimal('90.00'))
+
+        # The transfer had gone out after all
+        self.transfer_webhook('transfer.success', withdrawal)
+        withdrawal.refresh_from_db()
+        self.assertEqual(withdrawal.status, 'completed')
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], Decimal('90.00'))
+
+    @override_settings(PAYSTACK_PAYOUT_MAX_ATTEMPTS=1)
+    def test_reconcile_fails_given_up_payout_paystack_never_received(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Withdrawal
+
+        withdrawal = self.queue(amount='10.00')
+        self.server.routes[('POST', '/transfer/bulk')] = (503, {'status': False})
+        self.assertEqual(payouts.process_queue()['submitted'], 1)
+        Withdrawal.objects.filter(pk=withdrawal.pk).update(submitted_at=timezone.now() - timedelta(hours=1))
+        self.server.routes[('GET', f'/transfer/verify/{withdrawal.reference}')] = (
+            404, {'status': False, 'message': 'Transfer not found'},
+        )
+        self.assertEqual(payouts.reconcile(), 1)
+        withdrawal.refresh_from_db()
+        self.assertEqual(withdrawal.status, 'failed')
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], Decimal('100.00'))
+
+    def test_success_after_refund_reverses_the_refund(self):
+        withdrawal = self.queue(amount='10.00')
+        payouts.process_queue()
+        self.transfer_webhook('transfer.failed', withdrawal, event_id=1)
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], Decimal('100.00'))
+
+        for event_id in (2, 3):
+            self.transfer_webhook('transfer.success', withdrawal, event_id=event_id)
+        withdrawal.refresh_from_db()
+        self.assertEqual(withdrawal.status, 'completed')
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], Decimal('90.00'))
+
+    def test_failed_transfer_refunds_the_reserve(self):
+        from .models import Transaction
+
+        withdrawal = self.queue(amount='40.00')
+        self.transfer_status = 'failed'
+        self.assertEqual(payouts.process_queue()['failed'], 1)
+        withdrawal.refresh_from_db()
+        self.assertEqual(withdrawal.status, 'failed')
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], Decimal('100.00'))
+        self.assertEqual(Transaction.objects.get(reference=withdrawal.reference).status, 'failed')
+
+    def test_rejected_recipient_fails_without_transfer(self):
+        withdrawal = self.queue()
+        self.server.routes[('POST', '/transferrecipient')] = (400, {'status': False, 'message': 'Invalid account'})
+        self.assertEqual(payouts.process_queue()['failed'], 1)
+        withdrawal.refresh_from_db()
+        self.assertEqual((withdrawal.status, withdrawal.last_error), ('failed', 'Invalid account'))
+        self.assertNotIn('/transfer/bulk', self.paths())
+
+    def test_reconcile_settles_transfers_without_webhook(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Withdrawal
+
+        withdrawal = self.queue()
+        payouts.process_queue()
+        self.assertEqual(payouts.reconcile(), 0)  # too recent to check
+
+        Withdrawal.objects.filter(pk=withdrawal.pk).update(submitted_at=timezone.now() - timedelta(hours=1))
+        self.server.routes[('GET', f'/transfer/verify/{withdrawal.reference}')] = (
+            200, {'status': True, 'data': {'status': 'success'}},
+        )
+        self.assertEqual(payouts.reconcile(), 1)
+        withdrawal.refresh_from_db()
+        self.assertEqual(withdrawal.status, 'completed')
+
+    def test_reconcile_skips_mock_withdrawals(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Withdrawal
+
+        withdrawal = Withdrawal.objects.create(
+            user=self.user, amount=Decimal('5.00'), bank_name='BANK: 1', account_number='1', account_name='A',
+            status='processing', reference=f'{payouts.MOCK_REFERENCE_PREFIX}{self.user.id}_1',
+        )
+        Withdrawal.objects.filter(pk=withdrawal.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(payouts.reconcile(), 0)
+        self.assertNotIn(f'/transfer/verify/{withdrawal.reference}', self.paths())
+
+    def test_referral_payout_settles_referral_withdrawal(self):
+        from .referral_models import ReferralCode, ReferralWithdrawal
+
+        code, _ = ReferralCode.objects.get_or_create(user=self.user, defaults={'code': 'PAYOUT1'})
+        referral = ReferralWithdrawal.objects.create(
+            user=self.user, amount=Decimal('20.00'), withdrawal_method='mpesa',
+            account_details={'phone_number': '0700000003', 'account_name': 'Payout User'},
+        )
+        withdrawal = payouts.queue_referral_payout(referral)
+        self.assertEqual(withdrawal.balance_debit, Decimal('0'))
+
+        self.transfer_status = 'success'
+        payouts.process_queue()
+        referral.refresh_from_db()
+        code.refresh_from_db()
+        self.assertEqual(referral.status, 'completed')
+        self.assertEqual(code.withdrawn_earnings, Decimal('20.00'))
+        # Referral payouts are funded from referral earnings, not the available balance
+        self.assertEqual(BalanceService.get(self.user)['available_balance'], Decimal('100.00'))
+
+    def test_command_reports_totals(self):
+        self.queue()
+        out = StringIO()
+        call_command('process_payouts', stdout=out)
+        self.assertIn('submitted=1', out.getvalue())
+
+    def test_recipient_registry_is_persisted_per_user(self):
+        from django.contrib.auth.models import User
+        from .models import TransferRecipient
+
+        self.queue()
+        payouts.process_queue()
+        cache.clear()
+        self.queue()
+        payouts.process_queue()
+        self.assertEqual(self.paths().count('/transferrecipient'), 1)
+        recipient = TransferRecipient.objects.get()
+        self.assertEqual((recipient.recipient_code, recipient.account_last4), ('RCP_1', '0001'))
+        self.assertNotIn('0700000001', recipient.account_key)
+
+        # The same account details for someone else are a different recipient
+        other = User.objects.create_user(username='payout_other', password='x')
+        code, error, _ = recipient_registry.get_recipient_code(other, 'mobile_money', '0700000001', 'MPesa')
+        self.assertEqual((code, error), ('RCP_2', None))
+
+    def test_stale_recipient_is_revalidated_lazily(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import TransferRecipient
+
+        recipient = lambda: recipient_registry.get_recipient_code(self.user, 'mobile_money', '0700000001', 'MPesa')
+        self.assertEqual(recipient()[0], 'RCP_1')
+        TransferRecipient.objects.update(last_validated_at=timezone.now() - timedelta(days=30))
+
+        # Paystack unreachable: keep using the known code
+        self.server.routes[('GET', '/transferrecipient/RCP_1')] = (503, {'status': False})
+        self.assertEqual(recipient()[0], 'RCP_1')
+
+        self.server.routes[('GET', '/transferrecipient/RCP_1')] = (200, {'status': True, 'data': {'active': True}})
+        self.assertEqual(recipient()[0], 'RCP_1')
+        calls = len(self.server.calls)
+        self.assertEqual(recipient()[0], 'RCP_1')
+        self.assertEqual(len(self.server.calls), calls)  # freshly validated, no round trip
+
+        # A failed transfer marks the recipient for re-checking; a deactivated one is replaced
+        recipient_registry.invalidate('RCP_1')
+        self.server.routes[('GET', '/transferrecipient/RCP_1')] = (200, {'status': True, 'data': {'active': False}})
+        self.assertEqual(recipient()[0], 'RCP_2')
+        self.assertEqual(TransferRecipient.objects.get().recipient_code, 'RCP_2')
+
+    def test_resolve_account_results_are_cached(self):
+        self.server.routes[('GET', '/bank/resolve')] = (
+            200, {'status': True, 'data': {'account_name': 'Payout User', 'account_number': '0123456789'}},
+        )
+        for _ in range(3):
+            result = recipient_registry.resolve_account('0123456789', '063')
+        self.assertEqual(result['data']['account_name'], 'Payout User')
+        self.assertEqual(self.paths().count('/bank/resolve'), 1)
+
+        # Outages aren't remembered; unknown accounts are, briefly
+        self.server.routes[('GET', '/bank/resolve')] = (503, {'status': False})
+        self.assertIsNone(recipient_registry.resolve_account('0000000000', '063'))
+        calls = self.paths().count('/bank/resolve')
+        self.server.routes[('GET', '/bank/resolve')] = (422, {'status': False, 'message': 'Could not resolve'})
+        self.assertFalse(recipient_registry.resolve_account('0000000000', '063')['status'])
+        self.assertFalse(recipient_registry.resolve_account('0000000000', '063')['status'])
+        self.assertEqual(self.paths().count('/bank/resolve'), calls + 1)
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', NEWSLETTER_SEND_INLINE=False,
+    NEWSLETTER_SEND_CHUNK_SIZE=3,
+)
+class NewsletterSendJobTests(TestCase):
+    """Newsletters are sent by the background job in chunks, resumable from the send logs"""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import Newsletter, NewsletterSubscriber
+
+        self.admin = User.objects.create_user(username='news_admin', password='x', is_staff=True)
+        self.subscribers = [
+            NewsletterSubscriber.objects.create(email=f'reader{i}@example.com', email_verified=i % 2 == 0)
+            for i in range(8)
+        ]
+        NewsletterSubscriber.objects.create(email='gone@example.com', status='unsubscribed')
+        self.newsletter = Newsletter.objects.create(
+            title='Issue 1', subject='Hello', content='<p>Hi</p>', created_by=self.admin,
+        )
+
+    def recipients(self):
+        return sorted(address for message in mail.outbox for address in message.to)
+
+    def test_view_starts_background_send_and_reports_progress(self):
+        from rest_framework.test import force_authenticate
+        from .newsletter_views import newsletter_send_progress, send_newsletter
+
+        request = APIRequestFactory().post('/')
+        force_authenticate(request, user=self.admin)
+        response = send_newsletter(request, newsletter_id=self.newsletter.id)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['total_recipients'], 8)
+        self.assertEqual(mail.outbox, [])
+
+        self.assertEqual(newsletter_sender.process_pending(), {'sent': 8, 'failed': 0})
+        self.assertEqual(self.recipients(), sorted(s.email for s in self.subscribers))
+        tracking_ids = {message.alternatives[0][0].split('/track/open/')[1].split('/')[0] for message in mail.outbox}
+        self.assertEqual(len(tracking_ids), 8)
+
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=self.admin)
+        progress = newsletter_send_progress(request, newsletter_id=self.newsletter.id).data
+        self.assertEqual((progress['status'], progress['total_sent'], progress['progress']), ('sent', 8, 100.0))
+        self.assertEqual(self.newsletter.send_logs.filter(status='sent').count(), 8)
+
+        # Sending again is refused
+        request = APIRequestFactory().post('/')
+        force_authenticate(request, user=self.admin)
+        self.assertEqual(send_newsletter(request, newsletter_id=self.newsletter.id).status_code, 400)
+
+    def test_resumes_after_a_crash_without_resending(self):
+        newsletter_sender.start(self.newsletter, background=False)
+        real_send_chunk = newsletter_sender.send_chunk
+        calls = itertools.count()
+
+        def crash_on_second_chunk(newsletter, logs):
+            if next(calls) == 1:
+                raise RuntimeError('worker killed')
+            return real_send_chunk(newsletter, logs)
+
+        with mock.patch.object(newsletter_sender, 'send_chunk', crash_on_second_chunk), \
+                self.assertRaises(RuntimeError):
+            newsletter_sender.process_pending()
+        self.newsletter.refresh_from_db()
+        self.assertEqual((self.newsletter.status, self.newsletter.total_sent), ('sending', 3))
+        self.assertEqual(self.newsletter.send_logs.filter(status='sending').count(), 3)
+
+        # The abandoned chunk is picked up again once its claim expires
+        self.assertEqual(newsletter_sender.process_pending()['sent'], 2)
+        with override_settings(NEWSLETTER_SEND_LOCK_TIMEOUT=-1):
+            self.assertEqual(newsletter_sender.process_pending()['sent'], 3)
+        self.newsletter.refresh_from_db()
+        self.assertEqual((self.newsletter.status, self.newsletter.total_sent), ('sent', 8))
+        self.assertEqual(self.recipients(), sorted(s.email for s in self.subscribers))
+
+    def test_failures_and_unsubscribes_are_recorded(self):
+        from django.core.mail.backends.locmem import EmailBackend
+
+        real_send = EmailBackend.send_messages
+
+        def reject_reader3(backend, messages):
+            if any('reader3@' in address for message in messages for address in message.to):
+                raise ConnectionError('mailbox unavailable')
+            return real_send(backend, messages)
+
+        newsletter_sender.start(self.newsletter, background=False)
+        newsletter_sender.queue_recipients(self.newsletter, chunk_size=100)
+        # Unsubscribed after the audience was queued: skipped at send time
+        self.subscribers[5].status = 'unsubscribed'
+        self.subscribers[5].save()
+        with mock.patch.object(EmailBackend, 'send_messages', reject_reader3):
+            self.assertEqual(newsletter_sender.process_pending(), {'sent': 6, 'failed': 1})
+
+        self.newsletter.refresh_from_db()
+        self.assertEqual((self.newsletter.status, self.newsletter.total_failed, self.newsletter.total_recipients), ('sent', 1, 7))
+        log = self.newsletter.send_logs.get(subscriber=self.subscribers[3])
+        self.assertEqual((log.status, log.error_message), ('failed', 'mailbox unavailable'))
+        self.assertEqual(self.newsletter.send_logs.get(subscriber=self.subscribers[5]).status, 'unsubscribed')
+
+    def test_newsletter_compiled_once_per_send_with_recipient_slots(self):
+        from .newsletter_render import compile_newsletter
+
+        self.newsletter.content = '<p>{{ newsletter.title }} 100%</p><a href="{{ unsubscribe_url }}">Leave</a>'
+        self.newsletter.render_content = True
+        self.newsletter.save()
+        newsletter_sender.start(self.newsletter, background=False)
+        with mock.patch('api.newsletter_render.compile_newsletter', wraps=compile_newsletter) as compile_mock:
+            self.assertEqual(newsletter_sender.process_pending()['sent'], 8)
+        self.assertEqual(compile_mock.call_count, 1)
+
+        by_email = {message.to[0]: message.alternatives[0][0] for message in mail.outbox}
+        for subscriber in self.subscribers:
+            html = by_email[subscriber.email]
+            self.assertTrue(html.startswith('<p>Issue 1 100%</p>'))
+            self.assertEqual(html.count(f'/newsletter/unsubscribe/{subscriber.unsubscribe_token}/'), 2)
+        log = self.newsletter.send_logs.get(subscriber=self.subscribers[0])
+        self.assertIn(f'/track/open/{log.tracking_id}/', by_email[self.subscribers[0].email])
+
+    def test_newsletter_content_is_sent_as_written_without_opt_in(self):
+        from .newsletter_render import compile_newsletter
+
+        self.newsletter.content = '<p>Use {{ name }} and {% raw %} in your template</p>'
+        html = compile_newsletter(self.newsletter).render('track', 'token')
+        self.assertTrue(html.startswith('<p>Use {{ name }} and {% raw %} in your template</p>'))
+        self.assertIn('/newsletter/unsubscribe/token/', html)
+
+    @override_settings(NEWSLETTER_OPEN_FLUSH_INTERVAL=3600)
+    def test_opens_are_buffered_and_flushed_in_aggregate(self):
+        from .newsletter_opens import PIXEL_GIF, open_tracker
+        from .newsletter_views import track_newsletter_open
+
+        newsletter_sender.start(self.newsletter, background=False)
+        newsletter_sender.process_pending()
+        logs = list(self.newsletter.send_logs.order_by('id')[:3])
+
+        with self.assertNumQueries(0):
+            for tracking_id in [log.tracking_id for log in logs] * 2 + ['unknown']:
+                response = track_newsletter_open(APIRequestFactory().get('/'), tracking_id=tracking_id)
+                self.assertEqual((response.status_code, response.content), (200, PIXEL_GIF))
+        self.assertEqual(open_tracker.pending(), 4)
+
+        self.assertEqual(open_tracker.flush(), 3)
+        self.newsletter.refresh_from_db()
+        self.assertEqual(self.newsletter.total_opened, 3)
+        for log in logs:
+            log.refresh_from_db()
+            log.subscriber.refresh_from_db()
+            self.assertEqual((log.status, log.batch_id, log.subscriber.email_open_count), ('opened', '', 1))
+
+        # Repeat opens are not counted again
+        open_tracker.record(logs[0].tracking_id)
+        self.assertEqual(open_tracker.flush(), 0)
+        self.newsletter.refresh_from_db()
+        self.assertEqual(self.newsletter.total_opened, 3)
+
+    def test_service_sends_to_verified_subscribers(self):
+        from .newsletter_service import NewsletterService
+
+        result = NewsletterService.send_newsletter(self.newsletter, background=False)
+        self.assertEqual((result['sent_count'], result['total_recipients'], result['status']), (4, 4, 'sent'))
+        self.assertEqual(self.recipients(), sorted(s.email for s in self.subscribers if s.email_verified))
+        with self.assertRaises(ValueError):
+            NewsletterService.send_newsletter(self.newsletter)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class MailDispatcherTests(SimpleTestCase):
+    """Outbound email shares one connection per thread and is throttled to the provider quota"""
+
+    def message(self, to):
+        return mail.EmailMessage('Hi', 'Body', 'from@example.com', [to])
+
+    def test_token_bucket_throttles_after_burst(self):
+        now = [0.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            now[0] += seconds
+
+        bucket = TokenBucket(rate=2, burst=3, clock=lambda: now[0], sleep=sleep)
+        self.assertEqual([bucket.acquire() for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertEqual(bucket.acquire(), 0.5)
+        now[0] += 1
+        self.assertEqual([bucket.acquire() for _ in range(2)], [0.0, 0.0])
+        self.assertEqual(waits, [0.5])
+        self.assertEqual(TokenBucket(rate=0, burst=1).acquire(), 0.0)
+
+    def test_connection_reused_until_max_messages(self):
+        dispatcher = MailDispatcher(rate=0, burst=1, max_messages=4)
+        results = dispatcher.send_messages([self.message(f'user{i}@example.com') for i in range(10)])
+        self.assertEqual(results, [None] * 10)
+        self.assertEqual(len(mail.outbox), 10)
+        metrics = dispatcher.metrics()
+        self.assertEqual((metrics['sent'], metrics['failed'], metrics['connections_opened']), (10, 0, 3))
+
+        # An idle connection is replaced on the next send
+        dispatcher.idle_timeout = -1
+        dispatcher.send_mail('Hi', 'Body', None, ['late@example.com'])
+        self.assertEqual(dispatcher.metrics()['connections_opened'], 4)
+        self.assertEqual(mail.outbox[-1].from_email, settings.DEFAULT_FROM_EMAIL)
+
+    def test_failures_are_isolated_per_message(self):
+        from django.core.mail.backends.locmem import EmailBackend
+
+        real_send = EmailBackend.send_messages
+
+        def reject_bad(backend, messages):
+            if messages[0].to == ['bad@example.com']:
+                raise ValueError('mailbox unavailable')
+            return real_send(backend, messages)
+
+        dispatcher = MailDispatcher(rate=0, burst=1)
+        with mock.patch.object(EmailBackend, 'send_messages', reject_bad):
+            results = dispatcher.send_messages([
+                self.message('a@example.com'), self.message('bad@example.com'), self.message('b@example.com'),
+            ])
+            self.assertEqual(results, [None, 'mailbox unavailable', None])
+            self.assertEqual(dispatcher.send_mail('Hi', 'Body', None, ['bad@example.com'], fail_silently=True), 0)
+            with self.assertRaises(ValueError):
+                dispatcher.send_mail('Hi', 'Body', None, ['bad@example.com'])
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['a@example.com', 'b@example.com'])
+        metrics = dispatcher.metrics()
+        self.assertEqual((metrics['sent'], metrics['failed'], metrics['connections_opened']), (2, 3, 1))
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_OUTBOX_INLINE=False)
+class EmailOutboxTests(TestCase):
+    """Requests only queue transactional email; the outbox worker delivers it with retries"""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.user = User.objects.create_user(username='outbox_user', email='outbox@example.com', password='x')
+        UserProfile.objects.create(user=self.user)
+
+    def test_forgot_password_queues_instead_of_sending(self):
+        from .models import OutboundEmail
+        from .views import forgot_password
+
+        response = forgot_password(APIRequestFactory().post('/', {'email': 'outbox@example.com'}, format='json'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mail.outbox, [])
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.category, email.to, email.status), ('password_reset', ['outbox@example.com'], 'pending'))
+
+        self.assertEqual(email_outbox.process_pending(), {'sent': 1, 'failed': 0})
+        self.assertEqual(mail.outbox[0].to, ['outbox@example.com'])
+        self.assertIn('/reset-password?token=', mail.outbox[0].body)
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'sent')
+        self.assertEqual(email_outbox.process_pending(), {'sent': 0, 'failed': 0})
+
+    def test_email_helpers_log_instead_of_printing(self):
+        from .views import send_password_reset_email
+
+        with self.assertLogs('api.views', 'INFO') as logs:
+            send_password_reset_email(self.user, 'token')
+            with mock.patch.object(email_outbox, 'enqueue', side_effect=RuntimeError('db down')):
+                send_password_reset_email(self.user, 'token')
+        self.assertIn('Password reset email queued for outbox@example.com', logs.output[0])
+        self.assertTrue(logs.output[1].startswith('ERROR:api.views:Failed to queue password reset email'))
+        self.assertIn('RuntimeError: db down', logs.output[1])
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=3, EMAIL_OUTBOX_RETRY_BASE=60)
+    def test_failures_back_off_then_give_up(self):
+        from django.core.mail.backends.locmem import EmailBackend
+        from django.utils import timezone
+        from .models import OutboundEmail
+
+        email = email_outbox.enqueue('Hi', 'Body', ['outbox@example.com'], category='test')
+        delays = []
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=ValueError('mailbox full')):
+            for attempt in (1, 2, 3):
+                before = timezone.now()
+                self.assertEqual(email_outbox.process_pending(), {'sent': 0, 'failed': 1})
+                email.refresh_from_db()
+                self.assertEqual((email.attempts, email.last_error), (attempt, 'mailbox full'))
+                if attempt < 3:
+                    self.assertEqual(email.status, 'pending')
+                    delays.append((email.next_attempt_at - before).total_seconds())
+                    # Not due yet, so the next pass leaves it alone
+                    self.assertEqual(email_outbox.process_pending(), {'sent': 0, 'failed': 0})
+                    OutboundEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(email.status, 'failed')
+        self.assertTrue(30 <= delays[0] <= 61, delays)
+        self.assertTrue(60 <= delays[1] <= 121, delays)
+        self.assertEqual(mail.outbox, [])
+
+        # A dead worker's claim is released after the lock timeout
+        OutboundEmail.objects.filter(pk=email.pk).update(status='sending', claimed_at=timezone.now())
+        with override_settings(EMAIL_OUTBOX_LOCK_TIMEOUT=-1):
+            self.assertEqual(email_outbox.release_stale_claims(), 1)
+
+    def test_staff_ticket_reply_notifies_and_queues_email(self):
+        from django.contrib.auth.models import User
+        from rest_framework.test import force_authenticate
+        from .admin_ticket_views import admin_reply_ticket
+        from .models import Notification, OutboundEmail
+        from .ticket_models import SupportTicket
+
+        admin = User.objects.create_user(username='agent', password='x', is_staff=True)
+        ticket = SupportTicket.objects.create(user=self.user, subject='Payout missing', description='...')
+        request = APIRequestFactory().post('/', {'message': 'We have re-sent your payout.'}, format='json')
+        force_authenticate(request, user=admin)
+        self.assertEqual(admin_reply_ticket(request, ticket_id=ticket.id).status_code, 201)
+
+        titles = set(Notification.objects.filter(user=self.user, notification_type='support').values_list('title', flat=True))
+        self.assertEqual(titles, {f'Ticket Updated: {ticket.ticket_id}', f'Support Response: {ticket.ticket_id}'})
+        email = OutboundEmail.objects.get(category='ticket')
+        self.assertIn('We have re-sent your payout.', email.body)
+        self.assertEqual(mail.outbox, [])
+
+
+@override_settings(NOTIFICATION_FANOUT_INLINE=False, NOTIFICATION_FANOUT_INLINE_MAX=5, NOTIFICATION_FANOUT_BATCH_SIZE=4)
+class NotificationFanoutTests(TestCase):
+    """Audience notifications are bulk-inserted in batches and published once per audience group"""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.admin = User.objects.create_user(username='fanout_admin', password='x', is_staff=True)
+        self.freelancers = []
+        for i in range(11):
+            user = User.objects.create_user(username=f'fan{i}', password='x')
+            UserProfile.objects.create(user=user, user_type='freelancer' if i < 3 else 'client')
+            self.freelancers += [user] if i < 3 else []
+
+    def send(self, user_type):
+        from rest_framework.test import force_authenticate
+        from .views import send_system_notification
+
+        request = APIRequestFactory().post('/', {'title': 'Maintenance', 'message': 'Tonight', 'user_type': user_type}, format='json')
+        force_authenticate(request, user=self.admin)
+        return send_system_notification(request)
+
+    def test_small_audience_is_written_inline_and_published_once(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from django.test.utils import CaptureQueriesContext
+        from .models import Notification
+
+        layer = get_channel_layer()
+        async_to_sync(layer.group_add)('audience_freelancer', 'test.fanout')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.send('freelancer')
+        self.assertEqual((response.status_code, response.data['count']), (200, 3))
+        self.assertEqual(
+            sorted(Notification.objects.filter(title='Maintenance').values_list('user_id', flat=True)),
+            [user.id for user in self.freelancers],
+        )
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "api_notification"')]
+        self.assertEqual(len(inserts), 1)
+
+        event = async_to_sync(layer.receive)('test.fanout')
+        self.assertEqual((event['type'], event['notification']['title']), ('notification_broadcast', 'Maintenance'))
+        async_to_sync(layer.group_discard)('audience_freelancer', 'test.fanout')
+
+    def test_large_audience_runs_in_background_and_resumes(self):
+        from .models import Notification, NotificationBroadcast
+
+        from django.contrib.auth.models import User
+
+        response = self.send('all')
+        total = User.objects.filter(is_active=True).count()
+        self.assertEqual((response.status_code, response.data['count']), (202, total))
+        self.assertFalse(Notification.objects.exists())
+
+        real_bulk_create = Notification.objects.bulk_create
+        calls = itertools.count()
+
+        def crash_on_second_batch(objs, *args, **kwargs):
+            if next(calls) == 1:
+                raise RuntimeError('worker killed')
+            return real_bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(Notification.objects, 'bulk_create', crash_on_second_batch), \
+                mock.patch.object(notification_fanout, 'publish') as publish, self.assertRaises(RuntimeError):
+            notification_fanout.process_pending()
+        broadcast = NotificationBroadcast.objects.get(id=response.data['broadcast_id'])
+        self.assertEqual((broadcast.status, broadcast.total_created), ('running', 4))
+        publish.assert_not_called()
+
+        with override_settings(NOTIFICATION_FANOUT_LOCK_TIMEOUT=-1), \
+                mock.patch.object(notification_fanout, 'publish') as publish:
+            self.assertEqual(notification_fanout.process_pending(), {'broadcasts': 1, 'notifications': total - 4})
+        publish.assert_called_once()
+        broadcast.refresh_from_db()
+        self.assertEqual((broadcast.status, broadcast.total_created), ('done', total))
+        user_ids = list(Notification.objects.values_list('user_id', flat=True))
+        self.assertEqual(sorted(user_ids), sorted(User.objects.filter(is_active=True).values_list('id', flat=True)))
+
+
+class NotificationPushTests(TestCase):
+    """Notifications are pushed to the user's WebSocket group once committed"""
+
+    def test_created_notifications_are_published_after_commit(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from django.contrib.auth.models import User
+        from django.db import transaction
+        from .models import Notification
+        from .notification_service import NotificationService
+
+        user = User.objects.create_user(username='pushed', password='x')
+        layer = get_channel_layer()
+        async_to_sync(layer.group_add)(f'user_{user.id}', 'test.push')
+        try:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                notification = NotificationService.create_notification(user, 'Order delivered', 'Check it out', 'order')
+            self.assertEqual(len(callbacks), 1)
+            event = async_to_sync(layer.receive)('test.push')
+            self.assertEqual(event['type'], 'notification')
+            self.assertEqual(
+                (event['notification']['id'], event['notification']['title'], event['notification']['notification_type']),
+                (notification.id, 'Order delivered', 'order'),
+            )
+
+            # Rolled back notifications are never pushed
+            with mock.patch.object(notification_fanout, 'publish_to_user') as publish:
+                with self.captureOnCommitCallbacks(execute=True):
+                    with self.assertRaises(RuntimeError), transaction.atomic():
+                        Notification.objects.create(user=user, title='Lost', message='', notification_type='system')
+                        raise RuntimeError('rollback')
+                publish.assert_not_called()
+        finally:
+            async_to_sync(layer.group_discard)(f'user_{user.id}', 'test.push')
+
+
+@override_settings(EMAIL_OUTBOX_INLINE=False)
+class NotificationDigestTests(TestCase):
+    """Daily/weekly email preferences are honoured with one digest per user and window"""
+
+    def setUp(self):
+        from datetime import datetime
+        from django.utils import timezone
+
+        # A Wednesday: the daily window is Tuesday, the weekly one the week before last Monday
+        self.now = timezone.make_aware(datetime(2026, 3, 4, 9, 0))
+        self.start, self.end = notification_digest.window('daily', self.now)
+
+    def _user(self, username, **preferences):
+        from django.contrib.auth.models import User
+        from .models import NotificationPreference
+
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password='x')
+        for category, frequency in preferences.items():
+            NotificationPreference.objects.create(
+                user=user, category=category, delivery_method='email', frequency=frequency,
+            )
+        return user
+
+    def _notify(self, user, notification_type, title, created_at=None):
+        from datetime import timedelta
+        from .models import Notification
+
+        notification = Notification.objects.create(user=user, title=title, message='', notification_type=notification_type)
+        Notification.objects.filter(pk=notification.pk).update(created_at=created_at or self.start + timedelta(hours=3))
+        return notification
+
+    def test_daily_digest_groups_categories_and_sends_once(self):
+        from datetime import timedelta
+        from .models import NotificationDigest, OutboundEmail
+
+        daily = self._user('daily_digest', order_updates='daily', messages='daily', payments='instant')
+        weekly = self._user('weekly_digest', order_updates='weekly')
+        nothing = self._user('no_digest')
+        self._notify(daily, 'order', 'Order delivered')
+        self._notify(daily, 'message', 'New message from Ann')
+        self._notify(daily, 'payment', 'Payment received')  # instant, not part of the digest
+        self._notify(daily, 'order', 'Too old', created_at=self.start - timedelta(hours=1))
+        self._notify(weekly, 'order', 'Weekly order')
+        self._notify(nothing, 'order', 'Nobody asked')
+
+        with self.assertNumQueries(9):
+            # Subscribed user ids, their preferences, sent digests and notifications in one query each,
+            # a savepoint with the digest and outbox rows for the one recipient, then the empty next batch
+            self.assertEqual(notification_digest.send_digests('daily', now=self.now, batch_size=10), 1)
+
+        email = OutboundEmail.objects.get(category='digest')
+        self.assertEqual(email.to, ['daily_digest@example.com'])
+        self.assertIn('2 updates yesterday', email.subject)
+        for text in ('Order Updates', 'Messages', 'Order delivered', 'New message from Ann'):
+            self.assertIn(text, email.html_body)
+        for text in ('Payment received', 'Too old'):
+            self.assertNotIn(text, email.html_body)
+        self.assertEqual(NotificationDigest.objects.get(user=daily).notification_count, 2)
+
+        # A second run for the same window sends nothing
+        self.assertEqual(notification_digest.send_digests('daily', now=self.now), 0)
+        self.assertEqual(OutboundEmail.objects.filter(category='digest').count(), 1)
+
+    def test_preferences_serializer_loads_preferences_once_per_list(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import Notification, NotificationPreference
+        from .serializers import NotificationWithPreferencesSerializer
+
+        user = self._user('serialized', order_updates='instant')
+        NotificationPreference.objects.create(user=user, category='messages', delivery_method='push')
+        for i in range(5):
+            self._notify(user, 'order', f'Order {i}')
+            self._notify(user, 'message', f'Message {i}')
+
+        notifications = Notification.objects.filter(user=user).order_by('id')
+        with CaptureQueriesContext(connection) as queries:
+            data = NotificationWithPreferencesSerializer(notifications, many=True).data
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(
+            {(row['notification_type'], row['can_email'], row['can_push']) for row in data},
+            {('order', True, False), ('message', False, True)},
+        )
+
+
+class NotificationRetentionTests(TestCase):
+    """Old read notifications move to the archive table in chunks; unread and recent ones stay"""
+
+    def test_archives_only_old_read_notifications(self):
+        from datetime import timedelta
+        from django.contrib.auth.models import User
+        from django.utils import timezone
+        from .models import ArchivedNotification, Notification
+
+        user = User.objects.create_user(username='retained', password='x')
+        old = timezone.now() - timedelta(days=120)
+        rows = {}
+        for title, is_read, created_at in (
+            ('old read 1', True, old), ('old read 2', True, old), ('old read 3', True, old),
+            ('old unread', False, old), ('recent read', True, timezone.now()),
+        ):
+            notification = Notification.objects.create(
+                user=user, title=title, message='body', notification_type='order', is_read=is_read,
+            )
+            Notification.objects.filter(pk=notification.pk).update(created_at=created_at)
+            rows[title] = notification
+
+        out = StringIO()
+        call_command('archive_notifications', '--days', '90', '--dry-run', stdout=out)
+        self.assertIn('Notifications to archive: 3', out.getvalue())
+        self.assertEqual(ArchivedNotification.objects.count(), 0)
+
+        self.assertEqual(notification_retention.archive_read_notifications(days=90, batch_size=2), 3)
+        self.assertEqual(
+            set(Notification.objects.filter(user=user).values_list('title', flat=True)), {'old unread', 'recent read'},
+        )
+        archived = ArchivedNotification.objects.get(title='old read 1')
+        self.assertEqual(
+            (archived.user_id, archived.message, archived.notification_type, archived.created_at),
+            (user.id, 'body', 'order', old),
+        )
+        self.assertEqual(notification_retention.archive_read_notifications(days=90), 0)
+
+
+class FakeSMSProvider:
+    def __init__(self, name, failing=False):
+        self.name = name
+        self.failing = failing
+        self.sent = []
+
+    def configured(self):
+        return True
+
+    def send(self, session, timeout, phone_number):
+        if self.failing:
+            raise SMSProviderError('timed out')
+        self.sent.append(phone_number)
+        return {'success': True, 'session_info': f'{self.name}_session_{phone_number}_123456', 'provider': self.name}
+
+
+@override_settings(
+    TWILIO_ACCOUNT_SID=None, VONAGE_API_KEY=None, SMS_BREAKER_THRESHOLD=2, SMS_BREAKER_RESET_TIMEOUT=60,
+    SMS_PHONE_RATE_PER_HOUR=1, SMS_PHONE_BURST=3, SMS_IP_RATE_PER_HOUR=1, SMS_IP_BURST=5,
+)
+class SMSDispatcherTests(SimpleTestCase):
+    """Verification SMS fail over between providers, behind circuit breakers and per-phone/IP limits"""
+
+    def test_failover_opens_breaker_on_failing_provider(self):
+        down, up = FakeSMSProvider('down', failing=True), FakeSMSProvider('up')
+        dispatcher = SMSDispatcher(providers=[down, up])
+
+        for i in range(4):
+            result = dispatcher.send_verification_code(f'+25470000000{i}')
+            self.assertEqual((result['success'], result['provider']), (True, 'up'))
+        self.assertEqual(len(up.sent), 4)
+        metrics = dispatcher.metrics()
+        # Two failures open the breaker, so the last two sends go straight to the next provider
+        self.assertEqual((metrics['down']['failed'], metrics['down']['skipped'], metrics['down']['breaker']), (2, 2, 'open'))
+        self.assertEqual(metrics['up']['sent'], 4)
+
+        up.failing = True
+        self.assertFalse(dispatcher.send_verification_code('+254700000009')['success'])
+
+    def test_breaker_lets_one_trial_through_after_reset_timeout(self):
+        now = [0.0]
+        breaker = CircuitBreaker(threshold=1, reset_timeout=30, clock=lambda: now[0])
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        now[0] = 31
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        now[0] = 62
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_rate_limits_per_phone_and_ip_before_any_provider(self):
+        dispatcher = SMSDispatcher()
+        with mock.patch.object(SMSService, '_send_mock_sms', wraps=SMSService._send_mock_sms) as send_mock:
+            results = [dispatcher.send_verification_code('+254711111111', '10.0.0.1') for _ in range(4)]
+            self.assertEqual([r['success'] for r in results], [True, True, True, False])
+            self.assertTrue(results[-1]['rate_limited'])
+            # The IP has two sends left for other numbers
+            results = [dispatcher.send_verification_code(f'+25472222222{i}', '10.0.0.1') for i in range(3)]
+            self.assertEqual([r['success'] for r in results], [True, True, False])
+        self.assertEqual(send_mock.call_count, 5)
+        self.assertEqual(dispatcher.metrics()['all']['rate_limited'], 2)
+
+
+@override_settings(TWILIO_ACCOUNT_SID=None, VONAGE_API_KEY=None)
+class PhoneVerificationTests(TestCase):
+    """The code sent by send_phone_verification verifies the phone through verify_phone_number"""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        sms_dispatcher.phone_limiter.reset()
+        sms_dispatcher.ip_limiter.reset()
+        cache.clear()
+        self.user = User.objects.create_user(username='phone_user', password='x')
+        UserProfile.objects.create(user=self.user)
+        self.factory = APIRequestFactory()
+
+    def _post(self, view, data):
+        from rest_framework.test import force_authenticate
+
+        request = self.factory.post('/api/auth/', data, format='json')
+        force_authenticate(request, user=self.user)
+        return view(request)
+
+    def test_sms_code_round_trip(self):
+        from .views import send_phone_verification, verify_phone_number
+
+        with mock.patch.object(SMSService, '_send_mock_sms', wraps=SMSService._send_mock_sms) as send_mock:
+            response = self._post(send_phone_verification, {'phone_number': '+254 712 345 678'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('verification_code', response.data)
+        phone, code = send_mock.call_args.args
+        self.assertEqual(phone, '+254712345678')
+
+        wrong = '000000' if code != '000000' else '111111'
+        self.assertEqual(self._post(verify_phone_number, {'code': wrong}).status_code, 400)
+        response = self._post(verify_phone_number, {'code': code})
+        self.assertEqual(response.status_code, 200)
+        self.user.userprofile.refresh_from_db()
+        self.assertEqual((self.user.userprofile.phone_number, self.user.userprofile.phone_verified), (phone, True))
+        # The code is single use
+        self.assertEqual(self._post(verify_phone_number, {'code': code}).status_code, 400)
+
+    def test_verifying_keeps_a_balance_credited_meanwhile(self):
+        from .views import send_phone_verification, verify_phone_number
+
+        with mock.patch.object(SMSService, '_send_mock_sms', wraps=SMSService._send_mock_sms) as send_mock:
+            self._post(send_phone_verification, {'phone_number': '+254712345678'})
+        code = send_mock.call_args.args[1]
+
+        real_verify_code = SMSService.verify_code
+
+        def credit_then_verify(session_info, provided_code):
+            # A payment lands after the view has loaded the profile, before it saves it
+            BalanceService.credit(self.user, Decimal('25.00'), entry_type='payment', reference='phone_race')
+            return real_verify_code(session_info, provided_code)
+
+        with mock.patch.object(SMSService, 'verify_code', side_effect=credit_then_verify):
+            self.assertEqual(self._post(verify_phone_number, {'code': code}).status_code, 200)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertTrue(profile.phone_verified)
+        self.assertEqual(profile.available_balance, Decimal('25.00'))
+
+    def test_repeated_requests_for_one_number_are_throttled(self):
+        from .views import send_phone_verification
+
+        statuses = [
+            self._post(send_phone_verification, {'phone_number': '+254712345678'}).status_code
+            for _ in range(settings.SMS_PHONE_BURST + 1)
+        ]
+        self.assertEqual(statuses[-1], 429)
+        self.assertEqual(set(statuses[:-1]), {200})
+
+    @override_settings(PHONE_VERIFICATION_MAX_ATTEMPTS=2)
+    def test_pending_code_is_stored_and_guesses_are_limited(self):
+        from .models import PhoneVerification
+        from .views import send_phone_verification, verify_phone_number
+
+        with mock.patch.object(SMSService, '_send_mock_sms', wraps=SMSService._send_mock_sms) as send_mock:
+            self._post(send_phone_verification, {'phone_number': '+254712345678'})
+        code = send_mock.call_args.args[1]
+        # Shared by every worker through the database, not a per-process cache
+        cache.clear()
+        self.assertEqual(PhoneVerification.objects.get(user=self.user).phone_number, '+254712345678')
+
+        wrong = '000000' if code != '000000' else '111111'
+        for _ in range(2):
+            self.assertEqual(self._post(verify_phone_number, {'code': wrong}).status_code, 400)
+        # Out of guesses: even the right code needs a new one
+        self.assertEqual(self._post(verify_phone_number, {'code': code}).status_code, 400)
+        self.assertFalse(PhoneVerification.objects.exists())
+
+    def test_client_ip_trusts_only_configured_proxies(self):
+        from .views import client_ip
+
+        request = self.factory.post('/', HTTP_X_FORWARDED_FOR='6.6.6.6, 203.0.113.7', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(client_ip(request), '10.0.0.2')
+        with override_settings(TRUSTED_PROXY_COUNT=1):
+            self.assertEqual(client_ip(request), '203.0.113.7')
+        with override_settings(TRUSTED_PROXY_COUNT=3):
+            self.assertEqual(client_ip(request), '10.0.0.2')
+
+    def test_forged_forwarded_for_does_not_evade_ip_limit(self):
+        from rest_framework.test import force_authenticate
+        from .views import send_phone_verification
+
+        statuses = []
+        for i in range(settings.SMS_IP_BURST + 1):
+            request = self.factory.post(
+                '/api/auth/', {'phone_number': f'+2547123456{i:02d}'}, format='json',
+                HTTP_X_FORWARDED_FOR=f'198.51.100.{i}',
+            )
+            force_authenticate(request, user=self.user)
+            statuses.append(send_phone_verification(request).status_code)
+        self.assertEqual(statuses[-1], 429)
@@ -2,9 +2,19 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Transaction, UserProfile
+from .balance_service import BalanceService
+from .exports import iter_csv
+from .models import Transaction
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction as db_transaction
+from django.db.models import Count, Q, Sum
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime
 from decimal import Decimal
+import binascii
 import logging
 
 logger = logging.getLogger(__name__)
@@ -30,21 +40,23 @@ def record_transaction(request):
             freelancer = None
         
         if freelancer:
-            # Create transaction record
-            transaction = Transaction.objects.create(
-                user=freelancer,
-                transaction_type='payment',
-                amount=amount,
-                description=f'Payment for {project}',
-                reference=reference,
-                status='completed'
-            )
-            
-            # Update freelancer's total earnings
-            profile, created = UserProfile.objects.get_or_create(user=freelancer)
-            profile.total_earnings += Decimal(str(amount))
-            profile.available_balance += Decimal(str(amount))
-            profile.save()
+            with db_transaction.atomic():
+                # Create transaction record
+                transaction = Transaction.objects.create(
+                    user=freelancer,
+                    transaction_type='payment',
+                    amount=amount,
+                    description=f'Payment for {project}',
+                    reference=reference,
+                    status='completed'
+                )
+                
+                # Update freelancer's total earnings
+                BalanceService.apply(
+                    freelancer, entry_type='payment', reference=reference,
+                    idempotency_key=f'transaction:{reference}',
+                    available_balance=Decimal(str(amount)), total_earnings=Decimal(str(amount)),
+                )
             
             return Response({
                 'status': 'success',
@@ -61,30 +73,127 @@ def record_transaction(request):
         logger.error(f'Transaction recording error: {e}')
         return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+TRANSACTION_PAGE_SIZE = 50
+MAX_TRANSACTION_PAGE_SIZE = 200
+STATEMENT_FIELDS = ('created_at', 'reference', 'transaction_type', 'status', 'description', 'amount')
+
+
+def encode_cursor(created_at, pk):
+    return urlsafe_b64encode(f'{created_at.isoformat()}|{pk}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor returned by encode_cursor; ValueError if it's malformed"""
+    try:
+        created_at, pk = urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, TypeError) as e:
+        raise ValueError(str(e))
+
+
+def filter_transactions(request):
+    """The user's transactions narrowed by the type/status/date query parameters; ValueError on a bad date"""
+    transactions = Transaction.objects.filter(user=request.user)
+    params = request.query_params
+    if params.get('type'):
+        transactions = transactions.filter(transaction_type__in=params['type'].split(','))
+    if params.get('status'):
+        transactions = transactions.filter(status__in=params['status'].split(','))
+    if params.get('start_date'):
+        transactions = transactions.filter(created_at__date__gte=date.fromisoformat(params['start_date']))
+    if params.get('end_date'):
+        transactions = transactions.filter(created_at__date__lte=date.fromisoformat(params['end_date']))
+    return transactions
+
+
+def summarize_transactions(transactions):
+    """Totals and counts per transaction type, computed by the database"""
+    summary = {'totals': {}, 'count': 0}
+    rows = transactions.values('transaction_type').annotate(total=Sum('amount'), count=Count('id')).order_by()
+    for row in rows:
+        summary['totals'][row['transaction_type']] = {'amount': float(row['total']), 'count': row['count']}
+        summary['count'] += row['count']
+    return summary
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_transactions(request):
-    """Get user's transaction history"""
+    """Get user's transaction history, newest first.
+
+    Keyset-paginated on (created_at, id): pass the returned ``next_cursor``
+    back as ``cursor`` for the next page, so deep pages cost the same as the
+    first. Filters: ``type`` and ``status`` (comma-separated), ``start_date``
+    and ``end_date`` (YYYY-MM-DD). The summary covers every filtered row, not
+    just the page.
+    """
     try:
-        transactions = Transaction.objects.filter(user=request.user).order_by('-created_at')
-        
-        transaction_data = []
-        for transaction in transactions:
-            transaction_data.append({
-                'id': transaction.id,
-                'type': transaction.transaction_type,
-                'amount': float(transaction.amount),
-                'description': transaction.description,
-                'reference': transaction.reference,
-                'status': transaction.status,
-                'created_at': transaction.created_at.isoformat()
-            })
-        
-        return Response({
+        try:
+            limit = min(int(request.query_params.get('limit', TRANSACTION_PAGE_SIZE)), MAX_TRANSACTION_PAGE_SIZE)
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(limit, 1)
+
+        try:
+            transactions = filter_transactions(request)
+        except ValueError:
+            return Response({'error': 'Dates must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        page = transactions.order_by('-created_at', '-id')
+        if request.query_params.get('cursor'):
+            try:
+                created_at, pk = decode_cursor(request.query_params['cursor'])
+            except ValueError:
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+            page = page.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+        rows = list(page.values('id', 'transaction_type', 'amount', 'description', 'reference', 'status', 'created_at')[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        transaction_data = [{
+            'id': row['id'],
+            'type': row['transaction_type'],
+            'amount': float(row['amount']),
+            'description': row['description'],
+            'reference': row['reference'],
+            'status': row['status'],
+            'created_at': row['created_at'].isoformat()
+        } for row in rows]
+
+        response_data = {
             'status': 'success',
-            'transactions': transaction_data
-        })
+            'transactions': transaction_data,
+            'next_cursor': encode_cursor(rows[-1]['created_at'], rows[-1]['id']) if has_more else None,
+            'has_more': has_more,
+        }
+        # The totals don't change from page to page; only compute them for the first one
+        if not request.query_params.get('cursor'):
+            response_data['summary'] = summarize_transactions(transactions)
+        return Response(response_data)
         
     except Exception as e:
         logger.error(f'Transaction retrieval error: {e}')
-        return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_transaction_statement(request):
+    """Stream the user's transactions as a CSV statement, oldest first.
+
+    Accepts the same filters as get_transactions. Rows are read with
+    ``iterator()`` and written line by line, so any history size streams in
+    constant memory.
+    """
+    try:
+        transactions = filter_transactions(request)
+    except ValueError:
+        return Response({'error': 'Dates must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+
+    chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    rows = transactions.order_by('created_at', 'id').values(*STATEMENT_FIELDS).iterator(chunk_size=chunk_size)
+
+    filename = f"statement_{request.user.username}_{timezone.now().strftime('%Y%m%d')}.csv"
+    response = StreamingHttpResponse(iter_csv(rows, STATEMENT_FIELDS), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
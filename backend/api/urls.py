@@ -247,6 +247,10 @@ urlpatterns = [
     path('admin/projects/', views.AdminProjectListView.as_view(), name='admin-project-list'),
     path('admin/transactions/', views.AdminTransactionListView.as_view(), name='admin-transaction-list'),
     path('admin/activity/', views.AdminActivityListView.as_view(), name='admin-activity-list'),
+    path('admin/users/export/', views.AdminUserExportView.as_view(), name='admin-user-export'),
+    path('admin/orders/export/', views.AdminOrderExportView.as_view(), name='admin-order-export'),
+    path('admin/transactions/export/', views.AdminTransactionExportView.as_view(), name='admin-transaction-export'),
+    path('admin/activity/export/', views.AdminActivityExportView.as_view(), name='admin-activity-export'),
     
     # Dispute Management URLs
     path('disputes/', views.DisputeListView.as_view(), name='dispute-list'),
@@ -287,6 +291,7 @@ urlpatterns = [
     # Error Management (Admin)
     path('admin/errors/', views.ErrorLogListView.as_view(), name='error-log-list'),
     path('admin/errors/<int:error_id>/resolve/', views.mark_error_resolved, name='mark-error-resolved'),
+    path('admin/profiling/', views.profiling_stats, name='profiling-stats'),
     
     # Analytics URLs
     path('analytics/user/', views.user_analytics, name='user-analytics'),
@@ -6,12 +6,12 @@ from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
 from django.contrib.auth import login, logout, authenticate
-from django.db.models import Q, Avg
+from django.db.models import Q, Avg, Count, F
 from django.utils import timezone
 from rest_framework.exceptions import ValidationError, PermissionDenied
+from datetime import timedelta
 from decimal import Decimal
 from django_filters.rest_framework import DjangoFilterBackend
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
@@ -19,6 +19,7 @@ import uuid
 import secrets
 import random
 import string
+import logging
 from .models import (
     UserProfile, ProfessionalDocument, Category, Subcategory, Gig, Order, OrderDeliverable, Project, Task, TaskProposal,
     Review, Message, Portfolio, Withdrawal, HelpRequest, Conversation, Team, GroupJoinRequest,
@@ -26,7 +27,7 @@ from .models import (
     Course, Lesson, Enrollment, SkillAssessment, AssessmentQuestion, AssessmentAttempt, SkillBadge, CourseReview,
     Dispute, ContentReport, AdminAction, SystemSettings, NotificationPreference, NotificationTemplate, ErrorLog,
     UserAnalytics, PlatformAnalytics, AnalyticsEvent, ThirdPartyIntegration, IntegrationSync, Like,
-    AIConversation, AIMessage, FreelancerProfile, ClientProfile
+    AIConversation, AIMessage, FreelancerProfile, ClientProfile, PhoneVerification
 )
 from .serializers import (
     UserSerializer, UserProfileSerializer, ProfessionalDocumentSerializer, UserRegistrationSerializer, 
@@ -46,8 +47,17 @@ from .serializers import (
     AIConversationSerializer, AIMessageSerializer, EnhancedUserSerializer, ProfileCompletionSerializer
 )
 from .profile_serializers import FreelancerProfileSerializer, ClientProfileSerializer
+from .exports import StreamingExportMixin
+from .log_utils import debug_event
+from . import email_outbox, notification_fanout
+from .balance_service import BalanceService
+from .mail_dispatcher import mail_dispatcher
+from .sms_dispatcher import sms_dispatcher
+from .sms_service import SMSService
 from rest_framework import serializers
 
+logger = logging.getLogger(__name__)
+
 def send_verification_email(user, token):
     """Send email verification using an HTML template (consistent with contact emails)."""
     verification_url = f"{settings.FRONTEND_URL}/verify-email?token={token}"
@@ -61,25 +71,17 @@ def send_verification_email(user, token):
         html_content = render_to_string('emails/verify_email.html', context)
         text_content = strip_tags(html_content)
 
-        print(f"Attempting to send email to: {user.email}")
-        print(f"SMTP settings: {settings.EMAIL_HOST}:{settings.EMAIL_PORT}")
-        print(f"From email: {settings.DEFAULT_FROM_EMAIL}")
-        print(f"Verification URL: {verification_url}")
-
-        send_mail(
+        # Delivered by the outbox worker so a slow SMTP server doesn't hold up signup
+        email_outbox.enqueue(
             subject,
             text_content,
-            settings.DEFAULT_FROM_EMAIL,
             [user.email],
             html_message=html_content,
-            fail_silently=False,
+            category='verification',
         )
-        print(f"Email sent successfully to {user.email}")
-        print(f"Verification link: {verification_url}")
-    except Exception as e:
-        print(f"Failed to send verification email to {user.email}: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.info(f"Verification email queued for {user.email}")
+    except Exception:
+        logger.exception(f"Failed to queue verification email for {user.email}")
 
 def send_password_reset_email(user, token):
     """Send password reset email"""
@@ -102,22 +104,10 @@ The Neurolancer Team
     '''
     
     try:
-        print(f"Attempting to send password reset email to: {user.email}")
-        print(f"Reset URL: {reset_url}")
-        
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email],
-            fail_silently=False,
-        )
-        print(f"Password reset email sent successfully to {user.email}")
-        print(f"Reset link: {reset_url}")
-    except Exception as e:
-        print(f"Failed to send password reset email to {user.email}: {e}")
-        import traceback
-        traceback.print_exc()
+        email_outbox.enqueue(subject, message, [user.email], category='password_reset')
+        logger.info(f"Password reset email queued for {user.email}")
+    except Exception:
+        logger.exception(f"Failed to queue password reset email for {user.email}")
 
 # Enhanced Authentication Views
 @api_view(['POST'])
@@ -145,7 +135,7 @@ def register(request):
         profile.email_verified = False
         profile.email_verification_token = verification_token
         profile.email_verification_sent_at = timezone.now()
-        profile.save()
+        profile.save(update_fields=['email_verified', 'email_verification_token', 'email_verification_sent_at', 'updated_at'])
         
         # Process referral if provided
         referral_code = request.data.get('referral_code')
@@ -208,7 +198,7 @@ def complete_profile(request):
         # Mark profile as completed
         profile = serializer.save()
         profile.profile_completed = True
-        profile.save()
+        profile.save(update_fields=['profile_completed', 'updated_at'])
         
         return Response({
             'message': 'Profile completed successfully',
@@ -218,10 +208,19 @@ def complete_profile(request):
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def client_ip(request):
+    """The client's address: REMOTE_ADDR, or the X-Forwarded-For entry added by the outermost trusted proxy"""
+    proxies = settings.TRUSTED_PROXY_COUNT
+    forwarded = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+    if proxies and len(forwarded) >= proxies:
+        # Entries left of this one came from the client and can be forged
+        return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def send_phone_verification(request):
-    """Send phone verification code using Firebase"""
+    """Text a verification code to the user's phone (providers, failover and rate limits in sms_dispatcher)"""
     phone_number = request.data.get('phone_number')
     
     if not phone_number:
@@ -248,16 +247,36 @@ def send_phone_verification(request):
             defaults={'user_type': 'client'}
         )
         
-        # Store phone number for client-side verification
+        # Store phone number for verification
         profile.phone_number = clean_phone
-        profile.save()
+        profile.save(update_fields=['phone_number', 'updated_at'])
         
-        return Response({
-            'success': True,
-            'message': 'Ready for client-side Firebase verification',
+        result = SMSService.send_verification_code(clean_phone, client_ip(request))
+        
+        if result.get('rate_limited'):
+            return Response({'error': result['message']}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        if not result.get('success'):
+            return Response({
+                'error': result.get('message', 'Failed to send verification code'),
+                'details': result.get('error') if settings.DEBUG else 'Please try again later'
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        
+        # The session (which may carry the code) stays on the server; verify_phone_number looks it up
+        PhoneVerification.objects.update_or_create(user=request.user, defaults={
             'phone_number': clean_phone,
-            'use_firebase': True
+            'session_info': result['session_info'],
+            'attempts': 0,
+            'expires_at': timezone.now() + timedelta(seconds=settings.PHONE_VERIFICATION_TTL),
         })
+        response = {
+            'success': True,
+            'message': 'Verification code sent',
+            'phone_number': clean_phone,
+            'provider': result.get('provider'),
+        }
+        if settings.DEBUG and result.get('mock'):
+            response['verification_code'] = result.get('verification_code')
+        return Response(response)
             
     except Exception as e:
         return Response({
@@ -268,18 +287,55 @@ def send_phone_verification(request):
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def verify_phone_number(request):
-    """Verify phone number with Firebase ID token"""
+    """Verify phone number with the SMS code from send_phone_verification, or a Firebase ID token"""
     firebase_token = request.data.get('firebase_token')
     phone_number = request.data.get('phone_number')
+    code = request.data.get('code')
     
-    if not firebase_token:
-        return Response({'error': 'Firebase token required'}, status=status.HTTP_400_BAD_REQUEST)
+    if not firebase_token and not code:
+        return Response({'error': 'Verification code or Firebase token required'}, status=status.HTTP_400_BAD_REQUEST)
     
     try:
         profile = request.user.userprofile
     except UserProfile.DoesNotExist:
         return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
     
+    if code:
+        pending = PhoneVerification.objects.filter(user=request.user, expires_at__gt=timezone.now()).first()
+        # A handful of guesses per code, then a new one has to be requested; each guess is
+        # counted before it is checked, so concurrent guesses can't exceed the limit
+        if pending is None or not PhoneVerification.objects.filter(
+            pk=pending.pk, attempts__lt=settings.PHONE_VERIFICATION_MAX_ATTEMPTS,
+        ).update(attempts=F('attempts') + 1):
+            PhoneVerification.objects.filter(user=request.user).delete()
+            return Response({
+                'error': 'No pending verification. Please request a new code.',
+                'verified': False
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        result = SMSService.verify_code(pending.session_info, str(code).strip())
+        if not result.get('verified'):
+            return Response({
+                'error': result.get('message', 'Invalid verification code'),
+                'verified': False
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Single use: only the request that deletes the session verifies the phone
+        if not PhoneVerification.objects.filter(pk=pending.pk).delete()[0]:
+            return Response({
+                'error': 'No pending verification. Please request a new code.',
+                'verified': False
+            }, status=status.HTTP_400_BAD_REQUEST)
+        profile.phone_number = pending.phone_number
+        profile.phone_verified = True
+        profile.save(update_fields=['phone_number', 'phone_verified', 'updated_at'])
+        return Response({
+            'success': True,
+            'message': 'Phone number verified successfully',
+            'phone_number': profile.phone_number,
+            'verified': True
+        })
+    
     try:
         # Verify Firebase ID token
         from .firebase_service import FirebaseService
@@ -290,7 +346,7 @@ def verify_phone_number(request):
             # Mark phone as verified
             profile.phone_number = phone_number or decoded_token.get('phone_number')
             profile.phone_verified = True
-            profile.save()
+            profile.save(update_fields=['phone_number', 'phone_verified', 'updated_at'])
             
             return Response({
                 'success': True,
@@ -470,7 +526,7 @@ def google_auth(request):
                 profile.google_photo_url = photo_url
                 if profile.avatar_type not in ['upload', 'google']:
                     profile.avatar_type = 'google'
-            profile.save()
+            profile.save(update_fields=['email_verified', 'google_id', 'google_photo_url', 'avatar_type', 'updated_at'])
         
         # Send welcome email and notifications for new Google users
         if is_new_user:
@@ -545,7 +601,7 @@ def verify_email(request):
         profile.email_verified = True
         profile.email_verification_token = None
         profile.email_verification_sent_at = None
-        profile.save()
+        profile.save(update_fields=['email_verified', 'email_verification_token', 'email_verification_sent_at', 'updated_at'])
         
         # Process referral verification if user was referred
         try:
@@ -576,7 +632,7 @@ def resend_verification_email(request):
     verification_token = secrets.token_urlsafe(32)
     profile.email_verification_token = verification_token
     profile.email_verification_sent_at = timezone.now()
-    profile.save()
+    profile.save(update_fields=['email_verification_token', 'email_verification_sent_at', 'updated_at'])
     
     # Send verification email
     send_verification_email(request.user, verification_token)
@@ -627,7 +683,7 @@ def forgot_password(request):
         profile = user.userprofile
         profile.password_reset_token = reset_token
         profile.password_reset_sent_at = timezone.now()
-        profile.save()
+        profile.save(update_fields=['password_reset_token', 'password_reset_sent_at', 'updated_at'])
         
         # Send password reset email
         send_password_reset_email(user, reset_token)
@@ -700,7 +756,7 @@ def reset_password(request):
         # Clear reset token
         profile.password_reset_token = None
         profile.password_reset_sent_at = None
-        profile.save()
+        profile.save(update_fields=['password_reset_token', 'password_reset_sent_at', 'updated_at'])
         
         return Response({
             'message': 'Password reset successfully. You can now login with your new password.',
@@ -1000,6 +1056,13 @@ class GigDetailView(generics.RetrieveAPIView):
     queryset = Gig.objects.filter(is_active=True)
     serializer_class = GigSerializer
     permission_classes = [permissions.AllowAny]
+    
+    def retrieve(self, request, *args, **kwargs):
+        from .analytics_service import AnalyticsService
+        gig = self.get_object()
+        serializer = self.get_serializer(gig)
+        AnalyticsService.record_view(gig.freelancer_id, 'gig_views', viewer=request.user)
+        return Response(serializer.data)
 
 class GigCreateView(generics.CreateAPIView):
     queryset = Gig.objects.all()
@@ -1080,6 +1143,8 @@ class OrderCreateView(generics.CreateAPIView):
     def perform_create(self, serializer):
         # Simple order creation - let the serializer handle the logic
         order = serializer.save()
+        from .analytics_service import AnalyticsService
+        AnalyticsService.record_order_created(order)
         return order
 
 class OrderListView(generics.ListAPIView):
@@ -1110,13 +1175,8 @@ class FreelancerOrdersView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        # Force fresh query from database to avoid caching issues
-        queryset = Order.objects.filter(freelancer=self.request.user).order_by('-created_at')
-        # Debug logging
-        print(f"FreelancerOrdersView: Found {queryset.count()} orders for user {self.request.user.username}")
-        for order in queryset:
-            print(f"Order {order.id}: {order.title} - Status: {order.status}")
-        return queryset
+        debug_event(logger, 'freelancer_orders.list', user_id=self.request.user.id)
+        return Order.objects.filter(freelancer=self.request.user).order_by('-created_at')
 
 @csrf_exempt
 @api_view(['POST'])
@@ -1241,6 +1301,10 @@ def update_order_status(request, order_id):
     order.refresh_from_db()
     print(f"Order {order.id} status updated from {old_status} to {order.status} (requested: {new_status})")
     
+    # Keep the analytics projection in step with the transition
+    from .analytics_service import AnalyticsService
+    AnalyticsService.record_order_transition(order, old_status, new_status)
+    
     # Send notifications
     send_order_status_notification(order, old_status, new_status, progress_message, request.user)
     
@@ -1460,25 +1524,17 @@ class MessageListView(generics.ListAPIView):
     
     def list(self, request, *args, **kwargs):
         conversation_id = self.kwargs.get('conversation_id')
-        print(f"Loading messages for conversation {conversation_id} by user {request.user.username}")
         
-        # Force fresh database query with no caching
         conversation = Conversation.objects.filter(id=conversation_id, participants=request.user).first()
         if not conversation:
-            print(f"  No access to conversation {conversation_id}")
+            debug_event(logger, 'messages.list.denied', conversation_id=conversation_id, user_id=request.user.id)
             return Response([])
         
-        # Get messages directly from database with fresh query
         messages = Message.objects.filter(conversation=conversation).select_related('sender', 'sender__userprofile').order_by('created_at')
-        print(f"Found {messages.count()} messages in conversation {conversation_id}")
-        
-        # Log the latest messages for debugging
-        latest_messages = messages.order_by('-created_at')[:5]
-        for msg in latest_messages:
-            print(f"  Message {msg.id}: {msg.content[:50]}... (from {msg.sender.username} at {msg.created_at})")
-        
         serializer = self.get_serializer(messages, many=True)
-        return Response(serializer.data)
+        data = serializer.data
+        debug_event(logger, 'messages.list', conversation_id=conversation_id, user_id=request.user.id, count=lambda: len(data))
+        return Response(data)
 
 class MessageCreateView(generics.CreateAPIView):
     queryset = Message.objects.all()
@@ -1529,12 +1585,11 @@ class MessageCreateView(generics.CreateAPIView):
         conversation.updated_at = timezone.now()
         conversation.save()
         
-        # Force refresh message from database to ensure it's properly saved
-        message.refresh_from_db()
-        print(f"Message created: ID={message.id}, Content='{message.content[:50]}...', Sender={message.sender.username}, Conversation={conversation.id}, Created_at={message.created_at}")
+        debug_event(logger, 'messages.create', message_id=message.id, sender_id=message.sender_id, conversation_id=conversation.id)
         
-        # Force database commit by doing another query
-        Message.objects.filter(id=message.id).update(created_at=message.created_at)
+        # Fold the reply delay into the sender's response time
+        from .analytics_service import AnalyticsService
+        AnalyticsService.record_message_response(message)
         
         # Broadcast message via WebSocket
         self.broadcast_message(message)
@@ -1552,7 +1607,6 @@ class MessageCreateView(generics.CreateAPIView):
                 
                 # Serialize message data
                 message_data = MessageSerializer(message).data
-                print(f"Broadcasting message {message.id} to conversation {message.conversation.id} at {message.created_at}")
                 
                 # Send to conversation group
                 conversation_group = f"conversation_{message.conversation.id}"
@@ -1575,12 +1629,10 @@ class MessageCreateView(generics.CreateAPIView):
                             'message': message_data
                         }
                     )
-                print(f"Message broadcast completed for conversation {message.conversation.id}")
-        except Exception as e:
+                debug_event(logger, 'messages.broadcast', message_id=message.id, conversation_id=message.conversation_id)
+        except Exception:
             # Don't fail message creation if WebSocket fails
-            print(f"WebSocket broadcast failed: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('WebSocket broadcast failed for message %s', message.id)
 
 class MessageUpdateView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = MessageSerializer
@@ -1878,6 +1930,12 @@ class FreelancerProfileView(generics.RetrieveAPIView):
         except UserProfile.DoesNotExist:
             from django.http import Http404
             raise Http404("Freelancer profile not found")
+    
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        from .analytics_service import AnalyticsService
+        AnalyticsService.record_view(int(self.kwargs.get('user_id')), 'profile_views', viewer=request.user)
+        return response
 
 # Dashboard Views
 @api_view(['GET'])
@@ -1904,18 +1962,17 @@ def dashboard_stats(request):
         from django.db.models import Sum
         actual_earnings = completed_orders_qs.aggregate(total=Sum('price'))['total'] or 0
         
-        # Always use calculated earnings, not cached profile values
-        total_earnings = float(actual_earnings)
+        # Balances come from the ledger projection; only BalanceService writes them
+        total_earnings = float(profile.total_earnings)
         available_balance = float(profile.available_balance)
         
         # Update profile with correct data if needed
-        if profile.completed_gigs != completed_orders or abs(float(profile.total_earnings) - total_earnings) > 0.01:
+        if profile.completed_gigs != completed_orders:
             profile.completed_gigs = completed_orders
-            profile.total_earnings = total_earnings
-            profile.save()
-            print(f"Updated profile for {user.username}: completed_gigs={completed_orders}, total_earnings=${total_earnings}")
+            profile.save(update_fields=['completed_gigs', 'updated_at'])
+            debug_event(logger, 'dashboard.profile_corrected', user_id=user.id, completed_gigs=completed_orders)
         
-        print(f"Dashboard stats for {user.username}: completed_orders={completed_orders}, actual_earnings=${actual_earnings}")
+        debug_event(logger, 'dashboard.stats', user_id=user.id, completed_orders=completed_orders, earnings=actual_earnings)
         
         # Monthly earnings data
         monthly_earnings = []
@@ -2292,6 +2349,8 @@ def create_task_assignment(request):
         project=task.project,
         task=task
     )
+    from .analytics_service import AnalyticsService
+    AnalyticsService.record_order_created(order)
     
     # Update task status to show it has a pending assignment
     task.status = 'pending'
@@ -2863,6 +2922,8 @@ def accept_proposal(request, proposal_id):
         status='accepted',
         package_type='custom'
     )
+    from .analytics_service import AnalyticsService
+    AnalyticsService.record_order_created(order)
     
     # Send notifications
     try:
@@ -2974,18 +3035,17 @@ def update_job_status(request, job_id):
         Q(client=job.client) | Q(freelancer__in=accepted_freelancers)
     ).filter(title__icontains=job.title)
     
-    print(f"Job {job.id} status update to {new_status}:")
-    print(f"  - Accepted freelancers: {list(accepted_freelancers)}")
-    print(f"  - Found {orders.count()} related orders")
-    for order in orders:
-        print(f"  - Order {order.id}: {order.title} (current status: {order.status})")
-    
-    if new_status == 'completed':
-        updated_count = orders.update(status='completed', completed_at=timezone.now())
-        print(f"  - Updated {updated_count} orders to completed")
-    elif new_status == 'cancelled':
-        updated_count = orders.update(status='cancelled')
-        print(f"  - Updated {updated_count} orders to cancelled")
+    if new_status in ('completed', 'cancelled'):
+        # The bulk update skips Order.save(), so feed each status change to the analytics projection
+        from .analytics_service import AnalyticsService
+        changed = list(orders.exclude(status=new_status).only('id', 'client_id', 'freelancer_id', 'price', 'status'))
+        fields = {'status': new_status}
+        if new_status == 'completed':
+            fields['completed_at'] = timezone.now()
+        updated_count = Order.objects.filter(id__in=[order.id for order in changed]).update(**fields)
+        for order in changed:
+            AnalyticsService.record_order_transition(order, order.status, new_status)
+        debug_event(logger, 'job_status.orders_updated', job_id=job.id, status=new_status, count=updated_count)
     
     # Send notifications to relevant parties
     if job.client == request.user:
@@ -3126,25 +3186,26 @@ def process_job_payment(request, job_id):
     # Create payment reference
     payment_reference = f"job_{job.id}_order_{order.id}_{timezone.now().strftime('%Y%m%d%H%M%S')}"
     
+    # Import currency conversion function
+    from .payments import convert_kes_to_usd
+    
+    # Convert KES payment to USD for balance storage
+    payment_amount_kes = order.price  # Order price is in KES
+    payment_amount_usd = convert_kes_to_usd(payment_amount_kes)
+    
     # Process payment (simulate success for now)
     order.is_paid = True
     order.payment_reference = payment_reference
+    order.escrow_amount = payment_amount_usd
     if order.status in ['pending', 'accepted']:
         order.status = 'in_progress'
     order.save()
     
     # Hold funds in escrow (convert KES to USD)
-    freelancer_profile = order.freelancer.userprofile
-    
-    # Import currency conversion function
-    from .payments import convert_kes_to_usd
-    
-    # Convert KES payment to USD for balance storage
-    payment_amount_kes = order.price  # Order price is in KES
-    payment_amount_usd = convert_kes_to_usd(payment_amount_kes)
-    
-    freelancer_profile.escrow_balance += payment_amount_usd
-    freelancer_profile.save()
+    BalanceService.credit(
+        order.freelancer, payment_amount_usd, field='escrow_balance',
+        entry_type='payment', reference=payment_reference, idempotency_key=f'escrow:{payment_reference}',
+    )
     
     print(f"Job payment processed: Held {payment_amount_kes} KES (${payment_amount_usd:.2f} USD) in escrow for freelancer {order.freelancer.username}")
     
@@ -3276,25 +3337,26 @@ def process_order_payment(request, order_id):
     # Create payment reference
     payment_reference = f"order_{order.id}_{timezone.now().strftime('%Y%m%d%H%M%S')}"
     
+    # Import currency conversion function
+    from .payments import convert_kes_to_usd
+    
+    # Convert KES payment to USD for balance storage
+    payment_amount_kes = order.price  # Order price is in KES
+    payment_amount_usd = convert_kes_to_usd(payment_amount_kes)
+    
     # Process payment (simulate success for now)
     order.is_paid = True
     order.payment_reference = payment_reference
+    order.escrow_amount = payment_amount_usd
     if order.status in ['pending', 'accepted']:
         order.status = 'in_progress'
     order.save()
     
     # Hold funds in escrow
-    freelancer_profile = order.freelancer.userprofile
-    
-    # Import currency conversion function
-    from .payments import convert_kes_to_usd
-    
-    # Convert KES payment to USD for balance storage
-    payment_amount_kes = order.price  # Order price is in KES
-    payment_amount_usd = convert_kes_to_usd(payment_amount_kes)
-    
-    freelancer_profile.escrow_balance += payment_amount_usd
-    freelancer_profile.save()
+    BalanceService.credit(
+        order.freelancer, payment_amount_usd, field='escrow_balance',
+        entry_type='payment', reference=payment_reference, idempotency_key=f'escrow:{payment_reference}',
+    )
     
     print(f"Order payment processed: Held {payment_amount_kes} KES (${payment_amount_usd:.2f} USD) in escrow for freelancer {order.freelancer.username}")
     
@@ -3823,10 +3885,7 @@ class MyCoursesView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        # Force fresh query from database
-        enrollments = Enrollment.objects.filter(student=self.request.user).select_for_update()
-        course_ids = list(enrollments.values_list('course_id', flat=True))
-        return Course.objects.filter(id__in=course_ids)
+        return Course.objects.filter(enrollments__student=self.request.user)
     
     def list(self, request, *args, **kwargs):
         # Get fresh course data
@@ -3834,24 +3893,24 @@ class MyCoursesView(generics.ListAPIView):
         serializer = self.get_serializer(queryset, many=True)
         courses_data = serializer.data
         
-        # Force completely fresh enrollment data with no caching
-        enrollments = Enrollment.objects.filter(student=request.user).select_related('course').prefetch_related('completed_lessons')
+        enrollments = Enrollment.objects.filter(student=request.user).annotate(
+            total_lessons=Count('course__lessons', distinct=True),
+            completed_count=Count('completed_lessons', distinct=True),
+        )
         enrollment_dict = {}
         
-        print(f"MyCoursesView: Processing enrollments for user {request.user.username}")
-        
         for enrollment in enrollments:
-            # Force refresh from database
-            enrollment.refresh_from_db()
-            
             # Recalculate progress to ensure accuracy
-            total_lessons = enrollment.course.lessons.count()
-            completed_count = enrollment.completed_lessons.count()
+            total_lessons = enrollment.total_lessons
+            completed_count = enrollment.completed_count
             calculated_progress = (completed_count / total_lessons) * 100 if total_lessons > 0 else 0
             
             # Update progress if it doesn't match calculated value
             if abs(float(enrollment.progress_percentage or 0) - calculated_progress) > 0.01:
-                print(f"  Correcting progress for course {enrollment.course.id}: {enrollment.progress_percentage}% -> {calculated_progress}%")
+                debug_event(
+                    logger, 'my_courses.progress_corrected', enrollment_id=enrollment.id,
+                    old=enrollment.progress_percentage, new=calculated_progress,
+                )
                 enrollment.progress_percentage = calculated_progress
                 
                 # Update status based on progress
@@ -3862,15 +3921,9 @@ class MyCoursesView(generics.ListAPIView):
                 else:
                     enrollment.status = 'active'
                 
-                enrollment.save()
-                enrollment.refresh_from_db()
+                enrollment.save(update_fields=['progress_percentage', 'status', 'completed_at'])
             
             enrollment_dict[enrollment.course_id] = enrollment
-            
-            print(f"  Course {enrollment.course.id} ({enrollment.course.title}):")
-            print(f"    - Completed lessons: {completed_count}/{total_lessons}")
-            print(f"    - Progress: {float(enrollment.progress_percentage or 0)}%")
-            print(f"    - Status: {enrollment.status}")
         
         # Add enrollment data to each course
         for course_data in courses_data:
@@ -3883,12 +3936,10 @@ class MyCoursesView(generics.ListAPIView):
                 course_data['enrollment_date'] = enrollment.enrolled_at.isoformat()
                 course_data['completed_at'] = enrollment.completed_at.isoformat() if enrollment.completed_at else None
                 
-                # Add debug info
-                completed_count = enrollment.completed_lessons.count()
-                total_lessons = enrollment.course.lessons.count()
+                # Lesson counts shown by the my-courses page
                 course_data['debug_info'] = {
-                    'completed_lessons': completed_count,
-                    'total_lessons': total_lessons,
+                    'completed_lessons': enrollment.completed_count,
+                    'total_lessons': enrollment.total_lessons,
                     'enrollment_id': enrollment.id
                 }
             else:
@@ -3896,7 +3947,7 @@ class MyCoursesView(generics.ListAPIView):
                 course_data['status'] = 'not_enrolled'
                 course_data['debug_info'] = {'error': 'No enrollment found'}
         
-        print(f"MyCoursesView: Returning {len(courses_data)} courses")
+        debug_event(logger, 'my_courses.list', user_id=request.user.id, courses=len(courses_data))
         return Response(courses_data)
 
 class MyCreatedCoursesView(generics.ListAPIView):
@@ -3971,10 +4022,10 @@ class CourseLessonsView(generics.ListAPIView):
             for lesson_data in lessons_data:
                 lesson_data['is_completed'] = lesson_data['id'] in completed_lesson_ids
             
-            print(f"CourseLessonsView: Course {course_id}, User {request.user.username}")
-            print(f"  - Total lessons: {len(lessons_data)}")
-            print(f"  - Completed lessons: {len(completed_lesson_ids)}")
-            print(f"  - Completed lesson IDs: {list(completed_lesson_ids)}")
+            debug_event(
+                logger, 'course_lessons.list', course_id=course_id, user_id=request.user.id,
+                lessons=len(lessons_data), completed=len(completed_lesson_ids),
+            )
         
         return Response(lessons_data)
 
@@ -4497,17 +4548,30 @@ def resolve_dispute(request, dispute_id):
             description=f'Dispute resolved with refund for order #{order.id}'
         )
     elif action == 'release':
-        if not order.escrow_released:
+        from django.db import transaction
+        from .payments import escrow_release_amounts
+        
+        with transaction.atomic():
+            # The conditional update makes this a no-op if release_escrow got there first
+            released = Order.objects.filter(pk=order.pk, escrow_released=False).update(
+                escrow_released=True, status='completed', updated_at=timezone.now()
+            )
+            if released:
+                # Move the freelancer's earnings out of escrow, as release_escrow does
+                earnings_usd = escrow_release_amounts(order)[1]
+                BalanceService.apply(
+                    order.freelancer,
+                    floor_at_zero=('escrow_balance',),
+                    entry_type='escrow_release',
+                    reference=f'order:{order.id}',
+                    idempotency_key=f'escrow_release:{order.id}',
+                    escrow_balance=-earnings_usd,
+                    available_balance=earnings_usd,
+                    total_earnings=earnings_usd,
+                )
+        if released:
             order.escrow_released = True
             order.status = 'completed'
-            order.save()
-            
-            # Update freelancer balance
-            freelancer_profile = order.freelancer.userprofile
-            freelancer_profile.available_balance += order.price
-            freelancer_profile.total_earnings += order.price
-            freelancer_profile.save()
-            
             AdminAction.objects.create(
                 admin=request.user,
                 action_type='payment_release',
@@ -4651,7 +4715,7 @@ class NotificationListView(generics.ListAPIView):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def real_time_notifications(request):
-    """Get real-time notifications for polling"""
+    """Recent notifications for clients without a WebSocket; connected clients get them as `notification` frames"""
     last_check = request.GET.get('last_check')
     queryset = Notification.objects.filter(user=request.user)
     
@@ -4762,28 +4826,24 @@ def send_system_notification(request):
     if not title or not message:
         return Response({'error': 'Title and message are required'}, status=400)
     
-    # Get target users
-    if user_type == 'client':
-        users = User.objects.filter(userprofile__user_type__in=['client', 'both'])
-    elif user_type == 'freelancer':
-        users = User.objects.filter(userprofile__user_type__in=['freelancer', 'both'])
-    else:
-        users = User.objects.filter(is_active=True)
+    if user_type not in ('client', 'freelancer'):
+        user_type = 'all'
     
-    # Create notifications
-    notifications_created = 0
-    for user in users:
-        Notification.objects.create(
-            user=user,
-            title=title,
-            message=message,
-            notification_type='system'
-        )
-        notifications_created += 1
+    # Large audiences are fanned out by the background worker
+    broadcast, total = notification_fanout.notify_audience(
+        user_type, title, message, notification_type='system', created_by=request.user,
+    )
+    if broadcast.status != 'done':
+        return Response({
+            'message': f'System notification queued for {total} users',
+            'count': total,
+            'broadcast_id': broadcast.id,
+        }, status=202)
     
     return Response({
-        'message': f'System notification sent to {notifications_created} users',
-        'count': notifications_created
+        'message': f'System notification sent to {broadcast.total_created} users',
+        'count': broadcast.total_created,
+        'broadcast_id': broadcast.id,
     })
 # Error Handling Views
 @api_view(['POST'])
@@ -4861,6 +4921,37 @@ class ErrorLogListView(generics.ListAPIView):
     filterset_fields = ['error_type', 'resolved']
     search_fields = ['message', 'url']
 
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminPermission])
+def profiling_stats(request):
+    """Per-endpoint request profiling stats; DELETE resets them"""
+    from .profiling import registry
+    from .paystack_client import paystack_client
+    
+    if not settings.PROFILING_ENABLED:
+        return Response({
+            'enabled': False,
+            'message': 'Set PROFILING_ENABLED=True to collect request stats',
+            'paystack': paystack_client.metrics(),
+            'mail': mail_dispatcher.metrics(),
+            'sms': sms_dispatcher.metrics(),
+        })
+    
+    if request.method == 'DELETE':
+        registry.reset()
+        paystack_client.reset_metrics()
+        mail_dispatcher.reset_metrics()
+        sms_dispatcher.reset_metrics()
+        return Response({'message': 'Profiling stats reset'})
+    
+    return Response({
+        'enabled': True,
+        **registry.snapshot(),
+        'paystack': paystack_client.metrics(),
+        'mail': mail_dispatcher.metrics(),
+        'sms': sms_dispatcher.metrics(),
+    })
+
 @api_view(['POST'])
 @permission_classes([IsAdminPermission])
 def mark_error_resolved(request, error_id):
@@ -4877,29 +4968,21 @@ def mark_error_resolved(request, error_id):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def user_analytics(request):
-    """Get user analytics and performance metrics"""
+    """Get user analytics and performance metrics.
+    
+    UserAnalytics is maintained as orders change, so this is a single read.
+    Pass ?refresh=1 to rebuild the order totals from scratch.
+    """
     from .models import UserAnalytics
     from .serializers import UserAnalyticsSerializer
-    from django.db.models import Sum, Count, Q
+    from .analytics_service import AnalyticsService
     
-    analytics, created = UserAnalytics.objects.get_or_create(user=request.user)
-    
-    # Update analytics data
-    analytics.total_orders = Order.objects.filter(
-        Q(client=request.user) | Q(freelancer=request.user)
-    ).count()
-    
-    if request.user.userprofile.user_type in ['freelancer', 'both']:
-        analytics.total_earnings = Order.objects.filter(
-            freelancer=request.user, status='completed'
-        ).aggregate(total=Sum('price'))['total'] or 0
-    
-    if request.user.userprofile.user_type in ['client', 'both']:
-        analytics.total_spent = Order.objects.filter(
-            client=request.user, status='completed'
-        ).aggregate(total=Sum('price'))['total'] or 0
-    
-    analytics.save()
+    analytics = None
+    if request.GET.get('refresh') not in ('1', 'true'):
+        analytics = UserAnalytics.objects.filter(user_id=request.user.id).first()
+    if analytics is None:
+        analytics = AnalyticsService.recompute(request.user.id)
+    analytics.user = request.user
     
     serializer = UserAnalyticsSerializer(analytics)
     return Response(serializer.data)
@@ -4909,6 +4992,7 @@ def user_analytics(request):
 def user_performance_metrics(request):
     """Get detailed performance metrics with date range"""
     from datetime import datetime, timedelta
+    from .models import UserAnalytics
     
     user = request.user
     date_range = int(request.GET.get('range', 30))  # days
@@ -4925,7 +5009,7 @@ def user_performance_metrics(request):
         'total_orders': orders.count(),
         'completed_orders': orders.filter(status='completed').count(),
         'avg_rating': float(user.userprofile.rating),
-        'response_time': 0,  # Calculate based on message response times
+        'response_time': UserAnalytics.objects.filter(user=user).values_list('response_time', flat=True).first() or 0,
         'earnings_trend': [],
         'order_trend': [],
         'category_breakdown': []
@@ -4959,9 +5043,12 @@ def track_event(request):
     from .models import AnalyticsEvent
     from .serializers import AnalyticsEventSerializer
     
+    from .analytics_service import AnalyticsService
+    
     serializer = AnalyticsEventSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
-        serializer.save()
+        event = serializer.save()
+        AnalyticsService.record_event(event.event_type, event.event_data, viewer=request.user)
         return Response({'status': 'event tracked'}, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -5273,7 +5360,7 @@ def update_avatar(request):
     if avatar_type == 'avatar' and selected_avatar:
         profile.avatar_type = 'avatar'
         profile.selected_avatar = selected_avatar
-        profile.save()
+        profile.save(update_fields=['avatar_type', 'selected_avatar', 'updated_at'])
         
         return Response({
             'message': 'Avatar updated successfully',
@@ -5283,7 +5370,7 @@ def update_avatar(request):
     elif avatar_type == 'upload' and profile_picture:
         profile.avatar_type = 'upload'
         profile.profile_picture = profile_picture
-        profile.save()
+        profile.save(update_fields=['avatar_type', 'profile_picture', 'updated_at'])
         
         return Response({
             'message': 'Profile picture updated successfully',
@@ -5327,7 +5414,7 @@ def submit_contact_form(request):
         })
         admin_text = strip_tags(admin_html)
         
-        send_mail(
+        mail_dispatcher.send_mail(
             f'Contact Form: {subject}',
             admin_text,
             settings.DEFAULT_FROM_EMAIL,
@@ -5342,7 +5429,7 @@ def submit_contact_form(request):
         })
         user_text = strip_tags(user_html)
         
-        send_mail(
+        mail_dispatcher.send_mail(
             'Thank you for contacting Neurolancer',
             user_text,
             settings.DEFAULT_FROM_EMAIL,
@@ -5384,7 +5471,7 @@ def submit_feedback_form(request):
         })
         admin_text = strip_tags(admin_html)
         
-        send_mail(
+        mail_dispatcher.send_mail(
             f'Feedback: {feedback_type.replace("_", " ").title()}',
             admin_text,
             settings.DEFAULT_FROM_EMAIL,
@@ -5400,7 +5487,7 @@ def submit_feedback_form(request):
         })
         user_text = strip_tags(user_html)
         
-        send_mail(
+        mail_dispatcher.send_mail(
             'Thank you for your feedback',
             user_text,
             settings.DEFAULT_FROM_EMAIL,
@@ -5714,6 +5801,34 @@ class AdminActivityListView(generics.ListAPIView):
     def get_queryset(self):
         return AdminAction.objects.all().select_related('admin', 'target_user')
 
+# Admin streaming exports
+class AdminUserExportView(StreamingExportMixin, AdminUserListView):
+    export_name = 'users'
+    export_fields = (
+        'id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff',
+        'userprofile__user_type', 'date_joined', 'last_login',
+    )
+
+class AdminOrderExportView(StreamingExportMixin, AdminOrderListView):
+    export_name = 'orders'
+    export_fields = (
+        'id', 'title', 'status', 'payment_status', 'is_paid', 'price', 'total_amount',
+        'client__username', 'freelancer__username', 'gig_id', 'created_at', 'completed_at',
+    )
+
+class AdminTransactionExportView(StreamingExportMixin, AdminTransactionListView):
+    export_name = 'transactions'
+    export_fields = (
+        'id', 'title', 'payment_reference', 'payment_status', 'price', 'total_amount',
+        'escrow_released', 'client__username', 'freelancer__username', 'created_at',
+    )
+
+class AdminActivityExportView(StreamingExportMixin, AdminActivityListView):
+    export_name = 'activity'
+    export_fields = (
+        'id', 'action_type', 'description', 'admin__username', 'target_user__username', 'created_at',
+    )
+
 # AI Assistant Views
 class AIConversationView(generics.RetrieveUpdateAPIView):
     serializer_class = AIConversationSerializer
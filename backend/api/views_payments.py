@@ -4,11 +4,15 @@ from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
 from decimal import Decimal
-import requests
 from .models import *
+from .currency import currency_service
 from .paystack_utils import paystack
+from .payments import fee_quote_response
+from . import ledger
+from .balance_service import BalanceService, InsufficientFunds
 from .serializers import *
 import time
+from django.db import transaction
 from django.utils import timezone
 
 @api_view(['POST'])
@@ -60,7 +64,7 @@ def create_subaccount(request):
         user_profile.bank_code = bank_code
         user_profile.account_number = account_number
         user_profile.account_name = account_name
-        user_profile.save()
+        user_profile.save(update_fields=['paystack_subaccount_code', 'bank_code', 'account_number', 'account_name', 'updated_at'])
         
         return Response({
             'status': 'success',
@@ -234,12 +238,14 @@ def verify_payment(request):
         order.payment_status = 'paid'
         order.is_paid = True
         order.status = 'accepted'
+        order.escrow_amount = order.price
         order.save()
         
-        # Update freelancer earnings (held in escrow)
-        freelancer_profile = order.freelancer.userprofile
-        freelancer_profile.escrow_balance += order.price
-        freelancer_profile.save()
+        # Update freelancer earnings (held in escrow); a repeated verify credits nothing
+        BalanceService.credit(
+            order.freelancer, order.price, field='escrow_balance',
+            entry_type='payment', reference=reference, idempotency_key=f'escrow:{reference}',
+        )
         
         # Create notification for Paystack payment
         create_payment_notification(
@@ -263,31 +269,38 @@ def wallet_payment(request):
     amount = Decimal(str(data.get('amount', 0)))
     payment_type = data.get('payment_type')
     
-    user_profile = get_object_or_404(UserProfile, user=request.user)
-    
-    # Check if user has sufficient balance
-    if user_profile.available_balance < amount:
+    get_object_or_404(UserProfile, user=request.user)
+    if amount <= 0:
         return Response({
             'status': 'error',
-            'message': 'Insufficient wallet balance'
+            'message': 'Amount must be greater than zero'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    # Deduct amount from wallet
-    user_profile.available_balance -= amount
-    user_profile.save()
-    
     # Generate payment reference
     reference = f"wallet_{request.user.id}_{int(time.time())}"
     
-    # Create transaction record
-    Transaction.objects.create(
-        user=request.user,
-        transaction_type='payment',
-        amount=amount,
-        description=f"Wallet payment for {payment_type}",
-        reference=reference,
-        status='completed'
-    )
+    # Deduct amount from wallet; the ledger rejects an overdraft
+    try:
+        with transaction.atomic():
+            balances = BalanceService.debit(
+                request.user, amount, entry_type='payment', reference=reference,
+                counterparty=ledger.WALLET_PAYMENTS, idempotency_key=f'wallet:{reference}',
+            )
+            
+            # Create transaction record
+            Transaction.objects.create(
+                user=request.user,
+                transaction_type='payment',
+                amount=amount,
+                description=f"Wallet payment for {payment_type}",
+                reference=reference,
+                status='completed'
+            )
+    except InsufficientFunds:
+        return Response({
+            'status': 'error',
+            'message': 'Insufficient wallet balance'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     # Create notification
     create_payment_notification(
@@ -339,18 +352,20 @@ def wallet_payment(request):
             order.is_paid = True
             order.status = 'accepted'
             order.payment_reference = reference
+            order.escrow_amount = order.price
             order.save()
             
-            # Update freelancer earnings (held in escrow)  
-            freelancer_profile = order.freelancer.userprofile
-            freelancer_profile.escrow_balance += order.price
-            freelancer_profile.save()
+            # Update freelancer earnings (held in escrow), paid for out of the client's wallet
+            BalanceService.credit(
+                order.freelancer, order.price, field='escrow_balance', entry_type='payment',
+                reference=reference, counterparty=ledger.WALLET_PAYMENTS, idempotency_key=f'escrow:{reference}',
+            )
     
     return Response({
         'status': 'success',
         'message': 'Payment completed successfully',
         'reference': reference,
-        'new_balance': float(user_profile.available_balance)
+        'new_balance': float(balances['available_balance'])
     })
 
 def create_payment_notification(user, payment_method, amount, reference, status):
@@ -375,49 +390,9 @@ def create_payment_notification(user, payment_method, amount, reference, status)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def calculate_fees(request):
-    """Calculate payment fees breakdown"""
-    data = request.data
-    amount = data.get('amount')
-    hours_worked = data.get('hours_worked')
-    hourly_rate = data.get('hourly_rate')
-    
-    # Calculate base amount
-    if amount:
-        base_amount = float(amount)
-    elif hours_worked and hourly_rate:
-        base_amount = float(hours_worked) * float(hourly_rate)
-    else:
-        return Response({
-            'status': 'error',
-            'message': 'Either amount or hours_worked and hourly_rate are required'
-        }, status=status.HTTP_400_BAD_REQUEST)
-    
-    # Calculate fees
-    platform_fee_percentage = 5  # 5% platform fee
-    platform_fee = base_amount * (platform_fee_percentage / 100)
-    
-    # Processing fee is 2.5% of base amount
-    processing_fee = base_amount * 0.025
-    
-    total_amount = base_amount + platform_fee + processing_fee
-    
-    return Response({
-        'status': 'success',
-        'breakdown': {
-            'base_amount': base_amount,
-            'platform_fee': platform_fee,
-            'platform_fee_percentage': platform_fee_percentage,
-            'processing_fee': processing_fee,
-            'total_amount': total_amount,
-            'currency': 'USD'
-        }
-    })
+    """Calculate payment fees breakdown (same fee engine and quote as calculate-fees/)"""
+    return fee_quote_response(request)
 
 def get_exchange_rate():
-    """Get USD to KES exchange rate"""
-    try:
-        response = requests.get('https://api.exchangerate-api.com/v4/latest/USD')
-        data = response.json()
-        return data['rates']['KES']
-    except:
-        return 130  # Fallback rate
\ No newline at end of file
+    """Get USD to KES exchange rate from the cached rate table"""
+    return float(currency_service.rate('USD', 'KES'))
\ No newline at end of file
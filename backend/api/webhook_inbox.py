@@ -0,0 +1,197 @@
+import hashlib
+import hmac
+import json
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import fees, ledger, payouts
+from .balance_service import BalanceService
+from .currency import kes_to_usd
+from .inline_worker import InlineWorker
+from .models import Order, PaystackWebhookEvent, Withdrawal
+
+logger = logging.getLogger(__name__)
+
+
+def verify_signature(body, signature, secret_key):
+    expected = hmac.new(secret_key.encode('utf-8'), body, hashlib.sha512).hexdigest()
+    return hmac.compare_digest(signature, expected)
+
+
+def event_key(payload):
+    """Stable identity of a Paystack event across redeliveries"""
+    data = payload.get('data') or {}
+    identity = data.get('id') or data.get('reference') or data.get('transfer_code')
+    if not identity:
+        identity = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return f"{payload.get('event', '')}:{identity}"[:200]
+
+
+def enqueue(payload):
+    """Store a verified webhook payload; returns (event, created). Redeliveries only bump a counter."""
+    key = event_key(payload)
+    data = payload.get('data') or {}
+    try:
+        with transaction.atomic():
+            event = PaystackWebhookEvent.objects.create(
+                event_key=key,
+                event=payload.get('event', '')[:50],
+                reference=str(data.get('reference') or '')[:100],
+                payload=payload,
+            )
+        return event, True
+    except IntegrityError:
+        PaystackWebhookEvent.objects.filter(event_key=key).update(deliveries=F('deliveries') + 1)
+        return None, False
+
+
+# Event handlers. Each runs inside the event's transaction and must be safe to run twice.
+
+def _handle_charge_success(data):
+    reference = data['reference']
+    metadata = data.get('metadata') or {}
+
+    base_amount = Decimal(str(metadata.get('base_amount', '0')))
+    payment_type = metadata.get('payment_type', 'gig')
+
+    if payment_type == 'gig' and metadata.get('order_id'):
+        order = Order.objects.select_for_update().filter(payment_reference=reference).first()
+        if order is None:
+            logger.error(f'Order not found for reference: {reference}')
+        elif order.payment_status == 'pending':
+            # Escrow holds the freelancer's earnings after the 5% fee, as verify_payment credits them
+            freelancer_earnings = fees.freelancer_split(base_amount)[1]
+            order.payment_status = 'paid'
+            order.status = 'in_progress'
+            order.is_paid = True
+            order.escrow_amount = kes_to_usd(freelancer_earnings)
+            order.save()
+
+            BalanceService.credit(
+                order.freelancer_id, order.escrow_amount, field='escrow_balance',
+                entry_type='payment', reference=reference, idempotency_key=f'escrow:{reference}',
+            )
+
+            logger.info(f'Order {order.id} payment processed: {freelancer_earnings} KES to escrow')
+
+    # Same breakdown verify_payment books, so whichever sees the charge first records the right amount
+    ledger.record_fee(reference, fees.platform_income(metadata))
+
+
+def _handle_transfer_success(data):
+    reference = data['reference']
+    withdrawal = Withdrawal.objects.select_for_update().filter(reference=reference).first()
+    if withdrawal is None:
+        logger.error(f'Withdrawal not found for reference: {reference}')
+        return
+    payouts.complete(withdrawal)
+
+
+def _handle_transfer_failed(data):
+    reference = data['reference']
+    withdrawal = Withdrawal.objects.select_for_update().filter(reference=reference).first()
+    if withdrawal is None:
+        logger.error(f'Withdrawal not found for reference: {reference}')
+        return
+    # Only the first failure notice refunds the balance
+    payouts.fail(withdrawal, data.get('reason') or data.get('status') or 'Transfer failed')
+
+
+HANDLERS = {
+    'charge.success': _handle_charge_success,
+    'transfer.success': _handle_transfer_success,
+    'transfer.failed': _handle_transfer_failed,
+    'transfer.reversed': _handle_transfer_failed,
+}
+
+
+def claim(event_id):
+    """Mark one pending event as ours; None if another worker got it first"""
+    claimed = PaystackWebhookEvent.objects.filter(id=event_id, status='pending').update(
+        status='processing', locked_at=timezone.now(),
+    )
+    return PaystackWebhookEvent.objects.get(id=event_id) if claimed else None
+
+
+def process_event(event):
+    """Run the handler for a claimed event; returns True on success"""
+    handler = HANDLERS.get(event.event)
+    event.attempts += 1
+    try:
+        with transaction.atomic():
+            if handler is not None:
+                handler(event.payload.get('data') or {})
+            event.status = 'processed'
+            event.processed_at = timezone.now()
+            event.last_error = ''
+            event.locked_at = None
+            event.save(update_fields=['status', 'processed_at', 'last_error', 'locked_at', 'attempts'])
+        return True
+    except Exception as e:
+        max_attempts = getattr(settings, 'PAYSTACK_WEBHOOK_MAX_ATTEMPTS', 5)
+        event.status = 'failed' if event.attempts >= max_attempts else 'pending'
+        event.last_error = f'{type(e).__name__}: {e}'
+        event.locked_at = None
+        event.save(update_fields=['status', 'last_error', 'locked_at', 'attempts'])
+        logger.error(f'Webhook event {event.event_key} failed (attempt {event.attempts}): {e}')
+        return False
+
+
+def release_stale_claims():
+    """Return events whose worker died mid-processing to the queue"""
+    timeout = getattr(settings, 'PAYSTACK_WEBHOOK_LOCK_TIMEOUT', 300)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return PaystackWebhookEvent.objects.filter(status='processing', locked_at__lt=cutoff).update(
+        status='pending', locked_at=None,
+    )
+
+
+def process_pending(batch_size=100, limit=None):
+    """One pass over the queue in arrival order; returns (processed, failed).
+
+    Each pending event is attempted at most once per pass. Once an event
+    fails, later events with the same reference wait for the next pass so a
+    reference's events are always applied in the order Paystack sent them.
+    """
+    release_stale_claims()
+    processed = failed = 0
+    last_id = 0
+    blocked = set()
+    while True:
+        batch = list(
+            PaystackWebhookEvent.objects.filter(status='pending', id__gt=last_id)
+            .order_by('id').values_list('id', 'reference')[:batch_size]
+        )
+        for event_id, reference in batch:
+            last_id = event_id
+            if reference and reference in blocked:
+                continue
+            event = claim(event_id)
+            if event is None:
+                continue
+            if process_event(event):
+                processed += 1
+            else:
+                failed += 1
+                if reference:
+                    blocked.add(reference)
+            if limit and processed + failed >= limit:
+                return processed, failed
+        if len(batch) < batch_size:
+            return processed, failed
+
+
+# Drains the queue when no dedicated `process_paystack_webhooks` worker is running
+# (PAYSTACK_WEBHOOK_INLINE)
+inline_worker = InlineWorker(process_pending, name='webhook')
+
+
+def schedule_processing():
+    if getattr(settings, 'PAYSTACK_WEBHOOK_INLINE', True):
+        transaction.on_commit(inline_worker.kick)
@@ -55,6 +55,7 @@ if not DEBUG:
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'api.middleware.ProfilingMiddleware',
     'api.middleware.SecurityHeadersMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -94,6 +95,21 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Shared cache (bank lists, rates); falls back to per-process memory without Redis
+if config('REDIS_URL', default=None):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -162,6 +178,22 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # Number of days to retain message attachments before automatic cleanup
 MESSAGE_ATTACHMENT_RETENTION_DAYS = int(config('MESSAGE_ATTACHMENT_RETENTION_DAYS', default='2'))
 
+# Analytics
+# Seconds between flushes of coalesced profile/gig view counters
+ANALYTICS_VIEW_FLUSH_INTERVAL = float(config('ANALYTICS_VIEW_FLUSH_INTERVAL', default='5'))
+
+# Admin exports
+# Rows fetched per database round trip when streaming CSV/JSONL exports
+EXPORT_CHUNK_SIZE = int(config('EXPORT_CHUNK_SIZE', default='2000'))
+
+# Request profiling (opt-in)
+PROFILING_ENABLED = config('PROFILING_ENABLED', default='False') == 'True'
+# Requests slower than this are kept in the slow-request log with their SQL; SQL text
+# is only captured (up to CAPTURE_SQL statements) once a request has run this long
+PROFILING_SLOW_REQUEST_MS = int(config('PROFILING_SLOW_REQUEST_MS', default='500'))
+PROFILING_SLOW_LOG_SIZE = int(config('PROFILING_SLOW_LOG_SIZE', default='50'))
+PROFILING_CAPTURE_SQL = int(config('PROFILING_CAPTURE_SQL', default='20'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -241,6 +273,80 @@ REST_FRAMEWORK = {
 # Paystack settings
 PAYSTACK_SECRET_KEY = config('PAYSTACK_SECRET_KEY', default='sk_test_fd47bd1c9a97e30551cc3bb2def6d664d1671246')
 PAYSTACK_PUBLIC_KEY = config('PAYSTACK_PUBLIC_KEY', default='pk_test_ce9730c10c85c796d2382e48d8635c0dcb59dd1a')
+PAYSTACK_BASE_URL = config('PAYSTACK_BASE_URL', default='https://api.paystack.co')
+# Timeouts (seconds) for the shared Paystack client; connect is kept just above a TCP retransmit window
+PAYSTACK_CONNECT_TIMEOUT = float(config('PAYSTACK_CONNECT_TIMEOUT', default='3.05'))
+PAYSTACK_READ_TIMEOUT = float(config('PAYSTACK_READ_TIMEOUT', default='15'))
+# Extra attempts for idempotent calls (GETs, reference-keyed POSTs); transfers are never retried
+PAYSTACK_MAX_RETRIES = int(config('PAYSTACK_MAX_RETRIES', default='2'))
+PAYSTACK_RETRY_BACKOFF = float(config('PAYSTACK_RETRY_BACKOFF', default='0.25'))
+PAYSTACK_POOL_SIZE = int(config('PAYSTACK_POOL_SIZE', default='10'))
+# Bank lists are fresh for BANK_LIST_CACHE_TTL, then served stale (while refreshing) for BANK_LIST_STALE_TTL
+BANK_LIST_CACHE_TTL = int(config('BANK_LIST_CACHE_TTL', default=str(6 * 60 * 60)))
+BANK_LIST_STALE_TTL = int(config('BANK_LIST_STALE_TTL', default=str(7 * 24 * 60 * 60)))
+
+# Exchange rates (USD base) are refreshed in the background every EXCHANGE_RATE_TTL seconds;
+# EXCHANGE_RATE_FALLBACK is served until the first successful fetch
+EXCHANGE_RATE_API_URL = config('EXCHANGE_RATE_API_URL', default='https://api.exchangerate-api.com/v4/latest/USD')
+EXCHANGE_RATE_TTL = int(config('EXCHANGE_RATE_TTL', default=str(60 * 60)))
+EXCHANGE_RATE_RETRY_AFTER = int(config('EXCHANGE_RATE_RETRY_AFTER', default='300'))
+EXCHANGE_RATE_FALLBACK = {'USD': '1', 'KES': config('EXCHANGE_RATE_FALLBACK_KES', default='130.0')}
+
+# Paystack webhooks are queued in PaystackWebhookEvent. Without a dedicated
+# `manage.py process_paystack_webhooks --loop` worker, set INLINE so each web
+# process drains the queue on a background thread after the enqueue commits.
+PAYSTACK_WEBHOOK_INLINE = config('PAYSTACK_WEBHOOK_INLINE', default='True') == 'True'
+PAYSTACK_WEBHOOK_MAX_ATTEMPTS = int(config('PAYSTACK_WEBHOOK_MAX_ATTEMPTS', default='5'))
+PAYSTACK_WEBHOOK_LOCK_TIMEOUT = int(config('PAYSTACK_WEBHOOK_LOCK_TIMEOUT', default='300'))
+
+# Withdrawals are queued and sent through Paystack's bulk transfer API by
+# `manage.py process_payouts --loop`; without that worker set INLINE so the web
+# process drains the queue on a background thread after each withdrawal commits.
+PAYSTACK_PAYOUT_INLINE = config('PAYSTACK_PAYOUT_INLINE', default='True') == 'True'
+PAYSTACK_PAYOUT_BATCH_SIZE = int(config('PAYSTACK_PAYOUT_BATCH_SIZE', default='100'))
+PAYSTACK_PAYOUT_MAX_ATTEMPTS = int(config('PAYSTACK_PAYOUT_MAX_ATTEMPTS', default='5'))
+PAYSTACK_PAYOUT_LOCK_TIMEOUT = int(config('PAYSTACK_PAYOUT_LOCK_TIMEOUT', default='300'))
+# Transfers with no webhook this long after submission are checked with /transfer/verify
+PAYSTACK_PAYOUT_RECONCILE_AFTER = int(config('PAYSTACK_PAYOUT_RECONCILE_AFTER', default=str(15 * 60)))
+# Registered transfer recipients are reused and only re-checked with Paystack after this long
+PAYSTACK_RECIPIENT_REVALIDATE_AFTER = int(config('PAYSTACK_RECIPIENT_REVALIDATE_AFTER', default=str(7 * 24 * 60 * 60)))
+# /bank/resolve results; unknown accounts are remembered briefly so typos can be corrected
+PAYSTACK_RESOLVE_CACHE_TTL = int(config('PAYSTACK_RESOLVE_CACHE_TTL', default=str(24 * 60 * 60)))
+PAYSTACK_RESOLVE_NEGATIVE_TTL = int(config('PAYSTACK_RESOLVE_NEGATIVE_TTL', default='300'))
+# Newsletters are sent in chunks by `manage.py send_newsletters --loop`; without that
+# worker set INLINE so the web process sends on a background thread instead.
+NEWSLETTER_SEND_INLINE = config('NEWSLETTER_SEND_INLINE', default='True') == 'True'
+NEWSLETTER_SEND_CHUNK_SIZE = int(config('NEWSLETTER_SEND_CHUNK_SIZE', default='200'))
+# A chunk claimed longer ago than this is assumed abandoned and sent again
+NEWSLETTER_SEND_LOCK_TIMEOUT = int(config('NEWSLETTER_SEND_LOCK_TIMEOUT', default='600'))
+# Tracking-pixel opens are buffered per process and written in aggregate every
+# FLUSH_INTERVAL seconds, or sooner once FLUSH_SIZE distinct opens are waiting
+NEWSLETTER_OPEN_FLUSH_INTERVAL = float(config('NEWSLETTER_OPEN_FLUSH_INTERVAL', default='5'))
+NEWSLETTER_OPEN_FLUSH_SIZE = int(config('NEWSLETTER_OPEN_FLUSH_SIZE', default='500'))
+
+# Audience-wide notifications are written in bulk batches by
+# `manage.py send_notification_broadcasts --loop`; audiences up to INLINE_MAX users
+# are written in the request, and without that worker set INLINE so larger ones are
+# fanned out on a background thread in the web process.
+NOTIFICATION_FANOUT_INLINE = config('NOTIFICATION_FANOUT_INLINE', default='True') == 'True'
+NOTIFICATION_FANOUT_INLINE_MAX = int(config('NOTIFICATION_FANOUT_INLINE_MAX', default='1000'))
+NOTIFICATION_FANOUT_BATCH_SIZE = int(config('NOTIFICATION_FANOUT_BATCH_SIZE', default='1000'))
+NOTIFICATION_FANOUT_LOCK_TIMEOUT = int(config('NOTIFICATION_FANOUT_LOCK_TIMEOUT', default='300'))
+
+# Daily/weekly notification digests (`manage.py send_notification_digests`) load
+# NotificationPreference rows for this many users per query
+NOTIFICATION_DIGEST_BATCH_SIZE = int(config('NOTIFICATION_DIGEST_BATCH_SIZE', default='500'))
+
+# `manage.py archive_notifications` moves read notifications older than
+# RETENTION_DAYS to ArchivedNotification, BATCH_SIZE rows per transaction
+NOTIFICATION_RETENTION_DAYS = int(config('NOTIFICATION_RETENTION_DAYS', default='90'))
+NOTIFICATION_ARCHIVE_BATCH_SIZE = int(config('NOTIFICATION_ARCHIVE_BATCH_SIZE', default='1000'))
+
+# Seconds a signed fee quote from payments/calculate-fees/ can be passed to initialize
+FEE_QUOTE_TTL = int(config('FEE_QUOTE_TTL', default=str(15 * 60)))
+
+# Accounts checked per batch by `manage.py verify_ledger`
+LEDGER_VERIFY_CHUNK_SIZE = int(config('LEDGER_VERIFY_CHUNK_SIZE', default='500'))
 FRONTEND_URL = config('FRONTEND_URL', default='https://neurolancer.work')
 
 # Firebase settings
@@ -257,16 +363,66 @@ EMAIL_USE_TLS = config('EMAIL_USE_TLS', default='True') == 'True'
 EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='neurolancermail@gmail.com')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='bgoyyonrlmejkqlm')
 DEFAULT_FROM_EMAIL = 'Neurolancer <noreply@neurolancer.com>'
+# Outbound mail goes through api.mail_dispatcher: one reused connection per worker
+# thread, throttled to the provider's quota (messages/second, burst size; 0 = unlimited)
+MAIL_SEND_RATE = float(config('MAIL_SEND_RATE', default='10'))
+MAIL_SEND_BURST = int(config('MAIL_SEND_BURST', default='20'))
+# Reopen a connection after this many idle seconds / messages sent on it
+MAIL_CONNECTION_IDLE_TIMEOUT = int(config('MAIL_CONNECTION_IDLE_TIMEOUT', default='30'))
+MAIL_CONNECTION_MAX_MESSAGES = int(config('MAIL_CONNECTION_MAX_MESSAGES', default='100'))
+# Transactional email is queued in the OutboundEmail outbox and delivered by
+# `manage.py send_outbox_emails --loop`; without that worker set INLINE so the web
+# process delivers on a background thread after each request commits (retries that
+# come due are then picked up on the next kick).
+EMAIL_OUTBOX_INLINE = config('EMAIL_OUTBOX_INLINE', default='True') == 'True'
+EMAIL_OUTBOX_BATCH_SIZE = int(config('EMAIL_OUTBOX_BATCH_SIZE', default='50'))
+# Failed sends are retried after ~RETRY_BASE seconds, doubling up to RETRY_MAX
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(config('EMAIL_OUTBOX_MAX_ATTEMPTS', default='8'))
+EMAIL_OUTBOX_RETRY_BASE = int(config('EMAIL_OUTBOX_RETRY_BASE', default='30'))
+EMAIL_OUTBOX_RETRY_MAX = int(config('EMAIL_OUTBOX_RETRY_MAX', default=str(60 * 60)))
+# A batch claimed longer ago than this is assumed abandoned and sent again
+EMAIL_OUTBOX_LOCK_TIMEOUT = int(config('EMAIL_OUTBOX_LOCK_TIMEOUT', default='300'))
 
 # Twilio SMS settings
 TWILIO_ACCOUNT_SID = config('TWILIO_ACCOUNT_SID', default=None)
 TWILIO_AUTH_TOKEN = config('TWILIO_AUTH_TOKEN', default=None)
 TWILIO_VERIFY_SERVICE_SID = config('TWILIO_VERIFY_SERVICE_SID', default=None)
 
+# Vonage SMS settings
+VONAGE_API_KEY = config('VONAGE_API_KEY', default=None)
+VONAGE_API_SECRET = config('VONAGE_API_SECRET', default=None)
+VONAGE_SENDER = config('VONAGE_SENDER', default='Neurolancer')
+
+# Verification SMS go through the configured providers in this order (api.sms_dispatcher);
+# with none configured codes are only logged (mock SMS)
+SMS_PROVIDERS = config('SMS_PROVIDERS', default='twilio,vonage')
+SMS_CONNECT_TIMEOUT = float(config('SMS_CONNECT_TIMEOUT', default='3.05'))
+SMS_READ_TIMEOUT = float(config('SMS_READ_TIMEOUT', default='5'))
+SMS_POOL_SIZE = int(config('SMS_POOL_SIZE', default='10'))
+# A provider failing BREAKER_THRESHOLD times in a row is skipped for BREAKER_RESET_TIMEOUT seconds
+SMS_BREAKER_THRESHOLD = int(config('SMS_BREAKER_THRESHOLD', default='3'))
+SMS_BREAKER_RESET_TIMEOUT = float(config('SMS_BREAKER_RESET_TIMEOUT', default='60'))
+# Codes sent per phone number and per client IP: bursts of BURST, refilled at RATE_PER_HOUR
+SMS_PHONE_RATE_PER_HOUR = float(config('SMS_PHONE_RATE_PER_HOUR', default='5'))
+SMS_PHONE_BURST = int(config('SMS_PHONE_BURST', default='3'))
+SMS_IP_RATE_PER_HOUR = float(config('SMS_IP_RATE_PER_HOUR', default='30'))
+SMS_IP_BURST = int(config('SMS_IP_BURST', default='10'))
+# Reverse proxies in front of the app that append to X-Forwarded-For; the client IP is the
+# address the outermost one saw. With 0 the header is ignored and REMOTE_ADDR is used.
+TRUSTED_PROXY_COUNT = int(config('TRUSTED_PROXY_COUNT', default='0'))
+# Seconds a sent code stays valid, and wrong guesses allowed before a new one is needed
+PHONE_VERIFICATION_TTL = int(config('PHONE_VERIFICATION_TTL', default='600'))
+PHONE_VERIFICATION_MAX_ATTEMPTS = int(config('PHONE_VERIFICATION_MAX_ATTEMPTS', default='5'))
+
 # Location API settings
 LOCATION_API_KEY = config('LOCATION_API_KEY', default=None)
 LOCATION_API_URL = config('LOCATION_API_URL', default='https://api.bigdatacloud.net/data/reverse-geocode-client')
 
+# Level for request-path logging in api.views; DEBUG enables per-request events
+API_LOG_LEVEL = config('API_LOG_LEVEL', default='INFO')
+# Fraction of DEBUG events that are actually emitted (see api.log_utils)
+LOG_SAMPLE_RATE = float(config('LOG_SAMPLE_RATE', default='0.1'))
+
 # Logging configuration
 LOGGING = {
     'version': 1,
@@ -300,6 +456,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'api.views': {
+            'handlers': ['file', 'console'],
+            'level': API_LOG_LEVEL,
+            'propagate': True,
+        },
         'api.consumers': {
             'handlers': ['file', 'console'],
             'level': 'DEBUG',